@@ -0,0 +1,182 @@
+import torch; torch.manual_seed(0)
+from afqinsight import AFQDataset
+import os
+import sys
+import argparse
+import time
+
+"""
+Cross-validation of the staged VAE + age/site predictors.
+
+The FA/MD data is prepared once, and every fold is a set of subject masks
+over it. Folds run at once in --workers forked processes sharing the
+prepared tensors.
+
+--scheme loso (leave-one-site-out): every fold holds out the subjects of one
+site. The models train on the train/val subjects of the other sites (with
+the site labels renumbered per fold) and are tested on the held-out site.
+
+--scheme kfold: --folds folds stratified by site and age bin, computed once
+and cached in cv_folds.npz. Fold f is tested on its subjects, selects its
+best epoch on fold f + 1 and trains on the others.
+
+Outputs in --output-dir, with <scheme> loso or kfold:
+- <scheme>_results.csv: one row per fold (held-out site), with the test MAE
+  and R² over samples and over subjects (mean prediction of their samples),
+  and p-value and 95% bootstrap confidence intervals of the subject scores
+- <scheme>_fold_metrics.csv: the same results as one row per fold and metric
+- <scheme>_summary.csv: mean of every metric over the folds with its 95%
+  confidence interval
+- held_out_site_<site>/ or fold_<f>/: the staged training outputs of each fold
+"""
+
+parser = argparse.ArgumentParser(description='Cross-validation of staged VAE age/site training')
+parser.add_argument('--output-dir', type=str, default='cv_results', help='Directory to save results')
+parser.add_argument('--scheme', choices=['loso', 'kfold'], default='loso', help='loso: leave one site out; kfold: folds stratified by site and age')
+parser.add_argument('--folds', type=int, default=5, help='Number of folds with --scheme kfold')
+parser.add_argument('--age-bins', type=int, default=4, help='Age quantile bins the k folds are stratified by (with the site)')
+parser.add_argument('--seed', type=int, default=0, help='Seed of the k-fold assignment')
+parser.add_argument('--epochs-stage1', type=int, default=500, help='Number of epochs for stage 1 training')
+parser.add_argument('--epochs-stage2', type=int, default=1000, help='Number of epochs for stage 2 training')
+parser.add_argument('--batch-size', type=int, default=128, help='Batch size for training')
+parser.add_argument('--learning-rate', type=float, default=0.0001, help='Learning rate')
+parser.add_argument('--sites', type=str, default=None, help='Comma-separated original site IDs to hold out with --scheme loso (default: every site)')
+parser.add_argument('--workers', type=int, default=1, help='Run this many folds at once in forked worker processes')
+parser.add_argument('--stack-fa-md', action='store_true', help='One two-channel FA+MD sample per subject and tract instead of separate FA and MD samples')
+parser.add_argument('--synthetic-scale', type=float, default=None, help='Use a synthetic HBN-like dataset of this many times the HBN size instead of downloading HBN')
+parser.add_argument('--permutations', type=int, default=1000, help='Permutations for the p-value of the test R² of each fold')
+parser.add_argument('--bootstrap-resamples', type=int, default=1000, help='Bootstrap resamples for the confidence intervals')
+args = parser.parse_args()
+
+# Adjust path as needed
+sys.path.insert(1, '/mmfs1/gscratch/nrdg/samchou/AFQ-Insight-Autoencoder-Experiments/Experiment_Utils')
+# sys.path.insert(1, '/Users/samchou/AFQ-Insight-Autoencoder-Experiments/AFQ-Insight-Autoencoder-Experiments/Experiment_Utils')
+try:
+    from utils import select_device, train_vae_age_site_staged
+    from models import Conv1DVariationalAutoencoder_fa, AgePredictorCNN, SitePredictorCNN, CombinedAE_Predictors
+    from attribution import age_path
+    from cross_validation import (aggregate_fold_results, cached_fold_assignments, kfold_folds,
+                                  leave_one_site_out_folds, prepare_subject_data, run_folds, tidy_fold_results)
+    from synthetic_data import make_synthetic_afq_dataset
+    from worker_pool import select_fork_safe_device
+except Exception as e:
+    print(f"ERROR importing utility functions: {str(e)}")
+    import traceback
+    print(traceback.format_exc())
+    sys.exit(1)
+
+# Same settings as the staged experiment of vae_age_site_stages.py
+latent_dim = 64
+dropout = 0.0
+age_dropout = 0.1
+site_dropout = 0.2
+w_recon = 1.0
+w_kl = 0.001
+w_age = 15.0
+w_site = 5.0
+
+# Workers are forked, so the parent must not initialize CUDA
+device = select_fork_safe_device() if args.workers > 1 else select_device()
+
+
+def train_fold(fold, train_loader, val_loader):
+    """Staged training of one fold; returns the age path of its best combined model."""
+    if "held_out_site" in fold:
+        save_dir = os.path.join(args.output_dir, f"held_out_site_{fold['held_out_site']:g}")
+        print(f"Holding out site {fold['held_out_site']:g}: training on sites {fold['site_vocab'].tolist()}")
+    else:
+        save_dir = os.path.join(args.output_dir, f"fold_{fold['fold']}")
+        print(f"Fold {fold['fold']}: testing on {int(fold['test'].sum())} subjects")
+    os.makedirs(save_dir, exist_ok=True)
+    _, input_channels, sequence_length = next(iter(train_loader))[0].shape
+    num_sites = len(fold["site_vocab"])
+    sys.stdout.flush()
+
+    def make_model():
+        return CombinedAE_Predictors(
+            Conv1DVariationalAutoencoder_fa(latent_dims=latent_dim, dropout=dropout, input_length=sequence_length,
+                                            input_channels=input_channels),
+            AgePredictorCNN(input_channels=input_channels, sequence_length=sequence_length, dropout=age_dropout),
+            SitePredictorCNN(num_sites=num_sites, input_channels=input_channels, sequence_length=sequence_length,
+                             dropout=site_dropout))
+
+    model = make_model()
+    start_time = time.time()
+    results = train_vae_age_site_staged(
+        vae_model=model.autoencoder,
+        age_predictor=model.age_predictor,
+        site_predictor=model.site_predictor,
+        train_data=train_loader,
+        val_data=val_loader,
+        epochs_stage1=args.epochs_stage1,
+        epochs_stage2=args.epochs_stage2,
+        lr=args.learning_rate,
+        device=device,
+        max_grad_norm=1.0,
+        w_recon=w_recon,
+        w_kl=w_kl,
+        w_age=w_age,
+        w_site=w_site,
+        kl_annealing_start_epoch=min(250, args.epochs_stage2 // 4),
+        kl_annealing_duration=min(500, args.epochs_stage2 // 2),
+        kl_annealing_start=0.0001,
+        grl_alpha_start=0.0,
+        grl_alpha_end=7.5,
+        grl_alpha_epochs=min(300, args.epochs_stage2),
+        save_dir=save_dir,
+        val_metric_to_monitor="val_age_mae"
+    )
+    training_time = time.time() - start_time
+
+    best = make_model()
+    best.load_state_dict(torch.load(os.path.join(save_dir, "best_combined_model.pth"), map_location="cpu"))
+    best.to(device).eval()
+    combined = results["combined"]
+    return {
+        "predict": age_path(best),
+        "best_val_mae": min(combined["val_age_mae_epoch"]) if combined.get("val_age_mae_epoch") else None,
+        "best_val_r2": max(combined["val_age_r2_epoch"]) if combined.get("val_age_r2_epoch") else None,
+        "training_time": training_time,
+    }
+
+
+if __name__ == "__main__":
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.synthetic_scale is not None:
+        dataset = make_synthetic_afq_dataset(scale=args.synthetic_scale)
+    else:
+        dataset = AFQDataset.from_study('hbn')
+    print(f"Loaded dataset with shape: {dataset.X.shape}")
+
+    # One prep for every fold
+    data = prepare_subject_data(dataset, batch_size=args.batch_size)
+    if args.scheme == 'loso':
+        held_out_sites = [float(site) for site in args.sites.split(",")] if args.sites else None
+        folds = leave_one_site_out_folds(data["site"], data["split"], held_out_sites)
+    else:
+        fold_of = cached_fold_assignments(os.path.join(args.output_dir, "cv_folds.npz"), data["site"].numpy(),
+                                          data["age"].numpy(), k=args.folds, age_bins=args.age_bins, seed=args.seed)
+        folds = kfold_folds(fold_of, data["site"])
+    print(f"Running {len(folds)} {args.scheme} folds with {args.workers} worker(s)")
+    sys.stdout.flush()
+
+    results_df = run_folds(data, folds, train_fold, workers=args.workers, batch_size=args.batch_size,
+                           layout="stacked" if args.stack_fa_md else "flattened", device=device,
+                           num_permutations=args.permutations, num_resamples=args.bootstrap_resamples)
+    results_file = os.path.join(args.output_dir, f"{args.scheme}_results.csv")
+    results_df.to_csv(results_file, index=False)
+    print(f"Saved per-fold results to {results_file}")
+    tidy_df = tidy_fold_results(results_df)
+    tidy_df.to_csv(os.path.join(args.output_dir, f"{args.scheme}_fold_metrics.csv"), index=False)
+    summary_df = aggregate_fold_results(tidy_df)
+    summary_df.to_csv(os.path.join(args.output_dir, f"{args.scheme}_summary.csv"), index=False)
+
+    print("\nTest results per fold:")
+    for _, row in results_df.iterrows():
+        name = f"Site {row['held_out_site']:g}" if args.scheme == 'loso' else f"Fold {int(row['fold'])}"
+        print(f"{name} ({int(row['n_test'])} subjects): MAE={row['subject_mae']:.3f} years "
+              f"[{row['mae_ci_low']:.3f}, {row['mae_ci_high']:.3f}], R²={row['subject_r2']:.3f} "
+              f"[{row['r2_ci_low']:.3f}, {row['r2_ci_high']:.3f}]")
+    print(f"\nMean over {len(results_df)} folds (95% CI):")
+    for _, row in summary_df[summary_df['metric'].isin(['subject_mae', 'subject_r2'])].iterrows():
+        print(f"{row['metric']}: {row['mean']:.3f} [{row['ci_low']:.3f}, {row['ci_high']:.3f}]")
@@ -33,7 +33,7 @@ sys.path.insert(1, '/mmfs1/gscratch/nrdg/samchou/AFQ-Insight-Autoencoder-Experim
 try:
     print("DEBUG: Importing utility functions")
     sys.stdout.flush()
-    from utils import select_device, kl_divergence_loss,prep_fa_flattned_data, prep_fa_flattened_remapped_data, train_vae_age_site_staged
+    from utils import select_device, kl_divergence_loss,prep_fa_flattned_data, prep_fa_flattened_remapped_data, prep_fa_md_stacked_remapped_data, train_vae_age_site_staged
     from models import Conv1DVariationalAutoencoder_fa, AgePredictorCNN, SitePredictorCNN, CombinedVAE_Predictors, ImprovedAgePredictorCNN, SimpleAgePredictorCNN
     print("DEBUG: Successfully imported utility functions")
     sys.stdout.flush()
@@ -81,7 +81,13 @@ try:
         # Assuming prep_pytorch_data returns torch_dataset, train_loader, test_loader, val_loader
         # If it returns datasets, create loaders here.
         # Adapt this call based on the actual signature and return values of your prep_pytorch_data
-        prep_output = prep_fa_flattened_remapped_data(dataset, batch_size=128)
+        # True: one [2, nodes] FA+MD sample per subject and tract, for two-channel models;
+        # False: FA and MD profiles as separate [1, nodes] samples
+        stack_fa_md = False
+        if stack_fa_md:
+            prep_output = prep_fa_md_stacked_remapped_data(dataset, batch_size=128)
+        else:
+            prep_output = prep_fa_flattened_remapped_data(dataset, batch_size=128)
         if len(prep_output) == 4:
             _, train_loader_raw, test_loader_raw, val_loader_raw = prep_output
         else:
@@ -110,9 +116,9 @@ try:
         print(traceback.format_exc())
         sys.stdout.flush()
 
-    if 'x_batch' in locals() and x_batch is not None:
-        input_channels = x_batch.shape[1]
-        sequence_length = x_batch.shape[2]
+    if 'x_sample' in locals() and x_sample is not None:
+        input_channels = x_sample.shape[1]
+        sequence_length = x_sample.shape[2]
         print(f"Detected input shape: channels={input_channels}, sequence_length={sequence_length}")
     else:
         print("Warning: Could not get sample batch to determine input shape.")
@@ -148,7 +154,8 @@ try:
 
     # Create models
     try:
-        vae = Conv1DVariationalAutoencoder_fa(latent_dims=latent_dim, dropout=dropout, input_length=sequence_length)
+        vae = Conv1DVariationalAutoencoder_fa(latent_dims=latent_dim, dropout=dropout, input_length=sequence_length,
+                                              input_channels=input_channels)
         
         # AgePredictorCNN now accepts sex information to improve age prediction
         # age_predictor = AgePredictorCNN(input_channels=input_channels, 
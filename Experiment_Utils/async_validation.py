@@ -0,0 +1,197 @@
+import copy
+import queue
+import traceback
+from collections import namedtuple
+
+import torch
+import torch.multiprocessing as mp
+
+# Asynchronous validation in a side process.
+# With async_validation enabled, a trainer does not wait for validation: after
+# each validated epoch it copies its weights into a snapshot in shared memory
+# and hands the snapshot to a worker process, which evaluates it while the
+# next epoch trains. Results come back a few epochs late and are applied to the
+# epoch they belong to:
+#
+# - val_* histories get a NaN placeholder that is filled once the result of
+#   that epoch arrives; metrics CSV rows are held back until then.
+# - The scheduler steps with each result as it arrives, i.e. up to max_lag
+#   epochs after the weights were taken.
+# - Best-model selection uses the snapshot that was evaluated, so the saved
+#   best model is the one the metric belongs to.
+#
+# The lag is bounded: there are max_lag snapshot buffers, and submitting a
+# snapshot while all of them are in use waits for the oldest result. After the
+# last epoch the trainer waits for every outstanding result.
+
+DEFAULT_ASYNC_VALIDATION = {
+    "max_lag": 2,            # snapshots in flight before training waits for results
+    "device": "cpu",         # device of the validation worker
+    "num_threads": 1,        # torch threads of the validation worker
+    "start_method": "spawn",  # multiprocessing start method
+}
+
+# One finished validation pass; model holds the evaluated weights
+ValidationResult = namedtuple("ValidationResult", ["epoch", "val_pass", "metrics", "model"])
+
+
+def async_validation_config(async_validation):
+    """
+    Normalizes a trainer's ``async_validation`` argument.
+
+    ``None``/``False`` disables asynchronous validation, ``True`` uses
+    ``DEFAULT_ASYNC_VALIDATION`` and a dict overrides some of its keys.
+    """
+    if not async_validation:
+        return None
+    config = dict(DEFAULT_ASYNC_VALIDATION)
+    if async_validation is not True:
+        unknown = set(async_validation) - set(config)
+        if unknown:
+            raise ValueError(f"Unknown async_validation options: {sorted(unknown)}")
+        config.update(async_validation)
+    if config["max_lag"] < 1:
+        raise ValueError("max_lag must be at least 1")
+    return config
+
+
+def _validation_worker(snapshots, loaders, evaluate, device, num_threads, requests, results):
+    torch.set_num_threads(num_threads)
+    # On CPU the shared snapshots are evaluated in place; other devices get a copy per request
+    on_cpu = torch.device(device).type == "cpu"
+    models = snapshots if on_cpu else [copy.deepcopy(snapshot).to(device) for snapshot in snapshots]
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        epoch, slot, val_pass, kwargs = request
+        try:
+            if not on_cpu:
+                models[slot].load_state_dict(snapshots[slot].state_dict())
+            metrics = evaluate(models[slot], loaders[val_pass], device, **kwargs)
+            results.put((epoch, slot, metrics, None))
+        except Exception:
+            results.put((epoch, slot, None, traceback.format_exc()))
+
+
+class AsyncValidator:
+    """Evaluates weight snapshots of a model in a separate process.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        The model being trained; only its architecture and weights are copied.
+    evaluate : callable
+        Module-level function ``evaluate(model, loader, device, **kwargs)``
+        returning a dict of metrics. It runs in the worker process, so it must
+        be picklable.
+    loaders : dict
+        Validation pass name (``"full"``, ``"fast"``) -> DataLoader. They are
+        sent to the worker once.
+    config : dict
+        Options from ``async_validation_config``.
+    """
+
+    def __init__(self, model, evaluate, loaders, config):
+        self.max_lag = config["max_lag"]
+        self.device = config["device"]
+        # Snapshot buffers in shared memory; the worker sees writes to them
+        self.snapshots = []
+        for _ in range(self.max_lag):
+            snapshot = copy.deepcopy(model).to("cpu").eval()
+            snapshot.share_memory()
+            self.snapshots.append(snapshot)
+        self._free = list(range(self.max_lag))
+        self._held = []
+        self._done = []
+        self._in_flight = {}
+
+        ctx = mp.get_context(config["start_method"])
+        self._requests = ctx.Queue()
+        self._results = ctx.Queue()
+        self._process = ctx.Process(
+            target=_validation_worker,
+            args=(self.snapshots, {name: loader for name, loader in loaders.items() if loader is not None},
+                  evaluate, self.device, config["num_threads"], self._requests, self._results),
+            daemon=True,
+        )
+        self._process.start()
+
+    @property
+    def pending(self):
+        """Epochs whose validation results have not been returned yet."""
+        return {epoch for epoch, _ in self._in_flight.values()} | {result.epoch for _, result in self._done}
+
+    def submit(self, epoch, val_pass, model, **kwargs):
+        """Copy ``model``'s weights into a free snapshot and queue its validation.
+
+        Waits for the oldest result if all ``max_lag`` snapshots are in use.
+        """
+        self._release()
+        while not self._free:
+            self._receive(block=True)
+            # The trainer has not seen this result yet; give it a private copy of the weights
+            slot, result = self._done[-1]
+            self._done[-1] = (None, result._replace(model=copy.deepcopy(result.model)))
+            self._free.append(slot)
+        slot = self._free.pop(0)
+        with torch.no_grad():
+            for target, source in zip(self.snapshots[slot].state_dict().values(), model.state_dict().values()):
+                target.copy_(source)
+        self._in_flight[slot] = (epoch, val_pass)
+        self._requests.put((epoch, slot, val_pass, kwargs))
+
+    def poll(self):
+        """Return the results that arrived so far, oldest epoch first.
+
+        The snapshots of returned results stay valid until the next call to
+        ``submit``, ``poll`` or ``drain``.
+        """
+        self._release()
+        while self._receive(block=False):
+            pass
+        return self._pop_done()
+
+    def drain(self):
+        """Wait for all outstanding results and return them, oldest epoch first."""
+        self._release()
+        while self._in_flight:
+            self._receive(block=True)
+        return self._pop_done()
+
+    def close(self):
+        """Stop the worker process."""
+        if self._process.is_alive():
+            self._requests.put(None)
+            self._process.join(timeout=10)
+            if self._process.is_alive():
+                self._process.terminate()
+
+    def _receive(self, block):
+        if not self._in_flight:
+            return False
+        while True:
+            try:
+                epoch, slot, metrics, error = self._results.get(timeout=1.0) if block else self._results.get_nowait()
+                break
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise RuntimeError("The validation worker exited unexpectedly")
+                if not block:
+                    return False
+        if error is not None:
+            self.close()
+            raise RuntimeError(f"Validation of epoch {epoch + 1} failed in the worker:\n{error}")
+        _, val_pass = self._in_flight.pop(slot)
+        self._done.append((slot, ValidationResult(epoch, val_pass, metrics, self.snapshots[slot])))
+        return True
+
+    def _pop_done(self):
+        done = sorted(self._done, key=lambda item: item[1].epoch)
+        self._done = []
+        self._held.extend(slot for slot, _ in done if slot is not None)
+        return [result for _, result in done]
+
+    def _release(self):
+        self._free.extend(self._held)
+        self._held = []
@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import torch
+
+# Gradient attribution maps of age predictions over tracts and nodes.
+# For an input of shape (num_tracts, length), an attribution map has the same
+# shape and tells how much each node of each tract moved the predicted age.
+# Integrated gradients evaluates all interpolation steps of many subjects in
+# one large forward/backward pass instead of one pass per step and subject.
+
+METHODS = ("integrated_gradients", "gradient_x_input")
+
+
+def age_path(model):
+    """
+    Deterministic input -> predicted age function of a trained model.
+
+    Age predictors are used as they are. For ``CombinedAE_Predictors`` (and
+    ``CombinedVAE_Predictors``), the age path is encoder -> decoder -> age
+    predictor, decoding the latent mean instead of a random sample so
+    attributions are reproducible.
+    """
+    if hasattr(model, "autoencoder"):
+        autoencoder = model.autoencoder
+    elif hasattr(model, "vae"):
+        autoencoder = model.vae
+    else:
+        return model
+    is_variational = getattr(model, "is_variational", True)
+
+    def predict(x):
+        if is_variational:
+            mean, _ = autoencoder.encoder(x)
+            x_hat = autoencoder.decoder(mean)
+        else:
+            x_hat = autoencoder(x)
+        return model.age_predictor(x_hat)
+
+    return predict
+
+
+def _input_gradients(predict, inputs):
+    inputs = inputs.detach().requires_grad_(True)
+    with torch.enable_grad():
+        # Samples are independent in eval mode, so the gradient of the sum is every sample's own gradient
+        (grad,) = torch.autograd.grad(predict(inputs).sum(), inputs)
+    return grad
+
+
+def gradient_x_input(predict, x):
+    """Gradient of the predicted age times the input, same shape as ``x``."""
+    return _input_gradients(predict, x) * x
+
+
+def integrated_gradients(predict, x, baseline=0.0, steps=32):
+    """
+    Integrated gradients of the predicted age from ``baseline`` to ``x``.
+
+    The ``steps`` interpolation points (midpoint rule) of every subject in
+    ``x`` go through one forward/backward pass of ``steps * len(x)`` inputs.
+
+    Parameters
+    ----------
+    predict : callable
+        Maps (batch, num_tracts, length) inputs to age predictions; the model
+        should be in eval mode.
+    x : torch.Tensor
+        Inputs of shape (batch, num_tracts, length).
+    baseline : torch.Tensor or float, optional
+        Reference input, broadcastable to one subject (e.g. the cohort mean).
+    steps : int, optional
+        Number of interpolation points.
+
+    Returns
+    -------
+    torch.Tensor
+        Attributions with the shape of ``x``. Per subject they sum to
+        approximately ``predict(x) - predict(baseline)``.
+    """
+    baseline = torch.as_tensor(baseline, dtype=x.dtype, device=x.device).expand_as(x[0])
+    alphas = (torch.arange(steps, dtype=x.dtype, device=x.device) + 0.5) / steps
+    delta = x - baseline
+    path = baseline + alphas.view(-1, 1, 1, 1) * delta.unsqueeze(0)
+    grads = _input_gradients(predict, path.reshape(-1, *x.shape[1:])).reshape(steps, *x.shape)
+    return delta * grads.mean(0)
+
+
+def save_attribution_maps(predict, loader, out_dir, method="integrated_gradients", baseline=0.0, steps=32,
+                          max_batch=4096, device="cpu", num_subjects=None):
+    """
+    Compute per-subject attribution maps over a loader and save them.
+
+    Writes ``<method>_per_subject.npy``, a (num_subjects, num_tracts, length)
+    float32 array filled through a memmap so the maps of a whole cohort never
+    have to fit in memory, and ``<method>_cohort_mean.npy`` and
+    ``<method>_cohort_mean_abs.npy``, the cohort-averaged (num_tracts, length)
+    maps. For integrated gradients, subjects are grouped so that each pass
+    holds at most ``max_batch`` interpolated inputs. ``num_subjects``
+    defaults to the size of ``loader.dataset``.
+
+    Returns
+    -------
+    np.ndarray
+        The cohort-averaged map.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown attribution method {method!r}; expected one of {METHODS}")
+    os.makedirs(out_dir, exist_ok=True)
+    num_subjects = len(loader.dataset) if num_subjects is None else num_subjects
+    sample, _ = next(iter(loader))
+    per_subject = np.lib.format.open_memmap(os.path.join(out_dir, f"{method}_per_subject.npy"), mode="w+",
+                                            dtype=np.float32, shape=(num_subjects, *sample.shape[1:]))
+    if torch.is_tensor(baseline):
+        baseline = baseline.to(device)
+    subjects_per_pass = max(1, max_batch // steps) if method == "integrated_gradients" else max_batch
+    row, total, total_abs = 0, 0.0, 0.0
+    for x, _ in loader:
+        for chunk in x.to(device).split(subjects_per_pass):
+            if method == "integrated_gradients":
+                maps = integrated_gradients(predict, chunk, baseline, steps)
+            else:
+                maps = gradient_x_input(predict, chunk)
+            maps = maps.double()
+            per_subject[row:row + len(chunk)] = maps.cpu().numpy()
+            total = total + maps.sum(0)
+            total_abs = total_abs + maps.abs().sum(0)
+            row += len(chunk)
+    per_subject.flush()
+
+    cohort_mean = (total / row).cpu().numpy().astype(np.float32)
+    np.save(os.path.join(out_dir, f"{method}_cohort_mean.npy"), cohort_mean)
+    np.save(os.path.join(out_dir, f"{method}_cohort_mean_abs.npy"), (total_abs / row).cpu().numpy().astype(np.float32))
+    return cohort_mean
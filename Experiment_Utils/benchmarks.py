@@ -0,0 +1,367 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import traceback
+from datetime import datetime
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+try:
+    from . import models
+    from . import utils
+    from .synthetic_data import make_synthetic_afq_dataset
+except ImportError:
+    import models
+    import utils
+    from synthetic_data import make_synthetic_afq_dataset
+
+# CPU-only, offline benchmark suite.
+# Times forward+backward for every model in models.py, the prep_* data
+# functions and dataset __getitem__ rates, and one epoch of each trainer, all
+# on synthetic data, and writes the results as JSON so runs from different
+# commits can be compared:
+#
+#   python Experiment_Utils/benchmarks.py --out bench_new.json --compare bench_old.json
+#
+# A case that cannot run (wrong input shape for a model, an incompatible
+# afqinsight version, a broken trainer) is recorded with its error instead of
+# aborting the suite.
+
+# Models timed by the suite: name -> (factory(sequence_length), input_channels)
+MODEL_CASES = {
+    "Conv1DVariationalAutoencoder_fa": (lambda length: models.Conv1DVariationalAutoencoder_fa(latent_dims=20, input_length=length), 1),
+    "Conv1DAutoencoder_fa": (lambda length: models.Conv1DAutoencoder_fa(latent_dims=20), 1),
+    "AgePredictorCNN": (lambda length: models.AgePredictorCNN(input_channels=1, sequence_length=length), 1),
+    "SitePredictorCNN": (lambda length: models.SitePredictorCNN(num_sites=4, input_channels=1, sequence_length=length), 1),
+    "ImprovedAgePredictorCNN": (lambda length: models.ImprovedAgePredictorCNN(input_channels=1, sequence_length=length), 1),
+    "SimpleAgePredictorCNN": (lambda length: models.SimpleAgePredictorCNN(input_channels=1, sequence_length=length), 1),
+    "CombinedVAE_Predictors": (lambda length: models.CombinedVAE_Predictors(
+        models.Conv1DVariationalAutoencoder_fa(latent_dims=20, input_length=length),
+        models.AgePredictorCNN(1, length), models.SitePredictorCNN(4, 1, length)), 1),
+    "CombinedAE_Predictors": (lambda length: models.CombinedAE_Predictors(
+        models.Conv1DAutoencoder_fa(latent_dims=20),
+        models.AgePredictorCNN(1, length), models.SitePredictorCNN(4, 1, length), is_variational=False), 1),
+    "Conv1DVariationalAutoencoder_fa_unflattened": (lambda length: models.Conv1DVariationalAutoencoder_fa_unflattened(num_tracts=48, latent_dims=20), 48),
+    "Conv1DVariationalAutoencoder": (lambda length: models.Conv1DVariationalAutoencoder(num_tracts=48, latent_dims=20), 48),
+}
+
+PREP_FUNCTIONS = (
+    "prep_fa_dataset",
+    "prep_fa_dataset_paired",
+    "prep_fa_flattned_data",
+    "prep_first_tract_data",
+    "prep_fa_flattened_remapped_data",
+    "prep_fa_md_stacked_remapped_data",
+)
+
+TRAINERS = (
+    "train_autoencoder",
+    "train_variational_autoencoder",
+    "train_variational_autoencoder_age_site",
+    "train_vae_age_site_staged",
+    "train_vae_age_site_alternating",
+    "train_vae_age_site_alternating_improved",
+)
+
+# Full and --quick settings
+DEFAULT_CONFIG = {
+    "batch_sizes": [16, 64, 128],
+    "lengths": [50, 100],
+    "warmup": 2,
+    "repeats": 10,
+    "n_subjects": 400,
+    "getitem_samples": 2000,
+    "trainer_samples": 512,
+    "trainer_batch_size": 64,
+}
+QUICK_CONFIG = {
+    "batch_sizes": [8],
+    "lengths": [50, 100],
+    "warmup": 1,
+    "repeats": 2,
+    "n_subjects": 60,
+    "getitem_samples": 100,
+    "trainer_samples": 32,
+    "trainer_batch_size": 16,
+}
+
+
+def _timings(fn, warmup, repeats):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _summary(times, n_samples):
+    median = float(np.median(times))
+    return {
+        "median_s": median,
+        "mean_s": float(np.mean(times)),
+        "min_s": float(np.min(times)),
+        "samples_per_sec": n_samples / median if median > 0 else None,
+    }
+
+
+def _error(exc):
+    return f"{type(exc).__name__}: {exc}"
+
+
+def environment_info():
+    """Machine and code version the results were measured on."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "numpy": np.__version__,
+    }
+
+
+def _model_loss(outputs):
+    if isinstance(outputs, torch.Tensor):
+        outputs = (outputs,)
+    return sum(out.float().mean() for out in outputs)
+
+
+def benchmark_models(batch_sizes, lengths, warmup=2, repeats=10, names=None):
+    """Time forward+backward of each model in ``MODEL_CASES`` per batch size and input length."""
+    results = []
+    for name, (factory, channels) in MODEL_CASES.items():
+        if names is not None and name not in names:
+            continue
+        for length in lengths:
+            for batch_size in batch_sizes:
+                record = {"model": name, "batch_size": batch_size, "length": length, "channels": channels}
+                try:
+                    torch.manual_seed(0)
+                    model = factory(length).train()
+                    x = torch.randn(batch_size, channels, length)
+
+                    def step():
+                        model.zero_grad(set_to_none=True)
+                        _model_loss(model(x)).backward()
+
+                    record.update(_summary(_timings(step, warmup, repeats), batch_size))
+                    record["parameters"] = sum(p.numel() for p in model.parameters())
+                except Exception as exc:
+                    record["error"] = _error(exc)
+                results.append(record)
+    return results
+
+
+def _getitem_rate(dataset, n_samples):
+    n = min(n_samples, len(dataset))
+    start = time.perf_counter()
+    for i in range(n):
+        dataset[i]
+    elapsed = time.perf_counter() - start
+    return {"items": n, "seconds": elapsed, "items_per_sec": n / elapsed if elapsed > 0 else None}
+
+
+def benchmark_data_prep(n_subjects=400, getitem_samples=2000, batch_size=32, names=None):
+    """Time each prep_* function and the ``__getitem__`` rate of the datasets it returns."""
+    results = []
+    try:
+        base = make_synthetic_afq_dataset(n_subjects)
+        record = {"function": "AFQDataset.as_torch_dataset"}
+        start = time.perf_counter()
+        torch_dataset = base.as_torch_dataset()
+        record["seconds"] = time.perf_counter() - start
+        record["getitem"] = _getitem_rate(torch_dataset, getitem_samples)
+    except Exception as exc:
+        return [{"function": "make_synthetic_afq_dataset", "error": _error(exc)}]
+    results.append(record)
+
+    for name in PREP_FUNCTIONS:
+        if names is not None and name not in names:
+            continue
+        record = {"function": name, "n_subjects": n_subjects, "batch_size": batch_size}
+        try:
+            dataset = make_synthetic_afq_dataset(n_subjects)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, train_loader, _, _ = getattr(utils, name)(dataset, batch_size=batch_size)
+            record["seconds"] = time.perf_counter() - start
+            record["train_items"] = len(train_loader.dataset)
+            record["getitem"] = _getitem_rate(train_loader.dataset, getitem_samples)
+        except Exception as exc:
+            record["error"] = _error(exc)
+        results.append(record)
+    return results
+
+
+def _run_trainer(name, train_loader, val_loader, save_dir):
+    length = train_loader.dataset.tensors[0].shape[-1]
+    vae = models.Conv1DVariationalAutoencoder_fa(latent_dims=20, input_length=length)
+    age = models.AgePredictorCNN(1, length)
+    site = models.SitePredictorCNN(4, 1, length)
+    staged = dict(epochs_stage1=1, epochs_stage2=1, device="cpu", save_dir=save_dir,
+                  save_predictions_interval=1000, periodic_save_interval=1000, log_level="warning")
+    if name == "train_autoencoder":
+        return {"ae": utils.train_autoencoder(models.Conv1DAutoencoder_fa(latent_dims=20), train_loader, val_loader,
+                                              epochs=1, device="cpu")}
+    if name == "train_variational_autoencoder":
+        return {"vae": utils.train_variational_autoencoder(vae, train_loader, val_loader, epochs=1, device="cpu",
+                                                           save_dir=save_dir, periodic_save_interval=1000)}
+    if name == "train_variational_autoencoder_age_site":
+        return {"combined": utils.train_variational_autoencoder_age_site(
+            models.CombinedAE_Predictors(vae, age, site), train_loader, val_loader, epochs=1, device="cpu",
+            save_prefix=os.path.join(save_dir, "best_combined_model"))}
+    if name == "train_vae_age_site_staged":
+        return utils.train_vae_age_site_staged(vae, age, site, train_loader, val_loader, **staged)
+    if name == "train_vae_age_site_alternating":
+        return utils.train_vae_age_site_alternating(vae, age, site, train_loader, val_loader, cycle_length=1, **staged)
+    return utils.train_vae_age_site_alternating_improved(vae, age, site, train_loader, val_loader, cycle_length=1, **staged)
+
+
+def benchmark_trainers(n_samples=512, batch_size=64, length=100, names=None):
+    """Time one epoch (per stage) of each trainer on random tensors."""
+    generator = torch.Generator().manual_seed(0)
+    x = torch.randn(n_samples, 1, length, generator=generator)
+    labels = torch.stack([
+        torch.rand(n_samples, generator=generator) * 16 + 5,
+        torch.randint(0, 2, (n_samples,), generator=generator).float(),
+        torch.randint(0, 4, (n_samples,), generator=generator).float(),
+    ], dim=1)
+    n_val = max(batch_size, n_samples // 5)
+    train_loader = DataLoader(TensorDataset(x, labels), batch_size=batch_size, shuffle=True)
+    val_loader = DataLoader(TensorDataset(x[:n_val], labels[:n_val]), batch_size=batch_size)
+
+    results = []
+    for name in TRAINERS:
+        if names is not None and name not in names:
+            continue
+        record = {"trainer": name, "n_samples": n_samples, "batch_size": batch_size, "length": length}
+        try:
+            torch.manual_seed(0)
+            cwd = os.getcwd()
+            # train_autoencoder saves its best model into the working directory
+            with tempfile.TemporaryDirectory() as save_dir, contextlib.redirect_stdout(io.StringIO()):
+                os.chdir(save_dir)
+                try:
+                    start = time.perf_counter()
+                    stage_results = _run_trainer(name, train_loader, val_loader, save_dir)
+                    record["seconds"] = time.perf_counter() - start
+                finally:
+                    os.chdir(cwd)
+            record["stages"] = {}
+            for stage, stage_result in stage_results.items():
+                if not isinstance(stage_result, dict):
+                    continue
+                phases = stage_result.get("phase_times_epoch", stage_result.get("phase_times_per_epoch"))
+                throughput = stage_result.get("samples_per_sec_epoch", stage_result.get("samples_per_sec_per_epoch"))
+                if phases is None:
+                    continue
+                record["stages"][stage] = {
+                    "phase_times": {phase: float(np.sum(times)) for phase, times in phases.items()},
+                    "samples_per_sec": float(np.mean(throughput)) if throughput else None,
+                }
+        except Exception as exc:
+            record["error"] = _error(exc)
+            record["traceback"] = traceback.format_exc(limit=3)
+        results.append(record)
+    return results
+
+
+def run_benchmarks(config=None, sections=("models", "data", "trainers")):
+    """Run the selected benchmark sections and return the JSON-serializable results."""
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    results = {"environment": environment_info(), "config": config}
+    if "models" in sections:
+        results["models"] = benchmark_models(config["batch_sizes"], config["lengths"],
+                                             warmup=config["warmup"], repeats=config["repeats"])
+    if "data" in sections:
+        results["data"] = benchmark_data_prep(config["n_subjects"], config["getitem_samples"])
+    if "trainers" in sections:
+        results["trainers"] = benchmark_trainers(config["trainer_samples"], config["trainer_batch_size"])
+    return results
+
+
+def _case_times(results):
+    """Flatten a results dict to {case key: seconds} for comparisons."""
+    times = {}
+    for record in results.get("models", []):
+        if "median_s" in record:
+            times[f"model/{record['model']}/L{record['length']}/B{record['batch_size']}"] = record["median_s"]
+    for record in results.get("data", []):
+        if "seconds" in record:
+            times[f"prep/{record['function']}"] = record["seconds"]
+        if "getitem" in record:
+            times[f"getitem/{record['function']}"] = record["getitem"]["seconds"] / max(record["getitem"]["items"], 1)
+    for record in results.get("trainers", []):
+        if "seconds" in record:
+            times[f"trainer/{record['trainer']}"] = record["seconds"]
+    return times
+
+
+def compare_results(old, new):
+    """Per-case ``new / old`` time ratios for cases present in both results (< 1 is faster)."""
+    old_times, new_times = _case_times(old), _case_times(new)
+    return {case: {"old_s": old_times[case], "new_s": new_times[case], "ratio": new_times[case] / old_times[case]}
+            for case in new_times if case in old_times and old_times[case] > 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU benchmarks for models, data preparation and trainers")
+    parser.add_argument('--out', type=str, default='benchmark_results.json', help='JSON file to write results to')
+    parser.add_argument('--quick', action='store_true', help='Small sizes and few repeats (smoke test)')
+    parser.add_argument('--sections', nargs='+', default=['models', 'data', 'trainers'],
+                        choices=['models', 'data', 'trainers'], help='Benchmark sections to run')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', help='Batch sizes for the model benchmarks')
+    parser.add_argument('--repeats', type=int, help='Timed repeats per model case')
+    parser.add_argument('--threads', type=int, help='torch.set_num_threads before running')
+    parser.add_argument('--compare', type=str, help='Earlier results JSON to compare against')
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    config = dict(QUICK_CONFIG if args.quick else DEFAULT_CONFIG)
+    if args.batch_sizes:
+        config["batch_sizes"] = args.batch_sizes
+    if args.repeats:
+        config["repeats"] = args.repeats
+
+    results = run_benchmarks(config, sections=args.sections)
+    if args.compare:
+        with open(args.compare) as f:
+            results["comparison"] = {"against": args.compare, "cases": compare_results(json.load(f), results)}
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+
+    for record in results.get("models", []):
+        status = record.get("error") or f"{record['median_s'] * 1000:.2f} ms ({record['samples_per_sec']:.0f} samples/s)"
+        print(f"{record['model']:45s} L={record['length']:<4d} B={record['batch_size']:<4d} {status}")
+    for record in results.get("data", []):
+        status = record.get("error") or f"{record['seconds']:.3f} s, getitem {record['getitem']['items_per_sec']:.0f}/s"
+        print(f"{record['function']:45s} {status}")
+    for record in results.get("trainers", []):
+        print(f"{record['trainer']:45s} {record.get('error') or '%.2f s' % record['seconds']}")
+    for case, cmp in results.get("comparison", {}).get("cases", {}).items():
+        print(f"{case:70s} {cmp['ratio']:.2f}x")
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
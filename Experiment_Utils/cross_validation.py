@@ -0,0 +1,321 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+from scipy import stats
+from torch.utils.data import DataLoader, TensorDataset
+
+try:
+    from .significance import prediction_significance
+    from .tract_importance import age_scores, predict_ages
+    from .utils import prep_fa_dataset, stack_fa_md_channels
+    from .worker_pool import run_in_pool, share_dataset_memory
+except ImportError:
+    from significance import prediction_significance
+    from tract_importance import age_scores, predict_ages
+    from utils import prep_fa_dataset, stack_fa_md_channels
+    from worker_pool import run_in_pool, share_dataset_memory
+
+# Cross-validation folds over one preprocessed tensor set.
+# The data is prepared once into per-subject tensors (profiles, age, sex,
+# original site and the train/val/test split of prep_pytorch_data). A fold is
+# only boolean subject masks plus the site vocabulary of its training sites,
+# and its loaders are built from the shared tensors by masking, so no fold
+# reruns the prep. Folds run in forked worker processes (worker_pool.py),
+# which inherit the tensors from shared memory.
+
+TRAIN, VAL, TEST = 0, 1, 2
+LAYOUTS = ("flattened", "stacked", "subjects")
+# Columns of run_folds results that describe the fold rather than measure it
+FOLD_COLUMNS = ["fold", "held_out_site", "n_train", "n_val", "n_test", "num_sites"]
+
+# Data, folds and trainer of the running folds, inherited by the forked workers
+_FOLD_STATE = {}
+
+
+def prepare_subject_data(dataset, target_labels=("dki_fa", "dki_md"), batch_size=64, site_col_name='scan_site_id',
+                         age_col_name='age'):
+    """
+    Run the FA/MD prep once and collect it as per-subject tensors.
+
+    Returns
+    -------
+    dict
+        ``x`` (subjects, tracts, nodes), ``age``, ``sex`` and original ``site``
+        (subjects,), and ``split`` (subjects,) with TRAIN, VAL or TEST of the
+        subject in the prep's split.
+    """
+    _, train_loader, test_loader, val_loader = prep_fa_dataset(
+        dataset, target_labels=list(target_labels), batch_size=batch_size
+    )
+    try:
+        age_idx = dataset.target_cols.index(age_col_name)
+        site_idx = dataset.target_cols.index(site_col_name)
+        sex_idx = dataset.target_cols.index('sex')
+    except (AttributeError, ValueError) as e:
+        raise ValueError("Could not find required columns for remapping.") from e
+
+    xs, ys, splits = [], [], []
+    for split, loader in ((TRAIN, train_loader), (VAL, val_loader), (TEST, test_loader)):
+        for x, y in loader:
+            xs.append(x.float())
+            ys.append(y.float())
+            splits.append(torch.full((len(x),), split, dtype=torch.int8))
+    y = torch.cat(ys)
+    return {"x": torch.cat(xs), "age": y[:, age_idx].contiguous(), "sex": y[:, sex_idx].contiguous(),
+            "site": y[:, site_idx].contiguous(), "split": torch.cat(splits)}
+
+
+def remap_sites(sites, site_vocab):
+    """Index of every site in the sorted ``site_vocab``, as float labels; -1 for sites not in it."""
+    position = torch.searchsorted(site_vocab, sites).clamp_max(len(site_vocab) - 1)
+    return torch.where(site_vocab[position] == sites, position.float(), torch.tensor(-1.0))
+
+
+def leave_one_site_out_folds(sites, split, held_out_sites=None):
+    """
+    One fold per held-out site.
+
+    The models of a fold train and validate on the train and val subjects of
+    the other sites, renumbered consecutively (``site_vocab``), and are tested
+    on every subject of the held-out site.
+
+    Parameters
+    ----------
+    sites : torch.Tensor
+        (subjects,) original site IDs.
+    split : torch.Tensor
+        (subjects,) TRAIN/VAL/TEST of every subject.
+    held_out_sites : list of float, optional
+        Sites to hold out; defaults to every site.
+
+    Returns
+    -------
+    list of dict
+        ``fold``, ``held_out_site``, boolean (subjects,) ``train``/``val``/``test``
+        masks and ``site_vocab``.
+    """
+    all_sites = torch.unique(sites)
+    if held_out_sites is None:
+        held_out_sites = all_sites.tolist()
+    folds = []
+    for fold, site in enumerate(held_out_sites):
+        held_out = sites == site
+        if not held_out.any():
+            raise ValueError(f"No subjects of site {site}; sites are {all_sites.tolist()}")
+        folds.append({
+            "fold": fold,
+            "held_out_site": float(site),
+            "train": ~held_out & (split == TRAIN),
+            "val": ~held_out & (split == VAL),
+            "test": held_out,
+            "site_vocab": all_sites[all_sites != site],
+        })
+    return folds
+
+
+def stratified_fold_assignments(sites, ages, k=5, age_bins=4, seed=0):
+    """
+    Fold (0..k-1) of every subject, stratified by site and age bin.
+
+    Subjects are grouped by site and age quantile bin, shuffled within their
+    group, and dealt to the folds round-robin, so every fold gets the same
+    share (within one subject) of every site x age group.
+    """
+    sites = np.asarray(sites)
+    ages = np.asarray(ages, dtype=float)
+    edges = np.quantile(ages, np.linspace(0, 1, age_bins + 1)[1:-1])
+    age_bin = np.searchsorted(edges, ages, side="right")
+    _, stratum = np.unique(np.stack([sites, age_bin], 1), axis=0, return_inverse=True)
+    order = np.random.default_rng(seed).permutation(len(ages))
+    order = order[np.argsort(stratum.reshape(-1)[order], kind="stable")]
+    # The rotation continues across groups, which keeps the fold sizes balanced too
+    fold_of = np.empty(len(ages), dtype=np.int64)
+    fold_of[order] = np.arange(len(ages)) % k
+    return fold_of
+
+
+def cached_fold_assignments(path, sites, ages, k=5, age_bins=4, seed=0):
+    """
+    ``stratified_fold_assignments``, cached in the .npz file ``path``.
+
+    The cache is keyed by the settings and a hash of the sites and ages, so
+    it is recomputed (and overwritten) for other data or settings.
+    """
+    sites = np.asarray(sites, dtype=np.float64)
+    ages = np.asarray(ages, dtype=np.float64)
+    digest = hashlib.sha1(sites.tobytes() + ages.tobytes()).hexdigest()[:12]
+    key = f"k={k},age_bins={age_bins},seed={seed},data={digest}"
+    if os.path.exists(path):
+        with np.load(path) as cached:
+            if str(cached["key"]) == key:
+                return cached["fold_of"]
+        print(f"Fold cache {path} has other settings or data; recomputing the folds")
+    fold_of = stratified_fold_assignments(sites, ages, k, age_bins, seed)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, fold_of=fold_of, key=key)
+    os.replace(tmp_path, path)
+    return fold_of
+
+
+def kfold_folds(fold_of, sites):
+    """
+    Folds of k-fold cross-validation from the fold of every subject.
+
+    Fold f tests on the subjects of fold f, validates (selects the best
+    epoch) on fold f + 1 and trains on the other k - 2 folds. Every fold
+    keeps the full site vocabulary.
+
+    Returns
+    -------
+    list of dict
+        ``fold``, boolean (subjects,) ``train``/``val``/``test`` masks and ``site_vocab``.
+    """
+    fold_of = torch.as_tensor(fold_of)
+    k = int(fold_of.max()) + 1
+    if k < 3:
+        raise ValueError(f"k-fold cross-validation needs at least 3 folds (test, val and train), got {k}")
+    site_vocab = torch.unique(sites)
+    return [{"fold": fold, "train": (fold_of != fold) & (fold_of != (fold + 1) % k), "val": fold_of == (fold + 1) % k,
+             "test": fold_of == fold, "site_vocab": site_vocab} for fold in range(k)]
+
+
+def fold_loaders(data, fold, batch_size=64, layout="flattened"):
+    """
+    Train, val and test loaders of a fold, with labels ``[age, sex, remapped_site]``.
+
+    ``layout`` gives the samples: "flattened" is one [1, nodes] sample per
+    subject and tract (as prep_fa_flattened_remapped_data), "stacked" one
+    [2, nodes] FA+MD sample per subject and bundle (as
+    prep_fa_md_stacked_remapped_data) and "subjects" one [tracts, nodes]
+    sample per subject. Samples are subject-major, and sites outside the
+    fold's vocabulary (the held-out site) are labelled -1.
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}; expected one of {LAYOUTS}")
+
+    def loader(mask, shuffle):
+        x = data["x"][mask]
+        labels = torch.stack([data["age"][mask], data["sex"][mask],
+                              remap_sites(data["site"][mask], fold["site_vocab"])], dim=1)
+        if layout == "flattened":
+            labels = labels.repeat_interleave(x.shape[1], dim=0)
+            x = x.reshape(-1, 1, x.shape[-1])
+        elif layout == "stacked":
+            labels = labels.repeat_interleave(x.shape[1] // 2, dim=0)
+            x = stack_fa_md_channels(x)
+        return DataLoader(TensorDataset(x, labels), batch_size=batch_size, shuffle=shuffle)
+
+    return loader(fold["train"], True), loader(fold["val"], False), loader(fold["test"], False)
+
+
+def held_out_scores(ages, predictions, samples_per_subject=1, num_permutations=1000, num_resamples=1000,
+                    confidence=0.95):
+    """
+    Age scores on a fold's test loader: ``mae``/``r2`` over samples, and
+    ``subject_mae``/``subject_r2`` of the subjects' mean predictions with
+    their p-value and bootstrap confidence intervals (resampling subjects).
+    """
+    mae, r2 = age_scores(predictions, ages)
+    subject_ages = ages.reshape(-1, samples_per_subject)[:, 0]
+    subject_predictions = predictions.reshape(-1, samples_per_subject).mean(1)
+    significance = prediction_significance(subject_predictions.numpy()[None], subject_ages.numpy(),
+                                           num_permutations, num_resamples, confidence)
+    scores = {"mae": mae.item(), "r2": r2.item(), "subject_mae": significance["mae"][0],
+              "subject_r2": significance["r2"][0]}
+    scores.update({name: significance[name][0] for name in
+                   ("r2_p_value", "r2_ci_low", "r2_ci_high", "mae_ci_low", "mae_ci_high")})
+    return scores
+
+
+def run_folds(data, folds, train_fold, workers=1, batch_size=64, layout="flattened", device="cpu",
+              num_permutations=1000, num_resamples=1000, confidence=0.95):
+    """
+    Train and test every fold, in ``workers`` forked processes.
+
+    Parameters
+    ----------
+    data : dict
+        Subject tensors from ``prepare_subject_data``; moved to shared memory
+        when ``workers > 1``.
+    folds : list of dict
+        Folds, e.g. from ``leave_one_site_out_folds``.
+    train_fold : callable
+        ``train_fold(fold, train_loader, val_loader)`` trains the fold's
+        models and returns a dict with ``predict``, a function of a batch of
+        inputs to predicted ages (e.g. ``age_path(model)``), and any scalar
+        results to report. It is not pickled, so it may be a closure; with
+        workers it runs in the children, which must not inherit an
+        initialized CUDA context (see worker_pool.select_fork_safe_device).
+    device : str or torch.device
+        Device the test inputs are moved to for ``predict``.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per fold: the fold's scalar keys (``fold``, ``held_out_site``,
+        ...), subject counts ``n_train``/``n_val``/``n_test``, ``num_sites``,
+        the scalar results of ``train_fold`` and the ``held_out_scores``.
+    """
+    _FOLD_STATE.update(data=data, folds=folds, train_fold=train_fold, batch_size=batch_size, layout=layout,
+                       device=device, significance=(num_permutations, num_resamples, confidence))
+    try:
+        indices = list(range(len(folds)))
+        if workers > 1:
+            share_dataset_memory(list(data.values()))
+            rows = [row for _, row in run_in_pool(_run_fold, indices, workers)]
+        else:
+            rows = [_run_fold(i) for i in indices]
+    finally:
+        _FOLD_STATE.clear()
+    return pd.DataFrame(rows).sort_values("fold").reset_index(drop=True)
+
+
+def _run_fold(index):
+    state = _FOLD_STATE
+    fold = state["folds"][index]
+    data = state["data"]
+    # Seeding by fold keeps results independent of scheduling
+    torch.manual_seed(fold["fold"])
+    train_loader, val_loader, test_loader = fold_loaders(data, fold, state["batch_size"], state["layout"])
+    results = dict(state["train_fold"](fold, train_loader, val_loader))
+    predict = results.pop("predict")
+
+    ages, predictions = predict_ages(predict, test_loader, state["device"])
+    n_test = int(fold["test"].sum())
+    row = {key: value for key, value in fold.items() if not isinstance(value, torch.Tensor)}
+    row.update(n_train=int(fold["train"].sum()), n_val=int(fold["val"].sum()), n_test=n_test,
+               num_sites=len(fold["site_vocab"]))
+    row.update({key: value for key, value in results.items() if np.isscalar(value)})
+    row.update(held_out_scores(ages, predictions, len(ages) // n_test, *state["significance"]))
+    return row
+
+
+def tidy_fold_results(results_df):
+    """Long format of ``run_folds`` results: the fold columns, ``metric`` and ``value``, one row per fold and metric."""
+    fold_columns = [column for column in FOLD_COLUMNS if column in results_df]
+    metrics = [column for column in results_df.columns
+               if column not in fold_columns and pd.api.types.is_numeric_dtype(results_df[column])]
+    return results_df.melt(id_vars=fold_columns, value_vars=metrics, var_name="metric", value_name="value")
+
+
+def aggregate_fold_results(tidy_df, confidence=0.95):
+    """
+    Mean of every metric over the folds, with its ``confidence`` interval
+    (Student t over the fold values).
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per metric: ``n_folds``, ``mean``, ``std``, ``ci_low`` and ``ci_high``.
+    """
+    summary = (tidy_df.dropna(subset=["value"]).groupby("metric", sort=False)["value"]
+               .agg(n_folds="count", mean="mean", std="std").reset_index())
+    half_width = (stats.t.ppf((1 + confidence) / 2, summary["n_folds"] - 1)
+                  * summary["std"] / np.sqrt(summary["n_folds"]))
+    summary["ci_low"] = summary["mean"] - half_width
+    summary["ci_high"] = summary["mean"] + half_width
+    return summary
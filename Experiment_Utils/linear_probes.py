@@ -0,0 +1,137 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Closed-form linear probes fitted for every tract at once.
+# A fast screen before the staged deep pipeline: ridge regression of age and a
+# multinomial logistic site probe on the nodes of each tract. Inputs are
+# stacked as (num_tracts, num_subjects, num_nodes), and every tract's model is
+# fitted in the same batched linear algebra calls.
+
+DEFAULT_ALPHAS = np.logspace(-2, 4, 13)
+
+
+def loader_arrays(loader):
+    """Concatenate the batches of a loader into ``(x, labels)`` tensors."""
+    xs, labels = zip(*[(x, y) for x, y in loader])
+    return torch.cat(xs), torch.cat(labels)
+
+
+def tract_features(x, mean=None, std=None):
+    """
+    Stack (subjects, num_tracts, nodes) inputs per tract and standardize every node.
+
+    Returns
+    -------
+    tuple
+        (num_tracts, subjects, nodes) float64 features, and the ``mean`` and
+        ``std`` used (computed from ``x`` unless given, e.g. from the training data).
+    """
+    x = x.double()
+    if mean is None:
+        mean, std = x.mean(0), x.std(0).clamp_min(1e-8)
+    return ((x - mean) / std).permute(1, 0, 2), mean, std
+
+
+def ridge_cv(features, targets, alphas=DEFAULT_ALPHAS, folds=5, seed=0):
+    """
+    Ridge regression of every tract, with the penalty chosen by cross-validation per tract.
+
+    The folds and the final fit on all subjects are stacked with the tracts,
+    and one batched ``torch.linalg.eigh`` of the (folds + 1, num_tracts,
+    nodes, nodes) Gram matrices gives the solution for every penalty.
+
+    Parameters
+    ----------
+    features : torch.Tensor
+        (num_tracts, num_subjects, num_nodes) features, e.g. from ``tract_features``.
+    targets : torch.Tensor
+        (num_subjects,) targets (ages).
+    alphas : array-like, optional
+        Candidate penalties.
+    folds : int, optional
+        Cross-validation folds.
+
+    Returns
+    -------
+    dict
+        ``weights`` (num_tracts, num_nodes) and ``intercept`` (num_tracts,)
+        of the final fits, the chosen ``alpha`` per tract, and ``cv_mse``
+        (num_tracts, num_alphas).
+    """
+    features = features.double()
+    targets = targets.double()
+    num_tracts, num_subjects, num_nodes = features.shape
+    alphas = torch.as_tensor(alphas, dtype=torch.float64)
+
+    fold_of = torch.randperm(num_subjects, generator=torch.Generator().manual_seed(seed)) % folds
+    # Row f < folds trains on everything but fold f; the last row trains on all subjects
+    train_masks = torch.stack([fold_of != f for f in range(folds)] + [torch.ones(num_subjects, dtype=torch.bool)])
+    weights = train_masks.double()
+    counts = weights.sum(1)
+    x_mean = torch.einsum("fn,tnd->ftd", weights, features) / counts[:, None, None]
+    y_mean = weights @ targets / counts
+    centered = features.unsqueeze(0) - x_mean.unsqueeze(2)  # (F, T, N, D)
+    masked = centered * weights[:, None, :, None]
+    gram = masked.transpose(-1, -2) @ centered  # (F, T, D, D)
+    moment = masked.transpose(-1, -2) @ (targets - y_mean[:, None])[:, None, :, None]  # (F, T, D, 1)
+
+    eigenvalues, eigenvectors = torch.linalg.eigh(gram)
+    projected = eigenvectors.transpose(-1, -2) @ moment  # (F, T, D, 1)
+    # Solutions for every penalty: V diag(1 / (lambda + alpha)) V^T X^T y
+    solutions = eigenvectors @ (projected / (eigenvalues.unsqueeze(-1) + alphas))  # (F, T, D, A)
+
+    predictions = centered @ solutions + y_mean[:, None, None, None]  # (F, T, N, A)
+    held_out = ~train_masks[:folds]
+    errors = (predictions[:folds] - targets[:, None]) ** 2 * held_out[:, None, :, None]
+    cv_mse = errors.sum((0, 2)) / num_subjects  # (T, A)
+    best = cv_mse.argmin(1)
+
+    tract_range = torch.arange(num_tracts)
+    final_weights = solutions[folds, tract_range, :, best]  # (T, D)
+    intercept = y_mean[folds] - (x_mean[folds] * final_weights).sum(1)
+    return {"weights": final_weights, "intercept": intercept, "alpha": alphas[best], "cv_mse": cv_mse}
+
+
+def ridge_predict(features, fit):
+    """(num_tracts, num_subjects) predictions of ``ridge_cv`` fits."""
+    return (features.double() @ fit["weights"].unsqueeze(-1)).squeeze(-1) + fit["intercept"][:, None]
+
+
+def fit_site_probe(features, sites, num_sites, l2=1e-3, max_iter=100):
+    """
+    Multinomial logistic regression of the site, for every tract at once.
+
+    The tracts' losses are independent, so their sum is minimized by one
+    full-batch L-BFGS run over the stacked (num_tracts, nodes, num_sites)
+    weights.
+
+    Returns
+    -------
+    dict
+        ``weights`` (num_tracts, num_nodes, num_sites) and ``bias``
+        (num_tracts, num_sites).
+    """
+    features = features.double()
+    sites = sites.long()
+    num_tracts, _, num_nodes = features.shape
+    weights = torch.zeros(num_tracts, num_nodes, num_sites, dtype=torch.float64, requires_grad=True)
+    bias = torch.zeros(num_tracts, num_sites, dtype=torch.float64, requires_grad=True)
+    optimizer = torch.optim.LBFGS([weights, bias], max_iter=max_iter, line_search_fn="strong_wolfe")
+
+    def closure():
+        optimizer.zero_grad()
+        logits = features @ weights + bias[:, None]
+        loss = F.cross_entropy(logits.reshape(-1, num_sites), sites.repeat(num_tracts), reduction="sum")
+        loss = loss / len(sites) + l2 * (weights ** 2).sum()
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return {"weights": weights.detach(), "bias": bias.detach()}
+
+
+def site_probe_accuracy(features, sites, fit):
+    """(num_tracts,) site accuracy of ``fit_site_probe`` fits."""
+    logits = features.double() @ fit["weights"] + fit["bias"][:, None]
+    return (logits.argmax(-1) == sites.long()).double().mean(1)
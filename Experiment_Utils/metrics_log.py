@@ -0,0 +1,179 @@
+import csv
+import io
+import os
+import time
+
+import numpy as np
+
+# Per-epoch metrics log shared by all trainers.
+# Each trainer appends one row per epoch (and per stage) to a CSV with a fixed
+# schema, so a run's metrics are on disk while it trains and every trainer's
+# file can be read by the same plotting code.
+
+# Canonical metric columns; names match the results-dict keys without "_epoch"
+METRIC_COLUMNS = [
+    "train_loss", "val_loss",
+    "train_recon_loss", "val_recon_loss",
+    "train_kl_loss", "val_kl_loss",
+    "train_rmse", "val_rmse",
+    "train_age_loss", "val_age_loss",
+    "train_site_loss", "val_site_loss",
+    "train_age_mae", "val_age_mae",
+    "train_site_acc", "val_site_acc",
+    "train_age_r2", "val_age_r2",
+    "train_r2", "val_r2",
+    "train_acc", "val_acc",
+    "current_beta", "current_grl_alpha", "current_lr",
+    "training_phase", "age_weight", "site_weight", "cycle_length", "val_pass",
+    # Throughput counters (see profiling.THROUGHPUT_METRICS)
+    "samples_per_sec", "step_time_mean", "step_time_p95",
+    "data_wait_time", "compute_time", "val_time", "checkpoint_time",
+]
+COLUMNS = ["stage", "epoch"] + METRIC_COLUMNS
+
+
+class MetricsWriter:
+    """Buffered, append-only CSV writer for per-epoch metrics.
+
+    Rows are buffered in memory and written in one block once ``flush_every``
+    rows are pending or ``flush_interval`` seconds have passed since the last
+    write, so logging every epoch costs one small write at most every few
+    epochs. Appending to an existing file keeps its rows (e.g. after a
+    restart) as long as the header matches.
+
+    Parameters
+    ----------
+    path : str or None
+        CSV file to append to. ``None`` gives a disabled writer whose
+        methods are no-ops, so trainers can log unconditionally.
+    flush_every : int, optional
+        Write once this many rows are buffered. Defaults to 10.
+    flush_interval : float, optional
+        Also write when this many seconds passed since the last write.
+        Defaults to 30.
+    """
+
+    def __init__(self, path, flush_every=10, flush_interval=30.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._last_flush = time.monotonic()
+        if path is None:
+            return
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, newline="") as f:
+                header = next(csv.reader(f), None)
+            if header != COLUMNS:
+                raise ValueError(f"Existing metrics file {path} has a different schema")
+        else:
+            with open(path, "w", newline="") as f:
+                csv.writer(f).writerow(COLUMNS)
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def log(self, stage, epoch, **metrics):
+        """Buffer one row for ``stage`` at ``epoch`` (1-based).
+
+        Metric names must be in ``METRIC_COLUMNS``; missing metrics are left
+        empty. Tensors and numpy scalars are converted to floats.
+        """
+        if self.path is None:
+            return
+        unknown = set(metrics) - set(METRIC_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown metric columns: {sorted(unknown)}")
+        row = [stage, int(epoch)] + [_to_cell(metrics.get(name)) for name in METRIC_COLUMNS]
+        self._rows.append(row)
+        if (len(self._rows) >= self.flush_every
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def log_last(self, stage, epoch, histories):
+        """Log the latest value of each history list, e.g. ``{"train_loss": train_loss_epoch}``."""
+        if self.path is None:
+            return
+        self.log(stage, epoch, **{name: values[-1] for name, values in histories.items() if len(values)})
+
+    def log_epoch(self, stage, epoch, histories):
+        """Log the values of ``epoch`` (1-based) from each history list, e.g. rows held back
+        until asynchronous validation results arrived."""
+        if self.path is None:
+            return
+        self.log(stage, epoch, **{name: values[epoch - 1] for name, values in histories.items() if len(values) >= epoch})
+
+    def flush(self):
+        """Write all buffered rows to disk."""
+        if self.path is None or not self._rows:
+            return
+        buf = io.StringIO()
+        csv.writer(buf).writerows(self._rows)
+        # One write per block keeps readers from seeing half-written rows in practice
+        with open(self.path, "a", newline="") as f:
+            f.write(buf.getvalue())
+        self._rows = []
+        self._last_flush = time.monotonic()
+
+    def truncate(self, stage, epoch):
+        """Drop the rows of ``stage`` after ``epoch`` (1-based), e.g. epochs logged after
+        the checkpoint a resumed run continues from, which it logs again."""
+        if self.path is None:
+            return
+        self.flush()
+        with open(self.path, newline="") as f:
+            rows = list(csv.reader(f))
+        kept = [row for row in rows[1:] if len(row) == len(COLUMNS) and not (row[0] == stage and int(row[1]) > epoch)]
+        if len(kept) == len(rows) - 1:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            csv.writer(f).writerows([COLUMNS] + kept)
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Converts a metric value into something csv can write
+def _to_cell(value):
+    if value is None:
+        return ""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value))
+    return value
+
+
+def read_metrics(path, stage=None):
+    """Read a metrics CSV, optionally only the rows of one ``stage``.
+
+    Safe to call while a trainer is still appending: a trailing row without
+    a newline is ignored.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    import pandas as pd
+
+    with open(path, newline="") as f:
+        text = f.read()
+    if not text.endswith("\n"):
+        text = text[: text.rfind("\n") + 1]
+    df = pd.read_csv(io.StringIO(text))
+    if stage is not None:
+        df = df[df["stage"] == stage].reset_index(drop=True)
+    return df
@@ -1,3 +1,4 @@
+import math
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -5,17 +6,18 @@ import torch.nn.functional as F
 # Variational encoder for flattened FA tract data (single channel 1D sequences)
 # Uses 1D convolutions to progressively downsample input and outputs mean/logvar for latent space
 # Supports variable input lengths (50 or 100) with dynamic shape calculation
+# input_channels=2 takes channel-stacked FA+MD profiles (prep_fa_md_stacked_remapped_data)
 class Conv1DVariationalEncoder_fa(nn.Module):
-    def __init__(self, latent_dims=20, dropout=0.2, input_length=50):
+    def __init__(self, latent_dims=20, dropout=0.2, input_length=50, input_channels=1):
         super().__init__()
-        self.conv1 = nn.Conv1d(1, 16, kernel_size=5, stride=2, padding=2)
+        self.conv1 = nn.Conv1d(input_channels, 16, kernel_size=5, stride=2, padding=2)
         self.conv2_50 = nn.Conv1d(16, 32, kernel_size=4, stride=2, padding=2)
         self.conv2_100 = nn.Conv1d(16, 32, kernel_size=5, stride=2, padding=2)
         self.conv3 = nn.Conv1d(32, 64, kernel_size=5, stride=2, padding=2)
         # self.conv4 = nn.Conv1d(64, 128, kernel_size=5, stride=2, padding=2)
 
         # Calculate the output size dynamically
-        self._dummy_input = torch.zeros(1, 1, input_length)
+        self._dummy_input = torch.zeros(1, input_channels, input_length)
         self._conv_output = self._get_conv_output_shape(self._dummy_input)
         self.flattened_size = self._conv_output[1] * self._conv_output[2]
         
@@ -52,7 +54,7 @@ class Conv1DVariationalEncoder_fa(nn.Module):
 # Uses transposed convolutions to upsample latent code back to original sequence length
 # Paired with Conv1DVariationalEncoder_fa to form complete VAE
 class Conv1DVariationalDecoder_fa(nn.Module):
-    def __init__(self, latent_dims=20, conv_output_shape=None):
+    def __init__(self, latent_dims=20, conv_output_shape=None, output_channels=1):
         super().__init__()
         # Store the expected shape of the conv features
         self.conv_channels = conv_output_shape[1]  # 64
@@ -63,7 +65,7 @@ class Conv1DVariationalDecoder_fa(nn.Module):
         self.deconv2 = nn.ConvTranspose1d(self.conv_channels, 32, kernel_size=5, stride=2, padding=2, output_padding=0)
         self.deconv3_100 = nn.ConvTranspose1d(32, 16, kernel_size=5, stride=2, padding=2, output_padding=1)
         self.deconv3_50 = nn.ConvTranspose1d(32, 16, kernel_size=4, stride=2, padding=2, output_padding=1)
-        self.deconv4 = nn.ConvTranspose1d(16, 1, kernel_size=5, stride=2, padding=2, output_padding=1)
+        self.deconv4 = nn.ConvTranspose1d(16, output_channels, kernel_size=5, stride=2, padding=2, output_padding=1)
         self.relu = nn.ReLU()
         
     def forward(self, x):
@@ -78,13 +80,15 @@ class Conv1DVariationalDecoder_fa(nn.Module):
 
 # Complete variational autoencoder for flattened FA tract data
 # Combines encoder and decoder with reparameterization trick for stochastic latent sampling
-# Designed for single-channel 1D sequences representing tract profiles
+# Designed for single-channel 1D sequences representing tract profiles, or
+# input_channels metrics of the same tract stacked as channels (FA+MD: 2)
 class Conv1DVariationalAutoencoder_fa(nn.Module):
-    def __init__(self, latent_dims=20, dropout=0.0, input_length=50):
+    def __init__(self, latent_dims=20, dropout=0.0, input_length=50, input_channels=1):
         super().__init__()
-        self.encoder = Conv1DVariationalEncoder_fa(latent_dims, dropout=dropout, input_length=input_length)
+        self.encoder = Conv1DVariationalEncoder_fa(latent_dims, dropout=dropout, input_length=input_length,
+                                                   input_channels=input_channels)
         # Pass the shape information from encoder to decoder
-        self.decoder = Conv1DVariationalDecoder_fa(latent_dims, self.encoder._conv_output)
+        self.decoder = Conv1DVariationalDecoder_fa(latent_dims, self.encoder._conv_output, output_channels=input_channels)
         self.latent_dims = latent_dims
         
     def reparameterize(self, mean, logvar):
@@ -190,7 +194,6 @@ class AgePredictorCNN(nn.Module):
         _dummy_input = torch.randn(1, input_channels, sequence_length)
         _conv_output_shape = self._get_conv_output_shape(_dummy_input)
         flat_size = _conv_output_shape[1] * _conv_output_shape[2]
-        print(f"[DEBUG] AgePredictorCNN: dummy input shape: {_dummy_input.shape}, conv output shape: {_conv_output_shape}, flat_size: {flat_size}")
 
         self.fc1 = nn.Linear(flat_size, 64) 
         self.fc_out = nn.Linear(64, 1)
@@ -202,7 +205,6 @@ class AgePredictorCNN(nn.Module):
         return x.shape
 
     def forward(self, x):
-        print(f"[DEBUG] AgePredictorCNN forward: input x shape: {x.shape}")
         if x.dim() == 2:
             x = x.unsqueeze(1)
         x = self.relu(self.bn1(self.conv1(x)))
@@ -212,7 +214,6 @@ class AgePredictorCNN(nn.Module):
         x = self.relu(self.bn3(self.conv3(x)))
         x = self.dropout(x)
         x = self.flatten(x)
-        print(f"[DEBUG] AgePredictorCNN forward: flattened x shape: {x.shape}")
         x = self.relu(self.fc1(x))
         x = self.dropout(x)
         age_pred = self.fc_out(x)
@@ -238,7 +239,6 @@ class SitePredictorCNN(nn.Module):
         _dummy_input = torch.randn(1, input_channels, sequence_length)
         _conv_output_shape = self._get_conv_output_shape(_dummy_input)
         flat_size = _conv_output_shape[1] * _conv_output_shape[2]
-        print(f"[DEBUG] SitePredictorCNN: dummy input shape: {_dummy_input.shape}, conv output shape: {_conv_output_shape}, flat_size: {flat_size}")
 
         self.fc1 = nn.Linear(flat_size, 64)
         self.fc_out = nn.Linear(64, num_sites)
@@ -250,7 +250,6 @@ class SitePredictorCNN(nn.Module):
         return x.shape
 
     def forward(self, x):
-        print(f"[DEBUG] SitePredictorCNN forward: input x shape: {x.shape}")
         x = self.relu(self.bn1(self.conv1(x)))
         x = self.dropout(x)
         x = self.relu(self.bn2(self.conv2(x)))
@@ -258,12 +257,48 @@ class SitePredictorCNN(nn.Module):
         x = self.relu(self.bn3(self.conv3(x)))
         x = self.dropout(x)
         x = self.flatten(x)
-        print(f"[DEBUG] SitePredictorCNN forward: flattened x shape: {x.shape}")
         x = self.relu(self.fc1(x))
         x = self.dropout(x)
         site_pred = self.fc_out(x)
         return site_pred
 
+# Opt-in shape logging for debugging a model's forward pass
+# Replaces the per-call shape prints that used to live in the predictor forwards
+def attach_shape_debug_hook(model, log=print):
+    """
+    Log input/output shapes on every forward call of ``model``.
+
+    Parameters
+    ----------
+    model : nn.Module
+        Model to instrument. If it has a ``flatten`` layer, the flattened
+        feature shape is logged too.
+    log : callable, optional
+        Called with each message; e.g. ``ProgressReporter.debug``.
+
+    Returns
+    -------
+    list
+        Hook handles; call ``handle.remove()`` on each to detach.
+    """
+    name = type(model).__name__
+
+    def _shapes(value):
+        if isinstance(value, (tuple, list)):
+            return [tuple(v.shape) for v in value if torch.is_tensor(v)]
+        return tuple(value.shape)
+
+    def _forward_hook(module, inputs, output):
+        log(f"[DEBUG] {name} forward: input x shape: {_shapes(inputs[0])}, output shape: {_shapes(output)}")
+
+    def _flatten_hook(module, inputs, output):
+        log(f"[DEBUG] {name} forward: flattened x shape: {tuple(output.shape)}")
+
+    handles = [model.register_forward_hook(_forward_hook)]
+    if isinstance(getattr(model, "flatten", None), nn.Flatten):
+        handles.append(model.flatten.register_forward_hook(_flatten_hook))
+    return handles
+
 try:
     from .utils import grad_reverse
 except ImportError:
@@ -739,4 +774,259 @@ class Conv1DVariationalAutoencoder(nn.Module):
         mean, logvar = self.encoder(x)
         z = self.reparameterize(mean, logvar)
         x_hat = self.decoder(z)
-        return x_hat, mean, logvar
\ No newline at end of file
+        return x_hat, mean, logvar
+# --- Packed per-tract models ---
+# The tract importance evaluation trains the same VAE, age predictor and site
+# predictor once per tract. The packed variants below hold one copy of a model
+# per tract in a single network: convolutions use groups=num_tracts and linear
+# layers are batched matrix multiplies, so tract t only ever sees channel
+# group t of the input and its own weights. Input is (batch, num_tracts *
+# input_channels, length) with the channels of each tract next to each other;
+# outputs get a tract dimension after the batch dimension.
+#
+# Every parameter and buffer (except the scalar BatchNorm step counter) is
+# tract-major: tensor.reshape(num_tracts, -1)[t] is tract t's slice. The
+# packed trainer relies on this for per-tract gradient clipping, learning
+# rates and best-model selection (see packed_training.py).
+
+# num_tracts independent nn.Linear layers applied to (batch, num_tracts, in_features) input
+class PackedLinear(nn.Module):
+    def __init__(self, num_tracts, in_features, out_features):
+        super().__init__()
+        self.num_tracts = num_tracts
+        self.in_features = in_features
+        self.out_features = out_features
+        self.weight = nn.Parameter(torch.empty(num_tracts, out_features, in_features))
+        self.bias = nn.Parameter(torch.empty(num_tracts, out_features))
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        # Same initialization as nn.Linear, drawn separately for each tract
+        bound = 1 / math.sqrt(self.in_features)
+        for t in range(self.num_tracts):
+            nn.init.kaiming_uniform_(self.weight[t], a=math.sqrt(5))
+        nn.init.uniform_(self.bias, -bound, bound)
+
+    def forward(self, x):
+        # (tracts, batch, in) @ (tracts, in, out) -> (batch, tracts, out)
+        x = torch.baddbmm(self.bias.unsqueeze(1), x.transpose(0, 1), self.weight.transpose(1, 2))
+        return x.transpose(0, 1)
+
+    def extra_repr(self):
+        return f"num_tracts={self.num_tracts}, in_features={self.in_features}, out_features={self.out_features}"
+
+# Packed Conv1DVariationalEncoder_fa: one encoder per tract
+# Leaves out the unused conv2_50 branch of the per-tract encoder
+class PackedConv1DVariationalEncoder_fa(nn.Module):
+    def __init__(self, num_tracts=48, latent_dims=20, dropout=0.2, input_length=50):
+        super().__init__()
+        self.num_tracts = num_tracts
+        self.conv1 = nn.Conv1d(num_tracts, num_tracts * 16, kernel_size=5, stride=2, padding=2, groups=num_tracts)
+        self.conv2_100 = nn.Conv1d(num_tracts * 16, num_tracts * 32, kernel_size=5, stride=2, padding=2, groups=num_tracts)
+        self.conv3 = nn.Conv1d(num_tracts * 32, num_tracts * 64, kernel_size=5, stride=2, padding=2, groups=num_tracts)
+
+        # Per-tract conv output shape, as in Conv1DVariationalEncoder_fa
+        conv_shape = self._get_conv_output_shape(torch.zeros(1, num_tracts, input_length))
+        self._conv_output = torch.Size([1, conv_shape[1] // num_tracts, conv_shape[2]])
+        self.flattened_size = self._conv_output[1] * self._conv_output[2]
+
+        self.fc_mean = PackedLinear(num_tracts, self.flattened_size, latent_dims)
+        self.fc_logvar = PackedLinear(num_tracts, self.flattened_size, latent_dims)
+
+        self.dropout = nn.Dropout(dropout)
+
+    def _get_conv_output_shape(self, x):
+        x = F.relu(self.conv1(x))
+        x = F.relu(self.conv2_100(x))
+        x = F.relu(self.conv3(x))
+        return x.shape
+
+    def forward(self, x):
+        x = F.relu(self.conv1(x))
+        x = self.dropout(x)
+        x = F.relu(self.conv2_100(x))
+        x = self.dropout(x)
+        x = F.relu(self.conv3(x))
+        x = self.dropout(x)
+        x = self.dropout(x)
+        # Flatten each tract's channels separately: (batch, tracts, 64 * length)
+        x = x.reshape(x.size(0), self.num_tracts, -1)
+        mean = self.fc_mean(x)
+        logvar = self.fc_logvar(x)
+        return mean, logvar
+
+# Packed Conv1DVariationalDecoder_fa: one decoder per tract
+# Leaves out the unused deconv3_50 branch of the per-tract decoder
+class PackedConv1DVariationalDecoder_fa(nn.Module):
+    def __init__(self, num_tracts=48, latent_dims=20, conv_output_shape=None):
+        super().__init__()
+        self.num_tracts = num_tracts
+        self.conv_channels = conv_output_shape[1]  # 64 per tract
+        self.conv_length = conv_output_shape[2]
+
+        self.fc = PackedLinear(num_tracts, latent_dims, 64 * 13)
+        self.deconv2 = nn.ConvTranspose1d(num_tracts * self.conv_channels, num_tracts * 32, kernel_size=5, stride=2,
+                                          padding=2, output_padding=0, groups=num_tracts)
+        self.deconv3_100 = nn.ConvTranspose1d(num_tracts * 32, num_tracts * 16, kernel_size=5, stride=2,
+                                              padding=2, output_padding=1, groups=num_tracts)
+        self.deconv4 = nn.ConvTranspose1d(num_tracts * 16, num_tracts, kernel_size=5, stride=2,
+                                          padding=2, output_padding=1, groups=num_tracts)
+
+    def forward(self, z):
+        x = self.fc(z)
+        x = x.reshape(z.size(0), self.num_tracts * 64, 13)
+        x = F.relu(self.deconv2(x))
+        x = F.relu(self.deconv3_100(x))
+        x = self.deconv4(x)
+        return x
+
+# Packed Conv1DVariationalAutoencoder_fa: num_tracts independent VAEs
+# x: (batch, num_tracts, length) -> x_prime (batch, num_tracts, length),
+# mean/logvar (batch, num_tracts, latent_dims)
+class PackedConv1DVariationalAutoencoder_fa(nn.Module):
+    def __init__(self, num_tracts=48, latent_dims=20, dropout=0.0, input_length=50):
+        super().__init__()
+        self.num_tracts = num_tracts
+        self.encoder = PackedConv1DVariationalEncoder_fa(num_tracts, latent_dims, dropout=dropout, input_length=input_length)
+        self.decoder = PackedConv1DVariationalDecoder_fa(num_tracts, latent_dims, self.encoder._conv_output)
+        self.latent_dims = latent_dims
+
+    def reparameterize(self, mean, logvar):
+        std = torch.exp(0.5 * logvar)
+        eps = torch.randn_like(std)
+        z = mean + eps * std
+        return z
+
+    def forward(self, x):
+        mean, logvar = self.encoder(x)
+        z = self.reparameterize(mean, logvar)
+        x_prime = self.decoder(z)
+        return x_prime, mean, logvar
+
+# Shared body of the packed predictors: AgePredictorCNN/SitePredictorCNN layers per tract
+class _PackedPredictorCNN(nn.Module):
+    def __init__(self, num_tracts, num_outputs, input_channels, sequence_length, dropout):
+        super().__init__()
+        self.num_tracts = num_tracts
+        self.conv1 = nn.Conv1d(num_tracts * input_channels, num_tracts * 32, kernel_size=5, stride=2, padding=2, groups=num_tracts)
+        self.bn1 = nn.BatchNorm1d(num_tracts * 32)
+        self.conv2 = nn.Conv1d(num_tracts * 32, num_tracts * 64, kernel_size=3, stride=2, padding=1, groups=num_tracts)
+        self.bn2 = nn.BatchNorm1d(num_tracts * 64)
+        self.conv3 = nn.Conv1d(num_tracts * 64, num_tracts * 128, kernel_size=3, stride=2, padding=1, groups=num_tracts)
+        self.bn3 = nn.BatchNorm1d(num_tracts * 128)
+
+        self.dropout = nn.Dropout(dropout)
+        self.relu = nn.ReLU()
+
+        _dummy_input = torch.randn(1, num_tracts * input_channels, sequence_length)
+        _conv_output_shape = self._get_conv_output_shape(_dummy_input)
+        flat_size = _conv_output_shape[1] // num_tracts * _conv_output_shape[2]
+
+        self.fc1 = PackedLinear(num_tracts, flat_size, 64)
+        self.fc_out = PackedLinear(num_tracts, 64, num_outputs)
+
+    def _get_conv_output_shape(self, x):
+        x = self.relu(self.bn1(self.conv1(x)))
+        x = self.relu(self.bn2(self.conv2(x)))
+        x = self.relu(self.bn3(self.conv3(x)))
+        return x.shape
+
+    def forward(self, x):
+        x = self.relu(self.bn1(self.conv1(x)))
+        x = self.dropout(x)
+        x = self.relu(self.bn2(self.conv2(x)))
+        x = self.dropout(x)
+        x = self.relu(self.bn3(self.conv3(x)))
+        x = self.dropout(x)
+        x = x.reshape(x.size(0), self.num_tracts, -1)
+        x = self.relu(self.fc1(x))
+        x = self.dropout(x)
+        return self.fc_out(x)
+
+# Packed AgePredictorCNN: (batch, num_tracts * input_channels, length) -> ages (batch, num_tracts)
+class PackedAgePredictorCNN(_PackedPredictorCNN):
+    def __init__(self, num_tracts=48, input_channels=1, sequence_length=50, dropout=0.2):
+        super().__init__(num_tracts, 1, input_channels, sequence_length, dropout)
+
+    def forward(self, x):
+        return super().forward(x).squeeze(-1)
+
+# Packed SitePredictorCNN: (batch, num_tracts * input_channels, length) -> logits (batch, num_tracts, num_sites)
+class PackedSitePredictorCNN(_PackedPredictorCNN):
+    def __init__(self, num_tracts=48, num_sites=4, input_channels=1, sequence_length=50, dropout=0.2):
+        super().__init__(num_tracts, num_sites, input_channels, sequence_length, dropout)
+        self.num_sites = num_sites
+
+# Keys of a packed model's state dict that stack one tensor per tract (PackedLinear);
+# all other tensors concatenate the per-tract tensors along their first dimension
+def _stacked_keys(model):
+    return {f"{name}.{param}" for name, module in model.named_modules()
+            if isinstance(module, PackedLinear) for param in ("weight", "bias")}
+
+def _num_tracts(model):
+    return next(module.num_tracts for module in model.modules() if isinstance(module, PackedLinear))
+
+def pack_tract_state_dicts(model, state_dicts):
+    """
+    Load one per-tract state dict per tract into a packed model.
+
+    Parameters
+    ----------
+    model : nn.Module
+        A packed model (or a combined model built from packed models).
+    state_dicts : list of dict
+        State dicts of the matching per-tract models, in tract order. Keys
+        the packed model does not have (e.g. ``conv2_50``) are ignored.
+    """
+    if len(state_dicts) != _num_tracts(model):
+        raise ValueError(f"Expected {_num_tracts(model)} state dicts, got {len(state_dicts)}")
+    stacked = _stacked_keys(model)
+    packed = {}
+    for key, value in model.state_dict().items():
+        tensors = [state_dict[key] for state_dict in state_dicts]
+        if value.dim() == 0:
+            packed[key] = tensors[0]
+        elif key in stacked:
+            packed[key] = torch.stack(tensors)
+        else:
+            packed[key] = torch.cat(tensors)
+    model.load_state_dict(packed)
+
+def unpack_tract_state_dict(model, tract):
+    """
+    Return the state dict of one tract of a packed model, in the layout of the
+    per-tract model (``Conv1DVariationalAutoencoder_fa``, ``AgePredictorCNN``,
+    ``SitePredictorCNN`` or ``CombinedAE_Predictors`` of those).
+
+    The per-tract VAE's unused ``conv2_50``/``deconv3_50`` layers are not part
+    of the packed model, so load the result with ``load_tract_state_dict``.
+    """
+    num_tracts = _num_tracts(model)
+    stacked = _stacked_keys(model)
+    state = {}
+    for key, value in model.state_dict().items():
+        if value.dim() == 0:
+            state[key] = value.clone()
+        elif key in stacked:
+            state[key] = value[tract].clone()
+        else:
+            state[key] = value.reshape(num_tracts, -1)[tract].reshape(value.shape[0] // num_tracts, *value.shape[1:]).clone()
+    return state
+
+# Length-specific layers of the per-tract VAE that its forward pass never uses
+# (it runs conv2_100/deconv3_100); packed models leave them out
+UNUSED_LENGTH_BRANCH_LAYERS = {"conv2_50", "deconv3_50"}
+
+def load_tract_state_dict(model, state_dict):
+    """
+    Load a per-tract state dict, saved by the serial or the packed trainer.
+
+    Only the unused ``conv2_50``/``deconv3_50`` layers may be missing; any
+    other missing or unexpected key raises a RuntimeError, so a checkpoint
+    never leaves layers the model runs with their random initial weights.
+    """
+    missing, unexpected = model.load_state_dict(state_dict, strict=False)
+    missing = [key for key in missing if not set(key.split(".")) & UNUSED_LENGTH_BRANCH_LAYERS]
+    if missing or unexpected:
+        raise RuntimeError(f"State dict does not match the model: missing keys {missing}, "
+                           f"unexpected keys {unexpected}")
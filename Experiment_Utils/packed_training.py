@@ -0,0 +1,663 @@
+import contextlib
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+try:
+    from .metrics_log import MetricsWriter
+    from .models import CombinedAE_Predictors, pack_tract_state_dicts, unpack_tract_state_dict
+    from .profiling import PhaseTimer
+    from .progress import ProgressReporter
+    from .utils import (calculate_r2_score, load_stage_checkpoint, plot_site_confusion_matrix,
+                        save_site_confusion_matrices, save_stage_checkpoint)
+    from .validation import ValidationSchedule, make_fast_val_loader
+except ImportError:
+    from metrics_log import MetricsWriter
+    from models import CombinedAE_Predictors, pack_tract_state_dicts, unpack_tract_state_dict
+    from profiling import PhaseTimer
+    from progress import ProgressReporter
+    from utils import (calculate_r2_score, load_stage_checkpoint, plot_site_confusion_matrix,
+                       save_site_confusion_matrices, save_stage_checkpoint)
+    from validation import ValidationSchedule, make_fast_val_loader
+
+# Staged training of many per-tract models at once.
+# train_vae_age_site_staged_packed runs the schedule of train_vae_age_site_staged
+# (VAE, age predictor and site predictor on raw data, then the combined model
+# with a gradient reversal layer in two phases) on the packed models from
+# models.py, training every tract in the same forward/backward pass. Tracts
+# stay independent:
+#
+# - The loss is the sum of the per-tract losses, so each tract's weights get
+#   exactly the gradient of its own loss.
+# - Gradients are clipped to max_grad_norm per tract.
+# - Each tract has its own ReduceLROnPlateau schedule (TractPlateau). Adam's
+#   update is proportional to the learning rate, so a tract's step is scaled
+#   by its learning rate over the optimizer's.
+# - Best-model selection keeps a copy of each tract's best weights.
+#
+# Mixed precision shares one GradScaler, so an overflow in one tract skips the
+# step of all tracts; this only happens on CUDA with mixed_precision=True.
+# Results, checkpoints and metrics CSVs are written per tract in the layout of
+# the per-tract trainer. The periodic checkpoints of the combined stage
+# (stage_combined_packed.pt) also hold each tract's slice of the packed Adam
+# state, so they only resume packed runs.
+
+
+class TractPlateau:
+    """Per-tract ``ReduceLROnPlateau(mode="min", factor=0.5, patience=10)``.
+
+    ``lr`` holds the current learning rate of every tract; ``step`` takes one
+    validation metric per tract and follows the torch scheduler's rules
+    (relative threshold, no cooldown).
+    """
+
+    def __init__(self, lr, num_tracts, factor=0.5, patience=10, threshold=1e-4, eps=1e-8):
+        self.lr = np.full(num_tracts, float(lr))
+        self.factor = factor
+        self.patience = patience
+        self.threshold = threshold
+        self.eps = eps
+        self.best = np.full(num_tracts, np.inf)
+        self.num_bad_epochs = np.zeros(num_tracts, dtype=int)
+
+    def step(self, metrics):
+        metrics = np.asarray(metrics, dtype=float)
+        better = metrics < self.best * (1 - self.threshold)
+        self.best = np.where(better, metrics, self.best)
+        self.num_bad_epochs = np.where(better, 0, self.num_bad_epochs + 1)
+        reduce = self.num_bad_epochs > self.patience
+        new_lr = self.lr * self.factor
+        self.lr = np.where(reduce & (self.lr - new_lr > self.eps), new_lr, self.lr)
+        self.num_bad_epochs[reduce] = 0
+
+
+# Adam state of one tract of a packed model, by parameter name; shared scalars (the step count) are kept whole
+def _tract_optimizer_state(model, optimizer, tract, num_tracts):
+    names = {param: name for name, param in model.named_parameters()}
+    return {names[param]: {key: value.reshape(num_tracts, -1)[tract].clone() if value.dim() else value.clone()
+                           for key, value in state.items()}
+            for param, state in optimizer.state.items()}
+
+def _load_tract_optimizer_states(model, optimizer, states):
+    params = dict(model.named_parameters())
+    for name, state in states[0].items():
+        param = params[name]
+        optimizer.state[param] = {
+            key: (torch.stack([tract_state[name][key] for tract_state in states]).view_as(param).to(param.device)
+                  if value.dim() else value.clone())
+            for key, value in state.items()}
+
+
+def clip_grad_norm_per_tract_(parameters, max_norm, num_tracts):
+    """``clip_grad_norm_`` applied to each tract's slice of packed parameters separately.
+
+    Returns the per-tract gradient norms before clipping.
+    """
+    grads = [p.grad for p in parameters if p.grad is not None]
+    if not grads:
+        return torch.zeros(num_tracts)
+    norms = torch.stack([g.detach().float().reshape(num_tracts, -1).pow(2).sum(1) for g in grads]).sum(0).sqrt()
+    clip_coef = (max_norm / (norms + 1e-6)).clamp(max=1.0)
+    for g in grads:
+        g.reshape(num_tracts, -1).mul_(clip_coef[:, None].to(g.dtype))
+    return norms
+
+
+# KL weight of an epoch; same sigmoid annealing as train_vae_age_site_staged
+def _kl_beta(epoch, w_kl, start_epoch, duration, start_value):
+    if duration > 0 and epoch >= start_epoch:
+        annealing_epoch = epoch - start_epoch
+        if annealing_epoch < duration:
+            progress = annealing_epoch / duration
+            sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+            return w_kl * (start_value + (1.0 - start_value) * sigmoid_val)
+        return w_kl
+    return 0.0 if epoch < start_epoch else w_kl
+
+
+# Per-tract losses of one batch; each returns (loss, metrics, outputs) with (num_tracts,) losses
+def _recon_kl(x_hat, mean, logvar, x):
+    batch_size = x.size(0)
+    recon = (x_hat - x.reshape(x_hat.shape)).pow(2).reshape(batch_size, x_hat.size(1), -1).mean(dim=(0, 2))
+    kl = -0.5 * (1 + logvar - mean.pow(2) - logvar.exp()).sum(dim=(0, 2)) / batch_size
+    return recon, kl
+
+def _age_mae(age_pred, labels):
+    return (age_pred - labels[:, 0:1].float()).abs().mean(0)
+
+def _site_ce(site_pred, labels):
+    site_true = labels[:, 2].long()[:, None].expand(-1, site_pred.size(1))
+    return F.cross_entropy(site_pred.transpose(1, 2), site_true, reduction="none").mean(0)
+
+
+# Confusion counts of every tract, (num_tracts, K, K) with rows = true site
+def _tract_confusion(site_true, predicted, num_sites):
+    num_tracts = predicted.size(1)
+    valid = (site_true >= 0) & (site_true < num_sites)
+    tract_offset = torch.arange(num_tracts, device=predicted.device)[None, :] * num_sites * num_sites
+    flat_idx = (tract_offset + site_true[:, None] * num_sites + predicted)[valid].reshape(-1)
+    counts = torch.bincount(flat_idx, minlength=num_tracts * num_sites * num_sites)
+    return counts.view(num_tracts, num_sites, num_sites)
+
+
+def _run_epoch(model, loader, batch_fn, device, use_amp, step=None, timer=None, num_sites=None):
+    """One pass over ``loader``; returns per-tract averages of the loss and of the metrics ``batch_fn`` reports.
+
+    ``step(loss)`` is called with the summed per-tract loss of each batch when
+    training. Age predictions add ``age_r2``, site logits ``site_acc`` (in %)
+    and, with ``num_sites``, ``site_cm`` confusion counts per tract.
+    """
+    sums = {}
+    items = 0
+    age_preds, age_trues = [], []
+    site_correct = None
+    site_cm = None
+    batches = timer.iterate(loader) if timer is not None else loader
+    with (torch.inference_mode() if step is None else contextlib.nullcontext()):
+        for x, labels in batches:
+            batch_size = x.size(0)
+            x = x.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
+            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                loss, metrics, outputs = batch_fn(x, labels)
+            if step is not None:
+                if timer is not None:
+                    timer.lap("forward")
+                step(loss.sum())
+
+            items += batch_size
+            for name, value in (("loss", loss), *metrics.items()):
+                value = value.detach().float() * batch_size
+                sums[name] = sums[name] + value if name in sums else value
+            if "age_pred" in outputs:
+                age_preds.append(outputs["age_pred"].detach().float())
+                age_trues.append(labels[:, 0].float())
+            if "site_pred" in outputs:
+                site_true = labels[:, 2].long()
+                predicted = outputs["site_pred"].detach().argmax(2)
+                correct = (predicted == site_true[:, None]).sum(0)
+                site_correct = correct if site_correct is None else site_correct + correct
+                if num_sites is not None:
+                    counts = _tract_confusion(site_true, predicted, num_sites)
+                    site_cm = counts if site_cm is None else site_cm + counts
+
+    averages = {name: (value / items).tolist() for name, value in sums.items()}
+    if age_preds:
+        preds = torch.cat(age_preds)
+        trues = torch.cat(age_trues)
+        averages["age_r2"] = [calculate_r2_score(trues, preds[:, t]) for t in range(preds.size(1))]
+    if site_correct is not None:
+        averages["site_acc"] = (site_correct.float() / items * 100).tolist()
+    if site_cm is not None:
+        averages["site_cm"] = site_cm.cpu().numpy()
+    return averages
+
+
+class _TractStage:
+    """Per-tract histories, learning rates, best weights and logs of one training stage.
+
+    ``metrics`` maps the names ``_run_epoch`` returns to the history names of
+    the per-tract trainer (e.g. ``{"loss": "loss", "age_r2": "r2"}``), which
+    become ``train_<name>_epoch``/``val_<name>_epoch`` in the results.
+    """
+
+    def __init__(self, name, model, num_tracts, lr, metrics, monitor, best_file, val_schedule,
+                 save_dirs, metrics_logs, log):
+        self.name = name
+        self.model = model
+        self.num_tracts = num_tracts
+        self.metrics = metrics
+        self.monitor = monitor
+        self.best_file = best_file
+        self.val_schedule = val_schedule
+        self.save_dirs = save_dirs
+        self.metrics_logs = metrics_logs
+        self.log = log
+        self.plateau = TractPlateau(lr, num_tracts)
+        self.histories = [{} for _ in range(num_tracts)]
+        self.best_value = np.full(num_tracts, np.inf)
+        self.best_epoch = np.zeros(num_tracts, dtype=int)
+        self.best_state = {key: value.detach().clone() for key, value in model.state_dict().items()}
+        self.timer = PhaseTimer()
+
+    def record(self, name, values):
+        """Append one value per tract (or one shared value) to history ``name``."""
+        if np.ndim(values) == 0:
+            values = [values] * self.num_tracts
+        for history, value in zip(self.histories, values):
+            history.setdefault(name, []).append(float(value))
+
+    def end_epoch(self, epoch, train, val, val_pass):
+        for source, history in self.metrics.items():
+            self.record(f"train_{history}", train[source])
+            self.record(f"val_{history}", val[source] if val is not None else float("nan"))
+        monitored = val[self.monitor_source] if val is not None else None
+        self.timer.lap("validation")
+
+        if val_pass is not None:
+            self.plateau.step(monitored)
+
+        self.timer.mark()
+        if self.val_schedule.selects_best(val_pass):
+            improved = np.asarray(monitored) < self.best_value
+            if improved.any():
+                self.best_value = np.where(improved, monitored, self.best_value)
+                self.best_epoch[improved] = epoch
+                self._keep_best(improved)
+
+        train_mean = np.nanmean(train["loss"])
+        val_mean = np.nanmean(val["loss"]) if val is not None else float("nan")
+        self.log.info(f"{self.name} epoch {epoch+1}/{self.val_schedule.epochs} | "
+                      f"Mean over {self.num_tracts} tracts - Train Loss: {train_mean:.4f} | Val Loss: {val_mean:.4f}")
+
+    @property
+    def monitor_source(self):
+        return next(source for source, history in self.metrics.items() if history == self.monitor)
+
+    def _keep_best(self, improved):
+        mask = torch.as_tensor(improved)
+        with torch.no_grad():
+            for key, value in self.model.state_dict().items():
+                best = self.best_state[key]
+                if value.dim() == 0:
+                    best.copy_(value)
+                else:
+                    tract_mask = mask.to(value.device)
+                    best.reshape(self.num_tracts, -1)[tract_mask] = value.reshape(self.num_tracts, -1)[tract_mask]
+        if self.save_dirs is not None:
+            for t in np.flatnonzero(improved):
+                torch.save(unpack_tract_state_dict(self.model, t), os.path.join(self.save_dirs[t], self.best_file))
+
+    def save_periodic(self, filename):
+        if self.save_dirs is None:
+            return
+        for t, save_dir in enumerate(self.save_dirs):
+            torch.save(unpack_tract_state_dict(self.model, t), os.path.join(save_dir, filename))
+
+    def log_epoch(self, epoch):
+        self.timer.lap("checkpoint")
+        self.timer.end_epoch()
+        for metrics_log, history in zip(self.metrics_logs, self.histories):
+            metrics_log.log_last(self.name, epoch + 1, {
+                **history,
+                "val_pass": self.val_schedule.history,
+                **self.timer.histories(suffix="")
+            })
+
+    def tract_state(self, t):
+        """Best metric, schedule and timings of tract ``t``, saved with the stage's periodic checkpoints."""
+        return {
+            "best_value": float(self.best_value[t]),
+            "best_epoch": int(self.best_epoch[t]),
+            "plateau": {name: getattr(self.plateau, name)[t].item() for name in ("lr", "best", "num_bad_epochs")},
+            "val_pass": self.val_schedule.history,
+            "phase_times": self.timer.history,
+            "throughput": self.timer.throughput,
+        }
+
+    def restore(self, histories, states):
+        """Continue from the histories and ``tract_state`` of every tract.
+
+        Call before loading the checkpointed weights: the best weights of each
+        tract are read back from its ``best_file``, and tracts without a best
+        yet keep the stage's starting weights. The learning-rate schedule is
+        restored by the caller, which may replace ``plateau``.
+        """
+        self.histories = histories
+        self.best_value = np.array([state["best_value"] for state in states])
+        self.best_epoch = np.array([state["best_epoch"] for state in states])
+        self.val_schedule.history.extend(states[0]["val_pass"])
+        for name, values in states[0]["phase_times"].items():
+            self.timer.history[name].extend(values)
+        for name, values in states[0]["throughput"].items():
+            self.timer.throughput[name].extend(values)
+        if self.save_dirs is not None and np.isfinite(self.best_value).any():
+            pack_tract_state_dicts(self.model, [
+                torch.load(os.path.join(save_dir, self.best_file), map_location="cpu") if np.isfinite(value)
+                else unpack_tract_state_dict(self.model, t)
+                for t, (save_dir, value) in enumerate(zip(self.save_dirs, self.best_value))])
+            self.best_state = {key: value.detach().clone() for key, value in self.model.state_dict().items()}
+
+    def finish(self, best_key):
+        """Load each tract's best weights and return the per-tract results dicts."""
+        self.model.load_state_dict(self.best_state)
+        return [{
+            best_key: float(self.best_value[t]),
+            **{f"{name}_epoch": values for name, values in history.items()},
+            "val_pass_epoch": self.val_schedule.history,
+            **self.timer.histories(),
+            "phase_times_epoch": self.timer.history,
+        } for t, history in enumerate(self.histories)]
+
+
+def train_vae_age_site_staged_packed(
+    vae_model,
+    age_predictor,
+    site_predictor,
+    train_data,
+    val_data,
+    epochs_stage1=100,
+    epochs_stage2=200,
+    lr=0.001,
+    device="cuda",
+    max_grad_norm=1.0,
+    w_recon=1.0,
+    w_kl=1.0,
+    w_age=1.0,
+    w_site=1.0,
+    kl_annealing_start_epoch=0,
+    kl_annealing_duration=50,
+    kl_annealing_start=0.001,
+    grl_alpha_start=0.0,
+    grl_alpha_end=2.5,
+    grl_alpha_epochs=100,
+    save_dirs=None,  # One directory per tract; None keeps everything in memory
+    val_metric_to_monitor="val_age_mae",
+    save_predictions_interval=50,  # Save site confusion matrices every N epochs
+    periodic_save_interval=50,  # Save model weights every N epochs
+    mixed_precision=True,  # Enable AMP only when running on CUDA
+    metrics_file="metrics.csv",  # Per-epoch metrics CSV inside each tract's directory (None disables it)
+    log_level=None,  # 'debug' | 'info' | 'warning'; defaults to $AFQ_LOG_LEVEL or 'info'
+    validate_every=1,  # Validate after every N-th epoch of each stage (see validation.py)
+    fast_val_subset=None,  # Samples (or fraction) of a fixed stratified val subset for quick passes
+    full_val_every=None,  # Full validation pass every N epochs when using fast_val_subset (default 5 x validate_every)
+    resume=False  # Skip stage-1 models whose stage checkpoints exist in every save_dir, continue stage 2 from its last
+):
+    """
+    Staged VAE/age/site training of all tracts of packed models at once.
+
+    Runs the schedule of ``train_vae_age_site_staged`` with
+    ``PackedConv1DVariationalAutoencoder_fa``, ``PackedAgePredictorCNN`` and
+    ``PackedSitePredictorCNN``; every tract trains as if it ran on its own.
+
+    Parameters
+    ----------
+    vae_model, age_predictor, site_predictor : nn.Module
+        Packed models with the same ``num_tracts`` (and one input channel per tract).
+    train_data, val_data : DataLoader
+        Batches of ``(x, labels)`` with x of shape (batch, num_tracts, length)
+        and labels ``[age, sex, remapped_site]``.
+    save_dirs : list of str, optional
+        Output directory of each tract for checkpoints (loadable into the
+        per-tract models with ``load_tract_state_dict``), site confusion matrices and
+        the metrics CSV.
+    fast_val_subset, full_val_every : optional
+        Validation cadence (see ``validation.py``). Only full passes select
+        the best models; with a fast subset ``full_val_every`` defaults to
+        5 x ``validate_every``.
+    resume : bool, optional
+        Restore stage-1 models from the ``stage_<name>.pt`` checkpoints an
+        earlier (packed or per-tract) run left in every ``save_dirs`` entry,
+        and continue the combined stage from the last periodic
+        ``stage_combined_packed.pt`` of an earlier packed run.
+
+    Returns
+    -------
+    list of dict
+        One results dict per tract, with the keys of ``train_vae_age_site_staged``.
+    """
+    log = ProgressReporter(level=log_level)
+    num_tracts = vae_model.num_tracts
+    if save_dirs is not None:
+        if len(save_dirs) != num_tracts:
+            raise ValueError(f"Expected {num_tracts} save_dirs, got {len(save_dirs)}")
+        for save_dir in save_dirs:
+            os.makedirs(save_dir, exist_ok=True)
+    x_sample, _ = next(iter(train_data))
+    if x_sample.shape[1] != num_tracts:
+        raise ValueError(f"Packed models have {num_tracts} tracts but the data has {x_sample.shape[1]} channels")
+
+    metrics_logs = [MetricsWriter(os.path.join(save_dir, metrics_file) if save_dirs is not None and metrics_file else None)
+                    for save_dir in (save_dirs or [None] * num_tracts)]
+    try:
+        fast_val_data = make_fast_val_loader(val_data, fast_val_subset)
+        torch.backends.cudnn.benchmark = True
+
+        use_amp = mixed_precision and str(device).startswith("cuda") and torch.cuda.is_available()
+        scaler = torch.amp.GradScaler() if use_amp else None
+
+        vae_model = vae_model.to(device)
+        age_predictor = age_predictor.to(device)
+        site_predictor = site_predictor.to(device)
+        num_sites = site_predictor.num_sites
+
+        def make_step(model, optimizer, stage, scaled_params, timer):
+            def step(loss):
+                optimizer.zero_grad(set_to_none=True)
+                if use_amp:
+                    scaler.scale(loss).backward()
+                    scaler.unscale_(optimizer)
+                else:
+                    loss.backward()
+                timer.lap("backward")
+                clip_grad_norm_per_tract_(model.parameters(), max_grad_norm, num_tracts)
+                timer.lap("clip")
+                # Per-tract learning rates: rescale each tract's Adam update
+                scale = stage.plateau.lr / lr
+                before = [p.detach().clone() for p in scaled_params] if not np.all(scale == 1.0) else None
+                if use_amp:
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    optimizer.step()
+                if before is not None:
+                    with torch.no_grad():
+                        for p, old in zip(scaled_params, before):
+                            tract_scale = torch.as_tensor(scale, dtype=p.dtype, device=p.device)[:, None]
+                            p.copy_((old.reshape(num_tracts, -1) + tract_scale * (p - old).reshape(num_tracts, -1)).view_as(p))
+                timer.lap("optimizer")
+            return step
+
+        def stage_for(name, model, epochs, metrics, monitor, best_file):
+            val_schedule = ValidationSchedule(val_data, epochs, validate_every, fast_val_data, full_val_every)
+            return _TractStage(name, model, num_tracts, lr, metrics, monitor, best_file, val_schedule,
+                               save_dirs, metrics_logs, log)
+
+        def validate(stage, model, epoch, batch_fn, num_sites=None):
+            val_pass = stage.val_schedule.pass_for(epoch)
+            stage.timer.mark()
+            if val_pass is None:
+                return val_pass, None
+            model.eval()
+            return val_pass, _run_epoch(model, stage.val_schedule.loader(val_pass), batch_fn, device, use_amp, num_sites=num_sites)
+
+        results = [{} for _ in range(num_tracts)]
+
+        # STAGE 1: Train each model independently on raw data
+        stage1 = [
+            ("vae", vae_model, epochs_stage1, {"loss": "loss", "recon_loss": "recon_loss", "kl_loss": "kl_loss"},
+             "best_val_loss", "best_vae.pth"),
+            ("age_predictor", age_predictor, epochs_stage1 * 2, {"loss": "loss", "age_r2": "r2"},
+             "best_val_mae", "best_age_predictor.pth"),
+            ("site_predictor", site_predictor, epochs_stage1, {"loss": "loss", "site_acc": "acc"},
+             "best_val_loss", "best_site_predictor.pth"),
+        ]
+        for name, model, epochs, metrics, best_key, best_file in stage1:
+            # Stage checkpoints are per tract, in the per-tract layout; a stage is skipped only if all tracts have one
+            restored = [load_stage_checkpoint(save_dir, name) for save_dir in save_dirs] if resume and save_dirs else [None]
+            if all(checkpoint is not None for checkpoint in restored):
+                log.info(f"Resuming: restored {name} of {num_tracts} tracts from their stage checkpoints")
+                pack_tract_state_dicts(model, [checkpoint["state_dict"] for checkpoint in restored])
+                for tract_results, checkpoint in zip(results, restored):
+                    tract_results[name] = checkpoint["results"]
+                continue
+            log.info(f"\n{'-'*40}\nTraining {name} for {num_tracts} tracts...\n{'-'*40}")
+            stage = stage_for(name, model, epochs, metrics, "loss", best_file)
+            optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+            step = make_step(model, optimizer, stage, list(model.parameters()), stage.timer)
+            for epoch in range(epochs):
+                stage.record("current_lr", stage.plateau.lr)
+                if name == "vae":
+                    current_beta = _kl_beta(epoch, w_kl, kl_annealing_start_epoch, kl_annealing_duration, kl_annealing_start)
+                    stage.record("current_beta", current_beta)
+
+                    def batch_fn(x, labels, beta=current_beta):
+                        x_hat, mean, logvar = vae_model(x)
+                        recon, kl = _recon_kl(x_hat, mean, logvar, x)
+                        return recon + beta * kl, {"recon_loss": recon, "kl_loss": kl}, {}
+                elif name == "age_predictor":
+                    def batch_fn(x, labels):
+                        age_pred = age_predictor(x)
+                        return _age_mae(age_pred, labels), {}, {"age_pred": age_pred}
+                else:
+                    def batch_fn(x, labels):
+                        site_pred = site_predictor(x)
+                        return _site_ce(site_pred, labels), {}, {"site_pred": site_pred}
+
+                model.train()
+                train = _run_epoch(model, train_data, batch_fn, device, use_amp, step=step, timer=stage.timer)
+                val_pass, val = validate(stage, model, epoch, batch_fn)
+                stage.end_epoch(epoch, train, val, val_pass)
+                if name == "vae" and (epoch + 1) % periodic_save_interval == 0:
+                    stage.save_periodic(f"vae_epoch_{epoch+1}.pth")
+                stage.log_epoch(epoch)
+            for tract_results, stage_results in zip(results, stage.finish(best_key)):
+                tract_results[name] = stage_results
+            if save_dirs is not None:
+                for t, save_dir in enumerate(save_dirs):
+                    save_stage_checkpoint(save_dir, name, results[t][name], unpack_tract_state_dict(model, t))
+
+        # STAGE 2: Train Combined Model with Frozen Predictors, then gradual unfreezing
+        log.info(f"\n{'='*40}\nSTAGE 2: Training combined models of {num_tracts} tracts\n{'='*40}")
+        combined_model = CombinedAE_Predictors(vae_model, age_predictor, site_predictor, is_variational=True).to(device)
+        combined_metrics = {name: name for name in ("loss", "recon_loss", "kl_loss", "age_loss", "site_loss",
+                                                    "age_mae", "site_acc", "age_r2")}
+        monitor = {"val_loss": "loss", "val_age_mae": "age_mae"}.get(val_metric_to_monitor, "loss")
+        stage = stage_for("combined", combined_model, epochs_stage2, combined_metrics, monitor, "best_combined_model.pth")
+        site_cm_epochs, train_site_cm_epoch, val_site_cm_epoch = [], [], []
+        phase1_epochs = epochs_stage2 // 2
+        phase2_epochs = epochs_stage2 - phase1_epochs
+        vae_params = list(vae_model.parameters())
+
+        # An interrupted stage 2 continues after the epoch of its last checkpoint, if every tract has it
+        start_epoch = 0
+        resumed = None
+        checkpoints = [load_stage_checkpoint(save_dir, "combined_packed") for save_dir in save_dirs] if resume and save_dirs else [None]
+        checkpoint_epochs = {checkpoint["training_state"]["epoch"] for checkpoint in checkpoints if checkpoint is not None}
+        if all(checkpoint is not None for checkpoint in checkpoints) and len(checkpoint_epochs) == 1:
+            resumed = [checkpoint["training_state"] for checkpoint in checkpoints]
+            start_epoch = resumed[0]["epoch"]
+            stage.restore([checkpoint["results"] for checkpoint in checkpoints], [state["stage"] for state in resumed])
+            pack_tract_state_dicts(combined_model, [checkpoint["state_dict"] for checkpoint in checkpoints])
+            site_cm_epochs.extend(resumed[0]["site_cm_epochs"])
+            for i in range(len(site_cm_epochs)):
+                train_site_cm_epoch.append(np.stack([state["train_site_cm_epoch"][i] for state in resumed]))
+                val_site_cm_epoch.append(np.stack([state["val_site_cm_epoch"][i] for state in resumed]))
+            if scaler is not None and resumed[0]["scaler"] is not None:
+                scaler.load_state_dict(resumed[0]["scaler"])
+            torch.set_rng_state(resumed[0]["rng_state"])
+            if resumed[0]["cuda_rng_state"] is not None and torch.cuda.is_available():
+                torch.cuda.set_rng_state_all(resumed[0]["cuda_rng_state"])
+            # Epochs after the checkpoint are logged again
+            for metrics_log in metrics_logs:
+                metrics_log.truncate(stage.name, start_epoch)
+            log.info(f"Resuming: restored the combined models of {num_tracts} tracts after epoch {start_epoch}")
+
+        for epoch in range(start_epoch, epochs_stage2):
+            if epoch < phase1_epochs:
+                if epoch in (0, start_epoch):
+                    log.info("Phase 1: Age and Site Predictor weights are frozen")
+                    for param in list(age_predictor.parameters()) + list(site_predictor.parameters()):
+                        param.requires_grad = False
+                    optimizer = torch.optim.Adam(vae_params, lr=lr)
+                    step = make_step(combined_model, optimizer, stage, vae_params, stage.timer)
+            else:
+                phase2_progress = (epoch - phase1_epochs) / max(1, phase2_epochs - 1)
+                if epoch in (phase1_epochs, start_epoch):
+                    log.info("Phase 2: Unfreezing Age and Site Predictor weights with controlled learning rates")
+                    for param in list(age_predictor.parameters()) + list(site_predictor.parameters()):
+                        param.requires_grad = True
+                    optimizer = torch.optim.Adam([
+                        {'params': vae_params, 'lr': lr},
+                        {'params': age_predictor.parameters(), 'lr': lr * 0.05 * phase2_progress},
+                        {'params': site_predictor.parameters(), 'lr': lr * 0.01 * phase2_progress}
+                    ])
+                    # A new scheduler, as in the per-tract trainer
+                    stage.plateau = TractPlateau(lr, num_tracts)
+                    step = make_step(combined_model, optimizer, stage, vae_params, stage.timer)
+                if epoch > phase1_epochs:
+                    optimizer.param_groups[1]['lr'] = lr * 0.01 * phase2_progress
+                    optimizer.param_groups[2]['lr'] = lr * 0.01 * phase2_progress
+            # Optimizer and schedule of the checkpoint, unless the phase starts with new ones
+            if epoch == start_epoch and epoch not in (0, phase1_epochs):
+                _load_tract_optimizer_states(combined_model, optimizer, [state["optimizer"] for state in resumed])
+                for name in ("lr", "best", "num_bad_epochs"):
+                    setattr(stage.plateau, name, np.array([state["stage"]["plateau"][name] for state in resumed]))
+            stage.record("current_lr", stage.plateau.lr)
+
+            if grl_alpha_epochs > 0 and epoch < grl_alpha_epochs:
+                current_grl_alpha = grl_alpha_start + (grl_alpha_end - grl_alpha_start) * epoch / grl_alpha_epochs
+            else:
+                current_grl_alpha = grl_alpha_end
+            current_beta = _kl_beta(epoch, w_kl, kl_annealing_start_epoch, kl_annealing_duration, kl_annealing_start)
+            stage.record("current_grl_alpha", current_grl_alpha)
+            stage.record("current_beta", current_beta)
+
+            def batch_fn(x, labels, beta=current_beta, grl_alpha=current_grl_alpha):
+                x_hat, mean, logvar, age_pred, site_pred = combined_model(x, grl_alpha=grl_alpha)
+                recon, kl = _recon_kl(x_hat, mean, logvar, x)
+                age_loss = _age_mae(age_pred, labels)
+                site_loss = _site_ce(site_pred, labels)
+                total = w_recon * recon + beta * kl + w_age * age_loss + w_site * site_loss
+                metrics = {"recon_loss": recon, "kl_loss": kl, "age_loss": age_loss, "site_loss": site_loss, "age_mae": age_loss}
+                return total, metrics, {"age_pred": age_pred, "site_pred": site_pred}
+
+            combined_model.train()
+            train = _run_epoch(combined_model, train_data, batch_fn, device, use_amp, step=step, timer=stage.timer,
+                               num_sites=num_sites)
+            val_pass, val = validate(stage, combined_model, epoch, batch_fn, num_sites=num_sites)
+            if val is not None:
+                site_cm_epochs.append(epoch + 1)
+                train_site_cm_epoch.append(train["site_cm"])
+                val_site_cm_epoch.append(val["site_cm"])
+            stage.end_epoch(epoch, train, val, val_pass)
+
+            if save_dirs is not None and val_pass is not None and (
+                    epoch == 0 or (epoch + 1) % save_predictions_interval == 0 or epoch == epochs_stage2 - 1):
+                for t, save_dir in enumerate(save_dirs):
+                    save_site_confusion_matrices(site_cm_epochs, [cm[t] for cm in train_site_cm_epoch],
+                                                 [cm[t] for cm in val_site_cm_epoch], save_dir)
+                    plot_dir = os.path.join(save_dir, 'confusion_matrices')
+                    os.makedirs(plot_dir, exist_ok=True)
+                    plot_site_confusion_matrix(train_site_cm_epoch[-1][t], f'Train Confusion Matrix - Epoch {epoch+1}',
+                                               os.path.join(plot_dir, f'train_confusion_matrix_epoch_{epoch+1}.png'))
+                    plot_site_confusion_matrix(val_site_cm_epoch[-1][t], f'Val Confusion Matrix - Epoch {epoch+1}',
+                                               os.path.join(plot_dir, f'val_confusion_matrix_epoch_{epoch+1}.png'))
+            if (epoch + 1) % periodic_save_interval == 0:
+                stage.save_periodic(f"combined_model_epoch_{epoch+1}.pth")
+            stage.log_epoch(epoch)
+            # Resume point of an interrupted stage 2 (restored with resume=True)
+            if save_dirs is not None and ((epoch + 1) % periodic_save_interval == 0 or epoch == epochs_stage2 - 1):
+                for t, save_dir in enumerate(save_dirs):
+                    save_stage_checkpoint(save_dir, "combined_packed", stage.histories[t],
+                                          unpack_tract_state_dict(combined_model, t), {
+                        "epoch": epoch + 1,
+                        "stage": stage.tract_state(t),
+                        "optimizer": _tract_optimizer_state(combined_model, optimizer, t, num_tracts),
+                        "site_cm_epochs": site_cm_epochs,
+                        "train_site_cm_epoch": [cm[t] for cm in train_site_cm_epoch],
+                        "val_site_cm_epoch": [cm[t] for cm in val_site_cm_epoch],
+                        "scaler": scaler.state_dict() if scaler is not None else None,
+                        "rng_state": torch.get_rng_state(),
+                        "cuda_rng_state": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                    })
+
+        best_key = f"best_{val_metric_to_monitor}"
+        for t, (tract_results, stage_results) in enumerate(zip(results, stage.finish(best_key))):
+            stage_results.update({
+                "site_cm_epochs": site_cm_epochs,
+                "train_site_cm_epoch": [cm[t] for cm in train_site_cm_epoch],
+                "val_site_cm_epoch": [cm[t] for cm in val_site_cm_epoch],
+                "best_epoch": int(stage.best_epoch[t]),
+                "model_path": os.path.join(save_dirs[t], "best_combined_model.pth") if save_dirs is not None else None,
+            })
+            tract_results["combined"] = stage_results
+
+        log.info(f"\n{'='*40}\nTraining complete for {num_tracts} tracts!\n{'='*40}")
+        return results
+    finally:
+        for metrics_log in metrics_logs:
+            metrics_log.close()
+        log.close()
@@ -0,0 +1,249 @@
+import json
+import os
+
+import numpy as np
+
+# Append-only store for per-epoch predictions of a single training run.
+# Replaces the pair of .npy files per split and epoch written by save_site_predictions
+# with one directory of flat column files plus an epoch index.
+
+# Column name -> (dtype, fill value used when a column is not provided)
+_COLUMNS = {
+    "site_true": (np.int16, -1),
+    "site_pred": (np.int16, -1),
+    "age_true": (np.float32, np.nan),
+    "age_pred": (np.float32, np.nan),
+}
+_LATENT_DTYPE = np.float32
+# Each index record is (epoch, split_id, row_offset, row_count)
+_INDEX_FIELDS = 4
+_INDEX_DTYPE = np.int64
+
+
+class PredictionStore:
+    """Single appendable container for per-epoch predictions.
+
+    Every column lives in its own flat binary file inside ``path``; rows of
+    all epochs and splits are appended back to back. ``index.bin`` holds one
+    fixed-size ``(epoch, split_id, offset, count)`` record per append and is
+    written *after* the column data, so a reader that only trusts complete
+    index records can open the store while training is still writing it.
+    Lookups by ``(split, epoch)`` are a dict lookup plus a memmap slice.
+    Appending a ``(split, epoch)`` pair again (e.g. after resuming a run)
+    replaces it: the newest index record of a pair wins.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store; created if needed.
+    mode : {'a', 'r'}, optional
+        ``'a'`` to append (and read), ``'r'`` for read-only access.
+    latent_dim : int, optional
+        Width of the latent column. An existing store keeps its recorded
+        width; a store without one records the width of the first latents
+        appended to it (earlier rows get NaN latents).
+    """
+
+    def __init__(self, path, mode="a", latent_dim=None):
+        if mode not in ("a", "r"):
+            raise ValueError("mode must be 'a' or 'r'")
+        self.path = path
+        self.mode = mode
+        meta_path = os.path.join(path, "meta.json")
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        elif mode == "r":
+            raise FileNotFoundError(f"No prediction store found at {path}")
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.meta = {"splits": [], "latent_dim": latent_dim}
+            self._write_meta()
+
+        self._index = {}
+        self._n_records = 0
+        self.refresh()
+        if mode == "a":
+            self._truncate_uncommitted()
+
+    # ------------------------------------------------------------------ paths
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    # ---------------------------------------------------------------- reading
+    def refresh(self):
+        """Pick up index records appended since the store was opened."""
+        index_path = os.path.join(self.path, "index.bin")
+        if not os.path.exists(index_path):
+            return
+        raw = np.fromfile(index_path, dtype=_INDEX_DTYPE)
+        # Ignore a trailing partial record from a write in progress
+        n_records = raw.size // _INDEX_FIELDS
+        records = raw[: n_records * _INDEX_FIELDS].reshape(n_records, _INDEX_FIELDS)
+        if n_records > self._n_records:
+            # Re-read meta too, a new split may have been registered
+            with open(os.path.join(self.path, "meta.json")) as f:
+                self.meta = json.load(f)
+        # Records are applied in write order, so a rewritten (split, epoch) maps to its newest rows
+        for epoch, split_id, offset, count in records[self._n_records:]:
+            split = self.meta["splits"][split_id]
+            self._index[(split, int(epoch))] = (int(offset), int(count))
+        self._n_records = n_records
+
+    def epochs(self, split=None):
+        """Sorted epochs stored for ``split`` (or for any split if None)."""
+        return sorted({e for s, e in self._index if split is None or s == split})
+
+    def keys(self):
+        """All stored ``(split, epoch)`` pairs."""
+        return sorted(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def _read_column(self, name, dtype, offset, count, width=1):
+        path = self._column_path(name)
+        if count == 0 or not os.path.exists(path):
+            return np.empty((count, width) if width > 1 else (count,), dtype=dtype)
+        shape = (count, width) if width > 1 else (count,)
+        itemsize = np.dtype(dtype).itemsize * width
+        data = np.memmap(path, dtype=dtype, mode="r", offset=offset * itemsize, shape=shape)
+        return np.array(data)
+
+    def get(self, epoch, split="val"):
+        """Return the predictions stored for ``(split, epoch)`` as a dict of arrays.
+
+        Keys are ``site_true``, ``site_pred``, ``age_true``, ``age_pred`` and,
+        for stores created with ``latent_dim``, ``latents`` of shape [N, D].
+        """
+        key = (split, int(epoch))
+        if key not in self._index:
+            self.refresh()
+        if key not in self._index:
+            raise KeyError(f"No predictions stored for split={split!r}, epoch={epoch}")
+        offset, count = self._index[key]
+        out = {name: self._read_column(name, dtype, offset, count)
+               for name, (dtype, _) in _COLUMNS.items()}
+        if self.meta.get("latent_dim"):
+            out["latents"] = self._read_column("latents", _LATENT_DTYPE, offset, count,
+                                               width=self.meta["latent_dim"])
+        return out
+
+    # ---------------------------------------------------------------- writing
+    def append(self, epoch, split, site_true, site_pred, age_true=None, age_pred=None, latents=None):
+        """Append one epoch of predictions for ``split``.
+
+        Inputs may be numpy arrays or tensors (on any device). Columns that
+        are not provided are filled with -1 (sites) or NaN (ages, latents).
+        A ``(split, epoch)`` pair that is already stored is replaced.
+        """
+        if self.mode != "a":
+            raise IOError("PredictionStore opened read-only")
+
+        values = {
+            "site_true": _to_numpy(site_true),
+            "site_pred": _to_numpy(site_pred),
+            "age_true": _to_numpy(age_true),
+            "age_pred": _to_numpy(age_pred),
+        }
+        count = len(values["site_true"])
+
+        # Check the latent width before anything is written, so a rejected append leaves no rows behind
+        lat = _to_numpy(latents)
+        if lat is not None:
+            lat = lat.reshape(count, -1).astype(_LATENT_DTYPE)
+            latent_dim = self.meta.get("latent_dim")
+            if latent_dim and lat.shape[1] != latent_dim:
+                raise ValueError(f"Expected latents of width {latent_dim}, got {lat.shape[1]}")
+
+        if split not in self.meta["splits"]:
+            self.meta["splits"].append(split)
+            self._write_meta()
+        split_id = self.meta["splits"].index(split)
+        offset = self._next_offset()
+
+        for name, (dtype, fill) in _COLUMNS.items():
+            col = values[name]
+            col = np.full(count, fill, dtype=dtype) if col is None else col.reshape(count).astype(dtype)
+            with open(self._column_path(name), "ab") as f:
+                col.tofile(f)
+
+        if lat is not None and not self.meta.get("latent_dim"):
+            self._add_latent_column(lat.shape[1], offset)
+        latent_dim = self.meta.get("latent_dim")
+        if latent_dim:
+            if lat is None:
+                lat = np.full((count, latent_dim), np.nan, dtype=_LATENT_DTYPE)
+            with open(self._column_path("latents"), "ab") as f:
+                lat.tofile(f)
+
+        # Commit: the index record is written last so readers never see partial rows
+        record = np.array([epoch, split_id, offset, count], dtype=_INDEX_DTYPE)
+        with open(os.path.join(self.path, "index.bin"), "ab") as f:
+            record.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._index[(split, int(epoch))] = (offset, count)
+        self._n_records += 1
+
+    def _add_latent_column(self, latent_dim, n_rows):
+        # First latents in a store created without a width: NaN rows for what is already
+        # stored, then record the width ("wb" discards a backfill left by a crashed append)
+        with open(self._column_path("latents"), "wb") as f:
+            np.full((n_rows, latent_dim), np.nan, dtype=_LATENT_DTYPE).tofile(f)
+        self.meta["latent_dim"] = int(latent_dim)
+        self._write_meta()
+
+    def _truncate_uncommitted(self):
+        # Drop rows written by an append that crashed before its index record
+        n_rows = self._next_offset()
+        widths = {name: np.dtype(dtype).itemsize for name, (dtype, _) in _COLUMNS.items()}
+        if self.meta.get("latent_dim"):
+            widths["latents"] = np.dtype(_LATENT_DTYPE).itemsize * self.meta["latent_dim"]
+        for name, row_bytes in widths.items():
+            path = self._column_path(name)
+            if os.path.exists(path) and os.path.getsize(path) > n_rows * row_bytes:
+                with open(path, "r+b") as f:
+                    f.truncate(n_rows * row_bytes)
+
+    def _next_offset(self):
+        if not self._index:
+            return 0
+        return max(offset + count for offset, count in self._index.values())
+
+
+# Converts tensors (any device) and sequences to numpy, leaving None alone
+def _to_numpy(values):
+    if values is None:
+        return None
+    if hasattr(values, "detach"):
+        values = values.detach().float().cpu().numpy() if values.is_floating_point() else values.detach().cpu().numpy()
+    return np.asarray(values)
+
+
+def open_prediction_store(save_dir, mode="a", latent_dim=None):
+    """Open (or create) the prediction store of the run saved in ``save_dir``.
+
+    Parameters
+    ----------
+    save_dir : str
+        Run directory passed as ``save_dir`` to the trainers.
+    mode : {'a', 'r'}, optional
+        ``'a'`` to append, ``'r'`` to read.
+    latent_dim : int, optional
+        Latent width, only used when the store is created.
+
+    Returns
+    -------
+    PredictionStore
+    """
+    return PredictionStore(os.path.join(save_dir, "site_predictions", "predictions"),
+                           mode=mode, latent_dim=latent_dim)
@@ -0,0 +1,227 @@
+import os
+import time
+
+import numpy as np
+import torch
+
+# Per-phase epoch timers and an optional torch.profiler window for the trainers.
+# Every trainer times its phases each epoch and returns them as
+# results["phase_times_epoch"], together with throughput histories
+# (samples/sec, step times, loader wait) next to its loss histories;
+# passing profile=... additionally records a window of training steps with
+# torch.profiler and exports Chrome traces.
+
+# Wall-clock phases of one epoch, in seconds.
+# "data" is time spent waiting on the loader; "other" is the rest of the epoch
+# not charged to any phase (metric bookkeeping, logging, scheduler steps).
+PHASES = ("data", "forward", "backward", "clip", "optimizer", "validation", "checkpoint", "other")
+
+# Always-on per-epoch throughput counters, in samples/sec and seconds.
+# compute_time is the training-loop time not spent waiting on the loader;
+# a high data_wait_time relative to it means the run is loader-bound.
+THROUGHPUT_METRICS = (
+    "samples_per_sec", "step_time_mean", "step_time_p95",
+    "data_wait_time", "compute_time", "val_time", "checkpoint_time",
+)
+
+# Defaults for the profile= option of the trainers
+PROFILE_DEFAULTS = {
+    "wait": 5,              # steps skipped before profiling starts
+    "warmup": 2,            # steps traced but discarded
+    "active": 5,            # steps recorded into each trace
+    "repeat": 1,            # number of wait/warmup/active cycles
+    "record_shapes": False,
+    "profile_memory": False,
+    "with_stack": False,
+    "stages": None,         # stage names to profile, None profiles every stage
+    "trace_dir": None,      # defaults to <save_dir>/profiler
+}
+
+
+class PhaseTimer:
+    """Accumulates wall-clock time per training phase over an epoch.
+
+    Wrap the training loader with ``iterate()`` so waiting for a batch is
+    charged to ``"data"`` and call ``lap(phase)`` after each step section to
+    charge the time since the previous mark to ``phase``. Whole blocks are
+    timed with ``mark()`` ... ``lap("validation")``. ``end_epoch()`` appends
+    the totals, plus ``"other"`` and the epoch's ``"total"``, to ``history``
+    and the epoch's ``THROUGHPUT_METRICS`` to ``throughput``.
+
+    Parameters
+    ----------
+    sync_cuda : bool, optional
+        Synchronize CUDA before every reading so GPU work is charged to the
+        phase that launched it. Costs throughput, so only enabled while
+        profiling.
+    """
+
+    def __init__(self, sync_cuda=False):
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.history = {name: [] for name in PHASES + ("total",)}
+        self.throughput = {name: [] for name in THROUGHPUT_METRICS}
+        self._totals = dict.fromkeys(PHASES, 0.0)
+        self._last = None
+        self._epoch_start = self._now()
+        self._step_start = None
+        self._step_times = []
+        self._samples = 0
+
+    def _now(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def iterate(self, loader):
+        """Yield the batches of ``loader``, charging the wait for each to ``"data"``."""
+        iterator = iter(loader)
+        while True:
+            start = self._now()
+            if self._step_start is not None:
+                self._step_times.append(start - self._step_start)
+                self._step_start = None
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                self._last = None
+                return
+            self._last = self._now()
+            self._totals["data"] += self._last - start
+            self._samples += _batch_size(batch)
+            self._step_start = self._last
+            yield batch
+
+    def mark(self):
+        """Start timing from now without charging any phase."""
+        self._last = self._now()
+
+    def lap(self, phase):
+        """Charge the time since the previous mark to ``phase``."""
+        now = self._now()
+        if self._last is not None:
+            self._totals[phase] += now - self._last
+        self._last = now
+
+    def end_epoch(self):
+        """Store this epoch's totals in ``history`` and start a new epoch."""
+        now = self._now()
+        totals = self._totals
+        totals["total"] = now - self._epoch_start
+        totals["other"] = max(0.0, totals["total"] - sum(totals[name] for name in PHASES if name != "other"))
+        for name, seconds in totals.items():
+            self.history[name].append(seconds)
+
+        step_times = np.asarray(self._step_times)
+        compute_time = float(step_times.sum())
+        loop_time = totals["data"] + compute_time
+        stats = {
+            "samples_per_sec": self._samples / loop_time if loop_time > 0 else 0.0,
+            "step_time_mean": float(step_times.mean()) if len(step_times) else 0.0,
+            "step_time_p95": float(np.percentile(step_times, 95)) if len(step_times) else 0.0,
+            "data_wait_time": totals["data"],
+            "compute_time": compute_time,
+            "val_time": totals["validation"],
+            "checkpoint_time": totals["checkpoint"],
+        }
+        for name, value in stats.items():
+            self.throughput[name].append(value)
+
+        self._totals = dict.fromkeys(PHASES, 0.0)
+        self._last = None
+        self._epoch_start = now
+        self._step_start = None
+        self._step_times = []
+        self._samples = 0
+        return totals
+
+    def histories(self, suffix="_epoch"):
+        """Throughput histories keyed like the trainers' results, e.g. ``samples_per_sec_epoch``."""
+        return {name + suffix: values for name, values in self.throughput.items()}
+
+
+# Number of samples in a loader batch (the first tensor of a tuple batch)
+def _batch_size(batch):
+    if isinstance(batch, (tuple, list)):
+        batch = batch[0]
+    return len(batch) if hasattr(batch, "__len__") else 1
+
+
+def profile_config(profile):
+    """Normalize the trainers' ``profile=`` argument.
+
+    ``None``/``False`` disables profiling, ``True`` uses ``PROFILE_DEFAULTS``
+    and a dict overrides individual defaults.
+    """
+    if not profile:
+        return None
+    config = dict(PROFILE_DEFAULTS)
+    if isinstance(profile, dict):
+        unknown = set(profile) - set(PROFILE_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown profile options: {sorted(unknown)}")
+        config.update(profile)
+    elif profile is not True:
+        raise TypeError("profile must be None, a bool or a dict of options")
+    return config
+
+
+class StepProfiler:
+    """torch.profiler over a window of training steps of one stage.
+
+    Call ``step()`` after every optimizer step and ``stop()`` when the stage
+    ends. Each completed window is exported as a Chrome trace
+    (``<trace_dir>/<stage>_step<N>.pt.trace.json``; open it in
+    chrome://tracing or Perfetto). A disabled profiler's methods are no-ops.
+
+    Parameters
+    ----------
+    profile : bool or dict or None
+        The trainer's ``profile=`` argument, see ``profile_config``.
+    save_dir : str
+        Run directory; traces go to ``save_dir/profiler`` unless the config
+        sets ``trace_dir``.
+    stage : str
+        Stage name used for the trace file names and the ``stages`` filter.
+    """
+
+    def __init__(self, profile, save_dir, stage):
+        self.stage = stage
+        self.trace_files = []
+        self._prof = None
+        config = profile_config(profile)
+        if config is None or (config["stages"] is not None and stage not in config["stages"]):
+            return
+
+        self.trace_dir = config["trace_dir"] or os.path.join(save_dir or ".", "profiler")
+        os.makedirs(self.trace_dir, exist_ok=True)
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._prof = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(wait=config["wait"], warmup=config["warmup"],
+                                             active=config["active"], repeat=config["repeat"]),
+            on_trace_ready=self._export,
+            record_shapes=config["record_shapes"],
+            profile_memory=config["profile_memory"],
+            with_stack=config["with_stack"],
+        )
+        self._prof.start()
+
+    @property
+    def enabled(self):
+        return self._prof is not None
+
+    def _export(self, prof):
+        path = os.path.join(self.trace_dir, f"{self.stage}_step{prof.step_num}.pt.trace.json")
+        prof.export_chrome_trace(path)
+        self.trace_files.append(path)
+
+    def step(self):
+        if self._prof is not None:
+            self._prof.step()
+
+    def stop(self):
+        if self._prof is not None:
+            self._prof.stop()
+            self._prof = None
@@ -0,0 +1,114 @@
+import atexit
+import os
+import sys
+import time
+
+# Leveled, buffered progress output for the training loops.
+# On SLURM every print lands in a .log file on the shared filesystem, so the
+# trainers buffer their lines and write them in blocks, rate-limit in-epoch
+# progress lines, and keep DEBUG output off unless asked for.
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+_LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+
+
+def _parse_level(level):
+    if level is None:
+        level = os.environ.get("AFQ_LOG_LEVEL", "info")
+    if isinstance(level, str):
+        try:
+            return _LEVELS[level.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown log level {level!r}; expected one of {sorted(_LEVELS)}")
+    return int(level)
+
+
+class ProgressReporter:
+    """Leveled, rate-limited, buffered replacement for ``print`` in trainers.
+
+    The logging methods take the same positional arguments as ``print``.
+    Lines are buffered and written in one block when ``max_buffered_lines``
+    are pending, when ``flush_interval`` seconds have passed, on
+    ``flush()``, or immediately for warnings and errors. Anything still
+    buffered is written at interpreter exit.
+
+    Parameters
+    ----------
+    level : str or int, optional
+        Minimum level to emit (``'debug'``, ``'info'``, ``'warning'``,
+        ``'error'``). Defaults to the ``AFQ_LOG_LEVEL`` environment variable,
+        or ``'info'``.
+    stream : file-like, optional
+        Where to write. Defaults to ``sys.stdout`` at write time.
+    min_interval : float, optional
+        Minimum seconds between two ``progress()`` lines with the same key.
+    flush_interval : float, optional
+        Maximum seconds a line stays buffered before it is written.
+    max_buffered_lines : int, optional
+        Write as soon as this many lines are buffered.
+    """
+
+    def __init__(self, level=None, stream=None, min_interval=30.0, flush_interval=10.0, max_buffered_lines=200):
+        self.level = _parse_level(level)
+        self.stream = stream
+        self.min_interval = min_interval
+        self.flush_interval = flush_interval
+        self.max_buffered_lines = max_buffered_lines
+        self._lines = []
+        self._last_flush = time.monotonic()
+        self._last_progress = {}
+        atexit.register(self.flush)
+
+    def enabled_for(self, level):
+        """True if messages at ``level`` would be emitted (use to skip costly debug work)."""
+        return _parse_level(level) >= self.level
+
+    def log(self, level, *values, sep=" "):
+        level = _parse_level(level)
+        if level < self.level:
+            return
+        self._lines.append(sep.join(str(v) for v in values))
+        if (level >= WARNING
+                or len(self._lines) >= self.max_buffered_lines
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def debug(self, *values, sep=" "):
+        self.log(DEBUG, *values, sep=sep)
+
+    def info(self, *values, sep=" "):
+        self.log(INFO, *values, sep=sep)
+
+    def warning(self, *values, sep=" "):
+        self.log(WARNING, *values, sep=sep)
+
+    def error(self, *values, sep=" "):
+        self.log(ERROR, *values, sep=sep)
+
+    def progress(self, *values, key="progress", sep=" "):
+        """Emit an INFO line at most once every ``min_interval`` seconds per ``key``."""
+        if INFO < self.level:
+            return
+        now = time.monotonic()
+        last = self._last_progress.get(key)
+        if last is not None and now - last < self.min_interval:
+            return
+        self._last_progress[key] = now
+        self.log(INFO, *values, sep=sep)
+
+    def flush(self):
+        """Write all buffered lines."""
+        if not self._lines:
+            return
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write("\n".join(self._lines) + "\n")
+        stream.flush()
+        self._lines = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
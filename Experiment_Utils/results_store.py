@@ -0,0 +1,237 @@
+import contextlib
+import glob
+import json
+import os
+import re
+import sqlite3
+
+import pandas as pd
+
+# Consolidated table of tract results.
+# Every finished tract run registers one summary row, keyed by the hash of its
+# settings and the tract index, in a SQLite database in the output directory.
+# Rankings, aggregations and the FA/MD comparison are then single queries,
+# instead of opening every tract directory's summary files. SQLite's file
+# locking serializes the writes of concurrent workers and jobs (writers wait
+# up to ``timeout`` seconds for the lock).
+
+RESULTS_FILE = "results.sqlite"
+
+# Column name -> SQL type; the adv_ columns are the stage 2 (adversarial)
+# summary of adversarial_training_summary.csv
+COLUMNS = {
+    "config_hash": "TEXT NOT NULL",
+    "tract_idx": "INTEGER NOT NULL",
+    "tract_name": "TEXT",
+    "modality": "TEXT",
+    "base_tract_name": "TEXT",
+    "best_val_r2": "REAL",
+    "best_val_mae": "REAL",
+    "best_site_acc": "REAL",
+    "training_time": "REAL",
+    "adv_best_val_r2": "REAL",
+    "adv_best_val_r2_epoch": "INTEGER",
+    "adv_best_val_mae": "REAL",
+    "adv_best_val_mae_epoch": "INTEGER",
+    "adv_best_site_acc": "REAL",
+    "adv_worst_site_acc": "REAL",
+    "adv_best_epoch": "INTEGER",
+    "adv_best_metric_value": "REAL",
+    "adv_total_epochs": "INTEGER",
+    "output_dir": "TEXT",
+    "finished": "TEXT",
+}
+ADVERSARIAL_COLUMNS = [name[len("adv_"):] for name in COLUMNS if name.startswith("adv_")]
+MODALITIES = ("dki_fa_md", "dki_fa", "dki_md")
+
+
+def tract_row(summary, adversarial_summary=None, config_hash=None):
+    """
+    Row of the results table from a tract's summary (tract_summary.json) and
+    its stage 2 summary (a row of adversarial_training_summary.csv).
+    """
+    row = {name: summary.get(name) for name in COLUMNS if name in summary}
+    # Older summaries only have the names read by the plotting scripts
+    row.setdefault("best_val_r2", summary.get("best_r2"))
+    row.setdefault("best_val_mae", summary.get("best_age_mae"))
+    for name in ADVERSARIAL_COLUMNS:
+        if adversarial_summary and name in adversarial_summary:
+            row[f"adv_{name}"] = adversarial_summary[name]
+    if config_hash is not None:
+        row["config_hash"] = config_hash
+    row.setdefault("config_hash", "")
+    return row
+
+
+def read_tract_dir(tract_dir, tract_names=None, config_hash=None):
+    """
+    Row of the results table from the files of one tract directory
+    (tract_summary.json, or training_results.json of older runs, and
+    adversarial_training_summary.csv); None if it has no results.
+    """
+    match = re.match(r"tract_(\d+)", os.path.basename(os.path.normpath(tract_dir)))
+    if match is None:
+        return None
+    tract_idx = int(match.group(1))
+    summary_file = os.path.join(tract_dir, "tract_summary.json")
+    results_file = os.path.join(tract_dir, "training_results.json")
+    if os.path.exists(summary_file):
+        with open(summary_file) as f:
+            summary = json.load(f)
+    elif os.path.exists(results_file):
+        try:
+            with open(results_file) as f:
+                results = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Error parsing JSON from {results_file}")
+            return None
+        summary = {"best_val_r2": results.get("best_val_r2"), "best_val_mae": results.get("best_val_mae"),
+                   "best_site_acc": results.get("best_site_acc"), "training_time": results.get("training_time")}
+    else:
+        return None
+
+    summary.setdefault("tract_idx", tract_idx)
+    summary.setdefault("tract_name", (tract_names or {}).get(tract_idx, f"tract_{tract_idx}"))
+    summary.setdefault("output_dir", tract_dir)
+    if "modality" not in summary:
+        summary["modality"] = next((m for m in MODALITIES if os.path.basename(tract_dir).endswith(m)), "unknown")
+    if "base_tract_name" not in summary:
+        modality = summary["modality"]
+        summary["base_tract_name"] = (summary["tract_name"].replace(modality, "") if modality != "unknown"
+                                      else summary["tract_name"])
+    adversarial_file = os.path.join(tract_dir, "adversarial_training_summary.csv")
+    adversarial = None
+    if os.path.exists(adversarial_file):
+        adversarial_df = pd.read_csv(adversarial_file)
+        if not adversarial_df.empty:
+            adversarial = adversarial_df.iloc[0].to_dict()
+    return tract_row(summary, adversarial, config_hash)
+
+
+class ResultsStore:
+    """
+    SQLite table of tract results, one row per settings hash and tract.
+
+    Parameters
+    ----------
+    path : str
+        Database file, e.g. ``os.path.join(output_dir, RESULTS_FILE)``.
+    timeout : float
+        Seconds a writer waits for another writer's lock.
+    """
+
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.timeout = timeout
+        columns = ", ".join(f"{name} {sql_type}" for name, sql_type in COLUMNS.items())
+        with self._connect() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS tract_results ({columns}, "
+                               "PRIMARY KEY (config_hash, tract_idx))")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with connection:  # one transaction, committed on success
+                yield connection
+        finally:
+            connection.close()
+
+    def record(self, row):
+        """Add (or replace) the row of a tract; keys that are not columns are ignored."""
+        self.record_many([row])
+
+    def record_many(self, rows):
+        """Add (or replace) several rows in one transaction."""
+        names = list(COLUMNS)
+        values = [tuple(_sql_value(row.get(name)) for name in names) for row in rows]
+        with self._connect() as connection:
+            connection.executemany(f"INSERT OR REPLACE INTO tract_results ({', '.join(names)}) "
+                                   f"VALUES ({', '.join('?' * len(names))})", values)
+
+    def query(self, sql, params=()):
+        """Run a query over the ``tract_results`` table and return a DataFrame."""
+        with self._connect() as connection:
+            return pd.read_sql_query(sql, connection, params=params)
+
+    def latest_config_hash(self):
+        """Settings hash of the most recently finished tract, or None for an empty table."""
+        df = self.query("SELECT config_hash FROM tract_results ORDER BY finished DESC LIMIT 1")
+        return df["config_hash"].iloc[0] if len(df) else None
+
+    def results(self, config_hash=None):
+        """All columns of the tracts of one settings hash (all rows if None), by tract index."""
+        where, params = _where(config_hash)
+        return self.query(f"SELECT * FROM tract_results{where} ORDER BY tract_idx", params)
+
+    def adversarial_results(self, config_hash=None):
+        """The stage 2 summaries, with the columns of adversarial_training_summary.csv and the modality."""
+        where, params = _where(config_hash, "adv_best_val_r2 IS NOT NULL")
+        selected = ", ".join(f"adv_{name} AS {name}" for name in ADVERSARIAL_COLUMNS)
+        return self.query(f"SELECT tract_idx, tract_name, {selected}, modality FROM tract_results{where} "
+                          "ORDER BY tract_idx", params)
+
+    def ranking(self, metric="best_val_r2", ascending=False, modality=None, config_hash=None):
+        """Tracts ordered by one column (best first), optionally of one modality."""
+        _check_column(metric)
+        where, params = _where(config_hash, *(["modality = ?"] if modality else []))
+        if modality:
+            params = params + (modality,)
+        order = "ASC" if ascending else "DESC"
+        return self.query(f"SELECT * FROM tract_results{where} ORDER BY {metric} IS NULL, {metric} {order}", params)
+
+    def fa_md_comparison(self, config_hash=None):
+        """
+        FA and MD results of the same bundles side by side, by ``r2_diff``
+        (FA - MD, positive when FA is better); ``mae_diff`` is negative when FA is better.
+        """
+        params = () if config_hash is None else (config_hash,)
+        return self.query(
+            "SELECT fa.base_tract_name AS base_tract, fa.tract_idx AS fa_tract_idx, md.tract_idx AS md_tract_idx, "
+            "fa.best_val_r2 AS fa_r2, md.best_val_r2 AS md_r2, fa.best_val_r2 - md.best_val_r2 AS r2_diff, "
+            "fa.best_val_mae AS fa_mae, md.best_val_mae AS md_mae, fa.best_val_mae - md.best_val_mae AS mae_diff "
+            "FROM tract_results fa JOIN tract_results md "
+            "ON fa.base_tract_name = md.base_tract_name AND fa.config_hash = md.config_hash "
+            "WHERE fa.modality = 'dki_fa' AND md.modality = 'dki_md'"
+            f"{'' if config_hash is None else ' AND fa.config_hash = ?'} ORDER BY r2_diff DESC", params)
+
+    def index_tract_dirs(self, input_dir, config_hash=None):
+        """
+        Register the tract_* directories of ``input_dir`` (e.g. from runs that
+        predate the results table); returns the number of rows added.
+        """
+        tract_names = {}
+        names_file = os.path.join(input_dir, "tract_names.json")
+        if os.path.exists(names_file):
+            with open(names_file) as f:
+                tract_names = dict(enumerate(json.load(f)))
+        rows = [read_tract_dir(tract_dir, tract_names, config_hash)
+                for tract_dir in sorted(glob.glob(os.path.join(input_dir, "tract_*"))) if os.path.isdir(tract_dir)]
+        rows = [row for row in rows if row is not None]
+        self.record_many(rows)
+        return len(rows)
+
+
+def _sql_value(value):
+    # numpy scalars and NaN from pandas rows
+    if value is None:
+        return None
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _check_column(name):
+    if name not in COLUMNS:
+        raise ValueError(f"Unknown column {name!r}; expected one of {list(COLUMNS)}")
+
+
+def _where(config_hash, *conditions):
+    conditions = list(conditions)
+    params = ()
+    if config_hash is not None:
+        conditions.insert(0, "config_hash = ?")
+        params = (config_hash,)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
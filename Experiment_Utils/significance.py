@@ -0,0 +1,176 @@
+import numpy as np
+
+# Permutation tests and bootstrap confidence intervals for tract rankings.
+# Refitting the models thousands of times is out of the question, so the
+# tests work on cheap scorers: age predictions cached from the trained models
+# (or closed-form probes). All permutations and bootstrap resamples of one
+# test are precomputed as an index/weight matrix, and every statistic of every
+# tract under every resample comes out of a few matrix products.
+
+
+def permutation_indices(num_samples, num_permutations=1000, seed=0):
+    """Matrix of ``num_permutations`` random permutations of ``range(num_samples)``, one per row."""
+    rng = np.random.default_rng(seed)
+    return np.argsort(rng.random((num_permutations, num_samples)), axis=1)
+
+
+def bootstrap_weights(num_samples, num_resamples=1000, seed=0):
+    """Bootstrap resamples as a (num_resamples, num_samples) matrix of how often each sample is drawn."""
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(num_samples, np.full(num_samples, 1 / num_samples), size=num_resamples).astype(float)
+
+
+def _p_values(observed, null):
+    # One-sided: fraction of the null (resamples in rows) at least as large as observed, counting observed itself
+    return (1 + (null >= observed).sum(0)) / (1 + len(null))
+
+
+def _intervals(samples, confidence):
+    tail = 100 * (1 - confidence) / 2
+    return np.nanpercentile(samples, tail, axis=0), np.nanpercentile(samples, 100 - tail, axis=0)
+
+
+def _bootstrap_r2_mae(weights, errors, ages):
+    # R² and MAE of every resample (rows) and scorer (columns)
+    n = weights.sum(1, keepdims=True)
+    sum_ages = weights @ ages
+    ss_tot = weights @ ages ** 2 - sum_ages ** 2 / n[:, 0]
+    return 1 - (weights @ (errors ** 2).T) / ss_tot[:, None], weights @ np.abs(errors).T / n
+
+
+def prediction_significance(predictions, ages, num_permutations=1000, num_resamples=1000, confidence=0.95,
+                            seed=0):
+    """
+    Significance of the R² of several scorers' age predictions.
+
+    The p-value tests R² against predictions unrelated to age, by permuting
+    the ages; the permuted residual sums of squares of all scorers are one
+    product with the permuted-age matrix. Confidence intervals resample the
+    subjects.
+
+    Parameters
+    ----------
+    predictions : np.ndarray
+        (num_scorers, num_subjects) predicted ages, e.g. one row per tract.
+    ages : np.ndarray
+        (num_subjects,) true ages.
+
+    Returns
+    -------
+    dict
+        Arrays with one entry per scorer: ``r2``, ``mae``, ``r2_p_value``,
+        ``r2_ci_low``, ``r2_ci_high``, ``mae_ci_low`` and ``mae_ci_high``.
+    """
+    predictions = np.atleast_2d(np.asarray(predictions, dtype=float))
+    ages = np.asarray(ages, dtype=float)
+    errors = predictions - ages
+    ss_tot = ((ages - ages.mean()) ** 2).sum()
+    r2 = 1 - (errors ** 2).sum(1) / ss_tot
+
+    permuted_ages = ages[permutation_indices(len(ages), num_permutations, seed)]
+    # sum((p - a_perm)^2) = sum(p^2) - 2 p.a_perm + sum(a^2)
+    ss_res = (predictions ** 2).sum(1) - 2 * permuted_ages @ predictions.T + (ages ** 2).sum()
+    null_r2 = 1 - ss_res / ss_tot
+
+    boot_r2, boot_mae = _bootstrap_r2_mae(bootstrap_weights(len(ages), num_resamples, seed + 1), errors, ages)
+    r2_low, r2_high = _intervals(boot_r2, confidence)
+    mae_low, mae_high = _intervals(boot_mae, confidence)
+    return {
+        "r2": r2,
+        "mae": np.abs(errors).mean(1),
+        "r2_p_value": _p_values(r2, null_r2),
+        "r2_ci_low": r2_low,
+        "r2_ci_high": r2_high,
+        "mae_ci_low": mae_low,
+        "mae_ci_high": mae_high,
+    }
+
+
+def occlusion_significance(intact, occluded, ages, num_permutations=1000, num_resamples=1000, confidence=0.95,
+                           seed=0):
+    """
+    Significance of the R² drop and MAE increase from occluding each tract.
+
+    Under the null hypothesis, occluding a tract does not change the model's
+    errors, so the labels "intact" and "occluded" can be swapped within each
+    subject. All random swaps are one sign matrix, and the null distributions
+    of every tract are one product of it with the per-subject error
+    differences. Confidence intervals resample the subjects.
+
+    Parameters
+    ----------
+    intact : np.ndarray
+        (num_subjects,) predictions from the unchanged inputs.
+    occluded : np.ndarray
+        (num_tracts, num_subjects) predictions with each tract occluded.
+    ages : np.ndarray
+        (num_subjects,) true ages.
+
+    Returns
+    -------
+    dict
+        Arrays with one entry per tract: ``r2_drop_p_value``,
+        ``r2_drop_ci_low``, ``r2_drop_ci_high``, ``mae_increase_p_value``,
+        ``mae_increase_ci_low`` and ``mae_increase_ci_high``.
+    """
+    intact = np.asarray(intact, dtype=float)
+    occluded = np.atleast_2d(np.asarray(occluded, dtype=float))
+    ages = np.asarray(ages, dtype=float)
+    n = len(ages)
+
+    # R² drop is the mean increase in squared error over the variance of the ages
+    squared_diff = (occluded - ages) ** 2 - (intact - ages) ** 2
+    absolute_diff = np.abs(occluded - ages) - np.abs(intact - ages)
+    rng = np.random.default_rng(seed)
+    signs = rng.choice([-1.0, 1.0], size=(num_permutations, n))
+
+    boot_weights = bootstrap_weights(n, num_resamples, seed + 1)
+    intact_r2, intact_mae = _bootstrap_r2_mae(boot_weights, (intact - ages)[None], ages)
+    occluded_r2, occluded_mae = _bootstrap_r2_mae(boot_weights, occluded - ages, ages)
+    r2_low, r2_high = _intervals(intact_r2 - occluded_r2, confidence)
+    mae_low, mae_high = _intervals(occluded_mae - intact_mae, confidence)
+    return {
+        "r2_drop_p_value": _p_values(squared_diff.sum(1), signs @ squared_diff.T),
+        "r2_drop_ci_low": r2_low,
+        "r2_drop_ci_high": r2_high,
+        "mae_increase_p_value": _p_values(absolute_diff.sum(1), signs @ absolute_diff.T),
+        "mae_increase_ci_low": mae_low,
+        "mae_increase_ci_high": mae_high,
+    }
+
+
+def successive_halving_keep(scores, ci_high=None, keep_fraction=0.5):
+    """
+    Which tracts a rung of successive halving promotes to the next one.
+
+    The top ``keep_fraction`` of the tracts by score go on, and so does any
+    other tract whose upper confidence bound reaches the score of the last
+    one kept: it is not clearly worse, and only clearly uninformative tracts
+    are dropped.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        (num_tracts,) validation R² of each tract in this rung.
+    ci_high : np.ndarray, optional
+        (num_tracts,) upper confidence bounds of the scores (NaN where unknown).
+    keep_fraction : float, optional
+        Fraction of the tracts always kept (at least one).
+
+    Returns
+    -------
+    tuple
+        (num_tracts,) boolean mask of the promoted tracts, and the cutoff:
+        the score of the last tract kept by rank.
+    """
+    scores = np.asarray(scores, dtype=float)
+    num_keep = max(1, int(np.ceil(keep_fraction * len(scores))))
+    # NaN scores (failed tracts) sort last
+    order = np.argsort(np.where(np.isnan(scores), np.inf, -scores), kind="stable")
+    keep = np.zeros(len(scores), dtype=bool)
+    keep[order[:num_keep]] = True
+    cutoff = scores[order[num_keep - 1]]
+    if ci_high is not None:
+        with np.errstate(invalid="ignore"):
+            keep |= np.asarray(ci_high, dtype=float) >= cutoff
+    return keep, cutoff
@@ -0,0 +1,196 @@
+import numpy as np
+from afqinsight import AFQDataset
+
+# Synthetic, AFQDataset-compatible tract profiles for offline runs.
+# AFQDataset.from_study('hbn') needs network access; make_synthetic_afq_dataset
+# builds a dataset with the same layout (metric/tract/node feature tuples,
+# one group per metric and tract, target_cols age/sex/scan_site_id with the
+# 0/1/3/4 site IDs the site map expects) from a simple generative model:
+#
+#   x[subject, metric, tract, node] = base profile
+#                                     + age slope * standardized age
+#                                     + sex offset
+#                                     + site offset (constant + smooth shape)
+#                                     + smooth subject deviation
+#                                     + node noise
+#
+# so age and site signals are known and recoverable. Subjects are generated in
+# chunks, which keeps memory bounded at 10-100x HBN size (use scale=).
+
+# Tracts of the HBN dataset: 16 bilateral bundles and 8 callosal segments
+HBN_TRACTS = (
+    "ARC_L", "ARC_R", "ATR_L", "ATR_R", "CGC_L", "CGC_R", "CST_L", "CST_R",
+    "IFO_L", "IFO_R", "ILF_L", "ILF_R", "SLF_L", "SLF_R", "UNC_L", "UNC_R",
+    "Orbital", "AntFrontal", "SupFrontal", "Motor", "SupParietal", "PostParietal", "Temporal", "Occipital",
+)
+
+# Roughly the number of subjects in AFQDataset.from_study('hbn')
+HBN_N_SUBJECTS = 2000
+
+# Site ID -> fraction of subjects. IDs match the site map {0: 0, 1: 1, 3: 2, 4: 3}
+HBN_SITE_PROBS = {0: 0.25, 1: 0.45, 3: 0.2, 4: 0.1}
+
+# Metric -> (mean, between-subject sd, sign of the age effect)
+METRIC_PARAMS = {
+    "dki_fa": (0.45, 0.05, 1.0),
+    "dki_md": (0.85, 0.08, -1.0),
+    "dki_rd": (0.65, 0.08, -1.0),
+    "dki_ad": (1.25, 0.10, -1.0),
+    "dki_mk": (1.00, 0.10, 1.0),
+    "dki_awf": (0.40, 0.05, 1.0),
+}
+
+TARGET_COLS = ["age", "sex", "scan_site_id"]
+
+
+def _smooth_basis(n_nodes, n_components):
+    # Low-frequency cosines along the tract, one row per component
+    nodes = np.linspace(0.0, 1.0, n_nodes)
+    return np.stack([np.cos(np.pi * k * nodes) for k in range(1, n_components + 1)])
+
+
+def make_synthetic_afq_dataset(
+    n_subjects=HBN_N_SUBJECTS,
+    scale=1.0,
+    tracts=HBN_TRACTS,
+    n_nodes=100,
+    metrics=("dki_fa", "dki_md"),
+    site_probs=None,
+    age_range=(5.0, 21.0),
+    age_beta=(2.0, 3.5),
+    p_male=0.6,
+    age_effect=1.0,
+    site_effect=0.5,
+    subject_noise=0.5,
+    node_noise=0.2,
+    missing_fraction=0.0,
+    n_components=4,
+    dtype=np.float32,
+    chunk_size=1024,
+    seed=0,
+    return_params=False,
+):
+    """
+    Generates a synthetic AFQDataset with the layout of the HBN study.
+
+    Parameters
+    ----------
+    n_subjects : int
+        Number of subjects before ``scale`` is applied.
+    scale : float
+        Multiplies ``n_subjects``; e.g. ``scale=100`` for a 100x HBN stress test.
+    tracts : sequence of str
+        Tract names. Each metric/tract pair becomes one group of ``n_nodes`` features.
+    n_nodes : int
+        Nodes per tract profile.
+    metrics : sequence of str
+        DKI metrics to generate, keys of ``METRIC_PARAMS``.
+    site_probs : dict, optional
+        Site ID -> fraction of subjects. Defaults to ``HBN_SITE_PROBS``.
+    age_range : tuple
+        Minimum and maximum age in years.
+    age_beta : tuple
+        Beta distribution parameters of age within ``age_range``
+        (the default skews young like HBN).
+    p_male : float
+        Fraction of subjects with sex 1.
+    age_effect : float
+        Age slope in units of the metric sd per sd of age.
+    site_effect : float
+        Size of the injected site offsets in units of the metric sd (0 disables them).
+    subject_noise : float
+        Smooth per-subject deviation along each tract, in metric sd.
+    node_noise : float
+        Independent noise per node, in metric sd.
+    missing_fraction : float
+        Fraction of feature values set to NaN (the prep_* functions impute them).
+    n_components : int
+        Number of low-frequency components of the profiles and deviations.
+    dtype : numpy dtype
+        dtype of ``X``; float32 halves memory for large datasets.
+    chunk_size : int
+        Subjects generated at a time.
+    seed : int
+        Random seed; the same arguments and seed give the same dataset.
+    return_params : bool
+        Also return the generating parameters (base profiles, age slopes,
+        site offsets), e.g. to check that site effects are removed.
+
+    Returns
+    -------
+    AFQDataset, or (AFQDataset, dict) if ``return_params`` is True.
+    """
+    unknown = [metric for metric in metrics if metric not in METRIC_PARAMS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {unknown}. Available metrics: {sorted(METRIC_PARAMS)}")
+    site_probs = HBN_SITE_PROBS if site_probs is None else site_probs
+    n_total = int(round(n_subjects * scale))
+    if n_total < 1:
+        raise ValueError("The dataset needs at least one subject")
+
+    rng = np.random.default_rng(seed)
+    group_names = [(metric, tract) for metric in metrics for tract in tracts]
+    feature_names = [(metric, tract, node) for metric, tract in group_names for node in range(n_nodes)]
+    groups = [np.arange(i * n_nodes, (i + 1) * n_nodes) for i in range(len(group_names))]
+    n_groups = len(group_names)
+
+    # Per-group metric statistics, broadcast over nodes
+    means = np.array([METRIC_PARAMS[metric][0] for metric, _ in group_names])[:, None]
+    sds = np.array([METRIC_PARAMS[metric][1] for metric, _ in group_names])[:, None]
+    age_signs = np.array([METRIC_PARAMS[metric][2] for metric, _ in group_names])[:, None]
+
+    # Fixed structure shared by all subjects
+    basis = _smooth_basis(n_nodes, n_components)
+    decay = 1.0 / np.arange(1, n_components + 1)
+    base_profiles = means + sds * (rng.normal(size=(n_groups, n_components)) * decay) @ basis
+    age_slopes = age_effect * sds * age_signs * rng.uniform(0.5, 1.5, size=(n_groups, 1)) * np.ones(n_nodes)
+    sex_offsets = 0.1 * sds * rng.normal(size=(n_groups, 1))
+    site_ids = np.array(sorted(site_probs), dtype=float)
+    site_offsets = site_effect * sds * (
+        rng.normal(size=(len(site_ids), n_groups, 1))
+        + 0.5 * (rng.normal(size=(len(site_ids), n_groups, n_components)) * decay) @ basis
+    )
+
+    # Phenotypes
+    probs = np.array([site_probs[site] for site in sorted(site_probs)], dtype=float)
+    site_index = rng.choice(len(site_ids), size=n_total, p=probs / probs.sum())
+    age = age_range[0] + (age_range[1] - age_range[0]) * rng.beta(*age_beta, size=n_total)
+    sex = (rng.random(n_total) < p_male).astype(float)
+    age_z = (age - age.mean()) / (age.std() or 1.0)
+
+    X = np.empty((n_total, n_groups * n_nodes), dtype=dtype)
+    for start in range(0, n_total, chunk_size):
+        stop = min(start + chunk_size, n_total)
+        n = stop - start
+        deviation = (rng.normal(size=(n, n_groups, n_components)) * decay) @ basis
+        chunk = (
+            base_profiles
+            + age_slopes * age_z[start:stop, None, None]
+            + sex_offsets * sex[start:stop, None, None]
+            + site_offsets[site_index[start:stop]]
+            + sds * (subject_noise * deviation + node_noise * rng.normal(size=(n, n_groups, n_nodes)))
+        )
+        if missing_fraction > 0:
+            chunk[rng.random(chunk.shape) < missing_fraction] = np.nan
+        X[start:stop] = chunk.reshape(n, -1)
+
+    y = np.column_stack([age, sex, site_ids[site_index]])
+    dataset = AFQDataset(
+        X=X,
+        y=y,
+        groups=groups,
+        feature_names=feature_names,
+        group_names=group_names,
+        target_cols=list(TARGET_COLS),
+        subjects=[f"sub-{i:07d}" for i in range(n_total)],
+    )
+    if not return_params:
+        return dataset
+    params = {
+        "base_profiles": base_profiles,
+        "age_slopes": age_slopes,
+        "sex_offsets": sex_offsets,
+        "site_ids": site_ids,
+        "site_offsets": site_offsets,
+    }
+    return dataset, params
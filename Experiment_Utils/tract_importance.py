@@ -0,0 +1,291 @@
+import copy
+
+import torch
+
+try:
+    from .progress import ProgressReporter
+    from .utils import load_stage_checkpoint, save_stage_checkpoint
+except ImportError:
+    from progress import ProgressReporter
+    from utils import load_stage_checkpoint, save_stage_checkpoint
+
+# Tract importance from a single model that sees every tract.
+# Instead of training one model per tract, one age predictor is trained on the
+# whole (num_tracts, length) profile and each tract is scored by how much worse
+# the model gets when that tract's information is taken away. Inputs are
+# (batch, num_tracts, length) with labels [age, sex, remapped_site], as in the
+# tract importance evaluation.
+
+
+def fit_age_predictor(model, train_data, val_data, epochs=100, lr=0.001, device="cpu", max_grad_norm=1.0,
+                      save_dir=None, resume=False, log_level=None):
+    """
+    Train an age predictor on raw tract profiles, keeping the best validation MAE.
+
+    Uses the optimizer, schedule and loss of the age predictor stage of
+    ``train_vae_age_site_staged`` (Adam, L1 loss, ReduceLROnPlateau). With
+    ``save_dir``, the result is saved as the ``age_predictor`` stage checkpoint,
+    and ``resume`` restores it instead of training again.
+
+    Returns
+    -------
+    dict
+        ``best_val_mae`` and the per-epoch ``train_loss_epoch``,
+        ``val_loss_epoch`` and ``val_r2_epoch`` histories.
+    """
+    log = ProgressReporter(level=log_level)
+    model = model.to(device)
+    restored = load_stage_checkpoint(save_dir, "age_predictor") if save_dir and resume else None
+    if restored is not None:
+        log.info("Resuming: restored the all-tract age predictor from its stage checkpoint")
+        model.load_state_dict(restored["state_dict"])
+        return restored["results"]
+
+    criterion = torch.nn.L1Loss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optimizer, "min", patience=10, factor=0.5)
+    history = {"train_loss_epoch": [], "val_loss_epoch": [], "val_r2_epoch": []}
+    best_mae, best_state = float("inf"), None
+
+    for epoch in range(epochs):
+        model.train()
+        train_loss, train_items = 0.0, 0
+        for x, labels in train_data:
+            age_true = labels[:, 0].float().unsqueeze(1).to(device)
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(model(x.to(device)), age_true)
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=max_grad_norm)
+            optimizer.step()
+            train_loss += loss.item() * x.size(0)
+            train_items += x.size(0)
+
+        model.eval()
+        ages, predictions = predict_ages(model, val_data, device)
+        val_mae, val_r2 = age_scores(predictions, ages)
+        history["train_loss_epoch"].append(train_loss / train_items)
+        history["val_loss_epoch"].append(float(val_mae))
+        history["val_r2_epoch"].append(float(val_r2))
+        scheduler.step(val_mae)
+        log.info(f"Epoch {epoch+1}/{epochs} | Train MAE: {train_loss / train_items:.4f} | "
+                 f"Val MAE: {val_mae:.4f} | Val R²: {val_r2:.4f}")
+        if val_mae < best_mae:
+            best_mae, best_state = float(val_mae), copy.deepcopy(model.state_dict())
+
+    if best_state is not None:
+        model.load_state_dict(best_state)
+    history["best_val_mae"] = best_mae
+    if save_dir:
+        save_stage_checkpoint(save_dir, "age_predictor", history, model.state_dict())
+    log.flush()
+    return history
+
+
+def tract_means(loader):
+    """Cohort mean profile of every tract over a loader, shape (num_tracts, length)."""
+    total, count = 0.0, 0
+    for x, _ in loader:
+        total = total + x.double().sum(0)
+        count += x.size(0)
+    return (total / count).float()
+
+
+def age_scores(predictions, ages):
+    """
+    MAE and R² of age predictions, over the last dimension.
+
+    ``predictions`` may have leading dimensions (e.g. one row per occluded
+    tract); the scores then have the same leading dimensions.
+    """
+    mae = (predictions - ages).abs().mean(-1)
+    ss_res = ((predictions - ages) ** 2).sum(-1)
+    ss_tot = ((ages - ages.mean()) ** 2).sum()
+    return mae, 1 - ss_res / ss_tot
+
+
+@torch.inference_mode()
+def predict_ages(predict, loader, device="cpu"):
+    """True ages and ``predict`` outputs over a loader, as two 1-D tensors."""
+    ages, predictions = [], []
+    for x, labels in loader:
+        predictions.append(predict(x.to(device)).reshape(-1).float().cpu())
+        ages.append(labels[:, 0].float())
+    return torch.cat(ages), torch.cat(predictions)
+
+
+@torch.inference_mode()
+def masked_predictions(predict, loader, baseline, masks, device="cpu", chunk_size=None):
+    """
+    Age predictions with sets of tracts replaced by a baseline profile.
+
+    For each batch, one copy per mask is made with the masked tracts replaced
+    by ``baseline``, and the copies go through ``predict`` as one stacked
+    batch (``chunk_size`` masks per forward pass to bound memory).
+
+    Parameters
+    ----------
+    predict : callable
+        Maps a (batch, num_tracts, length) tensor to age predictions; the model
+        should be in eval mode.
+    loader : iterable
+        Batches of ``(x, labels)`` with the age in ``labels[:, 0]``.
+    baseline : torch.Tensor or float
+        Replacement profile of every tract, shape (num_tracts, length) (e.g.
+        ``tract_means`` of the training data), or a constant such as 0.
+    masks : torch.Tensor
+        Boolean (num_masks, num_tracts); row k marks the tracts replaced in
+        copy k. Masks of shape (num_masks, num_tracts, length) replace single
+        nodes instead.
+    chunk_size : int, optional
+        Masks per forward pass. Defaults to all of them.
+
+    Returns
+    -------
+    tuple of torch.Tensor
+        True ages (num_subjects,), predictions from the unchanged inputs
+        (num_subjects,) and from the masked inputs (num_masks, num_subjects).
+    """
+    masks = masks.to(device)
+    if masks.dim() == 2:
+        masks = masks.unsqueeze(-1)
+    chunk = chunk_size or len(masks)
+    ages, intact, masked = [], [], []
+    for x, labels in loader:
+        x = x.to(device)
+        batch, num_tracts, length = x.shape
+        fill = torch.as_tensor(baseline, dtype=x.dtype, device=device).expand(num_tracts, length)
+        batch_masked = []
+        for mask in masks.split(chunk):
+            copies = torch.where(mask.unsqueeze(1), fill, x.unsqueeze(0))
+            out = predict(copies.reshape(-1, num_tracts, length))
+            batch_masked.append(out.reshape(len(mask), batch).float().cpu())
+        masked.append(torch.cat(batch_masked))
+        intact.append(predict(x).reshape(-1).float().cpu())
+        ages.append(labels[:, 0].float())
+    return torch.cat(ages), torch.cat(intact), torch.cat(masked, 1)
+
+
+def occlusion_importance(predict, loader, baseline, device="cpu", chunk_size=None):
+    """
+    Score every tract by replacing it with a baseline profile.
+
+    All occluded copies of a batch go through ``predict`` in one batched
+    forward pass (``chunk_size`` tracts per pass); see ``masked_predictions``
+    for the parameters.
+
+    Returns
+    -------
+    dict
+        ``intact_mae`` and ``intact_r2`` of the unchanged inputs, arrays
+        ``occluded_mae``, ``occluded_r2``, ``mae_increase`` and ``r2_drop``
+        with one entry per tract, and the ``ages``, ``intact_predictions``
+        and (num_tracts, num_subjects) ``occluded_predictions`` they come
+        from (for significance tests).
+    """
+    num_tracts = next(iter(loader))[0].shape[1]
+    masks = torch.eye(num_tracts, dtype=torch.bool)
+    ages, intact, occluded = masked_predictions(predict, loader, baseline, masks, device, chunk_size)
+    intact_mae, intact_r2 = age_scores(intact, ages)
+    occluded_mae, occluded_r2 = age_scores(occluded, ages)
+    return {
+        "intact_mae": float(intact_mae),
+        "intact_r2": float(intact_r2),
+        "occluded_mae": occluded_mae.numpy(),
+        "occluded_r2": occluded_r2.numpy(),
+        "mae_increase": (occluded_mae - intact_mae).numpy(),
+        "r2_drop": (intact_r2 - occluded_r2).numpy(),
+        "ages": ages.numpy(),
+        "intact_predictions": intact.numpy(),
+        "occluded_predictions": occluded.numpy(),
+    }
+
+
+def pairwise_occlusion_importance(predict, loader, baseline, device="cpu", chunk_size=64):
+    """
+    Score every pair of tracts by replacing both with a baseline profile.
+
+    The single tracts and all ``num_tracts * (num_tracts - 1) / 2`` pairs
+    (1,128 for 48 tracts) are masked in stacked batches of ``chunk_size``
+    copies per subject; see ``masked_predictions`` for the parameters.
+
+    The interaction of tracts i and j is the drop from masking both minus the
+    drops from masking each alone. It is positive when the pair carries
+    information that neither tract loses on its own, e.g. left and right
+    versions of a bundle that stand in for each other.
+
+    Returns
+    -------
+    dict
+        ``intact_mae`` and ``intact_r2``, and symmetric (num_tracts,
+        num_tracts) arrays ``pair_r2_drop`` and ``pair_mae_increase`` (single
+        tracts on the diagonal) and ``r2_interaction`` and
+        ``mae_interaction`` (zero diagonal).
+    """
+    num_tracts = next(iter(loader))[0].shape[1]
+    first, second = torch.triu_indices(num_tracts, num_tracts, 1)
+    pair_masks = torch.zeros(len(first), num_tracts, dtype=torch.bool)
+    pair_masks[torch.arange(len(first)), first] = True
+    pair_masks[torch.arange(len(first)), second] = True
+    masks = torch.cat([torch.eye(num_tracts, dtype=torch.bool), pair_masks])
+    ages, intact, masked = masked_predictions(predict, loader, baseline, masks, device, chunk_size)
+    intact_mae, intact_r2 = age_scores(intact, ages)
+    masked_mae, masked_r2 = age_scores(masked, ages)
+
+    results = {"intact_mae": float(intact_mae), "intact_r2": float(intact_r2)}
+    for pair_key, interaction_key, drop in [("pair_r2_drop", "r2_interaction", intact_r2 - masked_r2),
+                                            ("pair_mae_increase", "mae_interaction", masked_mae - intact_mae)]:
+        single = drop[:num_tracts]
+        pair = torch.diag(single)
+        pair[first, second] = pair[second, first] = drop[num_tracts:]
+        interaction = pair - single[:, None] - single[None, :]
+        interaction.fill_diagonal_(0)
+        results[pair_key] = pair.numpy()
+        results[interaction_key] = interaction.numpy()
+    return results
+
+
+def sliding_window_occlusion(predict, loader, baseline, window=10, stride=1, device="cpu", chunk_size=None):
+    """
+    Score segments along every tract by replacing a sliding window of nodes.
+
+    Every window position of every tract is one masked copy of each subject,
+    and all copies of a batch go through ``predict`` as one stacked batch
+    (``chunk_size`` copies per pass); see ``masked_predictions`` for the
+    parameters. Works the same for per-tract models (one tract) and models
+    that see all tracts.
+
+    Returns
+    -------
+    dict
+        ``starts`` (first node of every window position), ``intact_mae`` and
+        ``intact_r2``, ``r2_drop`` and ``mae_increase`` of shape (num_tracts,
+        num_positions), and ``node_r2_drop`` and ``node_mae_increase`` of
+        shape (num_tracts, length): the mean over the windows covering each
+        node (NaN for nodes no window covers).
+    """
+    num_tracts, length = next(iter(loader))[0].shape[1:]
+    if not 0 < window <= length:
+        raise ValueError(f"Window of {window} nodes does not fit tracts of {length} nodes")
+    starts = torch.arange(0, length - window + 1, stride)
+    nodes = torch.arange(length)
+    # coverage[p, n]: window position p covers node n
+    coverage = (nodes >= starts[:, None]) & (nodes < starts[:, None] + window)
+    masks = torch.zeros(num_tracts, len(starts), num_tracts, length, dtype=torch.bool)
+    masks[torch.arange(num_tracts), :, torch.arange(num_tracts)] = coverage
+    ages, intact, masked = masked_predictions(predict, loader, baseline, masks.reshape(-1, num_tracts, length),
+                                              device, chunk_size)
+    intact_mae, intact_r2 = age_scores(intact, ages)
+    masked_mae, masked_r2 = age_scores(masked, ages)
+    r2_drop = (intact_r2 - masked_r2).reshape(num_tracts, len(starts))
+    mae_increase = (masked_mae - intact_mae).reshape(num_tracts, len(starts))
+    coverage = coverage.float()
+    covered = coverage.sum(0)
+    return {
+        "starts": starts.numpy(),
+        "intact_mae": float(intact_mae),
+        "intact_r2": float(intact_r2),
+        "r2_drop": r2_drop.numpy(),
+        "mae_increase": mae_increase.numpy(),
+        "node_r2_drop": (r2_drop @ coverage / covered).numpy(),
+        "node_mae_increase": (mae_increase @ coverage / covered).numpy(),
+    }
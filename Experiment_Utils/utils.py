@@ -10,6 +10,21 @@ from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
 import contextlib  # Local import to avoid adding a global dependency
 import os
 
+try:
+    from .prediction_store import open_prediction_store
+    from .metrics_log import MetricsWriter
+    from .progress import ProgressReporter
+    from .profiling import PhaseTimer, StepProfiler
+    from .validation import ValidationSchedule, make_fast_val_loader
+    from .async_validation import AsyncValidator, ValidationResult, async_validation_config
+except ImportError:
+    from prediction_store import open_prediction_store
+    from metrics_log import MetricsWriter
+    from progress import ProgressReporter
+    from profiling import PhaseTimer, StepProfiler
+    from validation import ValidationSchedule, make_fast_val_loader
+    from async_validation import AsyncValidator, ValidationResult, async_validation_config
+
 # Beta annealing scheduler: starts at 0, then smoothly increases to 1 using sigmoid
 # Used for KL divergence weight in VAE training
 def get_beta(current_epoch, total_epochs, start_epoch=100):
@@ -44,222 +59,135 @@ def train_variational_autoencoder_age_site(
      grl_alpha_epochs=100,
      save_prefix="best_combined_model",
      val_metric_to_monitor="val_age_mae",
-     is_variational=True
+     is_variational=True,
+     metrics_file=None,  # Optional CSV path for the per-epoch metrics log
+     profile=None,  # torch.profiler window (True or dict, see profiling.profile_config)
+     validate_every=1,  # Validate after every N-th epoch (see validation.py)
+     fast_val_subset=None,  # Samples (or fraction) of a fixed stratified subset for quick passes
+     full_val_every=None  # Full validation pass every N epochs when using fast_val_subset (default 5 x validate_every)
  ):
-     torch.backends.cudnn.benchmark = True
+     metrics_log = MetricsWriter(metrics_file)
+     try:
+         profiler = StepProfiler(profile, os.path.dirname(save_prefix), "combined")
+         torch.backends.cudnn.benchmark = True
  
-     opt = torch.optim.Adam(combined_model.parameters(), lr=lr)
-     scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(opt, "min", patience=10, factor=0.5, verbose=True)
-     # Enable AMP/GradScaler only when using CUDA and the caller wants mixed precision
-     use_amp = str(device).startswith("cuda") and torch.cuda.is_available()
-     scaler = torch.amp.GradScaler() if use_amp else None
+         opt = torch.optim.Adam(combined_model.parameters(), lr=lr)
+         scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(opt, "min", patience=10, factor=0.5, verbose=True)
+         # Enable AMP/GradScaler only when using CUDA and the caller wants mixed precision
+         use_amp = str(device).startswith("cuda") and torch.cuda.is_available()
+         scaler = torch.amp.GradScaler() if use_amp else None
  
-     train_loss_epoch = []
-     val_loss_epoch = []
-     train_recon_loss_epoch = []
-     val_recon_loss_epoch = []
-     train_kl_loss_epoch = []
-     val_kl_loss_epoch = []
-     train_age_loss_epoch = []
-     val_age_loss_epoch = []
-     train_site_loss_epoch = []
-     val_site_loss_epoch = []
-     train_age_mae_epoch = []
-     val_age_mae_epoch = []
-     train_site_acc_epoch = []
-     val_site_acc_epoch = []
-     current_beta_epoch = []
-     current_grl_alpha_epoch = []
-     current_lr_epoch = []
+         train_loss_epoch = []
+         val_loss_epoch = []
+         train_recon_loss_epoch = []
+         val_recon_loss_epoch = []
+         train_kl_loss_epoch = []
+         val_kl_loss_epoch = []
+         train_age_loss_epoch = []
+         val_age_loss_epoch = []
+         train_site_loss_epoch = []
+         val_site_loss_epoch = []
+         train_age_mae_epoch = []
+         val_age_mae_epoch = []
+         train_site_acc_epoch = []
+         val_site_acc_epoch = []
+         current_beta_epoch = []
+         current_grl_alpha_epoch = []
+         current_lr_epoch = []
  
-     best_val_metric_value = float("inf") 
-     best_model_state = None
-     best_epoch = 0
-     model_filename = f"{save_prefix}.pth"
+         best_val_metric_value = float("inf") 
+         best_model_state = None
+         best_epoch = 0
+         model_filename = f"{save_prefix}.pth"
  
-     # --- Loss Criteria --- (Defined outside the loop)
-     recon_criterion = torch.nn.MSELoss(reduction="mean")
-     age_criterion = torch.nn.L1Loss(reduction="mean") # MAE
-     site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
+         # --- Loss Criteria --- (Defined outside the loop)
+         recon_criterion = torch.nn.MSELoss(reduction="mean")
+         age_criterion = torch.nn.L1Loss(reduction="mean") # MAE
+         site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
  
-     if not hasattr(combined_model, "forward") or len(combined_model.forward.__code__.co_varnames) < 3:
-         print("Warning: combined_model.forward signature should ideally accept (self, x, grl_alpha).")
+         if not hasattr(combined_model, "forward") or len(combined_model.forward.__code__.co_varnames) < 3:
+             print("Warning: combined_model.forward signature should ideally accept (self, x, grl_alpha).")
  
-     print(f"Starting combined training on {device}... Monitoring ", val_metric_to_monitor)
-     num_train_batches = len(train_data)
-     # num_val_batches = len(val_data)
+         print(f"Starting combined training on {device}... Monitoring ", val_metric_to_monitor)
+         num_train_batches = len(train_data)
+         # num_val_batches = len(val_data)
  
-     for epoch in range(epochs):
-         current_lr_epoch.append(opt.param_groups[0]["lr"])
+         val_schedule = ValidationSchedule(val_data, epochs, validate_every,
+                                           make_fast_val_loader(val_data, fast_val_subset), full_val_every)
+         timer = PhaseTimer(sync_cuda=profiler.enabled)
+         for epoch in range(epochs):
+             current_lr_epoch.append(opt.param_groups[0]["lr"])
  
-         # --- GRL Alpha Calculation ---
-         if grl_alpha_epochs > 0 and epoch < grl_alpha_epochs:
-             progress = epoch / grl_alpha_epochs
-             current_grl_alpha = grl_alpha_start + (grl_alpha_end - grl_alpha_start) * progress
-         elif epoch >= grl_alpha_epochs:
-             current_grl_alpha = grl_alpha_end
-         else:
-             current_grl_alpha = grl_alpha_end
-         current_grl_alpha_epoch.append(current_grl_alpha)
+             # --- GRL Alpha Calculation ---
+             if grl_alpha_epochs > 0 and epoch < grl_alpha_epochs:
+                 progress = epoch / grl_alpha_epochs
+                 current_grl_alpha = grl_alpha_start + (grl_alpha_end - grl_alpha_start) * progress
+             elif epoch >= grl_alpha_epochs:
+                 current_grl_alpha = grl_alpha_end
+             else:
+                 current_grl_alpha = grl_alpha_end
+             current_grl_alpha_epoch.append(current_grl_alpha)
  
-         # --- KL Beta Calculation ---
-         if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
-             annealing_epoch = epoch - kl_annealing_start_epoch
-             if annealing_epoch < kl_annealing_duration:
-                 progress = annealing_epoch / kl_annealing_duration
-                 sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
-                 kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
+             # --- KL Beta Calculation ---
+             if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
+                 annealing_epoch = epoch - kl_annealing_start_epoch
+                 if annealing_epoch < kl_annealing_duration:
+                     progress = annealing_epoch / kl_annealing_duration
+                     sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+                     kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
+                 else:
+                     kl_annealing_factor = 1.0
              else:
-                 kl_annealing_factor = 1.0
-         else:
-             kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
+                 kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
          
-         # Skip KL annealing for non-variational autoencoders
-         if is_variational:
-             current_beta = w_kl * kl_annealing_factor
-         else:
-             current_beta = 0.0  # Always zero for non-variational autoencoders
-         current_beta_epoch.append(current_beta)
- 
-         current_w_recon = w_recon
-         current_w_age = w_age
-         current_w_site = w_site
- 
-         # =================== TRAINING ==================
-         combined_model.train()
-         running_loss = 0.0
-         running_recon_loss = 0.0
-         running_kl_loss = 0.0
-         running_age_loss = 0.0
-         running_site_loss = 0.0
-         running_age_mae_sum = 0.0 
-         running_site_correct = 0.0
-         train_items = 0
- 
-         for i, (x, labels) in enumerate(train_data):
-             batch_size = x.size(0)
-             tract_data = x.to(device, non_blocking=True)
- 
- 
- 
-             age_true = labels[:, 0].float().unsqueeze(1).to(device) #for some reason non_blocking=True causes nan values
-             site_true = labels[:, 1].long().to(device, non_blocking=True) # Get remapped site index as Long
- 
-             if torch.isnan(age_true).any(): print(f"train NaN found in age_true! Batch indices: {torch.where(torch.isnan(age_true))[0].tolist()}")
- 
-             opt.zero_grad(set_to_none=True)
- 
-             with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                 model_out = combined_model(tract_data, grl_alpha=current_grl_alpha)
-                 x_hat, mean, logvar, age_pred, site_pred = model_out
- 
-                 recon_loss = recon_criterion(x_hat, tract_data)
-                 kl_loss_unreduced = kl_divergence_loss(mean, logvar)
-                 kl_loss = kl_loss_unreduced / batch_size 
-                 age_loss = age_criterion(age_pred, age_true)
-                 site_loss = site_criterion(site_pred, site_true)
- 
-                 if torch.isnan(recon_loss): print(f"NaN found in recon_loss!")
-                 if torch.isnan(kl_loss): print(f"NaN found in kl_loss! mean={mean.mean().item():.2f}, logvar={logvar.mean().item():.2f}")
- 
-                 if torch.isnan(age_loss): print(f"NaN found in age_loss! age_pred mean: {age_pred.mean().item():.2f}, age_true mean: {age_true.nanmean().item():.2f}, any age_true NaN: {torch.isnan(age_true).any()}")
-                 if torch.isnan(site_loss): print(f"NaN found in site_loss!")
-                 # -------------------------------------------
- 
-                 total_loss = (current_w_recon * recon_loss +
-                               current_beta * kl_loss +
-                               current_w_age * age_loss +
-                               current_w_site * site_loss)
- 
-                 # --- DEBUG: Check total loss ---
-                 if torch.isnan(total_loss): print("train NaN found in total_loss BEFORE backward!")
-                 # ---------------------------------
- 
-             if use_amp:
-                 scaler.scale(total_loss).backward()
-                 scaler.unscale_(opt)
+             # Skip KL annealing for non-variational autoencoders
+             if is_variational:
+                 current_beta = w_kl * kl_annealing_factor
              else:
-                 total_loss.backward()
+                 current_beta = 0.0  # Always zero for non-variational autoencoders
+             current_beta_epoch.append(current_beta)
  
-             torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
-             if use_amp:
-                 scaler.step(opt)
-                 scaler.update()
-             else:
-                 opt.step()
+             current_w_recon = w_recon
+             current_w_age = w_age
+             current_w_site = w_site
  
-             train_items += batch_size
-             running_loss += total_loss.item() * batch_size
-             running_recon_loss += recon_loss.item() * batch_size
-             running_kl_loss += kl_loss.item() * batch_size
-             running_age_loss += age_loss.item() * batch_size
-             running_site_loss += site_loss.item() * batch_size
-             running_age_mae_sum += age_loss.item() * batch_size # L1 loss is MAE
-             _, predicted_sites = torch.max(site_pred.data, 1)
-             # Use correct target variable
-             running_site_correct += (predicted_sites == site_true).sum().item()
+             # =================== TRAINING ==================
+             combined_model.train()
+             running_loss = 0.0
+             running_recon_loss = 0.0
+             running_kl_loss = 0.0
+             running_age_loss = 0.0
+             running_site_loss = 0.0
+             running_age_mae_sum = 0.0 
+             running_site_correct = 0.0
+             train_items = 0
  
-             if (i + 1) % 10 == 0 or (i + 1) == num_train_batches:
-                 print(f"\rEpoch {epoch+1}/{epochs} | Batch {i+1}/{num_train_batches} | Train Loss: {total_loss.item():.4f}", end="")
+             for i, (x, labels) in enumerate(timer.iterate(train_data)):
+                 batch_size = x.size(0)
+                 tract_data = x.to(device, non_blocking=True)
  
-         # Calculate average training metrics for the epoch
-         avg_train_loss = running_loss / train_items
-         avg_train_recon_loss = running_recon_loss / train_items
-         avg_train_kl_loss = running_kl_loss / train_items
-         avg_train_age_loss = running_age_loss / train_items
-         avg_train_site_loss = running_site_loss / train_items
-         avg_train_age_mae = running_age_mae_sum / train_items
-         avg_train_site_acc = (running_site_correct / train_items) * 100
  
-         # Append training metrics to lists
-         train_loss_epoch.append(avg_train_loss)
-         train_recon_loss_epoch.append(avg_train_recon_loss)
-         train_kl_loss_epoch.append(avg_train_kl_loss)
-         train_age_loss_epoch.append(avg_train_age_loss)
-         train_site_loss_epoch.append(avg_train_site_loss)
-         train_age_mae_epoch.append(avg_train_age_mae)
-         train_site_acc_epoch.append(avg_train_site_acc)
  
-         # =================== VALIDATION ==================
-         combined_model.eval()
-         running_val_loss = 0.0
-         running_val_recon_loss = 0.0
-         running_val_kl_loss = 0.0
-         running_val_age_loss = 0.0
-         running_val_site_loss = 0.0
-         running_val_age_mae_sum = 0.0
-         running_val_site_correct = 0.0
-         val_items = 0
+                 age_true = labels[:, 0].float().unsqueeze(1).to(device) #for some reason non_blocking=True causes nan values
+                 site_true = labels[:, 1].long().to(device, non_blocking=True) # Get remapped site index as Long
  
-         with torch.no_grad():
-             for x, labels in val_data:
-                 batch_size = x.size(0)
-                 tract_data = x.to(device, non_blocking=True)
-                 # Revert to correct batch-wise slicing
-                 age_true = labels[:, 0].float().unsqueeze(1).to(device)
-                 site_true = labels[:, 1].long().to(device, non_blocking=True)
+                 if torch.isnan(age_true).any(): print(f"train NaN found in age_true! Batch indices: {torch.where(torch.isnan(age_true))[0].tolist()}")
  
-                 # --- DEBUG: Check for NaNs in true labels ---
-                 if torch.isnan(age_true).any(): print(f"NaN found in val age_true! Batch indices: {torch.where(torch.isnan(age_true))[0].tolist()}")
-                 # ---------------------------------------------
+                 opt.zero_grad(set_to_none=True)
  
                  with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                     # Removed print
                      model_out = combined_model(tract_data, grl_alpha=current_grl_alpha)
                      x_hat, mean, logvar, age_pred, site_pred = model_out
-                     # Removed print
-                     # --- DEBUG: Check for NaNs in model outputs ---
  
                      recon_loss = recon_criterion(x_hat, tract_data)
-                     kl_loss = kl_divergence_loss(mean, logvar) / batch_size
- 
+                     kl_loss_unreduced = kl_divergence_loss(mean, logvar)
+                     kl_loss = kl_loss_unreduced / batch_size 
                      age_loss = age_criterion(age_pred, age_true)
                      site_loss = site_criterion(site_pred, site_true)
  
-                     # --- DEBUG: Check individual loss values ---
                      if torch.isnan(recon_loss): print(f"NaN found in recon_loss!")
                      if torch.isnan(kl_loss): print(f"NaN found in kl_loss! mean={mean.mean().item():.2f}, logvar={logvar.mean().item():.2f}")
-                     # Use correct target variable in debug message
+ 
                      if torch.isnan(age_loss): print(f"NaN found in age_loss! age_pred mean: {age_pred.mean().item():.2f}, age_true mean: {age_true.nanmean().item():.2f}, any age_true NaN: {torch.isnan(age_true).any()}")
                      if torch.isnan(site_loss): print(f"NaN found in site_loss!")
                      # -------------------------------------------
@@ -270,106 +198,249 @@ def train_variational_autoencoder_age_site(
                                    current_w_site * site_loss)
  
                      # --- DEBUG: Check total loss ---
-                     if torch.isnan(total_loss): print("NaN found in total_loss BEFORE backward!")
+                     if torch.isnan(total_loss): print("train NaN found in total_loss BEFORE backward!")
                      # ---------------------------------
+                 timer.lap("forward")
  
-                 val_items += batch_size
-                 running_val_loss += total_loss.item() * batch_size
-                 running_val_recon_loss += recon_loss.item() * batch_size
-                 running_val_kl_loss += kl_loss.item() * batch_size
-                 running_val_age_loss += age_loss.item() * batch_size
-                 running_val_site_loss += site_loss.item() * batch_size
-                 running_val_age_mae_sum += age_loss.item() * batch_size
+                 if use_amp:
+                     scaler.scale(total_loss).backward()
+                     scaler.unscale_(opt)
+                 else:
+                     total_loss.backward()
+                 timer.lap("backward")
+ 
+                 torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
+                 timer.lap("clip")
+                 if use_amp:
+                     scaler.step(opt)
+                     scaler.update()
+                 else:
+                     opt.step()
+                 timer.lap("optimizer")
+                 profiler.step()
+ 
+                 train_items += batch_size
+                 running_loss += total_loss.item() * batch_size
+                 running_recon_loss += recon_loss.item() * batch_size
+                 running_kl_loss += kl_loss.item() * batch_size
+                 running_age_loss += age_loss.item() * batch_size
+                 running_site_loss += site_loss.item() * batch_size
+                 running_age_mae_sum += age_loss.item() * batch_size # L1 loss is MAE
                  _, predicted_sites = torch.max(site_pred.data, 1)
                  # Use correct target variable
-                 running_val_site_correct += (predicted_sites == site_true).sum().item()
+                 running_site_correct += (predicted_sites == site_true).sum().item()
  
-         # Calculate average validation metrics
-         avg_val_loss = running_val_loss / val_items
-         avg_val_recon_loss = running_val_recon_loss / val_items
-         avg_val_kl_loss = running_val_kl_loss / val_items
-         avg_val_age_loss = running_val_age_loss / val_items
-         avg_val_site_loss = running_val_site_loss / val_items
-         avg_val_age_mae = running_val_age_mae_sum / val_items
-         avg_val_site_acc = (running_val_site_correct / val_items) * 100
+                 if (i + 1) % 10 == 0 or (i + 1) == num_train_batches:
+                     print(f"\rEpoch {epoch+1}/{epochs} | Batch {i+1}/{num_train_batches} | Train Loss: {total_loss.item():.4f}", end="")
  
-         # Append validation metrics to lists
-         val_loss_epoch.append(avg_val_loss)
-         val_recon_loss_epoch.append(avg_val_recon_loss)
-         val_kl_loss_epoch.append(avg_val_kl_loss)
-         val_age_loss_epoch.append(avg_val_age_loss)
-         val_site_loss_epoch.append(avg_val_site_loss)
-         val_age_mae_epoch.append(avg_val_age_mae)
-         val_site_acc_epoch.append(avg_val_site_acc)
+             # Calculate average training metrics for the epoch
+             avg_train_loss = running_loss / train_items
+             avg_train_recon_loss = running_recon_loss / train_items
+             avg_train_kl_loss = running_kl_loss / train_items
+             avg_train_age_loss = running_age_loss / train_items
+             avg_train_site_loss = running_site_loss / train_items
+             avg_train_age_mae = running_age_mae_sum / train_items
+             avg_train_site_acc = (running_site_correct / train_items) * 100
  
-         # --- Scheduler Step --- (Step based on the chosen metric)
-         # Create a temporary dict to easily access the metric value by key
-         current_epoch_val_metrics = {
-             "val_loss": avg_val_loss,
-             "val_recon_loss": avg_val_recon_loss,
-             "val_kl_loss": avg_val_kl_loss,
-             "val_age_loss": avg_val_age_loss,
-             "val_site_loss": avg_val_site_loss,
-             "val_age_mae": avg_val_age_mae,
-             "val_site_acc": avg_val_site_acc # Accuracy isn't usually used for ReduceLROnPlateau min mode
-         }
-         metric_to_schedule = current_epoch_val_metrics.get(val_metric_to_monitor)
-         if metric_to_schedule is None:
-             print(f"Warning: Metric '{val_metric_to_monitor}' not found for scheduler. Defaulting to 'val_loss'.")
-             metric_to_schedule = avg_val_loss
-         scheduler.step(metric_to_schedule)
+             # Append training metrics to lists
+             train_loss_epoch.append(avg_train_loss)
+             train_recon_loss_epoch.append(avg_train_recon_loss)
+             train_kl_loss_epoch.append(avg_train_kl_loss)
+             train_age_loss_epoch.append(avg_train_age_loss)
+             train_site_loss_epoch.append(avg_train_site_loss)
+             train_age_mae_epoch.append(avg_train_age_mae)
+             train_site_acc_epoch.append(avg_train_site_acc)
+ 
+             # =================== VALIDATION ==================
+             val_pass = val_schedule.pass_for(epoch)
+             timer.mark()
+             if val_pass is not None:
+                 combined_model.eval()
+                 running_val_loss = 0.0
+                 running_val_recon_loss = 0.0
+                 running_val_kl_loss = 0.0
+                 running_val_age_loss = 0.0
+                 running_val_site_loss = 0.0
+                 running_val_age_mae_sum = 0.0
+                 running_val_site_correct = 0.0
+                 val_items = 0
  
-         # --- Checkpoint Best Model (similar to train_vae) ---
-         current_val_metric = metric_to_schedule # Use the same metric value as scheduler
-         if current_val_metric < best_val_metric_value:
-             best_val_metric_value = current_val_metric
-             best_epoch = epoch + 1
-             best_model_state = combined_model.state_dict().copy() # Store state dict
-             print(f"\nEpoch {epoch+1}: New best model found! {val_metric_to_monitor}: {best_val_metric_value:.4f}. State stored.")
+                 with torch.inference_mode():
+                     for x, labels in val_schedule.loader(val_pass):
+                         batch_size = x.size(0)
+                         tract_data = x.to(device, non_blocking=True)
+                         # Revert to correct batch-wise slicing
+                         age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                         site_true = labels[:, 1].long().to(device, non_blocking=True)
  
-         # --- Print Epoch Summary --- (Using average metrics)
-         print(f"\nEpoch {epoch+1} Summary:")
-         print(f"  LR: {current_lr_epoch[-1]:.1e} | Beta: {current_beta:.4f} | GRL Alpha: {current_grl_alpha:.4f}")
-         print(f"  Loss (Train/Val): {avg_train_loss:.4f} / {avg_val_loss:.4f}")
-         print(f"  Recon Loss (Train/Val): {avg_train_recon_loss:.4f} / {avg_val_recon_loss:.4f}")
-         print(f"  KL Loss (Train/Val): {avg_train_kl_loss:.6f} / {avg_val_kl_loss:.6f}")
-         print(f"  Age MAE (Train/Val): {avg_train_age_mae:.4f} / {avg_val_age_mae:.4f}")
-         print(f"  Site Acc (Train/Val): {avg_train_site_acc:.2f}% / {avg_val_site_acc:.2f}%")
-         print("-" * 60)
+                         # --- DEBUG: Check for NaNs in true labels ---
+                         if torch.isnan(age_true).any(): print(f"NaN found in val age_true! Batch indices: {torch.where(torch.isnan(age_true))[0].tolist()}")
+                         # ---------------------------------------------
  
-     # --- Save Best Model State After Loop --- (similar to train_vae)
-     if best_model_state is not None:
-         print(f"\nTraining complete. Saving best model from epoch {best_epoch} ({val_metric_to_monitor}: {best_val_metric_value:.4f}) to {model_filename}")
-         torch.save(best_model_state, model_filename)
-     else:
-         print("\nTraining complete. No best model state was saved (no improvement found or error occurred).")
-         model_filename = None # Indicate no model was saved
+                         with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                             # Removed print
+                             model_out = combined_model(tract_data, grl_alpha=current_grl_alpha)
+                             x_hat, mean, logvar, age_pred, site_pred = model_out
+                             # Removed print
+                             # --- DEBUG: Check for NaNs in model outputs ---
  
-     # --- Return Results Dictionary (similar to train_vae) ---
-     results = {
-         "train_loss_epoch": train_loss_epoch,
-         "val_loss_epoch": val_loss_epoch,
-         "train_recon_loss_epoch": train_recon_loss_epoch,
-         "val_recon_loss_epoch": val_recon_loss_epoch,
-         "train_kl_loss_epoch": train_kl_loss_epoch,
-         "val_kl_loss_epoch": val_kl_loss_epoch,
-         "train_age_loss_epoch": train_age_loss_epoch,
-         "val_age_loss_epoch": val_age_loss_epoch,
-         "train_site_loss_epoch": train_site_loss_epoch,
-         "val_site_loss_epoch": val_site_loss_epoch,
-         "train_age_mae_epoch": train_age_mae_epoch,
-         "val_age_mae_epoch": val_age_mae_epoch,
-         "train_site_acc_epoch": train_site_acc_epoch,
-         "val_site_acc_epoch": val_site_acc_epoch,
-         "current_beta_epoch": current_beta_epoch,
-         "current_grl_alpha_epoch": current_grl_alpha_epoch,
-         "current_lr_epoch": current_lr_epoch,
-         f"best_{val_metric_to_monitor}": best_val_metric_value,
-         "best_epoch": best_epoch,
-         "model_path": model_filename
-     }
+                             recon_loss = recon_criterion(x_hat, tract_data)
+                             kl_loss = kl_divergence_loss(mean, logvar) / batch_size
  
-     return results
+                             age_loss = age_criterion(age_pred, age_true)
+                             site_loss = site_criterion(site_pred, site_true)
+ 
+                             # --- DEBUG: Check individual loss values ---
+                             if torch.isnan(recon_loss): print(f"NaN found in recon_loss!")
+                             if torch.isnan(kl_loss): print(f"NaN found in kl_loss! mean={mean.mean().item():.2f}, logvar={logvar.mean().item():.2f}")
+                             # Use correct target variable in debug message
+                             if torch.isnan(age_loss): print(f"NaN found in age_loss! age_pred mean: {age_pred.mean().item():.2f}, age_true mean: {age_true.nanmean().item():.2f}, any age_true NaN: {torch.isnan(age_true).any()}")
+                             if torch.isnan(site_loss): print(f"NaN found in site_loss!")
+                             # -------------------------------------------
+ 
+                             total_loss = (current_w_recon * recon_loss +
+                                           current_beta * kl_loss +
+                                           current_w_age * age_loss +
+                                           current_w_site * site_loss)
+ 
+                             # --- DEBUG: Check total loss ---
+                             if torch.isnan(total_loss): print("NaN found in total_loss BEFORE backward!")
+                             # ---------------------------------
+ 
+                         val_items += batch_size
+                         running_val_loss += total_loss.item() * batch_size
+                         running_val_recon_loss += recon_loss.item() * batch_size
+                         running_val_kl_loss += kl_loss.item() * batch_size
+                         running_val_age_loss += age_loss.item() * batch_size
+                         running_val_site_loss += site_loss.item() * batch_size
+                         running_val_age_mae_sum += age_loss.item() * batch_size
+                         _, predicted_sites = torch.max(site_pred.data, 1)
+                         # Use correct target variable
+                         running_val_site_correct += (predicted_sites == site_true).sum().item()
+ 
+                 # Calculate average validation metrics
+                 avg_val_loss = running_val_loss / val_items
+                 avg_val_recon_loss = running_val_recon_loss / val_items
+                 avg_val_kl_loss = running_val_kl_loss / val_items
+                 avg_val_age_loss = running_val_age_loss / val_items
+                 avg_val_site_loss = running_val_site_loss / val_items
+                 avg_val_age_mae = running_val_age_mae_sum / val_items
+                 avg_val_site_acc = (running_val_site_correct / val_items) * 100
+             else:
+                 avg_val_loss = avg_val_recon_loss = avg_val_kl_loss = avg_val_age_loss = float("nan")
+                 avg_val_site_loss = avg_val_age_mae = avg_val_site_acc = float("nan")
+         
+             # Append validation metrics to lists
+             val_loss_epoch.append(avg_val_loss)
+             val_recon_loss_epoch.append(avg_val_recon_loss)
+             val_kl_loss_epoch.append(avg_val_kl_loss)
+             val_age_loss_epoch.append(avg_val_age_loss)
+             val_site_loss_epoch.append(avg_val_site_loss)
+             val_age_mae_epoch.append(avg_val_age_mae)
+             val_site_acc_epoch.append(avg_val_site_acc)
+             timer.lap("validation")
+ 
+             # --- Scheduler Step --- (Step based on the chosen metric)
+             # Create a temporary dict to easily access the metric value by key
+             current_epoch_val_metrics = {
+                 "val_loss": avg_val_loss,
+                 "val_recon_loss": avg_val_recon_loss,
+                 "val_kl_loss": avg_val_kl_loss,
+                 "val_age_loss": avg_val_age_loss,
+                 "val_site_loss": avg_val_site_loss,
+                 "val_age_mae": avg_val_age_mae,
+                 "val_site_acc": avg_val_site_acc # Accuracy isn't usually used for ReduceLROnPlateau min mode
+             }
+             metric_to_schedule = current_epoch_val_metrics.get(val_metric_to_monitor)
+             if metric_to_schedule is None:
+                 print(f"Warning: Metric '{val_metric_to_monitor}' not found for scheduler. Defaulting to 'val_loss'.")
+                 metric_to_schedule = avg_val_loss
+             if val_pass is not None:
+                 scheduler.step(metric_to_schedule)
+ 
+             # --- Checkpoint Best Model (similar to train_vae) ---
+             current_val_metric = metric_to_schedule # Use the same metric value as scheduler
+             if val_schedule.selects_best(val_pass) and current_val_metric < best_val_metric_value:
+                 best_val_metric_value = current_val_metric
+                 best_epoch = epoch + 1
+                 timer.mark()
+                 best_model_state = combined_model.state_dict().copy() # Store state dict
+                 timer.lap("checkpoint")
+                 print(f"\nEpoch {epoch+1}: New best model found! {val_metric_to_monitor}: {best_val_metric_value:.4f}. State stored.")
+ 
+             # --- Print Epoch Summary --- (Using average metrics)
+             print(f"\nEpoch {epoch+1} Summary:")
+             print(f"  LR: {current_lr_epoch[-1]:.1e} | Beta: {current_beta:.4f} | GRL Alpha: {current_grl_alpha:.4f}")
+             print(f"  Loss (Train/Val): {avg_train_loss:.4f} / {avg_val_loss:.4f}")
+             print(f"  Recon Loss (Train/Val): {avg_train_recon_loss:.4f} / {avg_val_recon_loss:.4f}")
+             print(f"  KL Loss (Train/Val): {avg_train_kl_loss:.6f} / {avg_val_kl_loss:.6f}")
+             print(f"  Age MAE (Train/Val): {avg_train_age_mae:.4f} / {avg_val_age_mae:.4f}")
+             print(f"  Site Acc (Train/Val): {avg_train_site_acc:.2f}% / {avg_val_site_acc:.2f}%")
+             print("-" * 60)
+             timer.end_epoch()
+             metrics_log.log_last("combined", epoch + 1, {
+                 "train_loss": train_loss_epoch,
+                 "val_loss": val_loss_epoch,
+                 "train_recon_loss": train_recon_loss_epoch,
+                 "val_recon_loss": val_recon_loss_epoch,
+                 "train_kl_loss": train_kl_loss_epoch,
+                 "val_kl_loss": val_kl_loss_epoch,
+                 "train_age_loss": train_age_loss_epoch,
+                 "val_age_loss": val_age_loss_epoch,
+                 "train_site_loss": train_site_loss_epoch,
+                 "val_site_loss": val_site_loss_epoch,
+                 "train_age_mae": train_age_mae_epoch,
+                 "val_age_mae": val_age_mae_epoch,
+                 "train_site_acc": train_site_acc_epoch,
+                 "val_site_acc": val_site_acc_epoch,
+                 "current_beta": current_beta_epoch,
+                 "current_grl_alpha": current_grl_alpha_epoch,
+                 "current_lr": current_lr_epoch,
+                 "val_pass": val_schedule.history,
+                 **timer.histories(suffix="")
+             })
+ 
+         profiler.stop()
+ 
+         # --- Save Best Model State After Loop --- (similar to train_vae)
+         if best_model_state is not None:
+             print(f"\nTraining complete. Saving best model from epoch {best_epoch} ({val_metric_to_monitor}: {best_val_metric_value:.4f}) to {model_filename}")
+             torch.save(best_model_state, model_filename)
+         else:
+             print("\nTraining complete. No best model state was saved (no improvement found or error occurred).")
+             model_filename = None # Indicate no model was saved
+ 
+         # --- Return Results Dictionary (similar to train_vae) ---
+         results = {
+             "train_loss_epoch": train_loss_epoch,
+             "val_loss_epoch": val_loss_epoch,
+             "train_recon_loss_epoch": train_recon_loss_epoch,
+             "val_recon_loss_epoch": val_recon_loss_epoch,
+             "train_kl_loss_epoch": train_kl_loss_epoch,
+             "val_kl_loss_epoch": val_kl_loss_epoch,
+             "train_age_loss_epoch": train_age_loss_epoch,
+             "val_age_loss_epoch": val_age_loss_epoch,
+             "train_site_loss_epoch": train_site_loss_epoch,
+             "val_site_loss_epoch": val_site_loss_epoch,
+             "train_age_mae_epoch": train_age_mae_epoch,
+             "val_age_mae_epoch": val_age_mae_epoch,
+             "train_site_acc_epoch": train_site_acc_epoch,
+             "val_site_acc_epoch": val_site_acc_epoch,
+             "current_beta_epoch": current_beta_epoch,
+             "current_grl_alpha_epoch": current_grl_alpha_epoch,
+             "current_lr_epoch": current_lr_epoch,
+             "val_pass_epoch": val_schedule.history,
+             **timer.histories(),
+             "phase_times_epoch": timer.history,
+             "trace_files": profiler.trace_files,
+             f"best_{val_metric_to_monitor}": best_val_metric_value,
+             "best_epoch": best_epoch,
+             "model_path": model_filename
+         }
+ 
+         return results
+     finally:
+         metrics_log.close()
  
 # Prepares FA data with site remapping for adversarial training
 # Filters out problematic sites (original sites are 0,1,3,4) and remaps site IDs to consecutive integers
@@ -515,347 +586,587 @@ def prep_fa_flattened_remapped_data(dataset, batch_size=64, site_col_name='scan_
          all_tracts_val_loader,
      )
 
+# Channel-stacked alternative to prep_fa_flattened_remapped_data: one sample per subject and tract,
+# with the tract's FA and MD profiles as two channels instead of two separate samples
+def stack_fa_md_channels(x):
+    """
+    Reshape [subjects, 2 * tracts, nodes] FA+MD profiles (every FA bundle,
+    then every MD bundle in the same order) into [subjects * tracts, 2, nodes]
+    samples, subject-major: sample ``s * tracts + t`` is tract t of subject s.
+    """
+    num_subjects, num_channels, num_nodes = x.shape
+    if num_channels % 2:
+        raise ValueError(f"Expected FA and MD channels for every tract, got {num_channels} channels")
+    return x.reshape(num_subjects, 2, num_channels // 2, num_nodes).transpose(1, 2).reshape(-1, 2, num_nodes)
+
+def prep_fa_md_stacked_remapped_data(dataset, batch_size=64, site_col_name='scan_site_id', age_col_name='age',
+                                     omit_site_idx=None):
+    """
+    Prepares loaders of channel-stacked FA+MD tract profiles with remapped labels.
+
+    Every subject gives one sample per tract, of shape [2, num_nodes] (FA,
+    then MD), so a model with ``input_channels=2`` sees both metrics of a
+    tract at once, in half the samples of the flattened FA/MD data. Labels
+    are ``[age, sex, remapped_site]`` as in prep_fa_flattened_remapped_data.
+    The samples are built once as tensors; no per-item indexing at train time.
+
+    Parameters
+    ----------
+    dataset : AFQDataset
+        Dataset with dki_fa and dki_md features, in the AFQDataset layout:
+        every FA bundle, then every MD bundle in the same order.
+    batch_size : int
+        The batch size to be used.
+    omit_site_idx : float, optional
+        Original site ID whose subjects are left out; the remaining sites are
+        renumbered consecutively.
+
+    Returns
+    -------
+    tuple:
+        The FA+MD dataset,
+        Training data loader,
+        Test data loader,
+        Validation data loader.
+    """
+    torch_dataset, train_loader, test_loader, val_loader = prep_fa_dataset(
+        dataset, target_labels=["dki_fa", "dki_md"], batch_size=batch_size
+    )
+    try:
+        age_idx = dataset.target_cols.index(age_col_name)
+        site_idx = dataset.target_cols.index(site_col_name)
+        sex_idx = dataset.target_cols.index('sex')
+    except (AttributeError, ValueError) as e:
+        raise ValueError("Could not find required columns for remapping.") from e
+
+    site_map = {0.0: 0.0, 1.0: 1.0, 3.0: 2.0, 4.0: 3.0}
+    if omit_site_idx is not None:
+        all_sites = torch.unique(torch.as_tensor(dataset.y[:, site_idx], dtype=torch.float32))
+        remaining_sites = [site for site in all_sites.tolist() if site != omit_site_idx]
+        site_map = {site: float(idx) for idx, site in enumerate(remaining_sites)}
+    print(f"Using site map: {site_map}")
+
+    def stacked(loader, shuffle):
+        x, y = (torch.cat(tensors) for tensors in zip(*loader))
+        sites = y[:, site_idx].float()
+        if omit_site_idx is not None:
+            keep = sites != omit_site_idx
+            x, y, sites = x[keep], y[keep], sites[keep]
+        remapped_sites = torch.full_like(sites, -1.0)
+        for original_site, new_site in site_map.items():
+            remapped_sites[sites == original_site] = new_site
+        if (remapped_sites == -1.0).any():
+            print(f"Warning: Site values {sites[remapped_sites == -1.0].unique().tolist()} not in map!")
+        labels = torch.stack([y[:, age_idx].float(), y[:, sex_idx].float(), remapped_sites], dim=1)
+
+        labels = labels.repeat_interleave(x.shape[1] // 2, dim=0)
+        return DataLoader(torch.utils.data.TensorDataset(stack_fa_md_channels(x.float()), labels),
+                          batch_size=batch_size, shuffle=shuffle)
+
+    loaders = stacked(train_loader, True), stacked(test_loader, False), stacked(val_loader, False)
+    print("prep_fa_md_stacked_remapped_data complete.")
+    return (torch_dataset, *loaders)
+
+# Validation pass of train_variational_autoencoder; also runs in the async validation worker
+def _evaluate_vae(model, loader, device, beta=1.0, use_amp=False):
+    model.eval()
+    val_rmse = 0
+    val_kl = 0
+    val_items = 0
+    val_recon_loss = 0
+    val_loss_total = 0  # Track total validation loss
+
+    with torch.inference_mode():
+        for x, *_ in loader:
+            batch_size = x.size(0)
+            tract_data = x.to(device, non_blocking=True)
+
+            with (torch.amp.autocast(device_type = "cuda") if use_amp else contextlib.nullcontext()):
+                x_hat, mean, logvar = model(tract_data)
+
+                # Use current_beta for validation loss calculation too
+                val_loss, val_recon_loss_batch, val_kl_loss_batch = vae_loss(tract_data, x_hat, mean, logvar, beta, reduction="sum")
+                batch_val_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
+
+            val_items += batch_size
+            val_loss_total += val_loss.item()
+            val_rmse += batch_val_rmse.item() * batch_size
+            # Only add KL loss if it has non-zero weight
+            if beta > 0:
+                val_kl += val_kl_loss_batch.item()
+            val_recon_loss += val_recon_loss_batch.item()
+
+    return {
+        "recon_loss": val_recon_loss / val_items,
+        "rmse": val_rmse / val_items,
+        # Calculate average KL loss carefully
+        "kl": (val_kl / val_items) if beta > 0 else 0.0,
+        "loss": val_loss_total / val_items,
+    }
+
 # Standard VAE training: Trains a single variational autoencoder for reconstruction
 # Includes KL annealing, mixed precision, and periodic model saving
 def train_variational_autoencoder(model, train_data, val_data, epochs=500, lr=0.001, device='cuda',
                                    beta=1.0, max_grad_norm=1.0,
                                    kl_annealing_start_epoch=200, kl_annealing_duration=200, kl_annealing_start=0.0001,
-                                   periodic_save_interval=50, mixed_precision=True, save_dir="vae_models"):
+                                   periodic_save_interval=50, mixed_precision=True, save_dir="vae_models",
+                                   metrics_file="metrics.csv", profile=None,
+                                   validate_every=1, fast_val_subset=None, full_val_every=None,
+                                   async_validation=None):
     """
     Training loop for variational autoencoder with delayed sigmoid KL annealing.
     KL term has zero weight until kl_annealing_start_epoch, then anneals over kl_annealing_duration.
+    Per-epoch metrics are appended to save_dir/metrics_file (None disables the log).
+    Per-phase wall-clock times are returned as phase_times_per_epoch and throughput counters
+    (samples_per_sec_per_epoch, step_time_p95_per_epoch, data_wait_time_per_epoch, ...) next to the
+    loss histories; profile=True (or a dict of options, see profiling.profile_config) also writes
+    torch.profiler traces to save_dir/profiler.
+    validate_every, fast_val_subset and full_val_every set the validation cadence (see validation.py);
+    epochs without validation record NaN validation metrics. Only full passes select the best model,
+    so with fast_val_subset full_val_every defaults to 5 x validate_every.
+    async_validation=True (or a dict of options, see async_validation.py) validates weight snapshots
+    in a side process while training continues; results are applied up to max_lag epochs later.
     """
     import os
     
     # Create save directory
     os.makedirs(save_dir, exist_ok=True)
     
-    torch.backends.cudnn.benchmark = True
+    metrics_log = MetricsWriter(os.path.join(save_dir, metrics_file) if metrics_file else None)
+    try:
+        profiler = StepProfiler(profile, save_dir, "vae")
+        torch.backends.cudnn.benchmark = True
 
-    latent_dim = model.latent_dims if hasattr(model, 'latent_dims') else "unknown"
-    dropout = model.encoder.dropout.p if hasattr(model, 'encoder') and hasattr(model.encoder, 'dropout') else "unknown"
+        latent_dim = model.latent_dims if hasattr(model, 'latent_dims') else "unknown"
+        dropout = model.encoder.dropout.p if hasattr(model, 'encoder') and hasattr(model.encoder, 'dropout') else "unknown"
     
-    model_filename = os.path.join(save_dir, f"best_vae_model_ld{latent_dim}_dr{dropout}.pth")
+        model_filename = os.path.join(save_dir, f"best_vae_model_ld{latent_dim}_dr{dropout}.pth")
 
-    opt = torch.optim.Adam(model.parameters(), lr=lr)
-    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(opt, 'min', patience=5, factor=0.5)
+        opt = torch.optim.Adam(model.parameters(), lr=lr)
+        scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(opt, 'min', patience=5, factor=0.5)
     
-    # Enable AMP/GradScaler only when using CUDA and the caller wants mixed precision
-    use_amp = mixed_precision and str(device).startswith("cuda") and torch.cuda.is_available()
-    scaler = torch.amp.GradScaler() if use_amp else None
+        # Enable AMP/GradScaler only when using CUDA and the caller wants mixed precision
+        use_amp = mixed_precision and str(device).startswith("cuda") and torch.cuda.is_available()
+        scaler = torch.amp.GradScaler() if use_amp else None
 
-    train_rmse_per_epoch = []
-    val_rmse_per_epoch = []
-    train_recon_per_epoch = []
-    val_recon_per_epoch = []
-    train_kl_per_epoch = []
-    val_kl_per_epoch = []
-    train_loss_per_epoch = []
-    val_loss_per_epoch = []
+        train_rmse_per_epoch = []
+        val_rmse_per_epoch = []
+        train_recon_per_epoch = []
+        val_recon_per_epoch = []
+        train_kl_per_epoch = []
+        val_kl_per_epoch = []
+        train_loss_per_epoch = []
+        val_loss_per_epoch = []
     
-    best_val_rmse = float('inf')  
-    best_model_state = None  
-    best_epoch = 0
+        best_val_rmse = float('inf')  
+        best_model_state = None  
+        best_epoch = 0
     
-    for epoch in range(epochs):
-        if epoch < kl_annealing_start_epoch:
-            kl_annealing_factor = 0.0
-        elif epoch < kl_annealing_start_epoch + kl_annealing_duration:
+        val_schedule = ValidationSchedule(val_data, epochs, validate_every,
+                                          make_fast_val_loader(val_data, fast_val_subset), full_val_every)
+        async_config = async_validation_config(async_validation)
+        validator = None
+        if async_config is not None:
+            validator = AsyncValidator(model, _evaluate_vae, {"full": val_data, "fast": val_schedule.fast_val_data}, async_config)
+            val_use_amp = use_amp and str(validator.device).startswith("cuda")
+        logged_epochs = 0
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs):
+            if epoch < kl_annealing_start_epoch:
+                kl_annealing_factor = 0.0
+            elif epoch < kl_annealing_start_epoch + kl_annealing_duration:
 
-            progress = (epoch - kl_annealing_start_epoch) / kl_annealing_duration 
+                progress = (epoch - kl_annealing_start_epoch) / kl_annealing_duration 
 
-            kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * (
-                1 / (1 + np.exp(-10 * (progress - 0.5))) 
-            )
-        else:
-            kl_annealing_factor = 1.0
+                kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * (
+                    1 / (1 + np.exp(-10 * (progress - 0.5))) 
+                )
+            else:
+                kl_annealing_factor = 1.0
             
-        current_beta = beta * kl_annealing_factor
+            current_beta = beta * kl_annealing_factor
         
-        model.train()
-        running_loss = 0
-        running_rmse = 0
-        running_kl = 0
-        items = 0
-        running_recon_loss = 0
+            model.train()
+            running_loss = 0
+            running_rmse = 0
+            running_kl = 0
+            items = 0
+            running_recon_loss = 0
         
-        for x, _ in train_data:
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
+            for x, _ in timer.iterate(train_data):
+                batch_size = x.size(0)
+                tract_data = x.to(device, non_blocking=True)
             
-            opt.zero_grad(set_to_none=True)
+                opt.zero_grad(set_to_none=True)
             
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                x_hat, mean, logvar = model(tract_data)
+                with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                    x_hat, mean, logvar = model(tract_data)
                 
-                loss, recon_loss, kl_loss = vae_loss(tract_data, x_hat, mean, logvar, current_beta, reduction="sum")
+                    loss, recon_loss, kl_loss = vae_loss(tract_data, x_hat, mean, logvar, current_beta, reduction="sum")
                 
-                batch_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
+                    batch_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
+                timer.lap("forward")
             
-            if use_amp:
-                scaled_loss = scaler.scale(loss)
-                scaled_loss.backward()
-                scaler.unscale_(opt)
-            else:
-                loss.backward()
+                if use_amp:
+                    scaled_loss = scaler.scale(loss)
+                    scaled_loss.backward()
+                    scaler.unscale_(opt)
+                else:
+                    loss.backward()
+                timer.lap("backward")
             
-            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=max_grad_norm)
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=max_grad_norm)
+                timer.lap("clip")
             
-            if use_amp:
-                scaler.step(opt)
-                scaler.update()
-            else:
-                opt.step()
+                if use_amp:
+                    scaler.step(opt)
+                    scaler.update()
+                else:
+                    opt.step()
+                timer.lap("optimizer")
+                profiler.step()
               
-            items += batch_size
-            running_loss += loss.item()
-            running_rmse += batch_rmse.item() * batch_size 
-            if current_beta > 0: 
-                running_kl += kl_loss.item()
-            running_recon_loss += recon_loss.item() # Average recon loss per item
-        
-        avg_train_rmse = running_rmse / items
-        avg_train_recon_loss = running_recon_loss / items
-        # Calculate average KL loss carefully, avoiding division by zero if beta was 0
-        avg_train_kl = (running_kl / items) if current_beta > 0 else 0.0 
-        avg_train_loss = running_loss / items
-        
-        train_rmse_per_epoch.append(avg_train_rmse)
-        train_kl_per_epoch.append(avg_train_kl)
-        train_recon_per_epoch.append(avg_train_recon_loss)
-        train_loss_per_epoch.append(avg_train_loss)
-
-        # Validation
-        model.eval()
-        val_rmse = 0
-        val_kl = 0
-        val_items = 0
-        val_recon_loss = 0
-        val_loss_total = 0  # Track total validation loss
-        
-        with torch.no_grad():
-            for x, *_ in val_data:
-                batch_size = x.size(0)
-                tract_data = x.to(device, non_blocking=True)
-                
-                with (torch.amp.autocast(device_type = "cuda") if use_amp else contextlib.nullcontext()):
-                    x_hat, mean, logvar = model(tract_data)
-                    
-                    # Use current_beta for validation loss calculation too
-                    val_loss, val_recon_loss_batch, val_kl_loss_batch = vae_loss(tract_data, x_hat, mean, logvar, current_beta, reduction="sum")
-                    batch_val_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
+                items += batch_size
+                running_loss += loss.item()
+                running_rmse += batch_rmse.item() * batch_size 
+                if current_beta > 0: 
+                    running_kl += kl_loss.item()
+                running_recon_loss += recon_loss.item() # Average recon loss per item
+        
+            avg_train_rmse = running_rmse / items
+            avg_train_recon_loss = running_recon_loss / items
+            # Calculate average KL loss carefully, avoiding division by zero if beta was 0
+            avg_train_kl = (running_kl / items) if current_beta > 0 else 0.0 
+            avg_train_loss = running_loss / items
+        
+            train_rmse_per_epoch.append(avg_train_rmse)
+            train_kl_per_epoch.append(avg_train_kl)
+            train_recon_per_epoch.append(avg_train_recon_loss)
+            train_loss_per_epoch.append(avg_train_loss)
+
+            # Validation (results of earlier epochs may arrive here with async validation)
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            val_rmse_per_epoch.append(float("nan"))
+            val_kl_per_epoch.append(float("nan"))
+            val_recon_per_epoch.append(float("nan"))
+            val_loss_per_epoch.append(float("nan"))
+            if validator is not None:
+                if val_pass is not None:
+                    validator.submit(epoch, val_pass, model, beta=current_beta, use_amp=val_use_amp)
+                completed = validator.drain() if epoch == epochs - 1 else validator.poll()
+            elif val_pass is not None:
+                metrics = _evaluate_vae(model, val_schedule.loader(val_pass), device, current_beta, use_amp)
+                completed = [ValidationResult(epoch, val_pass, metrics, model)]
+            else:
+                completed = []
+            timer.lap("validation")
+        
+            for result in completed:
+                val_rmse_per_epoch[result.epoch] = result.metrics["rmse"]
+                val_kl_per_epoch[result.epoch] = result.metrics["kl"]
+                val_recon_per_epoch[result.epoch] = result.metrics["recon_loss"]
+                val_loss_per_epoch[result.epoch] = result.metrics["loss"]
+                if result.epoch != epoch:
+                    print(f"Epoch {result.epoch+1} (async validation), Val RMSE: {result.metrics['rmse']:.4f}, "
+                          f"KL (Val): {result.metrics['kl']:.4f}, Recon (Val): {result.metrics['recon_loss']:.4f}")
+            
+                scheduler.step(result.metrics["loss"])
+            
+                timer.mark()
+                # Check and save the best model state if current validation loss is lower
+                if val_schedule.selects_best(result.val_pass) and result.metrics["rmse"] < best_val_rmse:
+                    print(f"Saving best model state with RMSE: {result.metrics['rmse']:.4f} at epoch {result.epoch+1}")
+                    best_val_rmse = result.metrics["rmse"]
+                    best_model_state = result.model.state_dict().copy()  # Make a copy to ensure it's preserved
+                    best_epoch = result.epoch + 1  # Make a copy to ensure it's preserved
                 
-                val_items += batch_size
-                val_loss_total += val_loss.item()
-                val_rmse += batch_val_rmse.item() * batch_size
-                # Only add KL loss if it has non-zero weight
-                if current_beta > 0:
-                    val_kl += val_kl_loss_batch.item()
-                val_recon_loss += val_recon_loss_batch.item()
-        
-        avg_val_recon_loss = val_recon_loss / val_items
-        avg_val_rmse = val_rmse / val_items
-        # Calculate average KL loss carefully
-        avg_val_kl = (val_kl / val_items) if current_beta > 0 else 0.0
-        avg_val_loss = val_loss_total / val_items
-        
-        val_rmse_per_epoch.append(avg_val_rmse)
-        val_kl_per_epoch.append(avg_val_kl)
-        val_recon_per_epoch.append(avg_val_recon_loss)
-        val_loss_per_epoch.append(avg_val_loss)
-        
-        scheduler.step(avg_val_loss)
-        
-        # Check and save the best model state if current validation loss is lower
-        if avg_val_rmse < best_val_rmse:
-            print(f"Saving best model state with RMSE: {avg_val_rmse:.4f} at epoch {epoch+1}")
-            best_val_rmse = avg_val_rmse
-            best_model_state = model.state_dict().copy()  # Make a copy to ensure it's preserved
-            best_epoch = epoch + 1  # Make a copy to ensure it's preserved
-            
-            torch.save(best_model_state, model_filename)
-            print(f"Best model saved to: {model_filename}")
-        
-        # Periodic saving every N epochs
-        if (epoch + 1) % periodic_save_interval == 0:
-            periodic_model_path = os.path.join(save_dir, f"vae_model_ld{latent_dim}_dr{dropout}_epoch_{epoch+1}.pth")
-            # Remove an existing file/directory with the same name to avoid I/O errors
-            if os.path.exists(periodic_model_path):
-                if os.path.isfile(periodic_model_path):
-                    os.remove(periodic_model_path)
-                else:
-                    import shutil
-                    shutil.rmtree(periodic_model_path)
-            torch.save(model.state_dict(), periodic_model_path)
-            print(f"  Saved periodic VAE model at epoch {epoch+1} to {periodic_model_path}")
-        
-        print(f"Epoch {epoch+1}, KL Weight: {current_beta:.6f}, Train RMSE: {avg_train_rmse:.4f}, Val RMSE: {avg_val_rmse:.4f}, KL (Train): {avg_train_kl:.4f}, KL (Val): {avg_val_kl:.4f}, "
-              f"Recon (Train): {avg_train_recon_loss:.4f}, Recon (Val): {avg_val_recon_loss:.4f}")
+                    torch.save(best_model_state, model_filename)
+                    print(f"Best model saved to: {model_filename}")
+                timer.lap("checkpoint")
+        
+            timer.mark()
+            # Periodic saving every N epochs
+            if (epoch + 1) % periodic_save_interval == 0:
+                periodic_model_path = os.path.join(save_dir, f"vae_model_ld{latent_dim}_dr{dropout}_epoch_{epoch+1}.pth")
+                # Remove an existing file/directory with the same name to avoid I/O errors
+                if os.path.exists(periodic_model_path):
+                    if os.path.isfile(periodic_model_path):
+                        os.remove(periodic_model_path)
+                    else:
+                        import shutil
+                        shutil.rmtree(periodic_model_path)
+                torch.save(model.state_dict(), periodic_model_path)
+                print(f"  Saved periodic VAE model at epoch {epoch+1} to {periodic_model_path}")
+            timer.lap("checkpoint")
+        
+            print(f"Epoch {epoch+1}, KL Weight: {current_beta:.6f}, Train RMSE: {avg_train_rmse:.4f}, Val RMSE: {val_rmse_per_epoch[-1]:.4f}, KL (Train): {avg_train_kl:.4f}, KL (Val): {val_kl_per_epoch[-1]:.4f}, "
+                  f"Recon (Train): {avg_train_recon_loss:.4f}, Recon (Val): {val_recon_per_epoch[-1]:.4f}")
+            timer.end_epoch()
+            # Rows of epochs still being validated asynchronously are written once their results arrive
+            pending = validator.pending if validator is not None else ()
+            while logged_epochs <= epoch and logged_epochs not in pending:
+                logged_epochs += 1
+                metrics_log.log_epoch("vae", logged_epochs, {
+                    "train_loss": train_loss_per_epoch,
+                    "val_loss": val_loss_per_epoch,
+                    "train_recon_loss": train_recon_per_epoch,
+                    "val_recon_loss": val_recon_per_epoch,
+                    "train_kl_loss": train_kl_per_epoch,
+                    "val_kl_loss": val_kl_per_epoch,
+                    "train_rmse": train_rmse_per_epoch,
+                    "val_rmse": val_rmse_per_epoch,
+                    "val_pass": val_schedule.history,
+                    **timer.histories(suffix="")
+                })
     
-    print(f"Training complete. Best model was from epoch {best_epoch} with validation RMSE: {best_val_rmse:.4f}")
+        profiler.stop()
+        if validator is not None:
+            validator.close()
+        print(f"Training complete. Best model was from epoch {best_epoch} with validation RMSE: {best_val_rmse:.4f}")
     
-    return {
-        "train_rmse_per_epoch": train_rmse_per_epoch,
-        "val_rmse_per_epoch": val_rmse_per_epoch,
-        "train_kl_per_epoch": train_kl_per_epoch,
-        "val_kl_per_epoch": val_kl_per_epoch,
-        "train_recon_per_epoch": train_recon_per_epoch,
-        "val_recon_per_epoch": val_recon_per_epoch,
-        "train_loss_per_epoch": train_loss_per_epoch,
-        "val_loss_per_epoch": val_loss_per_epoch,
-        "best_val_rmse": best_val_rmse,
-        "best_epoch": best_epoch,
-        "model_path": model_filename
-    }
+        return {
+            "train_rmse_per_epoch": train_rmse_per_epoch,
+            "val_rmse_per_epoch": val_rmse_per_epoch,
+            "train_kl_per_epoch": train_kl_per_epoch,
+            "val_kl_per_epoch": val_kl_per_epoch,
+            "train_recon_per_epoch": train_recon_per_epoch,
+            "val_recon_per_epoch": val_recon_per_epoch,
+            "train_loss_per_epoch": train_loss_per_epoch,
+            "val_loss_per_epoch": val_loss_per_epoch,
+            "val_pass_per_epoch": val_schedule.history,
+            **timer.histories("_per_epoch"),
+            "phase_times_per_epoch": timer.history,
+            "trace_files": profiler.trace_files,
+            "best_val_rmse": best_val_rmse,
+            "best_epoch": best_epoch,
+            "model_path": model_filename
+        }
+    finally:
+        metrics_log.close()
 
 # Standard autoencoder training: Trains a non-variational autoencoder for reconstruction
+# Validation pass of train_autoencoder; also runs in the async validation worker
+def _evaluate_ae(model, loader, device, use_amp=False):
+    model.eval()
+    val_rmse = 0
+    val_recon_loss = 0
+    val_items = 0
+
+    with torch.inference_mode():
+        for x, _ in loader:
+            batch_size = x.size(0)
+            tract_data = x.to(device, non_blocking=True)
+
+            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                # Forward pass
+                x_hat = model(tract_data)
+
+                loss = F.mse_loss(tract_data, x_hat, reduction="sum")
+                batch_val_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
+
+            val_items += batch_size
+            val_recon_loss += loss.item()
+            val_rmse += batch_val_rmse.item() * batch_size
+
+    return {"rmse": val_rmse / val_items, "recon_loss": val_recon_loss / val_items}
+
 # Simple reconstruction loss with mixed precision support
-def train_autoencoder(model, train_data, val_data, epochs=500, lr=0.001, device='cuda', max_grad_norm=1.0, mixed_precision=True):
+def train_autoencoder(model, train_data, val_data, epochs=500, lr=0.001, device='cuda', max_grad_norm=1.0, mixed_precision=True,
+                      metrics_file=None, profile=None, validate_every=1, fast_val_subset=None, full_val_every=None,
+                      async_validation=None):
     """
-    Training loop for standard autoencoder
+    Training loop for standard autoencoder.
+    If metrics_file is given, per-epoch metrics are appended to that CSV.
+    Per-phase wall-clock times are returned as phase_times_per_epoch and throughput counters
+    (samples_per_sec_per_epoch, step_time_p95_per_epoch, data_wait_time_per_epoch, ...) next to the
+    loss histories; profile=True (or a dict of options, see profiling.profile_config) also writes
+    torch.profiler traces to ./profiler.
+    validate_every, fast_val_subset and full_val_every set the validation cadence (see validation.py);
+    epochs without validation record NaN validation metrics. Only full passes select the best model,
+    so with fast_val_subset full_val_every defaults to 5 x validate_every.
+    async_validation=True (or a dict of options, see async_validation.py) validates weight snapshots
+    in a side process while training continues; results are applied up to max_lag epochs later.
     """
-    torch.backends.cudnn.benchmark = True
-
-    # Get latent dimensions and dropout from the model
-    latent_dim = model.latent_dims if hasattr(model, 'latent_dims') else "unknown"
-    # Get dropout from the encoder component
-    dropout = model.encoder.dropout.p if hasattr(model, 'encoder') and hasattr(model.encoder, 'dropout') else "unknown"
-    
-    # Create a unique model filename
-    model_filename = f"best_ae_model_ld{latent_dim}_dr{dropout}.pth"
-
-    opt = torch.optim.Adam(model.parameters(), lr=lr)
-    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(opt, 'min', patience=5, factor=0.5)
-    
-    # Enable AMP/GradScaler only when running on CUDA and caller wants it
-    use_amp = mixed_precision and str(device).startswith("cuda") and torch.cuda.is_available()
-    scaler = torch.amp.GradScaler() if use_amp else None  # GradScaler not needed off-CUDA
-
-    train_rmse_per_epoch = []
-    val_rmse_per_epoch = []
-    train_recon_loss_per_epoch = []
-    val_recon_loss_per_epoch = []
-    train_loss_per_epoch = []
-    val_loss_per_epoch = []
-    
-    best_val_rmse = float('inf')  # Track the best (lowest) validation RMSE
-    best_model_state = None  # Save the best model state
-    best_epoch = 0
-    
-    for epoch in range(epochs):
-        # Training
-        model.train()
-        running_loss = 0
-        running_rmse = 0
-        items = 0
-        running_recon_loss = 0
-        
-        for x, _ in train_data:
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
+    metrics_log = MetricsWriter(metrics_file)
+    try:
+        profiler = StepProfiler(profile, ".", "ae")
+        torch.backends.cudnn.benchmark = True
+
+        # Get latent dimensions and dropout from the model
+        latent_dim = model.latent_dims if hasattr(model, 'latent_dims') else "unknown"
+        # Get dropout from the encoder component
+        dropout = model.encoder.dropout.p if hasattr(model, 'encoder') and hasattr(model.encoder, 'dropout') else "unknown"
+    
+        # Create a unique model filename
+        model_filename = f"best_ae_model_ld{latent_dim}_dr{dropout}.pth"
+
+        opt = torch.optim.Adam(model.parameters(), lr=lr)
+        scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(opt, 'min', patience=5, factor=0.5)
+    
+        # Enable AMP/GradScaler only when running on CUDA and caller wants it
+        use_amp = mixed_precision and str(device).startswith("cuda") and torch.cuda.is_available()
+        scaler = torch.amp.GradScaler() if use_amp else None  # GradScaler not needed off-CUDA
+
+        train_rmse_per_epoch = []
+        val_rmse_per_epoch = []
+        train_recon_loss_per_epoch = []
+        val_recon_loss_per_epoch = []
+        train_loss_per_epoch = []
+        val_loss_per_epoch = []
+    
+        best_val_rmse = float('inf')  # Track the best (lowest) validation RMSE
+        best_model_state = None  # Save the best model state
+        best_epoch = 0
+    
+        val_schedule = ValidationSchedule(val_data, epochs, validate_every,
+                                          make_fast_val_loader(val_data, fast_val_subset), full_val_every)
+        async_config = async_validation_config(async_validation)
+        validator = None
+        if async_config is not None:
+            validator = AsyncValidator(model, _evaluate_ae, {"full": val_data, "fast": val_schedule.fast_val_data}, async_config)
+            val_use_amp = use_amp and str(validator.device).startswith("cuda")
+        logged_epochs = 0
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs):
+            # Training
+            model.train()
+            running_loss = 0
+            running_rmse = 0
+            items = 0
+            running_recon_loss = 0
+        
+            for x, _ in timer.iterate(train_data):
+                batch_size = x.size(0)
+                tract_data = x.to(device, non_blocking=True)
             
-            opt.zero_grad(set_to_none=True)
+                opt.zero_grad(set_to_none=True)
             
-            # Forward pass (AMP only on CUDA)
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                x_hat = model(tract_data)
+                # Forward pass (AMP only on CUDA)
+                with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                    x_hat = model(tract_data)
                 
-                # Compute loss
-                recon_loss = F.mse_loss(tract_data, x_hat, reduction="sum")
-                loss = recon_loss
+                    # Compute loss
+                    recon_loss = F.mse_loss(tract_data, x_hat, reduction="sum")
+                    loss = recon_loss
                 
-                # Calculate RMSE (primarily for logging)
-                batch_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
+                    # Calculate RMSE (primarily for logging)
+                    batch_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
+                timer.lap("forward")
             
-            # Scale the total loss for backward pass
-            if use_amp:
-                scaler.scale(loss).backward()
-                scaler.unscale_(opt)
-            else:
-                loss.backward()
+                # Scale the total loss for backward pass
+                if use_amp:
+                    scaler.scale(loss).backward()
+                    scaler.unscale_(opt)
+                else:
+                    loss.backward()
+                timer.lap("backward")
             
-            # Clip gradients
-            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=max_grad_norm)
+                # Clip gradients
+                torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=max_grad_norm)
+                timer.lap("clip")
             
-            # Step optimizer with scaled gradients
-            if use_amp:
-                scaler.step(opt)
-                scaler.update()
-            else:
-                opt.step()
+                # Step optimizer with scaled gradients
+                if use_amp:
+                    scaler.step(opt)
+                    scaler.update()
+                else:
+                    opt.step()
+                timer.lap("optimizer")
+                profiler.step()
               
-            #increasing by batch size
-            items += batch_size
-            running_loss += loss.item()
-            running_rmse += batch_rmse.item() * batch_size  # Weighted sum
-            running_recon_loss += recon_loss.item() # Average recon loss per item
-        
-        avg_train_rmse = running_rmse / items
-        avg_train_recon_loss = running_recon_loss / items
-        avg_train_loss = running_loss / items
-        train_rmse_per_epoch.append(avg_train_rmse)
-        train_recon_loss_per_epoch.append(avg_train_recon_loss)
-        train_loss_per_epoch.append(avg_train_loss)
-        
-        # Validation
-        model.eval()
-        val_rmse = 0
-        val_recon_loss = 0
-        val_items = 0
-        
-        with torch.no_grad():
-            for x, _ in val_data:
-                batch_size = x.size(0)
-                tract_data = x.to(device, non_blocking=True)
-                
-                with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                    # Forward pass
-                    x_hat = model(tract_data)
-                    
-                    loss = F.mse_loss(tract_data, x_hat, reduction="sum")
-                    batch_val_rmse = torch.sqrt(F.mse_loss(tract_data, x_hat, reduction="mean"))
-                
-                val_items += batch_size
-                val_recon_loss += loss.item()
-                val_rmse += batch_val_rmse.item() * batch_size
-        
-        avg_val_rmse = val_rmse / val_items
-        avg_val_recon_loss = val_recon_loss / val_items
-        avg_val_loss = avg_val_recon_loss
-        
-        val_rmse_per_epoch.append(avg_val_rmse)
-        val_recon_loss_per_epoch.append(avg_val_recon_loss)
-        val_loss_per_epoch.append(avg_val_loss)
-        
-        scheduler.step(avg_val_loss)
-        
-        # Check and save the best model state if current validation RMSE is lower
-        if avg_val_rmse < best_val_rmse:
-            print(f"Epoch {epoch+1}: Saving best model state with RMSE: {avg_val_rmse:.4f}")
-            best_val_rmse = avg_val_rmse
-            best_epoch = epoch + 1
+                #increasing by batch size
+                items += batch_size
+                running_loss += loss.item()
+                running_rmse += batch_rmse.item() * batch_size  # Weighted sum
+                running_recon_loss += recon_loss.item() # Average recon loss per item
+        
+            avg_train_rmse = running_rmse / items
+            avg_train_recon_loss = running_recon_loss / items
+            avg_train_loss = running_loss / items
+            train_rmse_per_epoch.append(avg_train_rmse)
+            train_recon_loss_per_epoch.append(avg_train_recon_loss)
+            train_loss_per_epoch.append(avg_train_loss)
+        
+            # Validation (results of earlier epochs may arrive here with async validation)
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            val_rmse_per_epoch.append(float("nan"))
+            val_recon_loss_per_epoch.append(float("nan"))
+            val_loss_per_epoch.append(float("nan"))
+            if validator is not None:
+                if val_pass is not None:
+                    validator.submit(epoch, val_pass, model, use_amp=val_use_amp)
+                completed = validator.drain() if epoch == epochs - 1 else validator.poll()
+            elif val_pass is not None:
+                completed = [ValidationResult(epoch, val_pass, _evaluate_ae(model, val_schedule.loader(val_pass), device, use_amp), model)]
+            else:
+                completed = []
+            timer.lap("validation")
+        
+            for result in completed:
+                val_rmse_per_epoch[result.epoch] = result.metrics["rmse"]
+                val_recon_loss_per_epoch[result.epoch] = result.metrics["recon_loss"]
+                val_loss_per_epoch[result.epoch] = result.metrics["recon_loss"]
+                if result.epoch != epoch:
+                    print(f"Epoch {result.epoch+1} (async validation), Val RMSE: {result.metrics['rmse']:.4f}, "
+                          f"Recon Loss (Val): {result.metrics['recon_loss']:.4f}")
             
-            # Save the best model weights to disk
-            torch.save(model.state_dict(), model_filename)
-            print(f"Best model saved to: {model_filename}")
-        
-        print(f"Epoch {epoch+1}, Train RMSE: {avg_train_rmse:.4f}, Val RMSE: {avg_val_rmse:.4f}, " +
-              f"Recon Loss (Train): {avg_train_recon_loss:.4f}, Recon Loss (Val): {avg_val_recon_loss:.4f}")
-        
-    print(f"Training complete. Best model was from epoch {best_epoch} with validation RMSE: {best_val_rmse:.4f}")
-    print(f"Best model saved to: {model_filename}")
+                scheduler.step(result.metrics["recon_loss"])
+            
+                # Check and save the best model state if current validation RMSE is lower
+                if val_schedule.selects_best(result.val_pass) and result.metrics["rmse"] < best_val_rmse:
+                    print(f"Epoch {result.epoch+1}: Saving best model state with RMSE: {result.metrics['rmse']:.4f}")
+                    best_val_rmse = result.metrics["rmse"]
+                    best_epoch = result.epoch + 1
+                
+                    # Save the best model weights to disk
+                    timer.mark()
+                    torch.save(result.model.state_dict(), model_filename)
+                    timer.lap("checkpoint")
+                    print(f"Best model saved to: {model_filename}")
+        
+            print(f"Epoch {epoch+1}, Train RMSE: {avg_train_rmse:.4f}, Val RMSE: {val_rmse_per_epoch[-1]:.4f}, " +
+                  f"Recon Loss (Train): {avg_train_recon_loss:.4f}, Recon Loss (Val): {val_recon_loss_per_epoch[-1]:.4f}")
+            timer.end_epoch()
+            # Rows of epochs still being validated asynchronously are written once their results arrive
+            pending = validator.pending if validator is not None else ()
+            while logged_epochs <= epoch and logged_epochs not in pending:
+                logged_epochs += 1
+                metrics_log.log_epoch("ae", logged_epochs, {
+                    "train_loss": train_loss_per_epoch,
+                    "val_loss": val_loss_per_epoch,
+                    "train_recon_loss": train_recon_loss_per_epoch,
+                    "val_recon_loss": val_recon_loss_per_epoch,
+                    "train_rmse": train_rmse_per_epoch,
+                    "val_rmse": val_rmse_per_epoch,
+                    "val_pass": val_schedule.history,
+                    **timer.histories(suffix="")
+                })
+        
+        profiler.stop()
+        if validator is not None:
+            validator.close()
+        print(f"Training complete. Best model was from epoch {best_epoch} with validation RMSE: {best_val_rmse:.4f}")
+        print(f"Best model saved to: {model_filename}")
     
-    return {
-        "train_rmse_per_epoch": train_rmse_per_epoch,
-        "val_rmse_per_epoch": val_rmse_per_epoch,
-        "train_recon_loss_per_epoch": train_recon_loss_per_epoch,
-        "val_recon_loss_per_epoch": val_recon_loss_per_epoch,
-        "train_loss_per_epoch": train_loss_per_epoch,
-        "val_loss_per_epoch": val_loss_per_epoch,
-        "best_val_rmse": best_val_rmse,
-        "best_epoch": best_epoch,
-        "model_path": model_filename
-    }
+        return {
+            "train_rmse_per_epoch": train_rmse_per_epoch,
+            "val_rmse_per_epoch": val_rmse_per_epoch,
+            "train_recon_loss_per_epoch": train_recon_loss_per_epoch,
+            "val_recon_loss_per_epoch": val_recon_loss_per_epoch,
+            "train_loss_per_epoch": train_loss_per_epoch,
+            "val_loss_per_epoch": val_loss_per_epoch,
+            "val_pass_per_epoch": val_schedule.history,
+            **timer.histories("_per_epoch"),
+            "phase_times_per_epoch": timer.history,
+            "trace_files": profiler.trace_files,
+            "best_val_rmse": best_val_rmse,
+            "best_epoch": best_epoch,
+            "model_path": model_filename
+        }
+    finally:
+        metrics_log.close()
 
 # Standard KL divergence loss for VAE: measures how far the learned distribution is from a standard Gaussian
 def kl_divergence_loss(mean, logvar):
@@ -1243,9 +1554,12 @@ def calculate_r2_score(y_true, y_pred, verbose=False):
     return r2.item()
 
 # Saves site prediction results to disk for creating confusion matrices later
-def save_site_predictions(true_sites, pred_sites, epoch, save_dir, prefix=''):
+def save_site_predictions(true_sites, pred_sites, epoch, save_dir, prefix='', age_true=None, age_pred=None, latents=None, log=print):
     """
     Save site prediction data to create confusion matrices.
+
+    All epochs and splits of a run are appended to one prediction store in
+    ``save_dir/site_predictions/predictions`` (see ``prediction_store.py``).
     
     Parameters
     ----------
@@ -1258,24 +1572,300 @@ def save_site_predictions(true_sites, pred_sites, epoch, save_dir, prefix=''):
     save_dir : str
         Directory to save the data
     prefix : str
-        Prefix for saved filenames (e.g., 'train' or 'val')
+        Split name for the saved predictions (e.g., 'train' or 'val')
+    age_true, age_pred : torch.Tensor, optional
+        True and predicted ages for the same samples
+    latents : torch.Tensor, optional
+        Latent codes [N, latent_dim] for the same samples
+    log : callable, optional
+        Where to report the save (e.g. a trainer's ``ProgressReporter.info``)
     """
-    import os
-    
-    # Convert tensors to numpy arrays if needed
-    if isinstance(true_sites, torch.Tensor):
-        true_sites = true_sites.cpu().numpy()
-    if isinstance(pred_sites, torch.Tensor):
-        pred_sites = pred_sites.cpu().numpy()
+    latent_dim = None if latents is None else int(latents.reshape(len(latents), -1).shape[1])
+    store = open_prediction_store(save_dir, latent_dim=latent_dim)
+    store.append(epoch, prefix, true_sites, pred_sites, age_true=age_true, age_pred=age_pred, latents=latents)
     
-    # Save the data
+    log(f"Saved {prefix} site prediction data for epoch {epoch}")
+
+# Streams site predictions into a K x K confusion matrix on the training device
+# One bincount per batch replaces collecting every label on the CPU
+class SiteConfusionAccumulator:
+    """
+    Accumulate a site confusion matrix without leaving the device.
+
+    Parameters
+    ----------
+    num_sites : int
+        Number of site classes (K).
+    device : str or torch.device
+        Device holding the running counts; should match the predictions.
+    """
+    def __init__(self, num_sites, device="cpu"):
+        self.num_sites = int(num_sites)
+        self.counts = torch.zeros(self.num_sites * self.num_sites, dtype=torch.long, device=device)
+
+    def update(self, true_sites, pred_sites):
+        """Add one batch of true/predicted site labels to the running counts."""
+        true_sites = true_sites.reshape(-1).long()
+        pred_sites = pred_sites.reshape(-1).long()
+        # Drop labels the remap could not place (e.g. -1) instead of corrupting the counts
+        valid = (true_sites >= 0) & (true_sites < self.num_sites)
+        flat_idx = true_sites[valid] * self.num_sites + pred_sites[valid]
+        self.counts += torch.bincount(flat_idx, minlength=self.num_sites * self.num_sites)
+
+    def compute(self):
+        """Return the raw counts as a [K, K] numpy array (rows = true, columns = predicted)."""
+        return self.counts.view(self.num_sites, self.num_sites).cpu().numpy()
+
+    def reset(self):
+        # Reallocate rather than zero in place: counts created during an
+        # inference_mode validation pass cannot be modified outside it
+        self.counts = torch.zeros_like(self.counts)
+
+# Writes all per-epoch site confusion matrices into a single compact file
+def save_site_confusion_matrices(epochs, train_matrices, val_matrices, save_dir):
+    """
+    Save per-epoch site confusion matrices as one ``.npz`` file.
+
+    Parameters
+    ----------
+    epochs : list of int
+        Epoch number (1-based) of each stored matrix.
+    train_matrices, val_matrices : list of np.ndarray
+        Raw [K, K] count matrices, one per entry in ``epochs``.
+    save_dir : str
+        Run directory; the file goes to ``site_predictions/site_confusion_matrices.npz``.
+    """
     data_dir = os.path.join(save_dir, 'site_predictions')
     os.makedirs(data_dir, exist_ok=True)
-    
-    np.save(os.path.join(data_dir, f'{prefix}_true_sites_epoch_{epoch}.npy'), true_sites)
-    np.save(os.path.join(data_dir, f'{prefix}_pred_sites_epoch_{epoch}.npy'), pred_sites)
-    
-    print(f"Saved {prefix} site prediction data for epoch {epoch}")
+    out_path = os.path.join(data_dir, 'site_confusion_matrices.npz')
+    tmp_path = out_path + '.tmp.npz'
+    np.savez(tmp_path,
+             epochs=np.asarray(epochs, dtype=np.int64),
+             train=np.stack(train_matrices).astype(np.int64),
+             val=np.stack(val_matrices).astype(np.int64))
+    # Replace atomically so a reader never sees a half-written file
+    os.replace(tmp_path, out_path)
+    return out_path
+
+# Loads the per-epoch site confusion matrices written by save_site_confusion_matrices
+def load_site_confusion_matrices(save_dir):
+    """
+    Load per-epoch site confusion matrices for a run.
+
+    Returns
+    -------
+    dict or None
+        ``{(prefix, epoch): counts}`` with prefix ``'train'`` or ``'val'`` and
+        ``counts`` a raw [K, K] array, or None if the run has no matrices.
+    """
+    path = os.path.join(save_dir, 'site_predictions', 'site_confusion_matrices.npz')
+    if not os.path.exists(path):
+        return None
+    matrices = {}
+    with np.load(path) as data:
+        for i, epoch in enumerate(data['epochs']):
+            matrices[('train', int(epoch))] = data['train'][i]
+            matrices[('val', int(epoch))] = data['val'][i]
+    return matrices
+
+# Stage checkpoints let an interrupted staged run skip the stages it already finished
+def save_stage_checkpoint(save_dir, name, results, state_dict, training_state=None):
+    """
+    Save the results and final weights of a finished training stage.
+
+    Written to ``stage_<name>.pt`` in ``save_dir`` by the staged trainers
+    after each stage-1 model; ``load_stage_checkpoint`` reads it back when a
+    run is resumed. The combined stage is also saved while it runs, with
+    its histories so far as ``results`` and a ``training_state`` (epoch,
+    optimizer, scheduler, ...) to continue from.
+    """
+    out_path = os.path.join(save_dir, f"stage_{name}.pt")
+    tmp_path = out_path + ".tmp"
+    torch.save({"results": results, "state_dict": state_dict, "training_state": training_state}, tmp_path)
+    # Replace atomically so an interrupted save never looks like a finished stage
+    os.replace(tmp_path, out_path)
+    return out_path
+
+def load_stage_checkpoint(save_dir, name):
+    """
+    Load a checkpoint written by ``save_stage_checkpoint``.
+
+    Returns
+    -------
+    dict or None
+        ``{"results": ..., "state_dict": ..., "training_state": ...}``, or None
+        if the stage has no checkpoint.
+    """
+    path = os.path.join(save_dir, f"stage_{name}.pt")
+    if not os.path.exists(path):
+        return None
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+def clear_stage_checkpoints(save_dir):
+    """
+    Delete every stage checkpoint (``stage_*.pt``) in ``save_dir``.
+
+    Checkpoints do not record the settings they were trained with, so a run
+    that will not resume clears them first; otherwise a later resume could
+    pick up a stage trained with other settings.
+    """
+    if not os.path.isdir(save_dir):
+        return
+    for file_name in os.listdir(save_dir):
+        if file_name.startswith("stage_") and file_name.endswith((".pt", ".pt.tmp")):
+            os.remove(os.path.join(save_dir, file_name))
+
+# Row-normalizes a raw confusion count matrix (rows with no samples stay zero)
+def normalize_confusion_matrix(counts):
+    counts = np.asarray(counts, dtype=np.float64)
+    row_sums = counts.sum(axis=1, keepdims=True)
+    return np.divide(counts, row_sums, out=np.zeros_like(counts), where=row_sums > 0)
+
+# Saves a row-normalized confusion matrix PNG from raw counts
+def plot_site_confusion_matrix(counts, title, out_path, site_names=None):
+    cm = normalize_confusion_matrix(counts)
+    labels = site_names if site_names is not None else [f"Site {i}" for i in range(cm.shape[0])]
+    disp = ConfusionMatrixDisplay(confusion_matrix=cm, display_labels=labels)
+    fig, ax = plt.subplots(figsize=(8, 6))
+    disp.plot(ax=ax, cmap='Blues', values_format='.2f')
+    plt.title(title)
+    plt.tight_layout()
+    plt.savefig(out_path)
+    plt.close(fig)
+    return cm
+
+# Builds raw count matrices from the per-sample predictions in a run's prediction store
+def _load_site_prediction_store(save_dir):
+    try:
+        store = open_prediction_store(save_dir, mode='r')
+    except FileNotFoundError:
+        return {}
+    matrices = {}
+    for prefix, epoch in store.keys():
+        preds = store.get(epoch, prefix)
+        true_sites = preds['site_true'].astype(np.int64)
+        pred_sites = preds['site_pred'].astype(np.int64)
+        num_sites = int(max(true_sites.max(), pred_sites.max())) + 1
+        matrices[(prefix, epoch)] = confusion_matrix(true_sites, pred_sites, labels=list(range(num_sites)))
+    return matrices
+
+# Reads the per-epoch .npy files written by older runs into raw count matrices
+def _load_site_prediction_files(save_dir):
+    data_dir = os.path.join(save_dir, 'site_predictions')
+    if not os.path.exists(data_dir):
+        return {}
+    matrices = {}
+    for f in sorted(os.listdir(data_dir)):
+        if not (f.endswith('.npy') and 'true_sites' in f):
+            continue
+        pred_path = os.path.join(data_dir, f.replace('true_sites', 'pred_sites'))
+        if not os.path.exists(pred_path):
+            continue
+        parts = f.split('_')
+        prefix = parts[0]
+        epoch = int(parts[-1].replace('.npy', ''))
+        true_sites = np.load(os.path.join(data_dir, f)).astype(np.int64)
+        pred_sites = np.load(pred_path).astype(np.int64)
+        num_sites = int(max(true_sites.max(), pred_sites.max())) + 1
+        matrices[(prefix, epoch)] = confusion_matrix(true_sites, pred_sites, labels=list(range(num_sites)))
+    return matrices
+
+# Creates confusion matrix plots/CSVs for every saved epoch of a run
+def create_confusion_matrices(save_dir, site_names=None):
+    """
+    Create and save confusion matrices from saved site prediction data.
+
+    Reads the compact per-epoch matrices written during training, falling back
+    to per-sample prediction files from older runs.
+
+    Parameters
+    ----------
+    save_dir : str
+        Directory where site prediction data is saved
+    site_names : list, optional
+        List of site names for axis labels
+    """
+    import pandas as pd
+
+    matrices = load_site_confusion_matrices(save_dir)
+    if matrices is None:
+        matrices = _load_site_prediction_store(save_dir)
+    if not matrices:
+        matrices = _load_site_prediction_files(save_dir)
+    if not matrices:
+        print(f"No site prediction data found in {os.path.join(save_dir, 'site_predictions')}")
+        return
+
+    plot_dir = os.path.join(save_dir, 'confusion_matrices')
+    os.makedirs(plot_dir, exist_ok=True)
+    print(f"Found {len(matrices)} site confusion matrices")
+
+    for (prefix, epoch), counts in sorted(matrices.items()):
+        labels = site_names if site_names is not None else [f"Site {i}" for i in range(counts.shape[0])]
+        cm = plot_site_confusion_matrix(
+            counts,
+            f'{prefix.capitalize()} Confusion Matrix - Epoch {epoch}',
+            os.path.join(plot_dir, f'{prefix}_confusion_matrix_epoch_{epoch}.png'),
+            site_names=labels,
+        )
+        # Also save a CSV of the confusion matrix for detailed analysis
+        pd.DataFrame(cm, index=labels, columns=labels).to_csv(
+            os.path.join(plot_dir, f'{prefix}_confusion_matrix_epoch_{epoch}.csv'))
+
+    create_confusion_matrix_summary(plot_dir, matrices)
+
+# Plots how validation site accuracy evolves relative to chance across saved epochs
+def create_confusion_matrix_summary(plot_dir, matrices):
+    """Create a summary visualization showing how confusion matrices evolve over time."""
+    import pandas as pd
+
+    val_epochs = sorted(epoch for prefix, epoch in matrices.keys() if prefix == 'val')
+    if len(val_epochs) <= 1:
+        print("Not enough epochs for time series visualization")
+        return
+
+    epochs = []
+    accuracies = []
+    chance_divergences = []  # How far from chance (1/num_classes)
+    for epoch in val_epochs:
+        cm = normalize_confusion_matrix(matrices[('val', epoch)])
+        accuracy = np.trace(cm) / np.sum(cm)
+        num_classes = cm.shape[0]
+        chance_level = 1.0 / num_classes
+        epochs.append(epoch)
+        accuracies.append(accuracy)
+        chance_divergences.append(accuracy - chance_level)
+
+    fig, ax1 = plt.subplots(figsize=(12, 6))
+    color = 'tab:blue'
+    ax1.set_xlabel('Epoch')
+    ax1.set_ylabel('Accuracy', color=color)
+    ax1.plot(epochs, accuracies, color=color, marker='o', label='Accuracy')
+    ax1.tick_params(axis='y', labelcolor=color)
+    ax1.axhline(y=chance_level, color='gray', linestyle='--', label=f'Chance Level ({chance_level:.2f})')
+
+    ax2 = ax1.twinx()
+    color = 'tab:red'
+    ax2.set_ylabel('Divergence from Chance', color=color)
+    ax2.plot(epochs, chance_divergences, color=color, marker='x', label='Divergence from Chance')
+    ax2.tick_params(axis='y', labelcolor=color)
+    ax2.axhline(y=0, color='lightgray', linestyle=':')
+
+    lines1, labels1 = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(lines1 + lines2, labels1 + labels2, loc='best')
+    plt.title('Site Classification Performance Over Training')
+    plt.tight_layout()
+    plt.savefig(os.path.join(plot_dir, 'site_performance_over_time.png'))
+    plt.close(fig)
+
+    pd.DataFrame({
+        'epoch': epochs,
+        'accuracy': accuracies,
+        'chance_level': [chance_level] * len(epochs),
+        'divergence_from_chance': chance_divergences
+    }).to_csv(os.path.join(plot_dir, 'site_performance_over_time.csv'), index=False)
+    print("Created site classification performance summary")
 
 # Two-stage training: Stage 1 trains VAE/age/site predictors independently, Stage 2 combines them
 # Uses phased training with frozen predictors initially, then gradual unfreezing
@@ -1305,832 +1895,949 @@ def train_vae_age_site_staged(
     save_predictions_interval=50,  # Save predictions every N epochs
     periodic_save_interval=50,  # Save model weights every N epochs
     is_variational=True,  # Whether the autoencoder is variational
-    mixed_precision=True  # Enable AMP only when running on CUDA
+    mixed_precision=True,  # Enable AMP only when running on CUDA
+    save_per_sample_predictions=False,  # Also store per-sample site/age predictions at each save interval
+    save_prediction_latents=False,  # Include latent means in the stored per-sample predictions
+    metrics_file="metrics.csv",  # Per-epoch metrics CSV inside save_dir (None disables it)
+    log_level=None,  # 'debug' | 'info' | 'warning'; defaults to $AFQ_LOG_LEVEL or 'info'
+    profile=None,  # True or dict of options: torch.profiler traces per stage in save_dir/profiler
+    validate_every=1,  # Validate after every N-th epoch of each stage (see validation.py)
+    fast_val_subset=None,  # Samples (or fraction) of a fixed stratified val subset for quick passes
+    full_val_every=None,  # Full validation pass every N epochs when using fast_val_subset (default 5 x validate_every)
+    resume=False  # Skip stage-1 models with a stage checkpoint in save_dir and continue stage 2 from its last one
  ):
+    log = ProgressReporter(level=log_level)
     import os, sys
-    print(f"DEBUG: Starting train_vae_age_site_staged function")
-    print(f"DEBUG: Training configuration - epochs_stage1={epochs_stage1}, epochs_stage2={epochs_stage2}, device={device}")
-    print(f"DEBUG: Autoencoder type - {'Variational' if is_variational else 'Non-variational'}")
-    print(f"DEBUG: KL annealing config - start_epoch={kl_annealing_start_epoch}, duration={kl_annealing_duration}, start_value={kl_annealing_start}")
-    print(f"DEBUG: Data loaders - train_data has {len(train_data)} batches, val_data has {len(val_data)} batches")
-    sys.stdout.flush()
+    log.debug(f"Starting train_vae_age_site_staged function")
+    log.debug(f"Training configuration - epochs_stage1={epochs_stage1}, epochs_stage2={epochs_stage2}, device={device}")
+    log.debug(f"Autoencoder type - {'Variational' if is_variational else 'Non-variational'}")
+    log.debug(f"KL annealing config - start_epoch={kl_annealing_start_epoch}, duration={kl_annealing_duration}, start_value={kl_annealing_start}")
+    log.debug(f"Data loaders - train_data has {len(train_data)} batches, val_data has {len(val_data)} batches")
     
     os.makedirs(save_dir, exist_ok=True)
-    print(f"DEBUG: Created directory {save_dir}")
-    sys.stdout.flush()
+    log.debug(f"Created directory {save_dir}")
     
-    torch.backends.cudnn.benchmark = True
+    # Per-epoch metrics log, written while training runs
+    metrics_log = MetricsWriter(os.path.join(save_dir, metrics_file) if metrics_file else None)
+    try:
+        # Fixed validation subset shared by all stages (None unless fast_val_subset is set)
+        fast_val_data = make_fast_val_loader(val_data, fast_val_subset)
+        torch.backends.cudnn.benchmark = True
     
-    # -------------------- AMP Setup --------------------
-    # Use automatic mixed precision only on CUDA when requested.
-    use_amp = mixed_precision and str(device).startswith("cuda") and torch.cuda.is_available()
-    scaler = torch.amp.GradScaler() if use_amp else None
-    # ---------------------------------------------------
+        # -------------------- AMP Setup --------------------
+        # Use automatic mixed precision only on CUDA when requested.
+        use_amp = mixed_precision and str(device).startswith("cuda") and torch.cuda.is_available()
+        scaler = torch.amp.GradScaler() if use_amp else None
+        # ---------------------------------------------------
      
-     # Move models to device
-    try:
-        print(f"DEBUG: Moving models to device {device}")
-        vae_model = vae_model.to(device)
-        age_predictor = age_predictor.to(device)
-        site_predictor = site_predictor.to(device)
-        print(f"DEBUG: Successfully moved models to {device}")
-        sys.stdout.flush()
-    except Exception as e:
-        print(f"ERROR moving models to device: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        sys.stdout.flush()
-        raise
-    
-    # Set up loss functions
-    print(f"DEBUG: Setting up loss functions")
-    sys.stdout.flush()
-    recon_criterion = torch.nn.MSELoss(reduction="mean")
-    age_criterion = torch.nn.L1Loss(reduction="mean")  # MAE
-    site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
-    
-    results = {}
-    
-    # STAGE 1: Train each model independently on raw data
-    print(f"\n{'='*40}\nSTAGE 1: Training models independently\n{'='*40}")
-    sys.stdout.flush()
-    
-    # --- STEP 1: Train VAE for reconstruction ---
-    print(f"\n{'-'*40}\nTraining {'VAE' if is_variational else 'Autoencoder'} for reconstruction...\n{'-'*40}")
-    sys.stdout.flush()
+         # Move models to device
+        try:
+            log.debug(f"Moving models to device {device}")
+            vae_model = vae_model.to(device)
+            age_predictor = age_predictor.to(device)
+            site_predictor = site_predictor.to(device)
+            log.debug(f"Successfully moved models to {device}")
+        except Exception as e:
+            log.error(f"ERROR moving models to device: {str(e)}")
+            import traceback
+            log.error(traceback.format_exc())
+            raise
     
-    try:
-        # Examine first batch of data
-        x_sample, labels_sample = next(iter(train_data))
-        print(f"DEBUG: First batch - x shape: {x_sample.shape}, labels shape: {labels_sample.shape}")
-        print(f"DEBUG: Labels sample: {labels_sample[0]}")
-        if labels_sample.shape[1] < 2:
-            print(f"WARNING: Labels only have {labels_sample.shape[1]} dimensions, expected at least 2")
-        sys.stdout.flush()
-    except Exception as e:
-        print(f"ERROR examining first batch: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        sys.stdout.flush()
-    
-    vae_optimizer = torch.optim.Adam(vae_model.parameters(), lr=lr)
-    vae_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(vae_optimizer, "min", patience=10, factor=0.5, verbose=True)
-    
-    best_vae_loss = float("inf")
-    best_vae_state = None
-    
-    # Initialize metrics tracking for VAE
-    vae_train_loss_epoch = []
-    vae_val_loss_epoch = []
-    vae_train_recon_loss_epoch = []
-    vae_val_recon_loss_epoch = []
-    vae_train_kl_loss_epoch = []
-    vae_val_kl_loss_epoch = []
-    vae_current_beta_epoch = []
-    vae_current_lr_epoch = []
-    
-    # Training loop for VAE
-    print(f"DEBUG: Starting VAE training loop for {epochs_stage1} epochs")
-    print(f"DEBUG: KL annealing will start at epoch {kl_annealing_start_epoch}")
-    sys.stdout.flush()
-    
-    for epoch in range(epochs_stage1):
-        print(f"DEBUG: VAE training - Starting epoch {epoch+1}/{epochs_stage1}")
-        sys.stdout.flush()
-        
-        # --- KL Beta Calculation ---
-        if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
-            annealing_epoch = epoch - kl_annealing_start_epoch
-            if annealing_epoch < kl_annealing_duration:
-                progress = annealing_epoch / kl_annealing_duration
-                sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
-                kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
+        # Set up loss functions
+        log.debug(f"Setting up loss functions")
+        recon_criterion = torch.nn.MSELoss(reduction="mean")
+        age_criterion = torch.nn.L1Loss(reduction="mean")  # MAE
+        site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
+    
+        results = {}
+    
+        # STAGE 1: Train each model independently on raw data
+        log.info(f"\n{'='*40}\nSTAGE 1: Training models independently\n{'='*40}")
+    
+        # --- STEP 1: Train VAE for reconstruction ---
+        log.info(f"\n{'-'*40}\nTraining {'VAE' if is_variational else 'Autoencoder'} for reconstruction...\n{'-'*40}")
+    
+        try:
+            # Examine first batch of data
+            x_sample, labels_sample = next(iter(train_data))
+            log.debug(f"First batch - x shape: {x_sample.shape}, labels shape: {labels_sample.shape}")
+            log.debug(f"Labels sample: {labels_sample[0]}")
+            if labels_sample.shape[1] < 2:
+                log.warning(f"WARNING: Labels only have {labels_sample.shape[1]} dimensions, expected at least 2")
+        except Exception as e:
+            log.error(f"ERROR examining first batch: {str(e)}")
+            import traceback
+            log.error(traceback.format_exc())
+    
+        vae_optimizer = torch.optim.Adam(vae_model.parameters(), lr=lr)
+        vae_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(vae_optimizer, "min", patience=10, factor=0.5, verbose=True)
+    
+        best_vae_loss = float("inf")
+        best_vae_state = None
+    
+        # Initialize metrics tracking for VAE
+        vae_train_loss_epoch = []
+        vae_val_loss_epoch = []
+        vae_train_recon_loss_epoch = []
+        vae_val_recon_loss_epoch = []
+        vae_train_kl_loss_epoch = []
+        vae_val_kl_loss_epoch = []
+        vae_current_beta_epoch = []
+        vae_current_lr_epoch = []
+    
+        # Training loop for VAE
+        log.debug(f"Starting VAE training loop for {epochs_stage1} epochs")
+        log.debug(f"KL annealing will start at epoch {kl_annealing_start_epoch}")
+    
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "vae")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        restored = load_stage_checkpoint(save_dir, "vae") if resume else None
+        if restored is not None:
+            log.info(f"Resuming: restored vae from its stage checkpoint")
+        for epoch in range(0 if restored is not None else epochs_stage1):
+            log.debug(f"VAE training - Starting epoch {epoch+1}/{epochs_stage1}")
+        
+            # --- KL Beta Calculation ---
+            if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
+                annealing_epoch = epoch - kl_annealing_start_epoch
+                if annealing_epoch < kl_annealing_duration:
+                    progress = annealing_epoch / kl_annealing_duration
+                    sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+                    kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
+                else:
+                    kl_annealing_factor = 1.0
             else:
-                kl_annealing_factor = 1.0
-        else:
-            kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
-        current_beta = w_kl * kl_annealing_factor
-        vae_current_beta_epoch.append(current_beta)
-        vae_current_lr_epoch.append(vae_optimizer.param_groups[0]["lr"])
-        
-        print(f"DEBUG: Current KL weight (beta): {current_beta:.6f}")
-        if not is_variational:
-            print(f"DEBUG: KL loss will be ignored for non-variational autoencoder")
-        sys.stdout.flush()
-        
-        # Training
-        vae_model.train()
-        train_recon_loss = 0.0
-        train_kl_loss = 0.0
-        train_total_loss = 0.0
-        train_items = 0
-        
-        print(f"DEBUG: VAE epoch {epoch+1} - Starting training loop over {len(train_data)} batches")
-        sys.stdout.flush()
-        
-        for i, (x, _) in enumerate(train_data):
-            if i == 0:
-                print(f"DEBUG: VAE epoch {epoch+1} - Processing first batch, shape={x.shape}")
-                sys.stdout.flush()
+                kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
+            current_beta = w_kl * kl_annealing_factor
+            vae_current_beta_epoch.append(current_beta)
+            vae_current_lr_epoch.append(vae_optimizer.param_groups[0]["lr"])
+        
+            log.debug(f"Current KL weight (beta): {current_beta:.6f}")
+            if not is_variational:
+                log.debug(f"KL loss will be ignored for non-variational autoencoder")
+        
+            # Training
+            vae_model.train()
+            train_recon_loss = 0.0
+            train_kl_loss = 0.0
+            train_total_loss = 0.0
+            train_items = 0
+        
+            log.debug(f"VAE epoch {epoch+1} - Starting training loop over {len(train_data)} batches")
+        
+            for i, (x, _) in enumerate(timer.iterate(train_data)):
+                if i == 0:
+                    log.debug(f"VAE epoch {epoch+1} - Processing first batch, shape={x.shape}")
             
-            batch_size = x.size(0)
+                batch_size = x.size(0)
             
-            try:
-                tract_data = x.to(device, non_blocking=True)
+                try:
+                    tract_data = x.to(device, non_blocking=True)
                 
-                vae_optimizer.zero_grad(set_to_none=True)
+                    vae_optimizer.zero_grad(set_to_none=True)
                 
-                with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                    if is_variational:
-                        x_hat, mean, logvar = vae_model(tract_data)
+                    with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                        if is_variational:
+                            x_hat, mean, logvar = vae_model(tract_data)
                         
-                        recon_loss = recon_criterion(x_hat, tract_data)
-                        kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
+                            recon_loss = recon_criterion(x_hat, tract_data)
+                            kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
                         
-                        # Explicitly ensure KL loss is zero before start_epoch
-                        if epoch < kl_annealing_start_epoch:
-                            weighted_kl_loss = 0.0
-                            # Still track the raw KL loss for monitoring
-                            kl_loss = kl_loss_raw
-                        else:
-                            weighted_kl_loss = current_beta * kl_loss_raw
-                            kl_loss = kl_loss_raw
+                            # Explicitly ensure KL loss is zero before start_epoch
+                            if epoch < kl_annealing_start_epoch:
+                                weighted_kl_loss = 0.0
+                                # Still track the raw KL loss for monitoring
+                                kl_loss = kl_loss_raw
+                            else:
+                                weighted_kl_loss = current_beta * kl_loss_raw
+                                kl_loss = kl_loss_raw
                         
-                        total_loss = recon_loss + weighted_kl_loss
-                    else:
-                        # Non-variational autoencoder - only returns x_hat
-                        x_hat = vae_model(tract_data)
+                            total_loss = recon_loss + weighted_kl_loss
+                        else:
+                            # Non-variational autoencoder - only returns x_hat
+                            x_hat = vae_model(tract_data)
                         
-                        recon_loss = recon_criterion(x_hat, tract_data)
-                        kl_loss = torch.tensor(0.0, device=device)  # No KL loss for standard autoencoder
+                            recon_loss = recon_criterion(x_hat, tract_data)
+                            kl_loss = torch.tensor(0.0, device=device)  # No KL loss for standard autoencoder
                         
-                        total_loss = recon_loss  # Only reconstruction loss
+                            total_loss = recon_loss  # Only reconstruction loss
                 
-                if use_amp:
-                    scaler.scale(total_loss).backward()
-                    # Unscale gradients before clipping
-                    scaler.unscale_(vae_optimizer)
-                    torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
-                    # Perform optimizer step with the scaler and update it
-                    scaler.step(vae_optimizer)
-                    scaler.update()
-                else:
-                    total_loss.backward()
-                    torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
-                    vae_optimizer.step()
+                    timer.lap("forward")
+                    if use_amp:
+                        scaler.scale(total_loss).backward()
+                        # Unscale gradients before clipping
+                        scaler.unscale_(vae_optimizer)
+                        timer.lap("backward")
+                        torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
+                        timer.lap("clip")
+                        # Perform optimizer step with the scaler and update it
+                        scaler.step(vae_optimizer)
+                        scaler.update()
+                        timer.lap("optimizer")
+                        profiler.step()
+                    else:
+                        total_loss.backward()
+                        timer.lap("backward")
+                        torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
+                        timer.lap("clip")
+                        vae_optimizer.step()
+                        timer.lap("optimizer")
+                        profiler.step()
                 
-                train_items += batch_size
-                train_recon_loss += recon_loss.item() * batch_size
-                train_kl_loss += kl_loss.item() * batch_size  # Store raw KL for monitoring
-                train_total_loss += total_loss.item() * batch_size
+                    train_items += batch_size
+                    train_recon_loss += recon_loss.item() * batch_size
+                    train_kl_loss += kl_loss.item() * batch_size  # Store raw KL for monitoring
+                    train_total_loss += total_loss.item() * batch_size
                 
-                if i == 0:
-                    print(f"DEBUG: VAE epoch {epoch+1} - Completed first batch successfully")
-                    if epoch < kl_annealing_start_epoch:
-                        print(f"DEBUG: KL loss calculated but not used in total loss: {kl_loss.item():.6f}")
-                    sys.stdout.flush()
+                    if i == 0:
+                        log.debug(f"VAE epoch {epoch+1} - Completed first batch successfully")
+                        if epoch < kl_annealing_start_epoch:
+                            log.debug(f"KL loss calculated but not used in total loss: {kl_loss.item():.6f}")
                 
-                if (i + 1) % 10 == 0:
-                    print(f"\rEpoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}", end="")
-                    sys.stdout.flush()
+                    if (i + 1) % 10 == 0:
+                        log.progress(f"Epoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}")
                     
-            except Exception as e:
-                print(f"\nERROR in VAE training batch {i}: {str(e)}")
-                import traceback
-                print(traceback.format_exc())
-                sys.stdout.flush()
-                raise
-        
-        print(f"\nDEBUG: VAE epoch {epoch+1} - Training loop completed, starting validation")
-        sys.stdout.flush()
-        
-        # Validation
-        vae_model.eval()
-        val_recon_loss = 0.0
-        val_kl_loss = 0.0
-        val_total_loss = 0.0
-        val_items = 0
-        
-        with torch.no_grad():
-            for x, _ in val_data:
-                batch_size = x.size(0)
-                tract_data = x.to(device, non_blocking=True)
+                except Exception as e:
+                    log.error(f"ERROR in VAE training batch {i}: {str(e)}")
+                    import traceback
+                    log.error(traceback.format_exc())
+                    raise
+        
+            log.debug(f"VAE epoch {epoch+1} - Training loop completed, starting validation")
+        
+            avg_train_recon_loss = train_recon_loss / train_items
+            avg_train_kl_loss = train_kl_loss / train_items
+            avg_train_total_loss = train_total_loss / train_items
+        
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                # Validation
+                vae_model.eval()
+                val_recon_loss = 0.0
+                val_kl_loss = 0.0
+                val_total_loss = 0.0
+                val_items = 0
+        
+                with torch.inference_mode():
+                    for x, _ in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
                 
-                with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                    if is_variational:
-                        x_hat, mean, logvar = vae_model(tract_data)
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            if is_variational:
+                                x_hat, mean, logvar = vae_model(tract_data)
                         
-                        recon_loss = recon_criterion(x_hat, tract_data)
-                        kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
+                                recon_loss = recon_criterion(x_hat, tract_data)
+                                kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
                         
-                        # Explicitly ensure KL loss is zero before start_epoch for validation too
-                        if epoch < kl_annealing_start_epoch:
-                            weighted_kl_loss = 0.0
-                            # Still track the raw KL loss for monitoring
-                            kl_loss = kl_loss_raw
-                        else:
-                            weighted_kl_loss = current_beta * kl_loss_raw
-                            kl_loss = kl_loss_raw
+                                # Explicitly ensure KL loss is zero before start_epoch for validation too
+                                if epoch < kl_annealing_start_epoch:
+                                    weighted_kl_loss = 0.0
+                                    # Still track the raw KL loss for monitoring
+                                    kl_loss = kl_loss_raw
+                                else:
+                                    weighted_kl_loss = current_beta * kl_loss_raw
+                                    kl_loss = kl_loss_raw
                         
-                        total_loss = recon_loss + weighted_kl_loss
-                    else:
-                        # Non-variational autoencoder - only returns x_hat
-                        x_hat = vae_model(tract_data)
+                                total_loss = recon_loss + weighted_kl_loss
+                            else:
+                                # Non-variational autoencoder - only returns x_hat
+                                x_hat = vae_model(tract_data)
                         
-                        recon_loss = recon_criterion(x_hat, tract_data)
-                        kl_loss = torch.tensor(0.0, device=device)  # No KL loss for standard autoencoder
+                                recon_loss = recon_criterion(x_hat, tract_data)
+                                kl_loss = torch.tensor(0.0, device=device)  # No KL loss for standard autoencoder
                         
-                        total_loss = recon_loss  # Only reconstruction loss
+                                total_loss = recon_loss  # Only reconstruction loss
                 
-                # No backward pass or optimizer step during validation
-                val_items += batch_size
-                val_recon_loss += recon_loss.item() * batch_size
-                val_kl_loss += kl_loss.item() * batch_size  # Store raw KL for monitoring
-                val_total_loss += total_loss.item() * batch_size
-        
-        avg_train_recon_loss = train_recon_loss / train_items
-        avg_train_kl_loss = train_kl_loss / train_items
-        avg_train_total_loss = train_total_loss / train_items
-        
-        avg_val_recon_loss = val_recon_loss / val_items
-        avg_val_kl_loss = val_kl_loss / val_items
-        avg_val_total_loss = val_total_loss / val_items
-        
-        # Store metrics
-        vae_train_loss_epoch.append(avg_train_total_loss)
-        vae_val_loss_epoch.append(avg_val_total_loss)
-        vae_train_recon_loss_epoch.append(avg_train_recon_loss)
-        vae_val_recon_loss_epoch.append(avg_val_recon_loss)
-        vae_train_kl_loss_epoch.append(avg_train_kl_loss)
-        vae_val_kl_loss_epoch.append(avg_val_kl_loss)
-        
-        print(f"\nEpoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_total_loss:.4f} | Val Loss: {avg_val_total_loss:.4f}")
-        print(f"  Recon Loss: {avg_train_recon_loss:.4f} (train) / {avg_val_recon_loss:.4f} (val)")
-        print(f"  KL Loss: {avg_train_kl_loss:.4f} (train) / {avg_val_kl_loss:.4f} (val)")
-        print(f"  KL Weight: {current_beta:.6f}")
-        sys.stdout.flush()
-        
-        vae_scheduler.step(avg_val_total_loss)
-        
-        # Save best model
-        if avg_val_total_loss < best_vae_loss:
-            best_vae_loss = avg_val_total_loss
-            best_vae_state = vae_model.state_dict()
-            torch.save(best_vae_state, os.path.join(save_dir, "best_vae.pth"))
-            print(f"  Saved best {'VAE' if is_variational else 'Autoencoder'} model with validation loss: {best_vae_loss:.4f}")
-            sys.stdout.flush()
-        
-        # Periodic saving every N epochs
-        if (epoch + 1) % periodic_save_interval == 0:
-            periodic_vae_path = os.path.join(save_dir, f"vae_epoch_{epoch+1}.pth")
-            # Ensure the save directory exists
-            os.makedirs(save_dir, exist_ok=True)
-            torch.save(vae_model.state_dict(), periodic_vae_path)
-            print(f"  Saved periodic {'VAE' if is_variational else 'Autoencoder'} model at epoch {epoch+1} to {periodic_vae_path}")
-    
-    # Load best VAE model
-    vae_model.load_state_dict(best_vae_state)
-    results["vae"] = {
-        "best_val_loss": best_vae_loss,
-        "train_loss_epoch": vae_train_loss_epoch,
-        "val_loss_epoch": vae_val_loss_epoch,
-        "train_recon_loss_epoch": vae_train_recon_loss_epoch,
-        "val_recon_loss_epoch": vae_val_recon_loss_epoch,
-        "train_kl_loss_epoch": vae_train_kl_loss_epoch,
-        "val_kl_loss_epoch": vae_val_kl_loss_epoch,
-        "current_beta_epoch": vae_current_beta_epoch,
-        "current_lr_epoch": vae_current_lr_epoch
-    }
+                        # No backward pass or optimizer step during validation
+                        val_items += batch_size
+                        val_recon_loss += recon_loss.item() * batch_size
+                        val_kl_loss += kl_loss.item() * batch_size  # Store raw KL for monitoring
+                        val_total_loss += total_loss.item() * batch_size
+        
+                avg_val_recon_loss = val_recon_loss / val_items
+                avg_val_kl_loss = val_kl_loss / val_items
+                avg_val_total_loss = val_total_loss / val_items
+            else:
+                avg_val_recon_loss = avg_val_kl_loss = avg_val_total_loss = float("nan")
+        
+            # Store metrics
+            vae_train_loss_epoch.append(avg_train_total_loss)
+            vae_val_loss_epoch.append(avg_val_total_loss)
+            vae_train_recon_loss_epoch.append(avg_train_recon_loss)
+            vae_val_recon_loss_epoch.append(avg_val_recon_loss)
+            vae_train_kl_loss_epoch.append(avg_train_kl_loss)
+            vae_val_kl_loss_epoch.append(avg_val_kl_loss)
+            timer.lap("validation")
+        
+            log.info(f"Epoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_total_loss:.4f} | Val Loss: {avg_val_total_loss:.4f}")
+            log.info(f"  Recon Loss: {avg_train_recon_loss:.4f} (train) / {avg_val_recon_loss:.4f} (val)")
+            log.info(f"  KL Loss: {avg_train_kl_loss:.4f} (train) / {avg_val_kl_loss:.4f} (val)")
+            log.info(f"  KL Weight: {current_beta:.6f}")
+        
+            if val_pass is not None:
+                vae_scheduler.step(avg_val_total_loss)
+        
+            timer.mark()
+            # Save best model
+            if val_schedule.selects_best(val_pass) and avg_val_total_loss < best_vae_loss:
+                best_vae_loss = avg_val_total_loss
+                best_vae_state = vae_model.state_dict()
+                torch.save(best_vae_state, os.path.join(save_dir, "best_vae.pth"))
+                log.info(f"  Saved best {'VAE' if is_variational else 'Autoencoder'} model with validation loss: {best_vae_loss:.4f}")
+        
+            # Periodic saving every N epochs
+            if (epoch + 1) % periodic_save_interval == 0:
+                periodic_vae_path = os.path.join(save_dir, f"vae_epoch_{epoch+1}.pth")
+                # Ensure the save directory exists
+                os.makedirs(save_dir, exist_ok=True)
+                torch.save(vae_model.state_dict(), periodic_vae_path)
+                log.info(f"  Saved periodic {'VAE' if is_variational else 'Autoencoder'} model at epoch {epoch+1} to {periodic_vae_path}")
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("vae", epoch + 1, {
+                "train_loss": vae_train_loss_epoch,
+                "val_loss": vae_val_loss_epoch,
+                "train_recon_loss": vae_train_recon_loss_epoch,
+                "val_recon_loss": vae_val_recon_loss_epoch,
+                "train_kl_loss": vae_train_kl_loss_epoch,
+                "val_kl_loss": vae_val_kl_loss_epoch,
+                "current_beta": vae_current_beta_epoch,
+                "current_lr": vae_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
     
-    # --- STEP 2: Train Age Predictor on raw data ---
-    print(f"\n{'-'*40}\nTraining Age Predictor on raw data...\n{'-'*40}")
+        profiler.stop()
+        # Load best VAE model
+        if restored is not None:
+            best_vae_state = restored["state_dict"]
+        vae_model.load_state_dict(best_vae_state)
+        results["vae"] = {
+            "best_val_loss": best_vae_loss,
+            "train_loss_epoch": vae_train_loss_epoch,
+            "val_loss_epoch": vae_val_loss_epoch,
+            "train_recon_loss_epoch": vae_train_recon_loss_epoch,
+            "val_recon_loss_epoch": vae_val_recon_loss_epoch,
+            "train_kl_loss_epoch": vae_train_kl_loss_epoch,
+            "val_kl_loss_epoch": vae_val_kl_loss_epoch,
+            "current_beta_epoch": vae_current_beta_epoch,
+            "current_lr_epoch": vae_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
+        if restored is not None:
+            results["vae"] = restored["results"]
+        else:
+            save_stage_checkpoint(save_dir, "vae", results["vae"], vae_model.state_dict())
     
-    age_optimizer = torch.optim.Adam(age_predictor.parameters(), lr=lr)
-    age_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(age_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        # --- STEP 2: Train Age Predictor on raw data ---
+        log.info(f"\n{'-'*40}\nTraining Age Predictor on raw data...\n{'-'*40}")
     
-    best_age_mae = float("inf")
-    best_age_state = None
+        age_optimizer = torch.optim.Adam(age_predictor.parameters(), lr=lr)
+        age_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(age_optimizer, "min", patience=10, factor=0.5, verbose=True)
     
-    # Initialize metrics tracking for Age Predictor
-    age_train_loss_epoch = []
-    age_val_loss_epoch = []
-    age_train_r2_epoch = []  # Add R² tracking
-    age_val_r2_epoch = []    # Add R² tracking
-    age_current_lr_epoch = []
+        best_age_mae = float("inf")
+        best_age_state = None
     
-    # Training loop for Age Predictor on raw data
-    for epoch in range(epochs_stage1*2):
-        age_current_lr_epoch.append(age_optimizer.param_groups[0]["lr"])
-        
-        # Training
-        age_predictor.train()
-        train_age_loss = 0.0
-        train_predictions = []
-        train_targets = []
-        train_items = 0
-        
-        for i, (x, labels) in enumerate(train_data):
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            age_true = labels[:, 0].float().unsqueeze(1).to(device)
-            # sex_data = labels[:, 1].float().to(device)  # Get sex data from labels - REMOVED
-            
-            age_optimizer.zero_grad(set_to_none=True)
-            
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                age_pred = age_predictor(tract_data)  # Pass sex data to age predictor - REMOVED sex_data
-                age_loss = age_criterion(age_pred, age_true)
-            
-            if use_amp:
-                scaler.scale(age_loss).backward()
-                scaler.unscale_(age_optimizer)
-                torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
-                scaler.step(age_optimizer)
-                scaler.update()
-            else:
-                age_loss.backward()
-                torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
-                age_optimizer.step()
-            
-            train_items += batch_size
-            train_age_loss += age_loss.item() * batch_size
-            
-            # Collect predictions and targets for R² calculation
-            train_predictions.append(age_pred.detach())
-            train_targets.append(age_true.detach())
-            
-            if (i + 1) % 10 == 0:
-                print(f"\rEpoch {epoch+1}/{epochs_stage1*2} | Batch {i+1}/{len(train_data)} | MAE: {age_loss.item():.4f}", end="")
-        
-        # Calculate R² for training set
-        all_train_preds = torch.cat(train_predictions)
-        all_train_targets = torch.cat(train_targets)
-        
-        # Add diagnostic information
-        with torch.no_grad():
-            train_pred_mean = all_train_preds.mean().item()
-            train_pred_std = all_train_preds.std().item() 
-            train_true_mean = all_train_targets.mean().item()
-            train_true_std = all_train_targets.std().item()
-            train_correlation = torch.corrcoef(torch.stack([all_train_preds.flatten(), all_train_targets.flatten()]))[0,1].item()
-            
-            print(f"\nDiagnostics for training:")
-            print(f"  Predictions: mean={train_pred_mean:.2f}, std={train_pred_std:.2f}, min={all_train_preds.min().item():.2f}, max={all_train_preds.max().item():.2f}")
-            print(f"  True values: mean={train_true_mean:.2f}, std={train_true_std:.2f}, min={all_train_targets.min().item():.2f}, max={all_train_targets.max().item():.2f}")
-            print(f"  Correlation: {train_correlation:.4f}")
-            
-            # If there's almost no variation in predictions, that's a problem
-            if train_pred_std < 0.1 * train_true_std:
-                print(f"  WARNING: Predictions have very low variation compared to true values!")
-        
-        # Use verbose mode in early epochs
-        verbose = (epoch < 5) 
-        train_r2 = calculate_r2_score(all_train_targets, all_train_preds, verbose=verbose)
-        
-        # Validation
-        age_predictor.eval()
-        val_age_loss = 0.0
-        val_predictions = []
-        val_targets = []
-        val_items = 0
-        
-        with torch.no_grad():
-            for x, labels in val_data:
+        # Initialize metrics tracking for Age Predictor
+        age_train_loss_epoch = []
+        age_val_loss_epoch = []
+        age_train_r2_epoch = []  # Add R² tracking
+        age_val_r2_epoch = []    # Add R² tracking
+        age_current_lr_epoch = []
+    
+        # Training loop for Age Predictor on raw data
+        val_schedule = ValidationSchedule(val_data, epochs_stage1*2, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "age_predictor")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        restored = load_stage_checkpoint(save_dir, "age_predictor") if resume else None
+        if restored is not None:
+            log.info(f"Resuming: restored age_predictor from its stage checkpoint")
+        for epoch in range(0 if restored is not None else epochs_stage1*2):
+            age_current_lr_epoch.append(age_optimizer.param_groups[0]["lr"])
+        
+            # Training
+            age_predictor.train()
+            train_age_loss = 0.0
+            train_predictions = []
+            train_targets = []
+            train_items = 0
+        
+            for i, (x, labels) in enumerate(timer.iterate(train_data)):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 age_true = labels[:, 0].float().unsqueeze(1).to(device)
-                # sex_data = labels[:, 1].float().to(device) - REMOVED
-                
+                # sex_data = labels[:, 1].float().to(device)  # Get sex data from labels - REMOVED
+            
+                age_optimizer.zero_grad(set_to_none=True)
+            
                 with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                    age_pred = age_predictor(tract_data)  # REMOVED sex_data
+                    age_pred = age_predictor(tract_data)  # Pass sex data to age predictor - REMOVED sex_data
                     age_loss = age_criterion(age_pred, age_true)
+            
+                timer.lap("forward")
+                if use_amp:
+                    scaler.scale(age_loss).backward()
+                    scaler.unscale_(age_optimizer)
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    scaler.step(age_optimizer)
+                    scaler.update()
+                    timer.lap("optimizer")
+                    profiler.step()
+                else:
+                    age_loss.backward()
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    age_optimizer.step()
+                    timer.lap("optimizer")
+                    profiler.step()
+            
+                train_items += batch_size
+                train_age_loss += age_loss.item() * batch_size
+            
+                # Collect predictions and targets for R² calculation
+                train_predictions.append(age_pred.detach())
+                train_targets.append(age_true.detach())
+            
+                if (i + 1) % 10 == 0:
+                    log.progress(f"Epoch {epoch+1}/{epochs_stage1*2} | Batch {i+1}/{len(train_data)} | MAE: {age_loss.item():.4f}")
+        
+            # Calculate R² for training set
+            all_train_preds = torch.cat(train_predictions)
+            all_train_targets = torch.cat(train_targets)
+        
+            # Add diagnostic information
+            with torch.no_grad():
+                train_pred_mean = all_train_preds.mean().item()
+                train_pred_std = all_train_preds.std().item() 
+                train_true_mean = all_train_targets.mean().item()
+                train_true_std = all_train_targets.std().item()
+                train_correlation = torch.corrcoef(torch.stack([all_train_preds.flatten(), all_train_targets.flatten()]))[0,1].item()
+            
+                log.debug(f"Diagnostics for training:")
+                log.debug(f"  Predictions: mean={train_pred_mean:.2f}, std={train_pred_std:.2f}, min={all_train_preds.min().item():.2f}, max={all_train_preds.max().item():.2f}")
+                log.debug(f"  True values: mean={train_true_mean:.2f}, std={train_true_std:.2f}, min={all_train_targets.min().item():.2f}, max={all_train_targets.max().item():.2f}")
+                log.debug(f"  Correlation: {train_correlation:.4f}")
+            
+                # If there's almost no variation in predictions, that's a problem
+                if train_pred_std < 0.1 * train_true_std:
+                    log.warning(f"  WARNING: Predictions have very low variation compared to true values!")
+        
+            # Use verbose mode in early epochs
+            verbose = (epoch < 5) and log.enabled_for("debug")
+            train_r2 = calculate_r2_score(all_train_targets, all_train_preds, verbose=verbose)
+            avg_train_age_loss = train_age_loss / train_items
+        
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                # Validation
+                age_predictor.eval()
+                val_age_loss = 0.0
+                val_predictions = []
+                val_targets = []
+                val_items = 0
+        
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                        # sex_data = labels[:, 1].float().to(device) - REMOVED
                 
-                val_items += batch_size
-                val_age_loss += age_loss.item() * batch_size
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            age_pred = age_predictor(tract_data)  # REMOVED sex_data
+                            age_loss = age_criterion(age_pred, age_true)
                 
-                # Collect predictions and targets for R² calculation
-                val_predictions.append(age_pred)
-                val_targets.append(age_true)
-        
-        # Calculate R² for validation set
-        all_val_preds = torch.cat(val_predictions)
-        all_val_targets = torch.cat(val_targets)
-        
-        # Add diagnostic information
-        with torch.no_grad():
-            val_pred_mean = all_val_preds.mean().item()
-            val_pred_std = all_val_preds.std().item() 
-            val_true_mean = all_val_targets.mean().item()
-            val_true_std = all_val_targets.std().item()
-            val_correlation = torch.corrcoef(torch.stack([all_val_preds.flatten(), all_val_targets.flatten()]))[0,1].item()
-            
-            print(f"\nDiagnostics for validation:")
-            print(f"  Predictions: mean={val_pred_mean:.2f}, std={val_pred_std:.2f}, min={all_val_preds.min().item():.2f}, max={all_val_preds.max().item():.2f}")
-            print(f"  True values: mean={val_true_mean:.2f}, std={val_true_std:.2f}, min={all_val_targets.min().item():.2f}, max={all_val_targets.max().item():.2f}")
-            print(f"  Correlation: {val_correlation:.4f}")
-            
-            # If there's almost no variation in predictions, that's a problem
-            if val_pred_std < 0.1 * val_true_std:
-                print(f"  WARNING: Predictions have very low variation compared to true values!")
-        
-        # Use verbose mode in early epochs
-        val_r2 = calculate_r2_score(all_val_targets, all_val_preds, verbose=verbose)
-        
-        avg_train_age_loss = train_age_loss / train_items
-        avg_val_age_loss = val_age_loss / val_items
-        
-        # Store metrics
-        age_train_loss_epoch.append(avg_train_age_loss)
-        age_val_loss_epoch.append(avg_val_age_loss)
-        age_train_r2_epoch.append(train_r2)
-        age_val_r2_epoch.append(val_r2)
-        
-        print(f"\nEpoch {epoch+1}/{epochs_stage1*2} | Train MAE: {avg_train_age_loss:.4f} | Val MAE: {avg_val_age_loss:.4f}")
-        print(f"  Train R²: {train_r2:.4f} | Val R²: {val_r2:.4f}")
-        
-        age_scheduler.step(avg_val_age_loss)
-        
-        # Save best model
-        if avg_val_age_loss < best_age_mae:
-            best_age_mae = avg_val_age_loss
-            best_age_state = age_predictor.state_dict()
-            torch.save(best_age_state, os.path.join(save_dir, "best_age_predictor.pth"))
-            print(f"  Saved best Age Predictor model with validation MAE: {best_age_mae:.4f}, R²: {val_r2:.4f}")
-    
-    # Load best Age Predictor model
-    age_predictor.load_state_dict(best_age_state)
-    results["age_predictor"] = {
-        "best_val_mae": best_age_mae,
-        "train_loss_epoch": age_train_loss_epoch,
-        "val_loss_epoch": age_val_loss_epoch,
-        "train_r2_epoch": age_train_r2_epoch,  # Add R² metrics to results
-        "val_r2_epoch": age_val_r2_epoch,      # Add R² metrics to results
-        "current_lr_epoch": age_current_lr_epoch
-    }
+                        val_items += batch_size
+                        val_age_loss += age_loss.item() * batch_size
+                
+                        # Collect predictions and targets for R² calculation
+                        val_predictions.append(age_pred)
+                        val_targets.append(age_true)
+        
+                # Calculate R² for validation set
+                all_val_preds = torch.cat(val_predictions)
+                all_val_targets = torch.cat(val_targets)
+        
+                # Add diagnostic information
+                with torch.no_grad():
+                    val_pred_mean = all_val_preds.mean().item()
+                    val_pred_std = all_val_preds.std().item() 
+                    val_true_mean = all_val_targets.mean().item()
+                    val_true_std = all_val_targets.std().item()
+                    val_correlation = torch.corrcoef(torch.stack([all_val_preds.flatten(), all_val_targets.flatten()]))[0,1].item()
+            
+                    log.debug(f"Diagnostics for validation:")
+                    log.debug(f"  Predictions: mean={val_pred_mean:.2f}, std={val_pred_std:.2f}, min={all_val_preds.min().item():.2f}, max={all_val_preds.max().item():.2f}")
+                    log.debug(f"  True values: mean={val_true_mean:.2f}, std={val_true_std:.2f}, min={all_val_targets.min().item():.2f}, max={all_val_targets.max().item():.2f}")
+                    log.debug(f"  Correlation: {val_correlation:.4f}")
+            
+                    # If there's almost no variation in predictions, that's a problem
+                    if val_pred_std < 0.1 * val_true_std:
+                        log.warning(f"  WARNING: Predictions have very low variation compared to true values!")
+        
+                # Use verbose mode in early epochs
+                val_r2 = calculate_r2_score(all_val_targets, all_val_preds, verbose=verbose)
+        
+                avg_val_age_loss = val_age_loss / val_items
+            else:
+                avg_val_age_loss = val_r2 = float("nan")
+        
+            # Store metrics
+            age_train_loss_epoch.append(avg_train_age_loss)
+            age_val_loss_epoch.append(avg_val_age_loss)
+            age_train_r2_epoch.append(train_r2)
+            age_val_r2_epoch.append(val_r2)
+            timer.lap("validation")
+        
+            log.info(f"Epoch {epoch+1}/{epochs_stage1*2} | Train MAE: {avg_train_age_loss:.4f} | Val MAE: {avg_val_age_loss:.4f}")
+            log.info(f"  Train R²: {train_r2:.4f} | Val R²: {val_r2:.4f}")
+        
+            if val_pass is not None:
+                age_scheduler.step(avg_val_age_loss)
+        
+            timer.mark()
+            # Save best model
+            if val_schedule.selects_best(val_pass) and avg_val_age_loss < best_age_mae:
+                best_age_mae = avg_val_age_loss
+                best_age_state = age_predictor.state_dict()
+                torch.save(best_age_state, os.path.join(save_dir, "best_age_predictor.pth"))
+                log.info(f"  Saved best Age Predictor model with validation MAE: {best_age_mae:.4f}, R²: {val_r2:.4f}")
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("age_predictor", epoch + 1, {
+                "train_loss": age_train_loss_epoch,
+                "val_loss": age_val_loss_epoch,
+                "train_r2": age_train_r2_epoch,
+                "val_r2": age_val_r2_epoch,
+                "current_lr": age_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
     
-    # --- STEP 3: Train Site Predictor on raw data ---
-    print(f"\n{'-'*40}\nTraining Site Predictor on raw data...\n{'-'*40}")
+        profiler.stop()
+        # Load best Age Predictor model
+        if restored is not None:
+            best_age_state = restored["state_dict"]
+        age_predictor.load_state_dict(best_age_state)
+        results["age_predictor"] = {
+            "best_val_mae": best_age_mae,
+            "train_loss_epoch": age_train_loss_epoch,
+            "val_loss_epoch": age_val_loss_epoch,
+            "train_r2_epoch": age_train_r2_epoch,  # Add R² metrics to results
+            "val_r2_epoch": age_val_r2_epoch,      # Add R² metrics to results
+            "current_lr_epoch": age_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
+        if restored is not None:
+            results["age_predictor"] = restored["results"]
+        else:
+            save_stage_checkpoint(save_dir, "age_predictor", results["age_predictor"], age_predictor.state_dict())
     
-    site_optimizer = torch.optim.Adam(site_predictor.parameters(), lr=lr)
-    site_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(site_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        # --- STEP 3: Train Site Predictor on raw data ---
+        log.info(f"\n{'-'*40}\nTraining Site Predictor on raw data...\n{'-'*40}")
     
-    best_site_loss = float("inf")
-    best_site_state = None
+        site_optimizer = torch.optim.Adam(site_predictor.parameters(), lr=lr)
+        site_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(site_optimizer, "min", patience=10, factor=0.5, verbose=True)
     
-    site_train_loss_epoch = []
-    site_val_loss_epoch = []
-    site_train_acc_epoch = []
-    site_val_acc_epoch = []
-    site_current_lr_epoch = []
+        best_site_loss = float("inf")
+        best_site_state = None
     
-    # Training loop for Site Predictor on raw data
-    for epoch in range(epochs_stage1):
-        site_current_lr_epoch.append(site_optimizer.param_groups[0]["lr"])
-        
-        # Training
-        site_predictor.train()
-        train_site_loss = 0.0
-        train_site_correct = 0
-        train_items = 0
-        
-        for i, (x, labels) in enumerate(train_data):
-
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            site_true = labels[:, 2].long().to(device, non_blocking=True)
+        site_train_loss_epoch = []
+        site_val_loss_epoch = []
+        site_train_acc_epoch = []
+        site_val_acc_epoch = []
+        site_current_lr_epoch = []
+    
+        # Training loop for Site Predictor on raw data
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "site_predictor")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        restored = load_stage_checkpoint(save_dir, "site_predictor") if resume else None
+        if restored is not None:
+            log.info(f"Resuming: restored site_predictor from its stage checkpoint")
+        for epoch in range(0 if restored is not None else epochs_stage1):
+            site_current_lr_epoch.append(site_optimizer.param_groups[0]["lr"])
+        
+            # Training
+            site_predictor.train()
+            train_site_loss = 0.0
+            train_site_correct = 0
+            train_items = 0
+        
+            for i, (x, labels) in enumerate(timer.iterate(train_data)):
 
-            site_optimizer.zero_grad(set_to_none=True)
-            
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                site_pred = site_predictor(tract_data)
-                site_loss = site_criterion(site_pred, site_true)
-
-            if epoch == 0 and i < 3:  
-                print(f"Site training debug - Batch {i}:")
-                print(f"  True site labels: {site_true.cpu().unique()}")
-                print(f"  Predicted site classes: {torch.argmax(site_pred, dim=1).cpu().unique()}")
-                print(f"  Raw predictions shape: {site_pred.shape}, Example: {site_pred[0]}")
-            
-            if use_amp:
-                scaler.scale(site_loss).backward()
-                scaler.unscale_(site_optimizer)
-                torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
-                scaler.step(site_optimizer)
-                scaler.update()
-            else:
-                site_loss.backward()
-                torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
-                site_optimizer.step()
-            
-            train_items += batch_size
-            train_site_loss += site_loss.item() * batch_size
-            _, predicted_sites = torch.max(site_pred.data, 1)
-            train_site_correct += (predicted_sites == site_true).sum().item()
-            
-            if (i + 1) % 10 == 0:
-                print(f"\rEpoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {site_loss.item():.4f}", end="")
-        
-        site_predictor.eval()
-        val_site_loss = 0.0
-        val_site_correct = 0
-        val_items = 0
-        
-        with torch.no_grad():
-            for x, labels in val_data:
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 site_true = labels[:, 2].long().to(device, non_blocking=True)
-                
+
+                site_optimizer.zero_grad(set_to_none=True)
+            
                 with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
                     site_pred = site_predictor(tract_data)
                     site_loss = site_criterion(site_pred, site_true)
-                
-                val_items += batch_size
-                val_site_loss += site_loss.item() * batch_size
-                _, predicted_sites = torch.max(site_pred.data, 1)
-                val_site_correct += (predicted_sites == site_true).sum().item()
-        
-        avg_train_site_loss = train_site_loss / train_items
-        avg_train_site_acc = (train_site_correct / train_items) * 100
-        avg_val_site_loss = val_site_loss / val_items
-        avg_val_site_acc = (val_site_correct / val_items) * 100
-        
-        site_train_loss_epoch.append(avg_train_site_loss)
-        site_val_loss_epoch.append(avg_val_site_loss)
-        site_train_acc_epoch.append(avg_train_site_acc)
-        site_val_acc_epoch.append(avg_val_site_acc)
-        
-        print(f"\nEpoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_site_loss:.4f} | Train Acc: {avg_train_site_acc:.2f}% | Val Loss: {avg_val_site_loss:.4f} | Val Acc: {avg_val_site_acc:.2f}%")
-        
-        site_scheduler.step(avg_val_site_loss)
-        
-        if avg_val_site_loss < best_site_loss:
-            best_site_loss = avg_val_site_loss
-            best_site_state = site_predictor.state_dict()
-            torch.save(best_site_state, os.path.join(save_dir, "best_site_predictor.pth"))
-            print(f"  Saved best Site Predictor model with validation loss: {best_site_loss:.4f} (Acc: {avg_val_site_acc:.2f}%)")
-    
-    # Load best Site Predictor model
-    site_predictor.load_state_dict(best_site_state)
-    results["site_predictor"] = {
-        "best_val_loss": best_site_loss,
-        "train_loss_epoch": site_train_loss_epoch,
-        "val_loss_epoch": site_val_loss_epoch,
-        "train_acc_epoch": site_train_acc_epoch,
-        "val_acc_epoch": site_val_acc_epoch,
-        "current_lr_epoch": site_current_lr_epoch
-    }
-    
 
-    # STAGE 2: Train Combined Model with Frozen Predictors
-
-    print(f"\n{'='*40}\nSTAGE 2: Training Combined Model with Frozen Predictors\n{'='*40}")
-    
-    # Create combined model
-    from models import CombinedAE_Predictors
-    combined_model = CombinedAE_Predictors(vae_model, age_predictor, site_predictor, is_variational=is_variational)
-    combined_model = combined_model.to(device)
-
-    # Training metrics - keep all your existing metrics
-    train_loss_epoch = []
-    val_loss_epoch = []
-    train_recon_loss_epoch = []
-    val_recon_loss_epoch = []
-    train_kl_loss_epoch = []
-    val_kl_loss_epoch = []
-    train_age_loss_epoch = []
-    val_age_loss_epoch = []
-    train_site_loss_epoch = []
-    val_site_loss_epoch = []
-    train_age_mae_epoch = []
-    val_age_mae_epoch = []
-    train_site_acc_epoch = []
-    val_site_acc_epoch = []
-    train_age_r2_epoch = []  # Add R² tracking
-    val_age_r2_epoch = []    # Add R² tracking
-    current_beta_epoch = []
-    current_grl_alpha_epoch = []
-    current_lr_epoch = []
-    
-    best_val_metric_value = float("inf")
-    best_combined_state = None
-    best_epoch = 0
-
-    # Define the total epochs for Stage 2
-    total_stage2_epochs = epochs_stage2
-    phase1_epochs = total_stage2_epochs // 2
-    phase2_epochs = total_stage2_epochs - phase1_epochs
-
-    print(f"Phase 1: {phase1_epochs} epochs with frozen predictors")
-    print(f"Phase 2: {phase2_epochs} epochs with gradual unfreezing")
-
-    # Combined training loop
-    for epoch in range(total_stage2_epochs):
-        # Phase management
-        if epoch < phase1_epochs:
-            # Phase 1: Freeze predictors
-            for param in age_predictor.parameters():
-                param.requires_grad = False
-            
-            for param in site_predictor.parameters():
-                param.requires_grad = False
-            
-            if epoch == 0:
-                print("Phase 1: Age and Site Predictor weights are frozen")
-                combined_optimizer = torch.optim.Adam(filter(lambda p: p.requires_grad, combined_model.parameters()), lr=lr)
-                combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(combined_optimizer, "min", patience=10, factor=0.5, verbose=True)
-        else:
-            # Phase 2: Unfreeze predictors with gradually increasing learning rates
-            phase2_progress = (epoch - phase1_epochs) / max(1, phase2_epochs - 1)  # 0 to 1
+                if epoch == 0 and i < 3:  
+                    log.debug(f"Site training debug - Batch {i}:")
+                    log.debug(f"  True site labels: {site_true.cpu().unique()}")
+                    log.debug(f"  Predicted site classes: {torch.argmax(site_pred, dim=1).cpu().unique()}")
+                    log.debug(f"  Raw predictions shape: {site_pred.shape}, Example: {site_pred[0]}")
             
-            if epoch == phase1_epochs:
-                print("Phase 2: Unfreezing Age and Site Predictor weights with controlled learning rates")
-                
-                # Unfreeze predictors
-                for param in age_predictor.parameters():
-                    param.requires_grad = True
-                
-                for param in site_predictor.parameters():
-                    param.requires_grad = True
+                timer.lap("forward")
+                if use_amp:
+                    scaler.scale(site_loss).backward()
+                    scaler.unscale_(site_optimizer)
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    scaler.step(site_optimizer)
+                    scaler.update()
+                    timer.lap("optimizer")
+                    profiler.step()
+                else:
+                    site_loss.backward()
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    site_optimizer.step()
+                    timer.lap("optimizer")
+                    profiler.step()
+            
+                train_items += batch_size
+                train_site_loss += site_loss.item() * batch_size
+                _, predicted_sites = torch.max(site_pred.data, 1)
+                train_site_correct += (predicted_sites == site_true).sum().item()
+            
+                if (i + 1) % 10 == 0:
+                    log.progress(f"Epoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {site_loss.item():.4f}")
+        
+            avg_train_site_loss = train_site_loss / train_items
+            avg_train_site_acc = (train_site_correct / train_items) * 100
+        
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                site_predictor.eval()
+                val_site_loss = 0.0
+                val_site_correct = 0
+                val_items = 0
+        
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        site_true = labels[:, 2].long().to(device, non_blocking=True)
                 
-                # Create a new optimizer with different learning rates
-                combined_optimizer = torch.optim.Adam([
-                    {'params': vae_model.parameters(), 'lr': lr},
-                    {'params': age_predictor.parameters(), 'lr': lr * 0.05 * phase2_progress},
-                    {'params': site_predictor.parameters(), 'lr': lr * 0.01 * phase2_progress}  # Increased from 0.0001 to 0.01
-                ])
-                combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(combined_optimizer, "min", patience=10, factor=0.5, verbose=True)
-                print(f"Created new optimizer with controlled learning rates")
-            elif epoch > phase1_epochs:
-                # Update learning rates based on progress
-                combined_optimizer.param_groups[1]['lr'] = lr * 0.01 * phase2_progress
-                combined_optimizer.param_groups[2]['lr'] = lr * 0.01 * phase2_progress  # Increased from 0.0001 to 0.01
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            site_pred = site_predictor(tract_data)
+                            site_loss = site_criterion(site_pred, site_true)
                 
-                print(f"Phase 2 Progress: {phase2_progress:.2f} | VAE lr: {combined_optimizer.param_groups[0]['lr']:.6f} | " +
-                      f"Age lr: {combined_optimizer.param_groups[1]['lr']:.6f} | Site lr: {combined_optimizer.param_groups[2]['lr']:.6f}")
+                        val_items += batch_size
+                        val_site_loss += site_loss.item() * batch_size
+                        _, predicted_sites = torch.max(site_pred.data, 1)
+                        val_site_correct += (predicted_sites == site_true).sum().item()
         
-        # Store current learning rate
-        current_lr_epoch.append(combined_optimizer.param_groups[0]["lr"])
-
-        # --- GRL Alpha Calculation ---
-        if grl_alpha_epochs > 0 and epoch < grl_alpha_epochs:
-            progress = epoch / grl_alpha_epochs
-            current_grl_alpha = grl_alpha_start + (grl_alpha_end - grl_alpha_start) * progress
-        else:
-            current_grl_alpha = grl_alpha_end
-        current_grl_alpha_epoch.append(current_grl_alpha)
-
-        # --- KL Beta Calculation ---
-        if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
-            annealing_epoch = epoch - kl_annealing_start_epoch
-            if annealing_epoch < kl_annealing_duration:
-                progress = annealing_epoch / kl_annealing_duration
-                sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
-                kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
+                avg_val_site_loss = val_site_loss / val_items
+                avg_val_site_acc = (val_site_correct / val_items) * 100
             else:
-                kl_annealing_factor = 1.0
-        else:
-            kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
-        
-        # Skip KL annealing for non-variational autoencoders
-        if is_variational:
-            current_beta = w_kl * kl_annealing_factor
+                avg_val_site_loss = avg_val_site_acc = float("nan")
+        
+            site_train_loss_epoch.append(avg_train_site_loss)
+            site_val_loss_epoch.append(avg_val_site_loss)
+            site_train_acc_epoch.append(avg_train_site_acc)
+            site_val_acc_epoch.append(avg_val_site_acc)
+            timer.lap("validation")
+        
+            log.info(f"Epoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_site_loss:.4f} | Train Acc: {avg_train_site_acc:.2f}% | Val Loss: {avg_val_site_loss:.4f} | Val Acc: {avg_val_site_acc:.2f}%")
+        
+            if val_pass is not None:
+                site_scheduler.step(avg_val_site_loss)
+        
+            timer.mark()
+            if val_schedule.selects_best(val_pass) and avg_val_site_loss < best_site_loss:
+                best_site_loss = avg_val_site_loss
+                best_site_state = site_predictor.state_dict()
+                torch.save(best_site_state, os.path.join(save_dir, "best_site_predictor.pth"))
+                log.info(f"  Saved best Site Predictor model with validation loss: {best_site_loss:.4f} (Acc: {avg_val_site_acc:.2f}%)")
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("site_predictor", epoch + 1, {
+                "train_loss": site_train_loss_epoch,
+                "val_loss": site_val_loss_epoch,
+                "train_acc": site_train_acc_epoch,
+                "val_acc": site_val_acc_epoch,
+                "current_lr": site_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+    
+        profiler.stop()
+        # Load best Site Predictor model
+        if restored is not None:
+            best_site_state = restored["state_dict"]
+        site_predictor.load_state_dict(best_site_state)
+        results["site_predictor"] = {
+            "best_val_loss": best_site_loss,
+            "train_loss_epoch": site_train_loss_epoch,
+            "val_loss_epoch": site_val_loss_epoch,
+            "train_acc_epoch": site_train_acc_epoch,
+            "val_acc_epoch": site_val_acc_epoch,
+            "current_lr_epoch": site_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
+        if restored is not None:
+            results["site_predictor"] = restored["results"]
         else:
-            current_beta = 0.0  # Always zero for non-variational autoencoders
-        current_beta_epoch.append(current_beta)
-        
-        # Training
-        combined_model.train()
-        running_loss = 0.0
-        running_recon_loss = 0.0
-        running_kl_loss = 0.0
-        running_age_loss = 0.0
-        running_site_loss = 0.0
-        running_age_mae_sum = 0.0
-        running_site_correct = 0.0
-        train_items = 0
-        train_age_preds = []  # Add these for R² calculation
-        train_age_trues = []  # Add these for R² calculation
-        
-        # For confusion matrix - collect all true and predicted site labels for this epoch
-        all_train_site_true = []
-        all_train_site_pred = []
-        
-        for i, (x, labels) in enumerate(train_data):
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            age_true = labels[:, 0].float().unsqueeze(1).to(device)
-            # sex_data = labels[:, 1].float().to(device)  # Get sex data - REMOVED
-            site_true = labels[:, 2].long().to(device, non_blocking=True)
+            save_stage_checkpoint(save_dir, "site_predictor", results["site_predictor"], site_predictor.state_dict())
+    
+
+        # STAGE 2: Train Combined Model with Frozen Predictors
+
+        log.info(f"\n{'='*40}\nSTAGE 2: Training Combined Model with Frozen Predictors\n{'='*40}")
+    
+        # Create combined model
+        try:
+            from .models import CombinedAE_Predictors
+        except ImportError:
+            from models import CombinedAE_Predictors
+        combined_model = CombinedAE_Predictors(vae_model, age_predictor, site_predictor, is_variational=is_variational)
+        combined_model = combined_model.to(device)
+
+        # Training metrics - keep all your existing metrics
+        train_loss_epoch = []
+        val_loss_epoch = []
+        train_recon_loss_epoch = []
+        val_recon_loss_epoch = []
+        train_kl_loss_epoch = []
+        val_kl_loss_epoch = []
+        train_age_loss_epoch = []
+        val_age_loss_epoch = []
+        train_site_loss_epoch = []
+        val_site_loss_epoch = []
+        train_age_mae_epoch = []
+        val_age_mae_epoch = []
+        train_site_acc_epoch = []
+        val_site_acc_epoch = []
+        train_age_r2_epoch = []  # Add R² tracking
+        val_age_r2_epoch = []    # Add R² tracking
+        # Per-epoch site confusion counts, accumulated on the device
+        site_cm_epochs = []
+        train_site_cm_epoch = []
+        val_site_cm_epoch = []
+        train_site_cm = None
+        val_site_cm = None
+        current_beta_epoch = []
+        current_grl_alpha_epoch = []
+        current_lr_epoch = []
+    
+        best_val_metric_value = float("inf")
+        best_combined_state = None
+        best_epoch = 0
+
+        # Define the total epochs for Stage 2
+        total_stage2_epochs = epochs_stage2
+        phase1_epochs = total_stage2_epochs // 2
+        phase2_epochs = total_stage2_epochs - phase1_epochs
+
+        log.info(f"Phase 1: {phase1_epochs} epochs with frozen predictors")
+        log.info(f"Phase 2: {phase2_epochs} epochs with gradual unfreezing")
+
+        # Combined training loop
+        val_schedule = ValidationSchedule(val_data, total_stage2_epochs, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "combined")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+
+        # Histories of the combined stage, also saved in its periodic stage checkpoints
+        combined_histories = {
+            "train_loss_epoch": train_loss_epoch,
+            "val_loss_epoch": val_loss_epoch,
+            "train_recon_loss_epoch": train_recon_loss_epoch,
+            "val_recon_loss_epoch": val_recon_loss_epoch,
+            "train_kl_loss_epoch": train_kl_loss_epoch,
+            "val_kl_loss_epoch": val_kl_loss_epoch,
+            "train_age_loss_epoch": train_age_loss_epoch,
+            "val_age_loss_epoch": val_age_loss_epoch,
+            "train_site_loss_epoch": train_site_loss_epoch,
+            "val_site_loss_epoch": val_site_loss_epoch,
+            "train_age_mae_epoch": train_age_mae_epoch,
+            "val_age_mae_epoch": val_age_mae_epoch,
+            "train_site_acc_epoch": train_site_acc_epoch,
+            "val_site_acc_epoch": val_site_acc_epoch,
+            "train_age_r2_epoch": train_age_r2_epoch,  # Add R² metrics
+            "val_age_r2_epoch": val_age_r2_epoch,      # Add R² metrics
+            "current_beta_epoch": current_beta_epoch,
+            "current_grl_alpha_epoch": current_grl_alpha_epoch,
+            "current_lr_epoch": current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            "site_cm_epochs": site_cm_epochs,
+            "train_site_cm_epoch": train_site_cm_epoch,
+            "val_site_cm_epoch": val_site_cm_epoch,
+        }
+        # An interrupted stage 2 continues after the epoch of its last stage checkpoint
+        start_epoch = 0
+        combined_restored = load_stage_checkpoint(save_dir, "combined") if resume else None
+        if combined_restored is not None:
+            training_state = combined_restored["training_state"]
+            start_epoch = training_state["epoch"]
+            combined_model.load_state_dict(combined_restored["state_dict"])
+            for name, values in combined_histories.items():
+                values.extend(combined_restored["results"][name])
+            for name, values in training_state["phase_times"].items():
+                timer.history[name].extend(values)
+            for name, values in training_state["throughput"].items():
+                timer.throughput[name].extend(values)
+            best_val_metric_value = training_state["best_val_metric_value"]
+            best_epoch = training_state["best_epoch"]
+            if best_val_metric_value < float("inf"):
+                # The live state dict an uninterrupted run holds; the best weights are in best_combined_model.pth
+                best_combined_state = combined_model.state_dict()
+            if scaler is not None and training_state["scaler"] is not None:
+                scaler.load_state_dict(training_state["scaler"])
+            torch.set_rng_state(training_state["rng_state"])
+            if training_state["cuda_rng_state"] is not None and torch.cuda.is_available():
+                torch.cuda.set_rng_state_all(training_state["cuda_rng_state"])
+            # Epochs after the checkpoint are logged again
+            metrics_log.truncate("combined", start_epoch)
+            log.info(f"Resuming: restored the combined model after epoch {start_epoch} from its stage checkpoint")
+
+        for epoch in range(start_epoch, total_stage2_epochs):
+            # Phase management
+            if epoch < phase1_epochs:
+                # Phase 1: Freeze predictors
+                for param in age_predictor.parameters():
+                    param.requires_grad = False
             
-            combined_optimizer.zero_grad(set_to_none=True)
+                for param in site_predictor.parameters():
+                    param.requires_grad = False
             
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha) # REMOVED sex=sex_data
+                if epoch in (0, start_epoch):
+                    log.info("Phase 1: Age and Site Predictor weights are frozen")
+                    combined_optimizer = torch.optim.Adam(filter(lambda p: p.requires_grad, combined_model.parameters()), lr=lr)
+                    combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(combined_optimizer, "min", patience=10, factor=0.5, verbose=True)
+                    if epoch > 0:
+                        combined_optimizer.load_state_dict(training_state["optimizer"])
+                        combined_scheduler.load_state_dict(training_state["scheduler"])
+            else:
+                # Phase 2: Unfreeze predictors with gradually increasing learning rates
+                phase2_progress = (epoch - phase1_epochs) / max(1, phase2_epochs - 1)  # 0 to 1
+            
+                if epoch in (phase1_epochs, start_epoch):
+                    log.info("Phase 2: Unfreezing Age and Site Predictor weights with controlled learning rates")
                 
-                recon_loss = recon_criterion(x_hat, tract_data)
+                    # Unfreeze predictors
+                    for param in age_predictor.parameters():
+                        param.requires_grad = True
                 
-                # Only calculate KL loss for variational autoencoders
-                if is_variational:
-                    kl_loss = kl_divergence_loss(mean, logvar) / batch_size
-                else:
-                    kl_loss = torch.tensor(0.0, device=device)
+                    for param in site_predictor.parameters():
+                        param.requires_grad = True
                 
-                age_loss = age_criterion(age_pred, age_true)
-                site_loss = site_criterion(site_pred, site_true)
+                    # Create a new optimizer with different learning rates
+                    combined_optimizer = torch.optim.Adam([
+                        {'params': vae_model.parameters(), 'lr': lr},
+                        {'params': age_predictor.parameters(), 'lr': lr * 0.05 * phase2_progress},
+                        {'params': site_predictor.parameters(), 'lr': lr * 0.01 * phase2_progress}  # Increased from 0.0001 to 0.01
+                    ])
+                    combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(combined_optimizer, "min", patience=10, factor=0.5, verbose=True)
+                    log.info(f"Created new optimizer with controlled learning rates")
+                    if epoch > phase1_epochs:
+                        combined_optimizer.load_state_dict(training_state["optimizer"])
+                        combined_scheduler.load_state_dict(training_state["scheduler"])
+                if epoch > phase1_epochs:
+                    # Update learning rates based on progress
+                    combined_optimizer.param_groups[1]['lr'] = lr * 0.01 * phase2_progress
+                    combined_optimizer.param_groups[2]['lr'] = lr * 0.01 * phase2_progress  # Increased from 0.0001 to 0.01
                 
-                # In adversarial training with frozen predictors:
-                # 1. Maximize age prediction performance (minimize loss)
-                # 2. Minimize site prediction performance (maximize loss) - this is handled by GRL
-                if is_variational:
-                    total_loss = (w_recon * recon_loss +
-                                 current_beta * kl_loss +
-                                 w_age * age_loss +
-                                 w_site * site_loss)
+                    log.info(f"Phase 2 Progress: {phase2_progress:.2f} | VAE lr: {combined_optimizer.param_groups[0]['lr']:.6f} | " +
+                          f"Age lr: {combined_optimizer.param_groups[1]['lr']:.6f} | Site lr: {combined_optimizer.param_groups[2]['lr']:.6f}")
+        
+            # Store current learning rate
+            current_lr_epoch.append(combined_optimizer.param_groups[0]["lr"])
+
+            # --- GRL Alpha Calculation ---
+            if grl_alpha_epochs > 0 and epoch < grl_alpha_epochs:
+                progress = epoch / grl_alpha_epochs
+                current_grl_alpha = grl_alpha_start + (grl_alpha_end - grl_alpha_start) * progress
+            else:
+                current_grl_alpha = grl_alpha_end
+            current_grl_alpha_epoch.append(current_grl_alpha)
+
+            # --- KL Beta Calculation ---
+            if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
+                annealing_epoch = epoch - kl_annealing_start_epoch
+                if annealing_epoch < kl_annealing_duration:
+                    progress = annealing_epoch / kl_annealing_duration
+                    sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+                    kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
                 else:
-                    # For non-variational autoencoders, skip KL loss entirely
-                    total_loss = (w_recon * recon_loss +
-                                 w_age * age_loss +
-                                 w_site * site_loss)
-            
-            if use_amp:
-                scaler.scale(total_loss).backward()
-                scaler.unscale_(combined_optimizer)
-                torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
-                scaler.step(combined_optimizer)
-                scaler.update()
+                    kl_annealing_factor = 1.0
             else:
-                total_loss.backward()
-                torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
-                combined_optimizer.step()
-            
-            train_items += batch_size
-            running_loss += total_loss.item() * batch_size
-            running_recon_loss += recon_loss.item() * batch_size
-            running_kl_loss += kl_loss.item() * batch_size
-            running_age_loss += age_loss.item() * batch_size
-            running_site_loss += site_loss.item() * batch_size
-            running_age_mae_sum += age_loss.item() * batch_size  # L1 loss is MAE
-            
-            # Store age predictions and true values for R² calculation
-            train_age_preds.append(age_pred.detach())
-            train_age_trues.append(age_true.detach())
-            
-            _, predicted_sites = torch.max(site_pred.data, 1)
-            running_site_correct += (predicted_sites == site_true).sum().item()
-            
-            # Collect site predictions and true labels for confusion matrix
-            all_train_site_true.append(site_true.detach().cpu())
-            all_train_site_pred.append(predicted_sites.detach().cpu())
-
-            if epoch == 0 and i < 3:  # Only print for first 3 batches of first epoch
-                print("predicted age: ", age_pred)
-                print("true age: ", age_true)
-                print("predicted site: ", predicted_sites)
-                print("true site: ", site_true)
-            
-            if (i + 1) % 10 == 0:
-                print(f"\rEpoch {epoch+1}/{epochs_stage2} | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}", end="")
-        
-        # Validation
-        combined_model.eval()
-        running_val_loss = 0.0
-        running_val_recon_loss = 0.0
-        running_val_kl_loss = 0.0
-        running_val_age_loss = 0.0
-        running_val_site_loss = 0.0
-        running_val_age_mae_sum = 0.0
-        running_val_site_correct = 0.0
-        val_items = 0
-        val_age_preds = []  # Add these for R² calculation
-        val_age_trues = []  # Add these for R² calculation
-        
-        # For confusion matrix - collect all true and predicted site labels for this epoch
-        all_val_site_true = []
-        all_val_site_pred = []
-        
-        with torch.no_grad():
-            for x, labels in val_data:
+                kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
+        
+            # Skip KL annealing for non-variational autoencoders
+            if is_variational:
+                current_beta = w_kl * kl_annealing_factor
+            else:
+                current_beta = 0.0  # Always zero for non-variational autoencoders
+            current_beta_epoch.append(current_beta)
+        
+            # Training
+            combined_model.train()
+            running_loss = 0.0
+            running_recon_loss = 0.0
+            running_kl_loss = 0.0
+            running_age_loss = 0.0
+            running_site_loss = 0.0
+            running_age_mae_sum = 0.0
+            running_site_correct = 0.0
+            train_items = 0
+            train_age_preds = []  # Add these for R² calculation
+            train_age_trues = []  # Add these for R² calculation
+        
+            # For confusion matrix - per-sample labels are only kept when explicitly requested
+            if train_site_cm is not None:
+                train_site_cm.reset()
+            all_train_site_true = []
+            all_train_site_pred = []
+            all_train_latents = []
+        
+            for i, (x, labels) in enumerate(timer.iterate(train_data)):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 age_true = labels[:, 0].float().unsqueeze(1).to(device)
                 # sex_data = labels[:, 1].float().to(device)  # Get sex data - REMOVED
                 site_true = labels[:, 2].long().to(device, non_blocking=True)
-
+            
+                combined_optimizer.zero_grad(set_to_none=True)
+            
                 with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
                     x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha) # REMOVED sex=sex_data
-                    
+                
                     recon_loss = recon_criterion(x_hat, tract_data)
-                    
+                
                     # Only calculate KL loss for variational autoencoders
                     if is_variational:
                         kl_loss = kl_divergence_loss(mean, logvar) / batch_size
                     else:
                         kl_loss = torch.tensor(0.0, device=device)
-                    
+                
                     age_loss = age_criterion(age_pred, age_true)
                     site_loss = site_criterion(site_pred, site_true)
-                    
+                
                     # In adversarial training with frozen predictors:
                     # 1. Maximize age prediction performance (minimize loss)
                     # 2. Minimize site prediction performance (maximize loss) - this is handled by GRL
@@ -2144,231 +2851,371 @@ def train_vae_age_site_staged(
                         total_loss = (w_recon * recon_loss +
                                      w_age * age_loss +
                                      w_site * site_loss)
+            
+                timer.lap("forward")
+                if use_amp:
+                    scaler.scale(total_loss).backward()
+                    scaler.unscale_(combined_optimizer)
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    scaler.step(combined_optimizer)
+                    scaler.update()
+                    timer.lap("optimizer")
+                    profiler.step()
+                else:
+                    total_loss.backward()
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    combined_optimizer.step()
+                    timer.lap("optimizer")
+                    profiler.step()
+            
+                train_items += batch_size
+                running_loss += total_loss.item() * batch_size
+                running_recon_loss += recon_loss.item() * batch_size
+                running_kl_loss += kl_loss.item() * batch_size
+                running_age_loss += age_loss.item() * batch_size
+                running_site_loss += site_loss.item() * batch_size
+                running_age_mae_sum += age_loss.item() * batch_size  # L1 loss is MAE
+            
+                # Store age predictions and true values for R² calculation
+                train_age_preds.append(age_pred.detach())
+                train_age_trues.append(age_true.detach())
+            
+                _, predicted_sites = torch.max(site_pred.data, 1)
+                running_site_correct += (predicted_sites == site_true).sum().item()
+            
+                # Update the on-device confusion matrix
+                if train_site_cm is None:
+                    train_site_cm = SiteConfusionAccumulator(site_pred.shape[1], device=site_pred.device)
+                train_site_cm.update(site_true, predicted_sites)
+                if save_per_sample_predictions:
+                    all_train_site_true.append(site_true.detach())
+                    all_train_site_pred.append(predicted_sites.detach())
+                    if save_prediction_latents:
+                        all_train_latents.append(mean.detach())
+
+                if epoch == 0 and i < 3:  # Only print for first 3 batches of first epoch
+                    log.debug("predicted age: ", age_pred)
+                    log.debug("true age: ", age_true)
+                    log.debug("predicted site: ", predicted_sites)
+                    log.debug("true site: ", site_true)
+            
+                if (i + 1) % 10 == 0:
+                    log.progress(f"Epoch {epoch+1}/{epochs_stage2} | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}")
+        
+            # Validation
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                combined_model.eval()
+                running_val_loss = 0.0
+                running_val_recon_loss = 0.0
+                running_val_kl_loss = 0.0
+                running_val_age_loss = 0.0
+                running_val_site_loss = 0.0
+                running_val_age_mae_sum = 0.0
+                running_val_site_correct = 0.0
+                val_items = 0
+                val_age_preds = []  # Add these for R² calculation
+                val_age_trues = []  # Add these for R² calculation
+        
+                # For confusion matrix - per-sample labels are only kept when explicitly requested
+                if val_site_cm is not None:
+                    val_site_cm.reset()
+                all_val_site_true = []
+                all_val_site_pred = []
+                all_val_latents = []
+        
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                        # sex_data = labels[:, 1].float().to(device)  # Get sex data - REMOVED
+                        site_true = labels[:, 2].long().to(device, non_blocking=True)
+
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha) # REMOVED sex=sex_data
+                    
+                            recon_loss = recon_criterion(x_hat, tract_data)
+                    
+                            # Only calculate KL loss for variational autoencoders
+                            if is_variational:
+                                kl_loss = kl_divergence_loss(mean, logvar) / batch_size
+                            else:
+                                kl_loss = torch.tensor(0.0, device=device)
+                    
+                            age_loss = age_criterion(age_pred, age_true)
+                            site_loss = site_criterion(site_pred, site_true)
+                    
+                            # In adversarial training with frozen predictors:
+                            # 1. Maximize age prediction performance (minimize loss)
+                            # 2. Minimize site prediction performance (maximize loss) - this is handled by GRL
+                            if is_variational:
+                                total_loss = (w_recon * recon_loss +
+                                             current_beta * kl_loss +
+                                             w_age * age_loss +
+                                             w_site * site_loss)
+                            else:
+                                # For non-variational autoencoders, skip KL loss entirely
+                                total_loss = (w_recon * recon_loss +
+                                             w_age * age_loss +
+                                             w_site * site_loss)
                 
-                val_items += batch_size
-                running_val_loss += total_loss.item() * batch_size
-                running_val_recon_loss += recon_loss.item() * batch_size
-                running_val_kl_loss += kl_loss.item() * batch_size
-                running_val_age_loss += age_loss.item() * batch_size
-                running_val_site_loss += site_loss.item() * batch_size
-                running_val_age_mae_sum += age_loss.item() * batch_size
+                        val_items += batch_size
+                        running_val_loss += total_loss.item() * batch_size
+                        running_val_recon_loss += recon_loss.item() * batch_size
+                        running_val_kl_loss += kl_loss.item() * batch_size
+                        running_val_age_loss += age_loss.item() * batch_size
+                        running_val_site_loss += site_loss.item() * batch_size
+                        running_val_age_mae_sum += age_loss.item() * batch_size
                 
-                # Store age predictions and true values for R² calculation
-                val_age_preds.append(age_pred)
-                val_age_trues.append(age_true)
+                        # Store age predictions and true values for R² calculation
+                        val_age_preds.append(age_pred)
+                        val_age_trues.append(age_true)
                 
-                _, predicted_sites = torch.max(site_pred.data, 1)
-                running_val_site_correct += (predicted_sites == site_true).sum().item()
+                        _, predicted_sites = torch.max(site_pred.data, 1)
+                        running_val_site_correct += (predicted_sites == site_true).sum().item()
                 
-                # Collect site predictions and true labels for confusion matrix
-                all_val_site_true.append(site_true.cpu())
-                all_val_site_pred.append(predicted_sites.cpu())
-        
-        # Save site prediction data for confusion matrix
-        if epoch == 0 or (epoch + 1) % save_predictions_interval == 0 or epoch == total_stage2_epochs - 1:
-            # Concat all predictions and true labels for this epoch
-            train_site_true = torch.cat(all_train_site_true).numpy()
-            train_site_pred = torch.cat(all_train_site_pred).numpy()
-            val_site_true = torch.cat(all_val_site_true).numpy()
-            val_site_pred = torch.cat(all_val_site_pred).numpy()
-            
-            # Save data for later confusion matrix generation
-            save_site_predictions(train_site_true, train_site_pred, epoch+1, save_dir, prefix='train')
-            save_site_predictions(val_site_true, val_site_pred, epoch+1, save_dir, prefix='val')
-            # --- NEW: Save confusion matrix PNGs for this epoch ---
-            import os
-            import matplotlib.pyplot as plt
-            from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
-            # Train confusion matrix
-            cm_train = confusion_matrix(train_site_true, train_site_pred, normalize='true')
-            labels_train = [f"Site {i}" for i in range(cm_train.shape[0])]
-            disp_train = ConfusionMatrixDisplay(confusion_matrix=cm_train, display_labels=labels_train)
-            fig_train, ax_train = plt.subplots(figsize=(8, 6))
-            disp_train.plot(ax=ax_train, cmap='Blues', values_format='.2f')
-            plt.title(f'Train Confusion Matrix - Epoch {epoch+1}')
-            plot_dir = os.path.join(save_dir, 'confusion_matrices')
-            os.makedirs(plot_dir, exist_ok=True)
-            plt.tight_layout()
-            plt.savefig(os.path.join(plot_dir, f'train_confusion_matrix_epoch_{epoch+1}.png'))
-            plt.close(fig_train)
-            # Val confusion matrix
-            cm_val = confusion_matrix(val_site_true, val_site_pred, normalize='true')
-            labels_val = [f"Site {i}" for i in range(cm_val.shape[0])]
-            disp_val = ConfusionMatrixDisplay(confusion_matrix=cm_val, display_labels=labels_val)
-            fig_val, ax_val = plt.subplots(figsize=(8, 6))
-            disp_val.plot(ax=ax_val, cmap='Blues', values_format='.2f')
-            plt.title(f'Val Confusion Matrix - Epoch {epoch+1}')
-            plt.tight_layout()
-            plt.savefig(os.path.join(plot_dir, f'val_confusion_matrix_epoch_{epoch+1}.png'))
-            plt.close(fig_val)
-        
-        # Generate visualizations at specified intervals
-        # if epoch == 0 or (epoch + 1) % visualization_interval == 0 or epoch == total_stage2_epochs - 1:
-        
-        # ... rest of the existing code ...
-        
-        # Calculate average metrics
-        avg_train_loss = running_loss / train_items
-        avg_train_recon_loss = running_recon_loss / train_items
-        avg_train_kl_loss = running_kl_loss / train_items
-        avg_train_age_loss = running_age_loss / train_items
-        avg_train_site_loss = running_site_loss / train_items
-        avg_train_age_mae = running_age_mae_sum / train_items
-        avg_train_site_acc = (running_site_correct / train_items) * 100
+                        # Update the on-device confusion matrix
+                        if val_site_cm is None:
+                            val_site_cm = SiteConfusionAccumulator(site_pred.shape[1], device=site_pred.device)
+                        val_site_cm.update(site_true, predicted_sites)
+                        if save_per_sample_predictions:
+                            all_val_site_true.append(site_true)
+                            all_val_site_pred.append(predicted_sites)
+                            if save_prediction_latents:
+                                all_val_latents.append(mean)
+        
+                # Record this epoch's site confusion matrices (one small K x K array each)
+                site_cm_epochs.append(epoch + 1)
+                train_site_cm_epoch.append(train_site_cm.compute())
+                val_site_cm_epoch.append(val_site_cm.compute())
+        
+            timer.lap("validation")
+
+            # Save site prediction data for confusion matrix (only after epochs with a validation pass)
+            if val_pass is not None and (epoch == 0 or (epoch + 1) % save_predictions_interval == 0 or epoch == total_stage2_epochs - 1):
+                save_site_confusion_matrices(site_cm_epochs, train_site_cm_epoch, val_site_cm_epoch, save_dir)
+                if save_per_sample_predictions:
+                    save_site_predictions(torch.cat(all_train_site_true), torch.cat(all_train_site_pred), epoch+1, save_dir, prefix='train',
+                                          age_true=torch.cat(train_age_trues), age_pred=torch.cat(train_age_preds),
+                                          latents=torch.cat(all_train_latents) if save_prediction_latents else None, log=log.info)
+                    save_site_predictions(torch.cat(all_val_site_true), torch.cat(all_val_site_pred), epoch+1, save_dir, prefix='val',
+                                          age_true=torch.cat(val_age_trues), age_pred=torch.cat(val_age_preds),
+                                          latents=torch.cat(all_val_latents) if save_prediction_latents else None, log=log.info)
+                # Save confusion matrix PNGs for this epoch
+                plot_dir = os.path.join(save_dir, 'confusion_matrices')
+                os.makedirs(plot_dir, exist_ok=True)
+                plot_site_confusion_matrix(train_site_cm_epoch[-1], f'Train Confusion Matrix - Epoch {epoch+1}',
+                                           os.path.join(plot_dir, f'train_confusion_matrix_epoch_{epoch+1}.png'))
+                plot_site_confusion_matrix(val_site_cm_epoch[-1], f'Val Confusion Matrix - Epoch {epoch+1}',
+                                           os.path.join(plot_dir, f'val_confusion_matrix_epoch_{epoch+1}.png'))
+            timer.lap("checkpoint")
+        
+            # Generate visualizations at specified intervals
+            # if epoch == 0 or (epoch + 1) % visualization_interval == 0 or epoch == total_stage2_epochs - 1:
+        
+            # ... rest of the existing code ...
+        
+            # Calculate average metrics
+            avg_train_loss = running_loss / train_items
+            avg_train_recon_loss = running_recon_loss / train_items
+            avg_train_kl_loss = running_kl_loss / train_items
+            avg_train_age_loss = running_age_loss / train_items
+            avg_train_site_loss = running_site_loss / train_items
+            avg_train_age_mae = running_age_mae_sum / train_items
+            avg_train_site_acc = (running_site_correct / train_items) * 100
  
-        # Calculate R² for training age predictions
-        all_train_age_preds = torch.cat(train_age_preds)
-        all_train_age_trues = torch.cat(train_age_trues)
-        
-        # Add diagnostic information
-        with torch.no_grad():
-            train_pred_mean = all_train_age_preds.mean().item()
-            train_pred_std = all_train_age_preds.std().item() 
-            train_true_mean = all_train_age_trues.mean().item()
-            train_true_std = all_train_age_trues.std().item()
-            train_correlation = torch.corrcoef(torch.stack([all_train_age_preds.flatten(), all_train_age_trues.flatten()]))[0,1].item()
-            
-            print(f"\nCombined model - Diagnostics for training age prediction:")
-            print(f"  Predictions: mean={train_pred_mean:.2f}, std={train_pred_std:.2f}, min={all_train_age_preds.min().item():.2f}, max={all_train_age_preds.max().item():.2f}")
-            print(f"  True values: mean={train_true_mean:.2f}, std={train_true_std:.2f}, min={all_train_age_trues.min().item():.2f}, max={all_train_age_trues.max().item():.2f}")
-            print(f"  Correlation: {train_correlation:.4f}")
-            
-            # If there's almost no variation in predictions, that's a problem
-            if train_pred_std < 0.1 * train_true_std:
-                print(f"  WARNING: Predictions have very low variation compared to true values!")
-        
-        # Use verbose mode in early epochs
-        verbose = (epoch < 5)
-        train_age_r2 = calculate_r2_score(all_train_age_trues, all_train_age_preds, verbose=verbose)
-        
-        avg_val_loss = running_val_loss / val_items
-        avg_val_recon_loss = running_val_recon_loss / val_items
-        avg_val_kl_loss = running_val_kl_loss / val_items
-        avg_val_age_loss = running_val_age_loss / val_items
-        avg_val_site_loss = running_val_site_loss / val_items
-        avg_val_age_mae = running_val_age_mae_sum / val_items
-        avg_val_site_acc = (running_val_site_correct / val_items) * 100
-        
-        # Calculate R² for validation age predictions
-        all_val_age_preds = torch.cat(val_age_preds)
-        all_val_age_trues = torch.cat(val_age_trues)
-        
-        # Add diagnostic information
-        with torch.no_grad():
-            val_pred_mean = all_val_age_preds.mean().item()
-            val_pred_std = all_val_age_preds.std().item() 
-            val_true_mean = all_val_age_trues.mean().item()
-            val_true_std = all_val_age_trues.std().item()
-            val_correlation = torch.corrcoef(torch.stack([all_val_age_preds.flatten(), all_val_age_trues.flatten()]))[0,1].item()
-            
-            print(f"\nCombined model - Diagnostics for validation age prediction:")
-            print(f"  Predictions: mean={val_pred_mean:.2f}, std={val_pred_std:.2f}, min={all_val_age_preds.min().item():.2f}, max={all_val_age_preds.max().item():.2f}")
-            print(f"  True values: mean={val_true_mean:.2f}, std={val_true_std:.2f}, min={all_val_age_trues.min().item():.2f}, max={all_val_age_trues.max().item():.2f}")
-            print(f"  Correlation: {val_correlation:.4f}")
-            
-            # If there's almost no variation in predictions, that's a problem
-            if val_pred_std < 0.1 * val_true_std:
-                print(f"  WARNING: Predictions have very low variation compared to true values!")
-        
-        # Use verbose mode in early epochs
-        val_age_r2 = calculate_r2_score(all_val_age_trues, all_val_age_preds, verbose=verbose)
-        
-        # Save metrics
-        train_loss_epoch.append(avg_train_loss)
-        train_recon_loss_epoch.append(avg_train_recon_loss)
-        train_kl_loss_epoch.append(avg_train_kl_loss)
-        train_age_loss_epoch.append(avg_train_age_loss)
-        train_site_loss_epoch.append(avg_train_site_loss)
-        train_age_mae_epoch.append(avg_train_age_mae)
-        train_site_acc_epoch.append(avg_train_site_acc)
-        train_age_r2_epoch.append(train_age_r2)  # Add R² to metrics
-        
-        val_loss_epoch.append(avg_val_loss)
-        val_recon_loss_epoch.append(avg_val_recon_loss)
-        val_kl_loss_epoch.append(avg_val_kl_loss)
-        val_age_loss_epoch.append(avg_val_age_loss)
-        val_site_loss_epoch.append(avg_val_site_loss)
-        val_age_mae_epoch.append(avg_val_age_mae)
-        val_site_acc_epoch.append(avg_val_site_acc)
-        val_age_r2_epoch.append(val_age_r2)  # Add R² to metrics
-        
-        # Create a temporary dict to easily access the metric value by key
-        current_epoch_val_metrics = {
-            "val_loss": avg_val_loss,
-            "val_age_mae": avg_val_age_mae,
-        }
-        
-        # Get current metric to monitor
-        current_val_metric = current_epoch_val_metrics.get(val_metric_to_monitor, avg_val_loss)
-        
-        # Print progress
-        print(f"\nEpoch {epoch+1}/{epochs_stage2} | Train Loss: {avg_train_loss:.4f} | " +
-              f"Val Loss: {avg_val_loss:.4f} | Val Age MAE: {avg_val_age_mae:.4f} | " +
-              f"Val Age R²: {val_age_r2:.4f} | Val Site Acc: {avg_val_site_acc:.2f}% | GRL Alpha: {current_grl_alpha:.2f}")
-        
-        # Step scheduler
-        combined_scheduler.step(current_val_metric)
+            # Calculate R² for training age predictions
+            all_train_age_preds = torch.cat(train_age_preds)
+            all_train_age_trues = torch.cat(train_age_trues)
+        
+            # Add diagnostic information
+            with torch.no_grad():
+                train_pred_mean = all_train_age_preds.mean().item()
+                train_pred_std = all_train_age_preds.std().item() 
+                train_true_mean = all_train_age_trues.mean().item()
+                train_true_std = all_train_age_trues.std().item()
+                train_correlation = torch.corrcoef(torch.stack([all_train_age_preds.flatten(), all_train_age_trues.flatten()]))[0,1].item()
+            
+                log.debug(f"Combined model - Diagnostics for training age prediction:")
+                log.debug(f"  Predictions: mean={train_pred_mean:.2f}, std={train_pred_std:.2f}, min={all_train_age_preds.min().item():.2f}, max={all_train_age_preds.max().item():.2f}")
+                log.debug(f"  True values: mean={train_true_mean:.2f}, std={train_true_std:.2f}, min={all_train_age_trues.min().item():.2f}, max={all_train_age_trues.max().item():.2f}")
+                log.debug(f"  Correlation: {train_correlation:.4f}")
+            
+                # If there's almost no variation in predictions, that's a problem
+                if train_pred_std < 0.1 * train_true_std:
+                    log.warning(f"  WARNING: Predictions have very low variation compared to true values!")
+        
+            # Use verbose mode in early epochs
+            verbose = (epoch < 5) and log.enabled_for("debug")
+            train_age_r2 = calculate_r2_score(all_train_age_trues, all_train_age_preds, verbose=verbose)
+        
+            if val_pass is not None:
+                avg_val_loss = running_val_loss / val_items
+                avg_val_recon_loss = running_val_recon_loss / val_items
+                avg_val_kl_loss = running_val_kl_loss / val_items
+                avg_val_age_loss = running_val_age_loss / val_items
+                avg_val_site_loss = running_val_site_loss / val_items
+                avg_val_age_mae = running_val_age_mae_sum / val_items
+                avg_val_site_acc = (running_val_site_correct / val_items) * 100
+        
+                # Calculate R² for validation age predictions
+                all_val_age_preds = torch.cat(val_age_preds)
+                all_val_age_trues = torch.cat(val_age_trues)
+        
+                # Add diagnostic information
+                with torch.no_grad():
+                    val_pred_mean = all_val_age_preds.mean().item()
+                    val_pred_std = all_val_age_preds.std().item() 
+                    val_true_mean = all_val_age_trues.mean().item()
+                    val_true_std = all_val_age_trues.std().item()
+                    val_correlation = torch.corrcoef(torch.stack([all_val_age_preds.flatten(), all_val_age_trues.flatten()]))[0,1].item()
+            
+                    log.debug(f"Combined model - Diagnostics for validation age prediction:")
+                    log.debug(f"  Predictions: mean={val_pred_mean:.2f}, std={val_pred_std:.2f}, min={all_val_age_preds.min().item():.2f}, max={all_val_age_preds.max().item():.2f}")
+                    log.debug(f"  True values: mean={val_true_mean:.2f}, std={val_true_std:.2f}, min={all_val_age_trues.min().item():.2f}, max={all_val_age_trues.max().item():.2f}")
+                    log.debug(f"  Correlation: {val_correlation:.4f}")
+            
+                    # If there's almost no variation in predictions, that's a problem
+                    if val_pred_std < 0.1 * val_true_std:
+                        log.warning(f"  WARNING: Predictions have very low variation compared to true values!")
         
-        # Save best model
-        if current_val_metric < best_val_metric_value:
-            best_val_metric_value = current_val_metric
+                # Use verbose mode in early epochs
+                val_age_r2 = calculate_r2_score(all_val_age_trues, all_val_age_preds, verbose=verbose)
+            else:
+                avg_val_loss = avg_val_recon_loss = avg_val_kl_loss = avg_val_age_loss = float("nan")
+                avg_val_site_loss = avg_val_age_mae = avg_val_site_acc = val_age_r2 = float("nan")
+        
+            # Save metrics
+            train_loss_epoch.append(avg_train_loss)
+            train_recon_loss_epoch.append(avg_train_recon_loss)
+            train_kl_loss_epoch.append(avg_train_kl_loss)
+            train_age_loss_epoch.append(avg_train_age_loss)
+            train_site_loss_epoch.append(avg_train_site_loss)
+            train_age_mae_epoch.append(avg_train_age_mae)
+            train_site_acc_epoch.append(avg_train_site_acc)
+            train_age_r2_epoch.append(train_age_r2)  # Add R² to metrics
+        
+            val_loss_epoch.append(avg_val_loss)
+            val_recon_loss_epoch.append(avg_val_recon_loss)
+            val_kl_loss_epoch.append(avg_val_kl_loss)
+            val_age_loss_epoch.append(avg_val_age_loss)
+            val_site_loss_epoch.append(avg_val_site_loss)
+            val_age_mae_epoch.append(avg_val_age_mae)
+            val_site_acc_epoch.append(avg_val_site_acc)
+            val_age_r2_epoch.append(val_age_r2)  # Add R² to metrics
+        
+            # Create a temporary dict to easily access the metric value by key
+            current_epoch_val_metrics = {
+                "val_loss": avg_val_loss,
+                "val_age_mae": avg_val_age_mae,
+            }
+        
+            # Get current metric to monitor
+            current_val_metric = current_epoch_val_metrics.get(val_metric_to_monitor, avg_val_loss)
+        
+            # Print progress
+            log.info(f"Epoch {epoch+1}/{epochs_stage2} | Train Loss: {avg_train_loss:.4f} | " +
+                  f"Val Loss: {avg_val_loss:.4f} | Val Age MAE: {avg_val_age_mae:.4f} | " +
+                  f"Val Age R²: {val_age_r2:.4f} | Val Site Acc: {avg_val_site_acc:.2f}% | GRL Alpha: {current_grl_alpha:.2f}")
+        
+            # Step scheduler
+            if val_pass is not None:
+                combined_scheduler.step(current_val_metric)
+        
+            timer.mark()
+            # Save best model
+            if val_schedule.selects_best(val_pass) and current_val_metric < best_val_metric_value:
+                best_val_metric_value = current_val_metric
+                best_combined_state = combined_model.state_dict()
+                best_epoch = epoch
+            
+                # Save model
+                model_path = os.path.join(save_dir, "best_combined_model.pth")
+                torch.save(best_combined_state, model_path)
+                log.info(f"  Saved best combined model with {val_metric_to_monitor}: {best_val_metric_value:.4f}")
+        
+            # Periodic saving every N epochs
+            if (epoch + 1) % periodic_save_interval == 0:
+                periodic_combined_path = os.path.join(save_dir, f"combined_model_epoch_{epoch+1}.pth")
+                # Ensure the save directory exists
+                os.makedirs(save_dir, exist_ok=True)
+                torch.save(combined_model.state_dict(), periodic_combined_path)
+                log.info(f"  Saved periodic combined model at epoch {epoch+1} to {periodic_combined_path}")
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("combined", epoch + 1, {
+                "train_loss": train_loss_epoch,
+                "val_loss": val_loss_epoch,
+                "train_recon_loss": train_recon_loss_epoch,
+                "val_recon_loss": val_recon_loss_epoch,
+                "train_kl_loss": train_kl_loss_epoch,
+                "val_kl_loss": val_kl_loss_epoch,
+                "train_age_loss": train_age_loss_epoch,
+                "val_age_loss": val_age_loss_epoch,
+                "train_site_loss": train_site_loss_epoch,
+                "val_site_loss": val_site_loss_epoch,
+                "train_age_mae": train_age_mae_epoch,
+                "val_age_mae": val_age_mae_epoch,
+                "train_site_acc": train_site_acc_epoch,
+                "val_site_acc": val_site_acc_epoch,
+                "train_age_r2": train_age_r2_epoch,
+                "val_age_r2": val_age_r2_epoch,
+                "current_beta": current_beta_epoch,
+                "current_grl_alpha": current_grl_alpha_epoch,
+                "current_lr": current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+            # Resume point of an interrupted stage 2 (restored with resume=True)
+            if (epoch + 1) % periodic_save_interval == 0 or epoch == total_stage2_epochs - 1:
+                save_stage_checkpoint(save_dir, "combined", combined_histories, combined_model.state_dict(), {
+                    "epoch": epoch + 1,
+                    "optimizer": combined_optimizer.state_dict(),
+                    "scheduler": combined_scheduler.state_dict(),
+                    "scaler": scaler.state_dict() if scaler is not None else None,
+                    "best_val_metric_value": best_val_metric_value,
+                    "best_epoch": best_epoch,
+                    "phase_times": timer.history,
+                    "throughput": timer.throughput,
+                    "rng_state": torch.get_rng_state(),
+                    "cuda_rng_state": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+                })
+    
+        profiler.stop()
+        # Load best combined model
+        if best_combined_state is not None:
+            combined_model.load_state_dict(best_combined_state)
+        else:
+            log.warning("WARNING: No best combined state was saved (training may have diverged)")
+            # Use the current state as fallback
             best_combined_state = combined_model.state_dict()
-            best_epoch = epoch
-            
-            # Save model
-            model_path = os.path.join(save_dir, "best_combined_model.pth")
-            torch.save(best_combined_state, model_path)
-            print(f"  Saved best combined model with {val_metric_to_monitor}: {best_val_metric_value:.4f}")
-        
-        # Periodic saving every N epochs
-        if (epoch + 1) % periodic_save_interval == 0:
-            periodic_combined_path = os.path.join(save_dir, f"combined_model_epoch_{epoch+1}.pth")
-            # Ensure the save directory exists
-            os.makedirs(save_dir, exist_ok=True)
-            torch.save(combined_model.state_dict(), periodic_combined_path)
-            print(f"  Saved periodic combined model at epoch {epoch+1} to {periodic_combined_path}")
-            sys.stdout.flush()
-    
-    # Load best combined model
-    if best_combined_state is not None:
-        combined_model.load_state_dict(best_combined_state)
-    else:
-        print("WARNING: No best combined state was saved (training may have diverged)")
-        # Use the current state as fallback
-        best_combined_state = combined_model.state_dict()
-    
-    # --- Return Results Dictionary ---
-    combined_results = {
-        "train_loss_epoch": train_loss_epoch,
-        "val_loss_epoch": val_loss_epoch,
-        "train_recon_loss_epoch": train_recon_loss_epoch,
-        "val_recon_loss_epoch": val_recon_loss_epoch,
-        "train_kl_loss_epoch": train_kl_loss_epoch,
-        "val_kl_loss_epoch": val_kl_loss_epoch,
-        "train_age_loss_epoch": train_age_loss_epoch,
-        "val_age_loss_epoch": val_age_loss_epoch,
-        "train_site_loss_epoch": train_site_loss_epoch,
-        "val_site_loss_epoch": val_site_loss_epoch,
-        "train_age_mae_epoch": train_age_mae_epoch,
-        "val_age_mae_epoch": val_age_mae_epoch,
-        "train_site_acc_epoch": train_site_acc_epoch,
-        "val_site_acc_epoch": val_site_acc_epoch,
-        "train_age_r2_epoch": train_age_r2_epoch,  # Add R² metrics
-        "val_age_r2_epoch": val_age_r2_epoch,      # Add R² metrics
-        "current_beta_epoch": current_beta_epoch,
-        "current_grl_alpha_epoch": current_grl_alpha_epoch,
-        "current_lr_epoch": current_lr_epoch,
-        f"best_{val_metric_to_monitor}": best_val_metric_value,
-        "best_epoch": best_epoch,
-        "model_path": os.path.join(save_dir, "best_combined_model.pth")
-    }
     
-    results["combined"] = combined_results
+        # --- Return Results Dictionary ---
+        combined_results = {
+            **combined_histories,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files,
+            f"best_{val_metric_to_monitor}": best_val_metric_value,
+            "best_epoch": best_epoch,
+            "model_path": os.path.join(save_dir, "best_combined_model.pth")
+        }
+    
+        results["combined"] = combined_results
     
-    print(f"\n{'='*40}\nTraining complete!\n{'='*40}")
-    print(f"Best {val_metric_to_monitor}: {best_val_metric_value:.4f}")
+        log.info(f"\n{'='*40}\nTraining complete!\n{'='*40}")
+        log.info(f"Best {val_metric_to_monitor}: {best_val_metric_value:.4f}")
     
-    return results
+        return results
+    finally:
+        metrics_log.close()
+        log.close()
 
 # Alternating adversarial training: Stage 1 independent training, Stage 2 alternates between 
 # optimizing VAE+age vs. optimizing site predictor in cycles to balance adversarial objectives
@@ -2400,7 +3247,13 @@ def train_vae_age_site_alternating(
     val_metric_to_monitor="val_age_mae",
     save_predictions_interval=50,
     periodic_save_interval=50,
-    is_variational=True
+    is_variational=True,
+    metrics_file="metrics.csv",
+    log_level=None,
+    profile=None,
+    validate_every=1,  # Validate after every N-th epoch of each stage (see validation.py)
+    fast_val_subset=None,  # Samples (or fraction) of a fixed stratified val subset for quick passes
+    full_val_every=None  # Full validation pass every N epochs when using fast_val_subset (default 5 x validate_every)
 ):
     """
     Alternating training approach:
@@ -2409,788 +3262,952 @@ def train_vae_age_site_alternating(
        - Phase A: Optimize reconstruction + age prediction (freeze site predictor)
        - Phase B: Optimize reconstruction + site confusion (freeze age predictor)
     """
+    log = ProgressReporter(level=log_level)
     import os, sys
-    print(f"DEBUG: Starting alternating training approach")
-    print(f"DEBUG: Cycle length: {cycle_length} epochs")
-    sys.stdout.flush()
+    log.debug(f"Starting alternating training approach")
+    log.debug(f"Cycle length: {cycle_length} epochs")
     
     os.makedirs(save_dir, exist_ok=True)
-    torch.backends.cudnn.benchmark = True
+    # Per-epoch metrics log, written while training runs
+    metrics_log = MetricsWriter(os.path.join(save_dir, metrics_file) if metrics_file else None)
+    try:
+        # Fixed validation subset shared by all stages (None unless fast_val_subset is set)
+        fast_val_data = make_fast_val_loader(val_data, fast_val_subset)
+        torch.backends.cudnn.benchmark = True
     
-    # Move models to device
-    vae_model = vae_model.to(device)
-    age_predictor = age_predictor.to(device)
-    site_predictor = site_predictor.to(device)
+        # Move models to device
+        vae_model = vae_model.to(device)
+        age_predictor = age_predictor.to(device)
+        site_predictor = site_predictor.to(device)
     
-    # Set up loss functions
-    recon_criterion = torch.nn.MSELoss(reduction="mean")
-    age_criterion = torch.nn.L1Loss(reduction="mean")
-    site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
+        # Set up loss functions
+        recon_criterion = torch.nn.MSELoss(reduction="mean")
+        age_criterion = torch.nn.L1Loss(reduction="mean")
+        site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
     
-    results = {}
+        results = {}
     
     
 
-    # STAGE 1: Train each model independently (reuse existing logic)
+        # STAGE 1: Train each model independently (reuse existing logic)
 
-    print(f"\n{'='*40}\nSTAGE 1: Training models independently\n{'='*40}")
-    sys.stdout.flush()
+        log.info(f"\n{'='*40}\nSTAGE 1: Training models independently\n{'='*40}")
     
-    # --- STEP 1: Train VAE for reconstruction ---
-    print(f"\n{'-'*40}\nTraining {'VAE' if is_variational else 'Autoencoder'} for reconstruction...\n{'-'*40}")
-    sys.stdout.flush()
+        # --- STEP 1: Train VAE for reconstruction ---
+        log.info(f"\n{'-'*40}\nTraining {'VAE' if is_variational else 'Autoencoder'} for reconstruction...\n{'-'*40}")
     
-    vae_optimizer = torch.optim.Adam(vae_model.parameters(), lr=lr)
-    vae_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(vae_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        vae_optimizer = torch.optim.Adam(vae_model.parameters(), lr=lr)
+        vae_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(vae_optimizer, "min", patience=10, factor=0.5, verbose=True)
     
-    best_vae_loss = float("inf")
-    best_vae_state = None
+        best_vae_loss = float("inf")
+        best_vae_state = None
     
-    # Initialize metrics tracking for VAE
-    vae_train_loss_epoch = []
-    vae_val_loss_epoch = []
-    vae_train_recon_loss_epoch = []
-    vae_val_recon_loss_epoch = []
-    vae_train_kl_loss_epoch = []
-    vae_val_kl_loss_epoch = []
-    vae_current_beta_epoch = []
-    vae_current_lr_epoch = []
+        # Initialize metrics tracking for VAE
+        vae_train_loss_epoch = []
+        vae_val_loss_epoch = []
+        vae_train_recon_loss_epoch = []
+        vae_val_recon_loss_epoch = []
+        vae_train_kl_loss_epoch = []
+        vae_val_kl_loss_epoch = []
+        vae_current_beta_epoch = []
+        vae_current_lr_epoch = []
     
-    # Training loop for VAE
-    for epoch in range(epochs_stage1):
-        # KL Beta Calculation
-        if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
-            annealing_epoch = epoch - kl_annealing_start_epoch
-            if annealing_epoch < kl_annealing_duration:
-                progress = annealing_epoch / kl_annealing_duration
-                sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
-                kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
-            else:
-                kl_annealing_factor = 1.0
-        else:
-            kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
-        current_beta = w_kl * kl_annealing_factor
-        vae_current_beta_epoch.append(current_beta)
-        vae_current_lr_epoch.append(vae_optimizer.param_groups[0]["lr"])
-        
-        # Training
-        vae_model.train()
-        train_recon_loss = 0.0
-        train_kl_loss = 0.0
-        train_total_loss = 0.0
-        train_items = 0
-        
-        for i, (x, _) in enumerate(train_data):
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            
-            vae_optimizer.zero_grad(set_to_none=True)
-            
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                if is_variational:
-                    x_hat, mean, logvar = vae_model(tract_data)
-                    recon_loss = recon_criterion(x_hat, tract_data)
-                    kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
-                    
-                    if epoch < kl_annealing_start_epoch:
-                        weighted_kl_loss = 0.0
-                        kl_loss = kl_loss_raw
-                    else:
-                        weighted_kl_loss = current_beta * kl_loss_raw
-                        kl_loss = kl_loss_raw
-                    
-                    total_loss = recon_loss + weighted_kl_loss
+        # Training loop for VAE
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "vae")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage1):
+            # KL Beta Calculation
+            if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
+                annealing_epoch = epoch - kl_annealing_start_epoch
+                if annealing_epoch < kl_annealing_duration:
+                    progress = annealing_epoch / kl_annealing_duration
+                    sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+                    kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
                 else:
-                    x_hat = vae_model(tract_data)
-                    recon_loss = recon_criterion(x_hat, tract_data)
-                    kl_loss = torch.tensor(0.0, device=device)
-                    total_loss = recon_loss
-            
-            if use_amp:
-                scaler.scale(total_loss).backward()
-                scaler.unscale_(vae_optimizer)
+                    kl_annealing_factor = 1.0
             else:
-                total_loss.backward()
-            
-            torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
-            vae_optimizer.step()
-            
-            train_items += batch_size
-            train_recon_loss += recon_loss.item() * batch_size
-            train_kl_loss += kl_loss.item() * batch_size
-            train_total_loss += total_loss.item() * batch_size
-            
-            if (i + 1) % 10 == 0:
-                print(f"\rEpoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}", end="")
+                kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
+            current_beta = w_kl * kl_annealing_factor
+            vae_current_beta_epoch.append(current_beta)
+            vae_current_lr_epoch.append(vae_optimizer.param_groups[0]["lr"])
         
-        # Validation
-        vae_model.eval()
-        val_recon_loss = 0.0
-        val_kl_loss = 0.0
-        val_total_loss = 0.0
-        val_items = 0
+            # Training
+            vae_model.train()
+            train_recon_loss = 0.0
+            train_kl_loss = 0.0
+            train_total_loss = 0.0
+            train_items = 0
         
-        with torch.no_grad():
-            for x, _ in val_data:
+            for i, (x, _) in enumerate(timer.iterate(train_data)):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
-                
+            
+                vae_optimizer.zero_grad(set_to_none=True)
+            
                 with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
                     if is_variational:
                         x_hat, mean, logvar = vae_model(tract_data)
                         recon_loss = recon_criterion(x_hat, tract_data)
                         kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
-                        
+                    
                         if epoch < kl_annealing_start_epoch:
                             weighted_kl_loss = 0.0
                             kl_loss = kl_loss_raw
                         else:
                             weighted_kl_loss = current_beta * kl_loss_raw
                             kl_loss = kl_loss_raw
-                        
+                    
                         total_loss = recon_loss + weighted_kl_loss
                     else:
                         x_hat = vae_model(tract_data)
                         recon_loss = recon_criterion(x_hat, tract_data)
                         kl_loss = torch.tensor(0.0, device=device)
                         total_loss = recon_loss
+            
+                timer.lap("forward")
+                if use_amp:
+                    scaler.scale(total_loss).backward()
+                    scaler.unscale_(vae_optimizer)
+                else:
+                    total_loss.backward()
+            
+                timer.lap("backward")
+                torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
+                timer.lap("clip")
+                vae_optimizer.step()
+                timer.lap("optimizer")
+                profiler.step()
+            
+                train_items += batch_size
+                train_recon_loss += recon_loss.item() * batch_size
+                train_kl_loss += kl_loss.item() * batch_size
+                train_total_loss += total_loss.item() * batch_size
+            
+                if (i + 1) % 10 == 0:
+                    log.progress(f"Epoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}")
+        
+            avg_train_recon_loss = train_recon_loss / train_items
+            avg_train_kl_loss = train_kl_loss / train_items
+            avg_train_total_loss = train_total_loss / train_items
+        
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                # Validation
+                vae_model.eval()
+                val_recon_loss = 0.0
+                val_kl_loss = 0.0
+                val_total_loss = 0.0
+                val_items = 0
+        
+                with torch.inference_mode():
+                    for x, _ in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
                 
-                val_items += batch_size
-                val_recon_loss += recon_loss.item() * batch_size
-                val_kl_loss += kl_loss.item() * batch_size
-                val_total_loss += total_loss.item() * batch_size
-        
-        avg_train_recon_loss = train_recon_loss / train_items
-        avg_train_kl_loss = train_kl_loss / train_items
-        avg_train_total_loss = train_total_loss / train_items
-        
-        avg_val_recon_loss = val_recon_loss / val_items
-        avg_val_kl_loss = val_kl_loss / val_items
-        avg_val_total_loss = val_total_loss / val_items
-        
-        # Store metrics
-        vae_train_loss_epoch.append(avg_train_total_loss)
-        vae_val_loss_epoch.append(avg_val_total_loss)
-        vae_train_recon_loss_epoch.append(avg_train_recon_loss)
-        vae_val_recon_loss_epoch.append(avg_val_recon_loss)
-        vae_train_kl_loss_epoch.append(avg_train_kl_loss)
-        vae_val_kl_loss_epoch.append(avg_val_kl_loss)
-        
-        print(f"\nEpoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_total_loss:.4f} | Val Loss: {avg_val_total_loss:.4f}")
-        print(f"  Recon Loss: {avg_train_recon_loss:.4f} (train) / {avg_val_recon_loss:.4f} (val)")
-        
-        vae_scheduler.step(avg_val_total_loss)
-        
-        # Save best model
-        if avg_val_total_loss < best_vae_loss:
-            best_vae_loss = avg_val_total_loss
-            best_vae_state = vae_model.state_dict()
-            torch.save(best_vae_state, os.path.join(save_dir, "best_vae_alternating.pth"))
-            print(f"  Saved best {'VAE' if is_variational else 'Autoencoder'} model")
-        
-        # Periodic saving
-        if (epoch + 1) % periodic_save_interval == 0:
-            periodic_vae_path = os.path.join(save_dir, f"vae_alternating_epoch_{epoch+1}.pth")
-            # Ensure the save directory exists
-            os.makedirs(save_dir, exist_ok=True)
-            torch.save(vae_model.state_dict(), periodic_vae_path)
-    
-    # Load best VAE model
-    vae_model.load_state_dict(best_vae_state)
-    results["vae"] = {
-        "best_val_loss": best_vae_loss,
-        "train_loss_epoch": vae_train_loss_epoch,
-        "val_loss_epoch": vae_val_loss_epoch,
-        "train_recon_loss_epoch": vae_train_recon_loss_epoch,
-        "val_recon_loss_epoch": vae_val_recon_loss_epoch,
-        "train_kl_loss_epoch": vae_train_kl_loss_epoch,
-        "val_kl_loss_epoch": vae_val_kl_loss_epoch,
-        "current_beta_epoch": vae_current_beta_epoch,
-        "current_lr_epoch": vae_current_lr_epoch
-    }
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            if is_variational:
+                                x_hat, mean, logvar = vae_model(tract_data)
+                                recon_loss = recon_criterion(x_hat, tract_data)
+                                kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
+                        
+                                if epoch < kl_annealing_start_epoch:
+                                    weighted_kl_loss = 0.0
+                                    kl_loss = kl_loss_raw
+                                else:
+                                    weighted_kl_loss = current_beta * kl_loss_raw
+                                    kl_loss = kl_loss_raw
+                        
+                                total_loss = recon_loss + weighted_kl_loss
+                            else:
+                                x_hat = vae_model(tract_data)
+                                recon_loss = recon_criterion(x_hat, tract_data)
+                                kl_loss = torch.tensor(0.0, device=device)
+                                total_loss = recon_loss
+                
+                        val_items += batch_size
+                        val_recon_loss += recon_loss.item() * batch_size
+                        val_kl_loss += kl_loss.item() * batch_size
+                        val_total_loss += total_loss.item() * batch_size
+        
+                avg_val_recon_loss = val_recon_loss / val_items
+                avg_val_kl_loss = val_kl_loss / val_items
+                avg_val_total_loss = val_total_loss / val_items
+            else:
+                avg_val_recon_loss = avg_val_kl_loss = avg_val_total_loss = float("nan")
+        
+            # Store metrics
+            vae_train_loss_epoch.append(avg_train_total_loss)
+            vae_val_loss_epoch.append(avg_val_total_loss)
+            vae_train_recon_loss_epoch.append(avg_train_recon_loss)
+            vae_val_recon_loss_epoch.append(avg_val_recon_loss)
+            vae_train_kl_loss_epoch.append(avg_train_kl_loss)
+            vae_val_kl_loss_epoch.append(avg_val_kl_loss)
+            timer.lap("validation")
+        
+            log.info(f"Epoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_total_loss:.4f} | Val Loss: {avg_val_total_loss:.4f}")
+            log.info(f"  Recon Loss: {avg_train_recon_loss:.4f} (train) / {avg_val_recon_loss:.4f} (val)")
+        
+            if val_pass is not None:
+                vae_scheduler.step(avg_val_total_loss)
+        
+            timer.mark()
+            # Save best model
+            if val_schedule.selects_best(val_pass) and avg_val_total_loss < best_vae_loss:
+                best_vae_loss = avg_val_total_loss
+                best_vae_state = vae_model.state_dict()
+                torch.save(best_vae_state, os.path.join(save_dir, "best_vae_alternating.pth"))
+                log.info(f"  Saved best {'VAE' if is_variational else 'Autoencoder'} model")
+        
+            # Periodic saving
+            if (epoch + 1) % periodic_save_interval == 0:
+                periodic_vae_path = os.path.join(save_dir, f"vae_alternating_epoch_{epoch+1}.pth")
+                # Ensure the save directory exists
+                os.makedirs(save_dir, exist_ok=True)
+                torch.save(vae_model.state_dict(), periodic_vae_path)
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("vae", epoch + 1, {
+                "train_loss": vae_train_loss_epoch,
+                "val_loss": vae_val_loss_epoch,
+                "train_recon_loss": vae_train_recon_loss_epoch,
+                "val_recon_loss": vae_val_recon_loss_epoch,
+                "train_kl_loss": vae_train_kl_loss_epoch,
+                "val_kl_loss": vae_val_kl_loss_epoch,
+                "current_beta": vae_current_beta_epoch,
+                "current_lr": vae_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
     
-    # --- STEP 2: Train Age Predictor on raw data ---
-    print(f"\n{'-'*40}\nTraining Age Predictor on raw data...\n{'-'*40}")
+        profiler.stop()
+        # Load best VAE model
+        vae_model.load_state_dict(best_vae_state)
+        results["vae"] = {
+            "best_val_loss": best_vae_loss,
+            "train_loss_epoch": vae_train_loss_epoch,
+            "val_loss_epoch": vae_val_loss_epoch,
+            "train_recon_loss_epoch": vae_train_recon_loss_epoch,
+            "val_recon_loss_epoch": vae_val_recon_loss_epoch,
+            "train_kl_loss_epoch": vae_train_kl_loss_epoch,
+            "val_kl_loss_epoch": vae_val_kl_loss_epoch,
+            "current_beta_epoch": vae_current_beta_epoch,
+            "current_lr_epoch": vae_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
     
-    age_optimizer = torch.optim.Adam(age_predictor.parameters(), lr=lr)
-    age_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(age_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        # --- STEP 2: Train Age Predictor on raw data ---
+        log.info(f"\n{'-'*40}\nTraining Age Predictor on raw data...\n{'-'*40}")
     
-    best_age_mae = float("inf")
-    best_age_state = None
+        age_optimizer = torch.optim.Adam(age_predictor.parameters(), lr=lr)
+        age_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(age_optimizer, "min", patience=10, factor=0.5, verbose=True)
     
-    age_train_loss_epoch = []
-    age_val_loss_epoch = []
-    age_train_r2_epoch = []
-    age_val_r2_epoch = []
-    age_current_lr_epoch = []
+        best_age_mae = float("inf")
+        best_age_state = None
     
-    # Training loop for Age Predictor
-    for epoch in range(epochs_stage1):
-        age_current_lr_epoch.append(age_optimizer.param_groups[0]["lr"])
-        
-        # Training
-        age_predictor.train()
-        train_age_loss = 0.0
-        train_predictions = []
-        train_targets = []
-        train_items = 0
-        
-        for i, (x, labels) in enumerate(train_data):
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            age_true = labels[:, 0].float().unsqueeze(1).to(device)
+        age_train_loss_epoch = []
+        age_val_loss_epoch = []
+        age_train_r2_epoch = []
+        age_val_r2_epoch = []
+        age_current_lr_epoch = []
+    
+        # Training loop for Age Predictor
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "age_predictor")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage1):
+            age_current_lr_epoch.append(age_optimizer.param_groups[0]["lr"])
+        
+            # Training
+            age_predictor.train()
+            train_age_loss = 0.0
+            train_predictions = []
+            train_targets = []
+            train_items = 0
+        
+            for i, (x, labels) in enumerate(timer.iterate(train_data)):
+                batch_size = x.size(0)
+                tract_data = x.to(device, non_blocking=True)
+                age_true = labels[:, 0].float().unsqueeze(1).to(device)
             
-            age_optimizer.zero_grad(set_to_none=True)
+                age_optimizer.zero_grad(set_to_none=True)
             
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                age_pred = age_predictor(tract_data)
-                age_loss = age_criterion(age_pred, age_true)
+                with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                    age_pred = age_predictor(tract_data)
+                    age_loss = age_criterion(age_pred, age_true)
             
-            if use_amp:
-                scaler.scale(age_loss).backward()
-                scaler.unscale_(age_optimizer)
-                torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
-                scaler.step(age_optimizer)
-                scaler.update()
-            else:
-                age_loss.backward()
-                torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
-                age_optimizer.step()
+                timer.lap("forward")
+                if use_amp:
+                    scaler.scale(age_loss).backward()
+                    scaler.unscale_(age_optimizer)
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    scaler.step(age_optimizer)
+                    scaler.update()
+                    timer.lap("optimizer")
+                    profiler.step()
+                else:
+                    age_loss.backward()
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    age_optimizer.step()
+                    timer.lap("optimizer")
+                    profiler.step()
             
-            train_items += batch_size
-            train_age_loss += age_loss.item() * batch_size
+                train_items += batch_size
+                train_age_loss += age_loss.item() * batch_size
             
-            train_predictions.append(age_pred.detach())
-            train_targets.append(age_true.detach())
+                train_predictions.append(age_pred.detach())
+                train_targets.append(age_true.detach())
             
-            if (i + 1) % 10 == 0:
-                print(f"\rEpoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | MAE: {age_loss.item():.4f}", end="")
-        
-        # Calculate R² for training set
-        all_train_preds = torch.cat(train_predictions)
-        all_train_targets = torch.cat(train_targets)
-        train_r2 = calculate_r2_score(all_train_targets, all_train_preds, verbose=False)
-        
-        # Validation
-        age_predictor.eval()
-        val_age_loss = 0.0
-        val_predictions = []
-        val_targets = []
-        val_items = 0
-        
-        with torch.no_grad():
-            for x, labels in val_data:
-                batch_size = x.size(0)
-                tract_data = x.to(device, non_blocking=True)
-                age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                if (i + 1) % 10 == 0:
+                    log.progress(f"Epoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | MAE: {age_loss.item():.4f}")
+        
+            # Calculate R² for training set
+            all_train_preds = torch.cat(train_predictions)
+            all_train_targets = torch.cat(train_targets)
+            train_r2 = calculate_r2_score(all_train_targets, all_train_preds, verbose=False)
+            avg_train_age_loss = train_age_loss / train_items
+        
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                # Validation
+                age_predictor.eval()
+                val_age_loss = 0.0
+                val_predictions = []
+                val_targets = []
+                val_items = 0
+        
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        age_true = labels[:, 0].float().unsqueeze(1).to(device)
                 
-                with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                    age_pred = age_predictor(tract_data)
-                    age_loss = age_criterion(age_pred, age_true)
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            age_pred = age_predictor(tract_data)
+                            age_loss = age_criterion(age_pred, age_true)
                 
-                val_items += batch_size
-                val_age_loss += age_loss.item() * batch_size
+                        val_items += batch_size
+                        val_age_loss += age_loss.item() * batch_size
                 
-                val_predictions.append(age_pred)
-                val_targets.append(age_true)
-        
-        # Calculate R² for validation set
-        all_val_preds = torch.cat(val_predictions)
-        all_val_targets = torch.cat(val_targets)
-        val_r2 = calculate_r2_score(all_val_targets, all_val_preds, verbose=False)
-        
-        avg_train_age_loss = train_age_loss / train_items
-        avg_val_age_loss = val_age_loss / val_items
-        
-        # Store metrics
-        age_train_loss_epoch.append(avg_train_age_loss)
-        age_val_loss_epoch.append(avg_val_age_loss)
-        age_train_r2_epoch.append(train_r2)
-        age_val_r2_epoch.append(val_r2)
-        
-        print(f"\nEpoch {epoch+1}/{epochs_stage1} | Train MAE: {avg_train_age_loss:.4f} | Val MAE: {avg_val_age_loss:.4f}")
-        print(f"  Train R²: {train_r2:.4f} | Val R²: {val_r2:.4f}")
-        
-        age_scheduler.step(avg_val_age_loss)
-        
-        # Save best model
-        if avg_val_age_loss < best_age_mae:
-            best_age_mae = avg_val_age_loss
-            best_age_state = age_predictor.state_dict()
-            torch.save(best_age_state, os.path.join(save_dir, "best_age_predictor_alternating.pth"))
-            print(f"  Saved best Age Predictor model with validation MAE: {best_age_mae:.4f}")
-    
-    # Load best Age Predictor model
-    age_predictor.load_state_dict(best_age_state)
-    results["age_predictor"] = {
-        "best_val_mae": best_age_mae,
-        "train_loss_epoch": age_train_loss_epoch,
-        "val_loss_epoch": age_val_loss_epoch,
-        "train_r2_epoch": age_train_r2_epoch,
-        "val_r2_epoch": age_val_r2_epoch,
-        "current_lr_epoch": age_current_lr_epoch
-    }
+                        val_predictions.append(age_pred)
+                        val_targets.append(age_true)
+        
+                # Calculate R² for validation set
+                all_val_preds = torch.cat(val_predictions)
+                all_val_targets = torch.cat(val_targets)
+                val_r2 = calculate_r2_score(all_val_targets, all_val_preds, verbose=False)
+        
+                avg_val_age_loss = val_age_loss / val_items
+            else:
+                avg_val_age_loss = val_r2 = float("nan")
+        
+            # Store metrics
+            age_train_loss_epoch.append(avg_train_age_loss)
+            age_val_loss_epoch.append(avg_val_age_loss)
+            age_train_r2_epoch.append(train_r2)
+            age_val_r2_epoch.append(val_r2)
+            timer.lap("validation")
+        
+            log.info(f"Epoch {epoch+1}/{epochs_stage1} | Train MAE: {avg_train_age_loss:.4f} | Val MAE: {avg_val_age_loss:.4f}")
+            log.info(f"  Train R²: {train_r2:.4f} | Val R²: {val_r2:.4f}")
+        
+            if val_pass is not None:
+                age_scheduler.step(avg_val_age_loss)
+        
+            timer.mark()
+            # Save best model
+            if val_schedule.selects_best(val_pass) and avg_val_age_loss < best_age_mae:
+                best_age_mae = avg_val_age_loss
+                best_age_state = age_predictor.state_dict()
+                torch.save(best_age_state, os.path.join(save_dir, "best_age_predictor_alternating.pth"))
+                log.info(f"  Saved best Age Predictor model with validation MAE: {best_age_mae:.4f}")
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("age_predictor", epoch + 1, {
+                "train_loss": age_train_loss_epoch,
+                "val_loss": age_val_loss_epoch,
+                "train_r2": age_train_r2_epoch,
+                "val_r2": age_val_r2_epoch,
+                "current_lr": age_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
     
-    # --- STEP 3: Train Site Predictor on raw data ---
-    print(f"\n{'-'*40}\nTraining Site Predictor on raw data...\n{'-'*40}")
+        profiler.stop()
+        # Load best Age Predictor model
+        age_predictor.load_state_dict(best_age_state)
+        results["age_predictor"] = {
+            "best_val_mae": best_age_mae,
+            "train_loss_epoch": age_train_loss_epoch,
+            "val_loss_epoch": age_val_loss_epoch,
+            "train_r2_epoch": age_train_r2_epoch,
+            "val_r2_epoch": age_val_r2_epoch,
+            "current_lr_epoch": age_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
     
-    site_optimizer = torch.optim.Adam(site_predictor.parameters(), lr=lr)
-    site_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(site_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        # --- STEP 3: Train Site Predictor on raw data ---
+        log.info(f"\n{'-'*40}\nTraining Site Predictor on raw data...\n{'-'*40}")
     
-    best_site_loss = float("inf")
-    best_site_state = None
+        site_optimizer = torch.optim.Adam(site_predictor.parameters(), lr=lr)
+        site_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(site_optimizer, "min", patience=10, factor=0.5, verbose=True)
     
-    site_train_loss_epoch = []
-    site_val_loss_epoch = []
-    site_train_acc_epoch = []
-    site_val_acc_epoch = []
-    site_current_lr_epoch = []
+        best_site_loss = float("inf")
+        best_site_state = None
     
-    # Training loop for Site Predictor
-    for epoch in range(epochs_stage1):
-        site_current_lr_epoch.append(site_optimizer.param_groups[0]["lr"])
-        
-        # Training
-        site_predictor.train()
-        train_site_loss = 0.0
-        train_site_correct = 0
-        train_items = 0
-        
-        for i, (x, labels) in enumerate(train_data):
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            site_true = labels[:, 2].long().to(device, non_blocking=True)
-
-            site_optimizer.zero_grad(set_to_none=True)
-            
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                site_pred = site_predictor(tract_data)
-                site_loss = site_criterion(site_pred, site_true)
-
-            if use_amp:
-                scaler.scale(site_loss).backward()
-                scaler.unscale_(site_optimizer)
-                torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
-                scaler.step(site_optimizer)
-                scaler.update()
-            else:
-                site_loss.backward()
-                torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
-                site_optimizer.step()
-            
-            train_items += batch_size
-            train_site_loss += site_loss.item() * batch_size
-            _, predicted_sites = torch.max(site_pred.data, 1)
-            train_site_correct += (predicted_sites == site_true).sum().item()
-            
-            if (i + 1) % 10 == 0:
-                print(f"\rEpoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {site_loss.item():.4f}", end="")
-        
-        site_predictor.eval()
-        val_site_loss = 0.0
-        val_site_correct = 0
-        val_items = 0
-        
-        with torch.no_grad():
-            for x, labels in val_data:
+        site_train_loss_epoch = []
+        site_val_loss_epoch = []
+        site_train_acc_epoch = []
+        site_val_acc_epoch = []
+        site_current_lr_epoch = []
+    
+        # Training loop for Site Predictor
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "site_predictor")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage1):
+            site_current_lr_epoch.append(site_optimizer.param_groups[0]["lr"])
+        
+            # Training
+            site_predictor.train()
+            train_site_loss = 0.0
+            train_site_correct = 0
+            train_items = 0
+        
+            for i, (x, labels) in enumerate(timer.iterate(train_data)):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 site_true = labels[:, 2].long().to(device, non_blocking=True)
-                
+
+                site_optimizer.zero_grad(set_to_none=True)
+            
                 with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
                     site_pred = site_predictor(tract_data)
                     site_loss = site_criterion(site_pred, site_true)
-                
-                val_items += batch_size
-                val_site_loss += site_loss.item() * batch_size
-                _, predicted_sites = torch.max(site_pred.data, 1)
-                val_site_correct += (predicted_sites == site_true).sum().item()
-        
-        avg_train_site_loss = train_site_loss / train_items
-        avg_train_site_acc = (train_site_correct / train_items) * 100
-        avg_val_site_loss = val_site_loss / val_items
-        avg_val_site_acc = (val_site_correct / val_items) * 100
-        
-        site_train_loss_epoch.append(avg_train_site_loss)
-        site_val_loss_epoch.append(avg_val_site_loss)
-        site_train_acc_epoch.append(avg_train_site_acc)
-        site_val_acc_epoch.append(avg_val_site_acc)
-        
-        print(f"\nEpoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_site_loss:.4f} | Train Acc: {avg_train_site_acc:.2f}% | Val Loss: {avg_val_site_loss:.4f} | Val Acc: {avg_val_site_acc:.2f}%")
-        
-        site_scheduler.step(avg_val_site_loss)
-        
-        if avg_val_site_loss < best_site_loss:
-            best_site_loss = avg_val_site_loss
-            best_site_state = site_predictor.state_dict()
-            torch.save(best_site_state, os.path.join(save_dir, "best_site_predictor_alternating.pth"))
-            print(f"  Saved best Site Predictor model with validation loss: {best_site_loss:.4f}")
-    
-    # Load best Site Predictor model
-    site_predictor.load_state_dict(best_site_state)
-    results["site_predictor"] = {
-        "best_val_loss": best_site_loss,
-        "train_loss_epoch": site_train_loss_epoch,
-        "val_loss_epoch": site_val_loss_epoch,
-        "train_acc_epoch": site_train_acc_epoch,
-        "val_acc_epoch": site_val_acc_epoch,
-        "current_lr_epoch": site_current_lr_epoch
-    }
-    
 
-    # STAGE 2: Alternating Adversarial Training
-
-    print(f"\n{'='*40}\nSTAGE 2: Alternating Adversarial Training\n{'='*40}")
-    print(f"Cycle structure: {cycle_length//2} epochs reconstruction+age, {cycle_length//2} epochs reconstruction+site")
-    
-    # Create combined model
-    from models import CombinedAE_Predictors
-    combined_model = CombinedAE_Predictors(vae_model, age_predictor, site_predictor, is_variational=is_variational)
-    combined_model = combined_model.to(device)
-    
-    # Training metrics
-    train_loss_epoch = []
-    val_loss_epoch = []
-    train_recon_loss_epoch = []
-    val_recon_loss_epoch = []
-    train_kl_loss_epoch = []
-    val_kl_loss_epoch = []
-    train_age_loss_epoch = []
-    val_age_loss_epoch = []
-    train_site_loss_epoch = []
-    val_site_loss_epoch = []
-    train_age_mae_epoch = []
-    val_age_mae_epoch = []
-    train_site_acc_epoch = []
-    val_site_acc_epoch = []
-    train_age_r2_epoch = []
-    val_age_r2_epoch = []
-    current_beta_epoch = []
-    current_grl_alpha_epoch = []
-    current_lr_epoch = []
-    training_phase_epoch = []  # Track which phase we're in
-    
-    best_val_metric_value = float("inf")
-    best_combined_state = None
-    best_epoch = 0
-
-    combined_optimizer = torch.optim.Adam([
-        {'params': vae_model.parameters(), 'lr': lr, 'name': 'vae'},
-        {'params': age_predictor.parameters(), 'lr': lr * 0.5, 'name': 'age'},
-        {'params': site_predictor.parameters(), 'lr': lr * 0.5, 'name': 'site'}
-    ])
-    combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
-        combined_optimizer, "min", patience=8, factor=0.7, verbose=False
-    )
-
-    # Alternating training loop
-    for epoch in range(epochs_stage2):
-        # Determine current phase within the cycle with smooth transitions
-        cycle_position = epoch % cycle_length
-        half_cycle = cycle_length // 2
-        transition_epochs = 2  # Number of epochs for smooth transition
-        
-        if cycle_position < half_cycle - transition_epochs:
-            # Phase A: Focus on reconstruction + age prediction
-            current_phase = "recon_age"
-            age_weight = 1.0
-            site_weight = 0.1  # Small weight to maintain some site awareness
-            current_grl_alpha = 0.0
-        elif cycle_position < half_cycle:
-            # Transition from A to B
-            current_phase = "transition_to_site"
-            transition_progress = (cycle_position - (half_cycle - transition_epochs)) / transition_epochs
-            age_weight = 1.0 - 0.8 * transition_progress  # Gradually reduce age focus
-            site_weight = 0.1 + 0.9 * transition_progress  # Gradually increase site focus
-            current_grl_alpha = grl_alpha_end * transition_progress * 0.5  # Gradual GRL ramp-up
-        elif cycle_position < cycle_length - transition_epochs:
-            # Phase B: Focus on reconstruction + site confusion
-            current_phase = "recon_site"
-            age_weight = 0.2  # Small weight to maintain some age awareness
-            site_weight = 1.0
-            phase_progress = (cycle_position - half_cycle) / (half_cycle - transition_epochs)
-            current_grl_alpha = grl_alpha_end * (0.5 + 0.5 * phase_progress)  # Continue ramping up
-        else:
-            # Transition from B to A
-            current_phase = "transition_to_age"
-            transition_progress = (cycle_position - (cycle_length - transition_epochs)) / transition_epochs
-            age_weight = 0.2 + 0.8 * transition_progress  # Gradually increase age focus
-            site_weight = 1.0 - 0.9 * transition_progress  # Gradually reduce site focus
-            current_grl_alpha = grl_alpha_end * (1.0 - 0.5 * transition_progress)  # Gradual GRL ramp-down
-        
-        training_phase_epoch.append(current_phase)
-        current_grl_alpha_epoch.append(current_grl_alpha)
-        current_lr_epoch.append(combined_optimizer.param_groups[0]["lr"])
-        
-        # KL Beta Calculation (same as before)
-        if is_variational and kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
-            annealing_epoch = epoch - kl_annealing_start_epoch
-            if annealing_epoch < kl_annealing_duration:
-                progress = annealing_epoch / kl_annealing_duration
-                sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
-                kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
-            else:
-                kl_annealing_factor = 1.0
-        else:
-            kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
-        
-        if is_variational:
-            current_beta = w_kl * kl_annealing_factor
-        else:
-            current_beta = 0.0
-        current_beta_epoch.append(current_beta)
-        
-        # Training
-        combined_model.train()
-        running_loss = 0.0
-        running_recon_loss = 0.0
-        running_kl_loss = 0.0
-        running_age_loss = 0.0
-        running_site_loss = 0.0
-        running_age_mae_sum = 0.0
-        running_site_correct = 0.0
-        train_items = 0
-        train_age_preds = []
-        train_age_trues = []
-        
-        for i, (x, labels) in enumerate(train_data):
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            age_true = labels[:, 0].float().unsqueeze(1).to(device)
-            site_true = labels[:, 2].long().to(device, non_blocking=True)
+                timer.lap("forward")
+                if use_amp:
+                    scaler.scale(site_loss).backward()
+                    scaler.unscale_(site_optimizer)
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    scaler.step(site_optimizer)
+                    scaler.update()
+                    timer.lap("optimizer")
+                    profiler.step()
+                else:
+                    site_loss.backward()
+                    timer.lap("backward")
+                    torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
+                    timer.lap("clip")
+                    site_optimizer.step()
+                    timer.lap("optimizer")
+                    profiler.step()
             
-            combined_optimizer.zero_grad(set_to_none=True)
+                train_items += batch_size
+                train_site_loss += site_loss.item() * batch_size
+                _, predicted_sites = torch.max(site_pred.data, 1)
+                train_site_correct += (predicted_sites == site_true).sum().item()
             
-            with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
-                x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha)
+                if (i + 1) % 10 == 0:
+                    log.progress(f"Epoch {epoch+1}/{epochs_stage1} | Batch {i+1}/{len(train_data)} | Loss: {site_loss.item():.4f}")
+        
+            avg_train_site_loss = train_site_loss / train_items
+            avg_train_site_acc = (train_site_correct / train_items) * 100
+        
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                site_predictor.eval()
+                val_site_loss = 0.0
+                val_site_correct = 0
+                val_items = 0
+        
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        site_true = labels[:, 2].long().to(device, non_blocking=True)
                 
-                recon_loss = recon_criterion(x_hat, tract_data)
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            site_pred = site_predictor(tract_data)
+                            site_loss = site_criterion(site_pred, site_true)
                 
-                if is_variational:
-                    kl_loss = kl_divergence_loss(mean, logvar) / batch_size
+                        val_items += batch_size
+                        val_site_loss += site_loss.item() * batch_size
+                        _, predicted_sites = torch.max(site_pred.data, 1)
+                        val_site_correct += (predicted_sites == site_true).sum().item()
+        
+                avg_val_site_loss = val_site_loss / val_items
+                avg_val_site_acc = (val_site_correct / val_items) * 100
+            else:
+                avg_val_site_loss = avg_val_site_acc = float("nan")
+        
+            site_train_loss_epoch.append(avg_train_site_loss)
+            site_val_loss_epoch.append(avg_val_site_loss)
+            site_train_acc_epoch.append(avg_train_site_acc)
+            site_val_acc_epoch.append(avg_val_site_acc)
+            timer.lap("validation")
+        
+            log.info(f"Epoch {epoch+1}/{epochs_stage1} | Train Loss: {avg_train_site_loss:.4f} | Train Acc: {avg_train_site_acc:.2f}% | Val Loss: {avg_val_site_loss:.4f} | Val Acc: {avg_val_site_acc:.2f}%")
+        
+            if val_pass is not None:
+                site_scheduler.step(avg_val_site_loss)
+        
+            timer.mark()
+            if val_schedule.selects_best(val_pass) and avg_val_site_loss < best_site_loss:
+                best_site_loss = avg_val_site_loss
+                best_site_state = site_predictor.state_dict()
+                torch.save(best_site_state, os.path.join(save_dir, "best_site_predictor_alternating.pth"))
+                log.info(f"  Saved best Site Predictor model with validation loss: {best_site_loss:.4f}")
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("site_predictor", epoch + 1, {
+                "train_loss": site_train_loss_epoch,
+                "val_loss": site_val_loss_epoch,
+                "train_acc": site_train_acc_epoch,
+                "val_acc": site_val_acc_epoch,
+                "current_lr": site_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+    
+        profiler.stop()
+        # Load best Site Predictor model
+        site_predictor.load_state_dict(best_site_state)
+        results["site_predictor"] = {
+            "best_val_loss": best_site_loss,
+            "train_loss_epoch": site_train_loss_epoch,
+            "val_loss_epoch": site_val_loss_epoch,
+            "train_acc_epoch": site_train_acc_epoch,
+            "val_acc_epoch": site_val_acc_epoch,
+            "current_lr_epoch": site_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
+    
+
+        # STAGE 2: Alternating Adversarial Training
+
+        log.info(f"\n{'='*40}\nSTAGE 2: Alternating Adversarial Training\n{'='*40}")
+        log.info(f"Cycle structure: {cycle_length//2} epochs reconstruction+age, {cycle_length//2} epochs reconstruction+site")
+    
+        # Create combined model
+        try:
+            from .models import CombinedAE_Predictors
+        except ImportError:
+            from models import CombinedAE_Predictors
+        combined_model = CombinedAE_Predictors(vae_model, age_predictor, site_predictor, is_variational=is_variational)
+        combined_model = combined_model.to(device)
+    
+        # Training metrics
+        train_loss_epoch = []
+        val_loss_epoch = []
+        train_recon_loss_epoch = []
+        val_recon_loss_epoch = []
+        train_kl_loss_epoch = []
+        val_kl_loss_epoch = []
+        train_age_loss_epoch = []
+        val_age_loss_epoch = []
+        train_site_loss_epoch = []
+        val_site_loss_epoch = []
+        train_age_mae_epoch = []
+        val_age_mae_epoch = []
+        train_site_acc_epoch = []
+        val_site_acc_epoch = []
+        train_age_r2_epoch = []
+        val_age_r2_epoch = []
+        current_beta_epoch = []
+        current_grl_alpha_epoch = []
+        current_lr_epoch = []
+        training_phase_epoch = []  # Track which phase we're in
+    
+        best_val_metric_value = float("inf")
+        best_combined_state = None
+        best_epoch = 0
+
+        combined_optimizer = torch.optim.Adam([
+            {'params': vae_model.parameters(), 'lr': lr, 'name': 'vae'},
+            {'params': age_predictor.parameters(), 'lr': lr * 0.5, 'name': 'age'},
+            {'params': site_predictor.parameters(), 'lr': lr * 0.5, 'name': 'site'}
+        ])
+        combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
+            combined_optimizer, "min", patience=8, factor=0.7, verbose=False
+        )
+
+        # Alternating training loop
+        val_schedule = ValidationSchedule(val_data, epochs_stage2, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "alternating")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage2):
+            # Determine current phase within the cycle with smooth transitions
+            cycle_position = epoch % cycle_length
+            half_cycle = cycle_length // 2
+            transition_epochs = 2  # Number of epochs for smooth transition
+        
+            if cycle_position < half_cycle - transition_epochs:
+                # Phase A: Focus on reconstruction + age prediction
+                current_phase = "recon_age"
+                age_weight = 1.0
+                site_weight = 0.1  # Small weight to maintain some site awareness
+                current_grl_alpha = 0.0
+            elif cycle_position < half_cycle:
+                # Transition from A to B
+                current_phase = "transition_to_site"
+                transition_progress = (cycle_position - (half_cycle - transition_epochs)) / transition_epochs
+                age_weight = 1.0 - 0.8 * transition_progress  # Gradually reduce age focus
+                site_weight = 0.1 + 0.9 * transition_progress  # Gradually increase site focus
+                current_grl_alpha = grl_alpha_end * transition_progress * 0.5  # Gradual GRL ramp-up
+            elif cycle_position < cycle_length - transition_epochs:
+                # Phase B: Focus on reconstruction + site confusion
+                current_phase = "recon_site"
+                age_weight = 0.2  # Small weight to maintain some age awareness
+                site_weight = 1.0
+                phase_progress = (cycle_position - half_cycle) / (half_cycle - transition_epochs)
+                current_grl_alpha = grl_alpha_end * (0.5 + 0.5 * phase_progress)  # Continue ramping up
+            else:
+                # Transition from B to A
+                current_phase = "transition_to_age"
+                transition_progress = (cycle_position - (cycle_length - transition_epochs)) / transition_epochs
+                age_weight = 0.2 + 0.8 * transition_progress  # Gradually increase age focus
+                site_weight = 1.0 - 0.9 * transition_progress  # Gradually reduce site focus
+                current_grl_alpha = grl_alpha_end * (1.0 - 0.5 * transition_progress)  # Gradual GRL ramp-down
+        
+            training_phase_epoch.append(current_phase)
+            current_grl_alpha_epoch.append(current_grl_alpha)
+            current_lr_epoch.append(combined_optimizer.param_groups[0]["lr"])
+        
+            # KL Beta Calculation (same as before)
+            if is_variational and kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
+                annealing_epoch = epoch - kl_annealing_start_epoch
+                if annealing_epoch < kl_annealing_duration:
+                    progress = annealing_epoch / kl_annealing_duration
+                    sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+                    kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
                 else:
-                    kl_loss = torch.tensor(0.0, device=device)
-                
-                age_loss = age_criterion(age_pred, age_true)
-                site_loss = site_criterion(site_pred, site_true)
-                
-                # Phase-specific loss calculation
-                if current_phase == "recon_age":
-                    # Focus on reconstruction and age prediction
-                    if is_variational:
-                        total_loss = (w_recon * recon_loss + 
-                                     current_beta * kl_loss + 
-                                     w_age * age_loss)
-                    else:
-                        total_loss = (w_recon * recon_loss + w_age * age_loss)
-                else:  # recon_site phase
-                    # Focus on reconstruction and site confusion
-                    if is_variational:
-                        total_loss = (w_recon * recon_loss + 
-                                     current_beta * kl_loss + 
-                                     w_site * site_loss)
-                    else:
-                        total_loss = (w_recon * recon_loss + w_site * site_loss)
-            
-            if use_amp:
-                scaler.scale(total_loss).backward()
-                scaler.unscale_(combined_optimizer)
+                    kl_annealing_factor = 1.0
             else:
-                total_loss.backward()
-            
-            # Accumulate metrics (same as before)
-            train_items += batch_size
-            running_loss += total_loss.item() * batch_size
-            running_recon_loss += recon_loss.item() * batch_size
-            running_kl_loss += kl_loss.item() * batch_size
-            running_age_loss += age_loss.item() * batch_size
-            running_site_loss += site_loss.item() * batch_size
-            running_age_mae_sum += age_loss.item() * batch_size
-            
-            train_age_preds.append(age_pred.detach())
-            train_age_trues.append(age_true.detach())
-            
-            _, predicted_sites = torch.max(site_pred.data, 1)
-            running_site_correct += (predicted_sites == site_true).sum().item()
-            
-            if (i + 1) % 10 == 0:
-                print(f"\rEpoch {epoch+1}/{epochs_stage2} ({current_phase}) | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}", end="")
-        
-        # Validation (same structure as training)
-        combined_model.eval()
-        running_val_loss = 0.0
-        running_val_recon_loss = 0.0
-        running_val_kl_loss = 0.0
-        running_val_age_loss = 0.0
-        running_val_site_loss = 0.0
-        running_val_age_mae_sum = 0.0
-        running_val_site_correct = 0.0
-        val_items = 0
-        val_age_preds = []
-        val_age_trues = []
-        
-        with torch.no_grad():
-            for x, labels in val_data:
+                kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
+        
+            if is_variational:
+                current_beta = w_kl * kl_annealing_factor
+            else:
+                current_beta = 0.0
+            current_beta_epoch.append(current_beta)
+        
+            # Training
+            combined_model.train()
+            running_loss = 0.0
+            running_recon_loss = 0.0
+            running_kl_loss = 0.0
+            running_age_loss = 0.0
+            running_site_loss = 0.0
+            running_age_mae_sum = 0.0
+            running_site_correct = 0.0
+            train_items = 0
+            train_age_preds = []
+            train_age_trues = []
+        
+            for i, (x, labels) in enumerate(timer.iterate(train_data)):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 age_true = labels[:, 0].float().unsqueeze(1).to(device)
                 site_true = labels[:, 2].long().to(device, non_blocking=True)
-                
+            
+                combined_optimizer.zero_grad(set_to_none=True)
+            
                 with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
                     x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha)
-                    
+                
                     recon_loss = recon_criterion(x_hat, tract_data)
-                    
+                
                     if is_variational:
                         kl_loss = kl_divergence_loss(mean, logvar) / batch_size
                     else:
                         kl_loss = torch.tensor(0.0, device=device)
-                    
+                
                     age_loss = age_criterion(age_pred, age_true)
                     site_loss = site_criterion(site_pred, site_true)
-                    
-                    # Use same phase-specific loss as training
+                
+                    # Phase-specific loss calculation
                     if current_phase == "recon_age":
+                        # Focus on reconstruction and age prediction
                         if is_variational:
                             total_loss = (w_recon * recon_loss + 
                                          current_beta * kl_loss + 
                                          w_age * age_loss)
                         else:
                             total_loss = (w_recon * recon_loss + w_age * age_loss)
-                    else:
+                    else:  # recon_site phase
+                        # Focus on reconstruction and site confusion
                         if is_variational:
                             total_loss = (w_recon * recon_loss + 
                                          current_beta * kl_loss + 
                                          w_site * site_loss)
                         else:
                             total_loss = (w_recon * recon_loss + w_site * site_loss)
+            
+                timer.lap("forward")
+                if use_amp:
+                    scaler.scale(total_loss).backward()
+                    scaler.unscale_(combined_optimizer)
+                else:
+                    total_loss.backward()
+                timer.lap("backward")
+                profiler.step()
+            
+                # Accumulate metrics (same as before)
+                train_items += batch_size
+                running_loss += total_loss.item() * batch_size
+                running_recon_loss += recon_loss.item() * batch_size
+                running_kl_loss += kl_loss.item() * batch_size
+                running_age_loss += age_loss.item() * batch_size
+                running_site_loss += site_loss.item() * batch_size
+                running_age_mae_sum += age_loss.item() * batch_size
+            
+                train_age_preds.append(age_pred.detach())
+                train_age_trues.append(age_true.detach())
+            
+                _, predicted_sites = torch.max(site_pred.data, 1)
+                running_site_correct += (predicted_sites == site_true).sum().item()
+            
+                if (i + 1) % 10 == 0:
+                    log.progress(f"Epoch {epoch+1}/{epochs_stage2} ({current_phase}) | Batch {i+1}/{len(train_data)} | Loss: {total_loss.item():.4f}")
+        
+            avg_train_loss = running_loss / train_items
+            avg_train_recon_loss = running_recon_loss / train_items
+            avg_train_kl_loss = running_kl_loss / train_items
+            avg_train_age_loss = running_age_loss / train_items
+            avg_train_site_loss = running_site_loss / train_items
+            avg_train_age_mae = running_age_mae_sum / train_items
+            avg_train_site_acc = (running_site_correct / train_items) * 100
+        
+            all_train_age_preds = torch.cat(train_age_preds)
+            all_train_age_trues = torch.cat(train_age_trues)
+            train_age_r2 = calculate_r2_score(all_train_age_trues, all_train_age_preds, verbose=False)
+        
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                # Validation (same structure as training)
+                combined_model.eval()
+                running_val_loss = 0.0
+                running_val_recon_loss = 0.0
+                running_val_kl_loss = 0.0
+                running_val_age_loss = 0.0
+                running_val_site_loss = 0.0
+                running_val_age_mae_sum = 0.0
+                running_val_site_correct = 0.0
+                val_items = 0
+                val_age_preds = []
+                val_age_trues = []
+        
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                        site_true = labels[:, 2].long().to(device, non_blocking=True)
+                
+                        with (torch.amp.autocast(device_type="cuda") if use_amp else contextlib.nullcontext()):
+                            x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha)
+                    
+                            recon_loss = recon_criterion(x_hat, tract_data)
+                    
+                            if is_variational:
+                                kl_loss = kl_divergence_loss(mean, logvar) / batch_size
+                            else:
+                                kl_loss = torch.tensor(0.0, device=device)
+                    
+                            age_loss = age_criterion(age_pred, age_true)
+                            site_loss = site_criterion(site_pred, site_true)
+                    
+                            # Use same phase-specific loss as training
+                            if current_phase == "recon_age":
+                                if is_variational:
+                                    total_loss = (w_recon * recon_loss + 
+                                                 current_beta * kl_loss + 
+                                                 w_age * age_loss)
+                                else:
+                                    total_loss = (w_recon * recon_loss + w_age * age_loss)
+                            else:
+                                if is_variational:
+                                    total_loss = (w_recon * recon_loss + 
+                                                 current_beta * kl_loss + 
+                                                 w_site * site_loss)
+                                else:
+                                    total_loss = (w_recon * recon_loss + w_site * site_loss)
                 
-                val_items += batch_size
-                running_val_loss += total_loss.item() * batch_size
-                running_val_recon_loss += recon_loss.item() * batch_size
-                running_val_kl_loss += kl_loss.item() * batch_size
-                running_val_age_loss += age_loss.item() * batch_size
-                running_val_site_loss += site_loss.item() * batch_size
-                running_val_age_mae_sum += age_loss.item() * batch_size
+                        val_items += batch_size
+                        running_val_loss += total_loss.item() * batch_size
+                        running_val_recon_loss += recon_loss.item() * batch_size
+                        running_val_kl_loss += kl_loss.item() * batch_size
+                        running_val_age_loss += age_loss.item() * batch_size
+                        running_val_site_loss += site_loss.item() * batch_size
+                        running_val_age_mae_sum += age_loss.item() * batch_size
                 
-                val_age_preds.append(age_pred)
-                val_age_trues.append(age_true)
+                        val_age_preds.append(age_pred)
+                        val_age_trues.append(age_true)
                 
-                _, predicted_sites = torch.max(site_pred.data, 1)
-                running_val_site_correct += (predicted_sites == site_true).sum().item()
-        
-        # Calculate metrics and save (same as before)
-        avg_train_loss = running_loss / train_items
-        avg_train_recon_loss = running_recon_loss / train_items
-        avg_train_kl_loss = running_kl_loss / train_items
-        avg_train_age_loss = running_age_loss / train_items
-        avg_train_site_loss = running_site_loss / train_items
-        avg_train_age_mae = running_age_mae_sum / train_items
-        avg_train_site_acc = (running_site_correct / train_items) * 100
-        
-        all_train_age_preds = torch.cat(train_age_preds)
-        all_train_age_trues = torch.cat(train_age_trues)
-        train_age_r2 = calculate_r2_score(all_train_age_trues, all_train_age_preds, verbose=False)
-        
-        avg_val_loss = running_val_loss / val_items
-        avg_val_recon_loss = running_val_recon_loss / val_items
-        avg_val_kl_loss = running_val_kl_loss / val_items
-        avg_val_age_loss = running_val_age_loss / val_items
-        avg_val_site_loss = running_val_site_loss / val_items
-        avg_val_age_mae = running_val_age_mae_sum / val_items
-        avg_val_site_acc = (running_val_site_correct / val_items) * 100
-        
-        all_val_age_preds = torch.cat(val_age_preds)
-        all_val_age_trues = torch.cat(val_age_trues)
-        val_age_r2 = calculate_r2_score(all_val_age_trues, all_val_age_preds, verbose=False)
-        
-        # Save metrics
-        train_loss_epoch.append(avg_train_loss)
-        train_recon_loss_epoch.append(avg_train_recon_loss)
-        train_kl_loss_epoch.append(avg_train_kl_loss)
-        train_age_loss_epoch.append(avg_train_age_loss)
-        train_site_loss_epoch.append(avg_train_site_loss)
-        train_age_mae_epoch.append(avg_train_age_mae)
-        train_site_acc_epoch.append(avg_train_site_acc)
-        train_age_r2_epoch.append(train_age_r2)
-        
-        val_loss_epoch.append(avg_val_loss)
-        val_recon_loss_epoch.append(avg_val_recon_loss)
-        val_kl_loss_epoch.append(avg_val_kl_loss)
-        val_age_loss_epoch.append(avg_val_age_loss)
-        val_site_loss_epoch.append(avg_val_site_loss)
-        val_age_mae_epoch.append(avg_val_age_mae)
-        val_site_acc_epoch.append(avg_val_site_acc)
-        val_age_r2_epoch.append(val_age_r2)
-        
-        # Monitor and save best model
-        current_epoch_val_metrics = {
-            "val_loss": avg_val_loss,
-            "val_age_mae": avg_val_age_mae,
+                        _, predicted_sites = torch.max(site_pred.data, 1)
+                        running_val_site_correct += (predicted_sites == site_true).sum().item()
+        
+            # Calculate metrics and save (same as before)
+            if val_pass is not None:
+                avg_val_loss = running_val_loss / val_items
+                avg_val_recon_loss = running_val_recon_loss / val_items
+                avg_val_kl_loss = running_val_kl_loss / val_items
+                avg_val_age_loss = running_val_age_loss / val_items
+                avg_val_site_loss = running_val_site_loss / val_items
+                avg_val_age_mae = running_val_age_mae_sum / val_items
+                avg_val_site_acc = (running_val_site_correct / val_items) * 100
+        
+                all_val_age_preds = torch.cat(val_age_preds)
+                all_val_age_trues = torch.cat(val_age_trues)
+                val_age_r2 = calculate_r2_score(all_val_age_trues, all_val_age_preds, verbose=False)
+            else:
+                avg_val_loss = avg_val_recon_loss = avg_val_kl_loss = avg_val_age_loss = float("nan")
+                avg_val_site_loss = avg_val_age_mae = avg_val_site_acc = val_age_r2 = float("nan")
+        
+            # Save metrics
+            train_loss_epoch.append(avg_train_loss)
+            train_recon_loss_epoch.append(avg_train_recon_loss)
+            train_kl_loss_epoch.append(avg_train_kl_loss)
+            train_age_loss_epoch.append(avg_train_age_loss)
+            train_site_loss_epoch.append(avg_train_site_loss)
+            train_age_mae_epoch.append(avg_train_age_mae)
+            train_site_acc_epoch.append(avg_train_site_acc)
+            train_age_r2_epoch.append(train_age_r2)
+        
+            val_loss_epoch.append(avg_val_loss)
+            val_recon_loss_epoch.append(avg_val_recon_loss)
+            val_kl_loss_epoch.append(avg_val_kl_loss)
+            val_age_loss_epoch.append(avg_val_age_loss)
+            val_site_loss_epoch.append(avg_val_site_loss)
+            val_age_mae_epoch.append(avg_val_age_mae)
+            val_site_acc_epoch.append(avg_val_site_acc)
+            val_age_r2_epoch.append(val_age_r2)
+            timer.lap("validation")
+        
+            # Monitor and save best model
+            current_epoch_val_metrics = {
+                "val_loss": avg_val_loss,
+                "val_age_mae": avg_val_age_mae,
+            }
+            current_val_metric = current_epoch_val_metrics.get(val_metric_to_monitor, avg_val_loss)
+        
+            # Print progress with phase information
+            log.info(f"Epoch {epoch+1}/{epochs_stage2} ({current_phase}) | Train Loss: {avg_train_loss:.4f} | " +
+                  f"Val Loss: {avg_val_loss:.4f} | Val Age MAE: {avg_val_age_mae:.4f} | " +
+                  f"Val Age R²: {val_age_r2:.4f} | Val Site Acc: {avg_val_site_acc:.2f}%")
+            log.info(f"  Recon RMSE: {np.sqrt(avg_val_recon_loss):.4f} | GRL Alpha: {current_grl_alpha:.2f}")
+        
+            if val_pass is not None:
+                combined_scheduler.step(current_val_metric)
+        
+            timer.mark()
+            # Save best model
+            if val_schedule.selects_best(val_pass) and current_val_metric < best_val_metric_value:
+                best_val_metric_value = current_val_metric
+                best_combined_state = combined_model.state_dict()
+                best_epoch = epoch
+            
+                model_path = os.path.join(save_dir, "best_alternating_model.pth")
+                torch.save(best_combined_state, model_path)
+                log.info(f"  Saved best alternating model with {val_metric_to_monitor}: {best_val_metric_value:.4f}")
+        
+            # Periodic saving
+            if (epoch + 1) % periodic_save_interval == 0:
+                periodic_path = os.path.join(save_dir, f"alternating_model_epoch_{epoch+1}.pth")
+                # Ensure the save directory exists
+                os.makedirs(save_dir, exist_ok=True)
+                torch.save(combined_model.state_dict(), periodic_path)
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("alternating", epoch + 1, {
+                "train_loss": train_loss_epoch,
+                "val_loss": val_loss_epoch,
+                "train_recon_loss": train_recon_loss_epoch,
+                "val_recon_loss": val_recon_loss_epoch,
+                "train_kl_loss": train_kl_loss_epoch,
+                "val_kl_loss": val_kl_loss_epoch,
+                "train_age_loss": train_age_loss_epoch,
+                "val_age_loss": val_age_loss_epoch,
+                "train_site_loss": train_site_loss_epoch,
+                "val_site_loss": val_site_loss_epoch,
+                "train_age_mae": train_age_mae_epoch,
+                "val_age_mae": val_age_mae_epoch,
+                "train_site_acc": train_site_acc_epoch,
+                "val_site_acc": val_site_acc_epoch,
+                "train_age_r2": train_age_r2_epoch,
+                "val_age_r2": val_age_r2_epoch,
+                "current_beta": current_beta_epoch,
+                "current_grl_alpha": current_grl_alpha_epoch,
+                "current_lr": current_lr_epoch,
+                "training_phase": training_phase_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+    
+        profiler.stop()
+        # Load best model
+        combined_model.load_state_dict(best_combined_state)
+    
+        # Return results
+        combined_results = {
+            "train_loss_epoch": train_loss_epoch,
+            "val_loss_epoch": val_loss_epoch,
+            "train_recon_loss_epoch": train_recon_loss_epoch,
+            "val_recon_loss_epoch": val_recon_loss_epoch,
+            "train_kl_loss_epoch": train_kl_loss_epoch,
+            "val_kl_loss_epoch": val_kl_loss_epoch,
+            "train_age_loss_epoch": train_age_loss_epoch,
+            "val_age_loss_epoch": val_age_loss_epoch,
+            "train_site_loss_epoch": train_site_loss_epoch,
+            "val_site_loss_epoch": val_site_loss_epoch,
+            "train_age_mae_epoch": train_age_mae_epoch,
+            "val_age_mae_epoch": val_age_mae_epoch,
+            "train_site_acc_epoch": train_site_acc_epoch,
+            "val_site_acc_epoch": val_site_acc_epoch,
+            "train_age_r2_epoch": train_age_r2_epoch,
+            "val_age_r2_epoch": val_age_r2_epoch,
+            "current_beta_epoch": current_beta_epoch,
+            "current_grl_alpha_epoch": current_grl_alpha_epoch,
+            "current_lr_epoch": current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files,
+            "training_phase_epoch": training_phase_epoch,  # New: track which phase each epoch was
+            f"best_{val_metric_to_monitor}": best_val_metric_value,
+            "best_epoch": best_epoch,
+            "model_path": os.path.join(save_dir, "best_alternating_model.pth")
         }
-        current_val_metric = current_epoch_val_metrics.get(val_metric_to_monitor, avg_val_loss)
-        
-        # Print progress with phase information
-        print(f"\nEpoch {epoch+1}/{epochs_stage2} ({current_phase}) | Train Loss: {avg_train_loss:.4f} | " +
-              f"Val Loss: {avg_val_loss:.4f} | Val Age MAE: {avg_val_age_mae:.4f} | " +
-              f"Val Age R²: {val_age_r2:.4f} | Val Site Acc: {avg_val_site_acc:.2f}%")
-        print(f"  Recon RMSE: {np.sqrt(avg_val_recon_loss):.4f} | GRL Alpha: {current_grl_alpha:.2f}")
-        
-        combined_scheduler.step(current_val_metric)
-        
-        # Save best model
-        if current_val_metric < best_val_metric_value:
-            best_val_metric_value = current_val_metric
-            best_combined_state = combined_model.state_dict()
-            best_epoch = epoch
-            
-            model_path = os.path.join(save_dir, "best_alternating_model.pth")
-            torch.save(best_combined_state, model_path)
-            print(f"  Saved best alternating model with {val_metric_to_monitor}: {best_val_metric_value:.4f}")
-        
-        # Periodic saving
-        if (epoch + 1) % periodic_save_interval == 0:
-            periodic_path = os.path.join(save_dir, f"alternating_model_epoch_{epoch+1}.pth")
-            # Ensure the save directory exists
-            os.makedirs(save_dir, exist_ok=True)
-            torch.save(combined_model.state_dict(), periodic_path)
-    
-    # Load best model
-    combined_model.load_state_dict(best_combined_state)
-    
-    # Return results
-    combined_results = {
-        "train_loss_epoch": train_loss_epoch,
-        "val_loss_epoch": val_loss_epoch,
-        "train_recon_loss_epoch": train_recon_loss_epoch,
-        "val_recon_loss_epoch": val_recon_loss_epoch,
-        "train_kl_loss_epoch": train_kl_loss_epoch,
-        "val_kl_loss_epoch": val_kl_loss_epoch,
-        "train_age_loss_epoch": train_age_loss_epoch,
-        "val_age_loss_epoch": val_age_loss_epoch,
-        "train_site_loss_epoch": train_site_loss_epoch,
-        "val_site_loss_epoch": val_site_loss_epoch,
-        "train_age_mae_epoch": train_age_mae_epoch,
-        "val_age_mae_epoch": val_age_mae_epoch,
-        "train_site_acc_epoch": train_site_acc_epoch,
-        "val_site_acc_epoch": val_site_acc_epoch,
-        "train_age_r2_epoch": train_age_r2_epoch,
-        "val_age_r2_epoch": val_age_r2_epoch,
-        "current_beta_epoch": current_beta_epoch,
-        "current_grl_alpha_epoch": current_grl_alpha_epoch,
-        "current_lr_epoch": current_lr_epoch,
-        "training_phase_epoch": training_phase_epoch,  # New: track which phase each epoch was
-        f"best_{val_metric_to_monitor}": best_val_metric_value,
-        "best_epoch": best_epoch,
-        "model_path": os.path.join(save_dir, "best_alternating_model.pth")
-    }
     
-    results["alternating"] = combined_results
+        results["alternating"] = combined_results
     
-    print(f"\n{'='*40}\nAlternating training complete!\n{'='*40}")
-    print(f"Best {val_metric_to_monitor}: {best_val_metric_value:.4f}")
+        log.info(f"\n{'='*40}\nAlternating training complete!\n{'='*40}")
+        log.info(f"Best {val_metric_to_monitor}: {best_val_metric_value:.4f}")
     
-    return results
+        return results
+    finally:
+        metrics_log.close()
+        log.close()
 
 # Improved alternating training: Enhanced version with adaptive cycle lengths and better
 # learning rate scheduling for more stable adversarial training dynamics
@@ -3223,127 +4240,102 @@ def train_vae_age_site_alternating_improved(
     save_predictions_interval=50,
     periodic_save_interval=50,
     is_variational=True,
-    adaptive_cycle_length=True
+    adaptive_cycle_length=True,
+    save_per_sample_predictions=False,
+    save_prediction_latents=False,
+    metrics_file="metrics.csv",
+    log_level=None,
+    profile=None,
+    validate_every=1,  # Validate after every N-th epoch of each stage (see validation.py)
+    fast_val_subset=None,  # Samples (or fraction) of a fixed stratified val subset for quick passes
+    full_val_every=None  # Full validation pass every N epochs when using fast_val_subset (default 5 x validate_every)
 ):
+    log = ProgressReporter(level=log_level)
     import os, sys
     import torch
-    print(f"DEBUG: Starting train_vae_age_site_alternating_improved function")
-    print(f"DEBUG: Training configuration - epochs_stage1={epochs_stage1}, epochs_stage2={epochs_stage2}, device={device}")
-    print(f"DEBUG: Autoencoder type - {'Variational' if is_variational else 'Non-variational'}")
-    print(f"DEBUG: KL annealing config - start_epoch={kl_annealing_start_epoch}, duration={kl_annealing_duration}, start_value={kl_annealing_start}")
-    print(f"DEBUG: Data loaders - train_data has {len(train_data)} batches, val_data has {len(val_data)} batches")
-    sys.stdout.flush()
+    log.debug(f"Starting train_vae_age_site_alternating_improved function")
+    log.debug(f"Training configuration - epochs_stage1={epochs_stage1}, epochs_stage2={epochs_stage2}, device={device}")
+    log.debug(f"Autoencoder type - {'Variational' if is_variational else 'Non-variational'}")
+    log.debug(f"KL annealing config - start_epoch={kl_annealing_start_epoch}, duration={kl_annealing_duration}, start_value={kl_annealing_start}")
+    log.debug(f"Data loaders - train_data has {len(train_data)} batches, val_data has {len(val_data)} batches")
     
     os.makedirs(save_dir, exist_ok=True)
-    print(f"DEBUG: Created directory {save_dir}")
-    sys.stdout.flush()
-    
-    torch.backends.cudnn.benchmark = True
+    log.debug(f"Created directory {save_dir}")
     
-    # Move models to device
+    # Per-epoch metrics log, written while training runs
+    metrics_log = MetricsWriter(os.path.join(save_dir, metrics_file) if metrics_file else None)
     try:
-        print(f"DEBUG: Moving models to device {device}")
-        vae_model = vae_model.to(device)
-        age_predictor = age_predictor.to(device)
-        site_predictor = site_predictor.to(device)
-        print(f"DEBUG: Successfully moved models to {device}")
-        sys.stdout.flush()
-    except Exception as e:
-        print(f"ERROR moving models to device: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        sys.stdout.flush()
-        raise
-    
-    # Set up loss functions
-    print(f"DEBUG: Setting up loss functions")
-    sys.stdout.flush()
-    recon_criterion = torch.nn.MSELoss(reduction="mean")
-    age_criterion = torch.nn.L1Loss(reduction="mean")  # MAE
-    site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
-    
-    results = {}
-    
-
-    # STAGE 1: Train each model independently on raw data
-
-    print(f"\n{'='*40}\nSTAGE 1: Training models independently\n{'='*40}")
-    sys.stdout.flush()
-    
-    # --- STEP 1: Train VAE for reconstruction ---
-    print(f"\n{'-'*40}\nTraining {'VAE' if is_variational else 'Autoencoder'} for reconstruction...\n{'-'*40}")
-    sys.stdout.flush()
-    vae_optimizer = torch.optim.Adam(vae_model.parameters(), lr=lr)
-    vae_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(vae_optimizer, "min", patience=10, factor=0.5, verbose=True)
-    best_vae_loss = float("inf")
-    best_vae_state = None
-    vae_train_loss_epoch = []
-    vae_val_loss_epoch = []
-    vae_train_recon_loss_epoch = []
-    vae_val_recon_loss_epoch = []
-    vae_train_kl_loss_epoch = []
-    vae_val_kl_loss_epoch = []
-    vae_current_beta_epoch = []
-    vae_current_lr_epoch = []
-    for epoch in range(epochs_stage1):
-        # KL Beta Calculation
-        if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
-            annealing_epoch = epoch - kl_annealing_start_epoch
-            if annealing_epoch < kl_annealing_duration:
-                progress = annealing_epoch / kl_annealing_duration
-                sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
-                kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
-            else:
-                kl_annealing_factor = 1.0
-        else:
-            kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
-        current_beta = w_kl * kl_annealing_factor
-        vae_current_beta_epoch.append(current_beta)
-        vae_current_lr_epoch.append(vae_optimizer.param_groups[0]["lr"])
-        vae_model.train()
-        train_recon_loss = 0.0
-        train_kl_loss = 0.0
-        train_total_loss = 0.0
-        train_items = 0
-        for x, _ in train_data:
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            vae_optimizer.zero_grad(set_to_none=True)
-            with torch.amp.autocast(device_type="cuda"):
-                if is_variational:
-                    x_hat, mean, logvar = vae_model(tract_data)
-                    recon_loss = recon_criterion(x_hat, tract_data)
-                    kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
-                    weighted_kl_loss = current_beta * kl_loss_raw
-                    total_loss = recon_loss + weighted_kl_loss
-                    kl_loss = kl_loss_raw
+        # Fixed validation subset shared by all stages (None unless fast_val_subset is set)
+        fast_val_data = make_fast_val_loader(val_data, fast_val_subset)
+        torch.backends.cudnn.benchmark = True
+    
+        # Move models to device
+        try:
+            log.debug(f"Moving models to device {device}")
+            vae_model = vae_model.to(device)
+            age_predictor = age_predictor.to(device)
+            site_predictor = site_predictor.to(device)
+            log.debug(f"Successfully moved models to {device}")
+        except Exception as e:
+            log.error(f"ERROR moving models to device: {str(e)}")
+            import traceback
+            log.error(traceback.format_exc())
+            raise
+    
+        # Set up loss functions
+        log.debug(f"Setting up loss functions")
+        recon_criterion = torch.nn.MSELoss(reduction="mean")
+        age_criterion = torch.nn.L1Loss(reduction="mean")  # MAE
+        site_criterion = torch.nn.CrossEntropyLoss(reduction="mean")
+    
+        results = {}
+    
+
+        # STAGE 1: Train each model independently on raw data
+
+        log.info(f"\n{'='*40}\nSTAGE 1: Training models independently\n{'='*40}")
+    
+        # --- STEP 1: Train VAE for reconstruction ---
+        log.info(f"\n{'-'*40}\nTraining {'VAE' if is_variational else 'Autoencoder'} for reconstruction...\n{'-'*40}")
+        vae_optimizer = torch.optim.Adam(vae_model.parameters(), lr=lr)
+        vae_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(vae_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        best_vae_loss = float("inf")
+        best_vae_state = None
+        vae_train_loss_epoch = []
+        vae_val_loss_epoch = []
+        vae_train_recon_loss_epoch = []
+        vae_val_recon_loss_epoch = []
+        vae_train_kl_loss_epoch = []
+        vae_val_kl_loss_epoch = []
+        vae_current_beta_epoch = []
+        vae_current_lr_epoch = []
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "vae")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage1):
+            # KL Beta Calculation
+            if kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
+                annealing_epoch = epoch - kl_annealing_start_epoch
+                if annealing_epoch < kl_annealing_duration:
+                    progress = annealing_epoch / kl_annealing_duration
+                    sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+                    kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
                 else:
-                    x_hat = vae_model(tract_data)
-                    recon_loss = recon_criterion(x_hat, tract_data)
-                    kl_loss = torch.tensor(0.0, device=device)
-                    total_loss = recon_loss
-            total_loss.backward()
-            torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
-            vae_optimizer.step()
-            train_items += batch_size
-            train_recon_loss += recon_loss.item() * batch_size
-            train_kl_loss += kl_loss.item() * batch_size
-            train_total_loss += total_loss.item() * batch_size
-        avg_train_recon_loss = train_recon_loss / train_items
-        avg_train_kl_loss = train_kl_loss / train_items
-        avg_train_total_loss = train_total_loss / train_items
-        vae_train_loss_epoch.append(avg_train_total_loss)
-        vae_train_recon_loss_epoch.append(avg_train_recon_loss)
-        vae_train_kl_loss_epoch.append(avg_train_kl_loss)
-        vae_model.eval()
-        val_recon_loss = 0.0
-        val_kl_loss = 0.0
-        val_total_loss = 0.0
-        val_items = 0
-        with torch.no_grad():
-            for x, _ in val_data:
+                    kl_annealing_factor = 1.0
+            else:
+                kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
+            current_beta = w_kl * kl_annealing_factor
+            vae_current_beta_epoch.append(current_beta)
+            vae_current_lr_epoch.append(vae_optimizer.param_groups[0]["lr"])
+            vae_model.train()
+            train_recon_loss = 0.0
+            train_kl_loss = 0.0
+            train_total_loss = 0.0
+            train_items = 0
+            for x, _ in timer.iterate(train_data):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
+                vae_optimizer.zero_grad(set_to_none=True)
                 with torch.amp.autocast(device_type="cuda"):
                     if is_variational:
                         x_hat, mean, logvar = vae_model(tract_data)
@@ -3357,359 +4349,451 @@ def train_vae_age_site_alternating_improved(
                         recon_loss = recon_criterion(x_hat, tract_data)
                         kl_loss = torch.tensor(0.0, device=device)
                         total_loss = recon_loss
-                val_items += batch_size
-                val_recon_loss += recon_loss.item() * batch_size
-                val_kl_loss += kl_loss.item() * batch_size
-                val_total_loss += total_loss.item() * batch_size
-        avg_val_recon_loss = val_recon_loss / val_items
-        avg_val_kl_loss = val_kl_loss / val_items
-        avg_val_total_loss = val_total_loss / val_items
-        vae_val_loss_epoch.append(avg_val_total_loss)
-        vae_val_recon_loss_epoch.append(avg_val_recon_loss)
-        vae_val_kl_loss_epoch.append(avg_val_kl_loss)
-        vae_scheduler.step(avg_val_total_loss)
-        if avg_val_total_loss < best_vae_loss:
-            best_vae_loss = avg_val_total_loss
-            best_vae_state = vae_model.state_dict()
-            torch.save(best_vae_state, os.path.join(save_dir, "best_vae_alternating_improved.pth"))
-        if (epoch + 1) % periodic_save_interval == 0:
-            periodic_vae_path = os.path.join(save_dir, f"vae_alternating_improved_epoch_{epoch+1}.pth")
-            # Ensure the save directory exists
-            os.makedirs(save_dir, exist_ok=True)
-            torch.save(vae_model.state_dict(), periodic_vae_path)
-    vae_model.load_state_dict(best_vae_state)
-    results["vae"] = {
-        "best_val_loss": best_vae_loss,
-        "train_loss_epoch": vae_train_loss_epoch,
-        "val_loss_epoch": vae_val_loss_epoch,
-        "train_recon_loss_epoch": vae_train_recon_loss_epoch,
-        "val_recon_loss_epoch": vae_val_recon_loss_epoch,
-        "train_kl_loss_epoch": vae_train_kl_loss_epoch,
-        "val_kl_loss_epoch": vae_val_kl_loss_epoch,
-        "current_beta_epoch": vae_current_beta_epoch,
-        "current_lr_epoch": vae_current_lr_epoch
-    }
-    # --- STEP 2: Train Age Predictor on raw data ---
-    print(f"\n{'-'*40}\nTraining Age Predictor on raw data...\n{'-'*40}")
-    age_optimizer = torch.optim.Adam(age_predictor.parameters(), lr=lr)
-    age_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(age_optimizer, "min", patience=10, factor=0.5, verbose=True)
-    best_age_mae = float("inf")
-    best_age_state = None
-    age_train_loss_epoch = []
-    age_val_loss_epoch = []
-    age_train_r2_epoch = []
-    age_val_r2_epoch = []
-    age_current_lr_epoch = []
-    for epoch in range(epochs_stage1):
-        age_current_lr_epoch.append(age_optimizer.param_groups[0]["lr"])
-        age_predictor.train()
-        train_age_loss = 0.0
-        train_predictions = []
-        train_targets = []
-        train_items = 0
-        for x, labels in train_data:
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            age_true = labels[:, 0].float().unsqueeze(1).to(device)
-            age_optimizer.zero_grad(set_to_none=True)
-            with torch.amp.autocast(device_type="cuda"):
-                age_pred = age_predictor(tract_data)
-                age_loss = age_criterion(age_pred, age_true)
-            age_loss.backward()
-            torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
-            age_optimizer.step()
-            train_items += batch_size
-            train_age_loss += age_loss.item() * batch_size
-            train_predictions.append(age_pred.detach())
-            train_targets.append(age_true.detach())
-        all_train_preds = torch.cat(train_predictions)
-        all_train_targets = torch.cat(train_targets)
-        train_r2 = calculate_r2_score(all_train_targets, all_train_preds, verbose=(epoch < 5))
-        avg_train_age_loss = train_age_loss / train_items
-        age_predictor.eval()
-        val_age_loss = 0.0
-        val_predictions = []
-        val_targets = []
-        val_items = 0
-        with torch.no_grad():
-            for x, labels in val_data:
+                timer.lap("forward")
+                total_loss.backward()
+                timer.lap("backward")
+                torch.nn.utils.clip_grad_norm_(vae_model.parameters(), max_norm=max_grad_norm)
+                timer.lap("clip")
+                vae_optimizer.step()
+                timer.lap("optimizer")
+                profiler.step()
+                train_items += batch_size
+                train_recon_loss += recon_loss.item() * batch_size
+                train_kl_loss += kl_loss.item() * batch_size
+                train_total_loss += total_loss.item() * batch_size
+            avg_train_recon_loss = train_recon_loss / train_items
+            avg_train_kl_loss = train_kl_loss / train_items
+            avg_train_total_loss = train_total_loss / train_items
+            vae_train_loss_epoch.append(avg_train_total_loss)
+            vae_train_recon_loss_epoch.append(avg_train_recon_loss)
+            vae_train_kl_loss_epoch.append(avg_train_kl_loss)
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                vae_model.eval()
+                val_recon_loss = 0.0
+                val_kl_loss = 0.0
+                val_total_loss = 0.0
+                val_items = 0
+                with torch.inference_mode():
+                    for x, _ in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        with torch.amp.autocast(device_type="cuda"):
+                            if is_variational:
+                                x_hat, mean, logvar = vae_model(tract_data)
+                                recon_loss = recon_criterion(x_hat, tract_data)
+                                kl_loss_raw = kl_divergence_loss(mean, logvar) / batch_size
+                                weighted_kl_loss = current_beta * kl_loss_raw
+                                total_loss = recon_loss + weighted_kl_loss
+                                kl_loss = kl_loss_raw
+                            else:
+                                x_hat = vae_model(tract_data)
+                                recon_loss = recon_criterion(x_hat, tract_data)
+                                kl_loss = torch.tensor(0.0, device=device)
+                                total_loss = recon_loss
+                        val_items += batch_size
+                        val_recon_loss += recon_loss.item() * batch_size
+                        val_kl_loss += kl_loss.item() * batch_size
+                        val_total_loss += total_loss.item() * batch_size
+                avg_val_recon_loss = val_recon_loss / val_items
+                avg_val_kl_loss = val_kl_loss / val_items
+                avg_val_total_loss = val_total_loss / val_items
+            else:
+                avg_val_recon_loss = avg_val_kl_loss = avg_val_total_loss = float("nan")
+            vae_val_loss_epoch.append(avg_val_total_loss)
+            vae_val_recon_loss_epoch.append(avg_val_recon_loss)
+            vae_val_kl_loss_epoch.append(avg_val_kl_loss)
+            timer.lap("validation")
+            if val_pass is not None:
+                vae_scheduler.step(avg_val_total_loss)
+            timer.mark()
+            if val_schedule.selects_best(val_pass) and avg_val_total_loss < best_vae_loss:
+                best_vae_loss = avg_val_total_loss
+                best_vae_state = vae_model.state_dict()
+                torch.save(best_vae_state, os.path.join(save_dir, "best_vae_alternating_improved.pth"))
+            if (epoch + 1) % periodic_save_interval == 0:
+                periodic_vae_path = os.path.join(save_dir, f"vae_alternating_improved_epoch_{epoch+1}.pth")
+                # Ensure the save directory exists
+                os.makedirs(save_dir, exist_ok=True)
+                torch.save(vae_model.state_dict(), periodic_vae_path)
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("vae", epoch + 1, {
+                "train_loss": vae_train_loss_epoch,
+                "val_loss": vae_val_loss_epoch,
+                "train_recon_loss": vae_train_recon_loss_epoch,
+                "val_recon_loss": vae_val_recon_loss_epoch,
+                "train_kl_loss": vae_train_kl_loss_epoch,
+                "val_kl_loss": vae_val_kl_loss_epoch,
+                "current_beta": vae_current_beta_epoch,
+                "current_lr": vae_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+        profiler.stop()
+        vae_model.load_state_dict(best_vae_state)
+        results["vae"] = {
+            "best_val_loss": best_vae_loss,
+            "train_loss_epoch": vae_train_loss_epoch,
+            "val_loss_epoch": vae_val_loss_epoch,
+            "train_recon_loss_epoch": vae_train_recon_loss_epoch,
+            "val_recon_loss_epoch": vae_val_recon_loss_epoch,
+            "train_kl_loss_epoch": vae_train_kl_loss_epoch,
+            "val_kl_loss_epoch": vae_val_kl_loss_epoch,
+            "current_beta_epoch": vae_current_beta_epoch,
+            "current_lr_epoch": vae_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
+        # --- STEP 2: Train Age Predictor on raw data ---
+        log.info(f"\n{'-'*40}\nTraining Age Predictor on raw data...\n{'-'*40}")
+        age_optimizer = torch.optim.Adam(age_predictor.parameters(), lr=lr)
+        age_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(age_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        best_age_mae = float("inf")
+        best_age_state = None
+        age_train_loss_epoch = []
+        age_val_loss_epoch = []
+        age_train_r2_epoch = []
+        age_val_r2_epoch = []
+        age_current_lr_epoch = []
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "age_predictor")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage1):
+            age_current_lr_epoch.append(age_optimizer.param_groups[0]["lr"])
+            age_predictor.train()
+            train_age_loss = 0.0
+            train_predictions = []
+            train_targets = []
+            train_items = 0
+            for x, labels in timer.iterate(train_data):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                age_optimizer.zero_grad(set_to_none=True)
                 with torch.amp.autocast(device_type="cuda"):
                     age_pred = age_predictor(tract_data)
                     age_loss = age_criterion(age_pred, age_true)
-                val_items += batch_size
-                val_age_loss += age_loss.item() * batch_size
-                val_predictions.append(age_pred)
-                val_targets.append(age_true)
-        all_val_preds = torch.cat(val_predictions)
-        all_val_targets = torch.cat(val_targets)
-        val_r2 = calculate_r2_score(all_val_targets, all_val_preds, verbose=(epoch < 5))
-        avg_val_age_loss = val_age_loss / val_items
-        age_train_loss_epoch.append(avg_train_age_loss)
-        age_val_loss_epoch.append(avg_val_age_loss)
-        age_train_r2_epoch.append(train_r2)
-        age_val_r2_epoch.append(val_r2)
-        age_scheduler.step(avg_val_age_loss)
-        if avg_val_age_loss < best_age_mae:
-            best_age_mae = avg_val_age_loss
-            best_age_state = age_predictor.state_dict()
-            torch.save(best_age_state, os.path.join(save_dir, "best_age_predictor_alternating_improved.pth"))
-    age_predictor.load_state_dict(best_age_state)
-    results["age_predictor"] = {
-        "best_val_mae": best_age_mae,
-        "train_loss_epoch": age_train_loss_epoch,
-        "val_loss_epoch": age_val_loss_epoch,
-        "train_r2_epoch": age_train_r2_epoch,
-        "val_r2_epoch": age_val_r2_epoch,
-        "current_lr_epoch": age_current_lr_epoch
-    }
-    # --- STEP 3: Train Site Predictor on raw data ---
-    print(f"\n{'-'*40}\nTraining Site Predictor on raw data...\n{'-'*40}")
-    site_optimizer = torch.optim.Adam(site_predictor.parameters(), lr=lr)
-    site_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(site_optimizer, "min", patience=10, factor=0.5, verbose=True)
-    best_site_loss = float("inf")
-    best_site_state = None
-    site_train_loss_epoch = []
-    site_val_loss_epoch = []
-    site_train_acc_epoch = []
-    site_val_acc_epoch = []
-    site_current_lr_epoch = []
-    for epoch in range(epochs_stage1):
-        site_current_lr_epoch.append(site_optimizer.param_groups[0]["lr"])
-        site_predictor.train()
-        train_site_loss = 0.0
-        train_site_correct = 0
-        train_items = 0
-        for x, labels in train_data:
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            site_true = labels[:, 2].long().to(device, non_blocking=True)
-            site_optimizer.zero_grad(set_to_none=True)
-            with torch.amp.autocast(device_type="cuda"):
-                site_pred = site_predictor(tract_data)
-                site_loss = site_criterion(site_pred, site_true)
-            site_loss.backward()
-            torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
-            site_optimizer.step()
-            train_items += batch_size
-            train_site_loss += site_loss.item() * batch_size
-            _, predicted_sites = torch.max(site_pred.data, 1)
-            train_site_correct += (predicted_sites == site_true).sum().item()
-        avg_train_site_loss = train_site_loss / train_items
-        avg_train_site_acc = (train_site_correct / train_items) * 100
-        site_predictor.eval()
-        val_site_loss = 0.0
-        val_site_correct = 0
-        val_items = 0
-        with torch.no_grad():
-            for x, labels in val_data:
+                timer.lap("forward")
+                age_loss.backward()
+                timer.lap("backward")
+                torch.nn.utils.clip_grad_norm_(age_predictor.parameters(), max_norm=max_grad_norm)
+                timer.lap("clip")
+                age_optimizer.step()
+                timer.lap("optimizer")
+                profiler.step()
+                train_items += batch_size
+                train_age_loss += age_loss.item() * batch_size
+                train_predictions.append(age_pred.detach())
+                train_targets.append(age_true.detach())
+            all_train_preds = torch.cat(train_predictions)
+            all_train_targets = torch.cat(train_targets)
+            train_r2 = calculate_r2_score(all_train_targets, all_train_preds, verbose=(epoch < 5 and log.enabled_for("debug")))
+            avg_train_age_loss = train_age_loss / train_items
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                age_predictor.eval()
+                val_age_loss = 0.0
+                val_predictions = []
+                val_targets = []
+                val_items = 0
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                        with torch.amp.autocast(device_type="cuda"):
+                            age_pred = age_predictor(tract_data)
+                            age_loss = age_criterion(age_pred, age_true)
+                        val_items += batch_size
+                        val_age_loss += age_loss.item() * batch_size
+                        val_predictions.append(age_pred)
+                        val_targets.append(age_true)
+                all_val_preds = torch.cat(val_predictions)
+                all_val_targets = torch.cat(val_targets)
+                val_r2 = calculate_r2_score(all_val_targets, all_val_preds, verbose=(epoch < 5 and log.enabled_for("debug")))
+                avg_val_age_loss = val_age_loss / val_items
+            else:
+                avg_val_age_loss = val_r2 = float("nan")
+            age_train_loss_epoch.append(avg_train_age_loss)
+            age_val_loss_epoch.append(avg_val_age_loss)
+            age_train_r2_epoch.append(train_r2)
+            age_val_r2_epoch.append(val_r2)
+            timer.lap("validation")
+            if val_pass is not None:
+                age_scheduler.step(avg_val_age_loss)
+            timer.mark()
+            if val_schedule.selects_best(val_pass) and avg_val_age_loss < best_age_mae:
+                best_age_mae = avg_val_age_loss
+                best_age_state = age_predictor.state_dict()
+                torch.save(best_age_state, os.path.join(save_dir, "best_age_predictor_alternating_improved.pth"))
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("age_predictor", epoch + 1, {
+                "train_loss": age_train_loss_epoch,
+                "val_loss": age_val_loss_epoch,
+                "train_r2": age_train_r2_epoch,
+                "val_r2": age_val_r2_epoch,
+                "current_lr": age_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+        profiler.stop()
+        age_predictor.load_state_dict(best_age_state)
+        results["age_predictor"] = {
+            "best_val_mae": best_age_mae,
+            "train_loss_epoch": age_train_loss_epoch,
+            "val_loss_epoch": age_val_loss_epoch,
+            "train_r2_epoch": age_train_r2_epoch,
+            "val_r2_epoch": age_val_r2_epoch,
+            "current_lr_epoch": age_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
+        # --- STEP 3: Train Site Predictor on raw data ---
+        log.info(f"\n{'-'*40}\nTraining Site Predictor on raw data...\n{'-'*40}")
+        site_optimizer = torch.optim.Adam(site_predictor.parameters(), lr=lr)
+        site_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(site_optimizer, "min", patience=10, factor=0.5, verbose=True)
+        best_site_loss = float("inf")
+        best_site_state = None
+        site_train_loss_epoch = []
+        site_val_loss_epoch = []
+        site_train_acc_epoch = []
+        site_val_acc_epoch = []
+        site_current_lr_epoch = []
+        val_schedule = ValidationSchedule(val_data, epochs_stage1, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "site_predictor")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage1):
+            site_current_lr_epoch.append(site_optimizer.param_groups[0]["lr"])
+            site_predictor.train()
+            train_site_loss = 0.0
+            train_site_correct = 0
+            train_items = 0
+            for x, labels in timer.iterate(train_data):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 site_true = labels[:, 2].long().to(device, non_blocking=True)
+                site_optimizer.zero_grad(set_to_none=True)
                 with torch.amp.autocast(device_type="cuda"):
                     site_pred = site_predictor(tract_data)
                     site_loss = site_criterion(site_pred, site_true)
-                val_items += batch_size
-                val_site_loss += site_loss.item() * batch_size
+                timer.lap("forward")
+                site_loss.backward()
+                timer.lap("backward")
+                torch.nn.utils.clip_grad_norm_(site_predictor.parameters(), max_norm=max_grad_norm)
+                timer.lap("clip")
+                site_optimizer.step()
+                timer.lap("optimizer")
+                profiler.step()
+                train_items += batch_size
+                train_site_loss += site_loss.item() * batch_size
                 _, predicted_sites = torch.max(site_pred.data, 1)
-                val_site_correct += (predicted_sites == site_true).sum().item()
-        avg_val_site_loss = val_site_loss / val_items
-        avg_val_site_acc = (val_site_correct / val_items) * 100
-        site_train_loss_epoch.append(avg_train_site_loss)
-        site_val_loss_epoch.append(avg_val_site_loss)
-        site_train_acc_epoch.append(avg_train_site_acc)
-        site_val_acc_epoch.append(avg_val_site_acc)
-        site_scheduler.step(avg_val_site_loss)
-        if avg_val_site_loss < best_site_loss:
-            best_site_loss = avg_val_site_loss
-            best_site_state = site_predictor.state_dict()
-            torch.save(best_site_state, os.path.join(save_dir, "best_site_predictor_alternating_improved.pth"))
-    site_predictor.load_state_dict(best_site_state)
-    results["site_predictor"] = {
-        "best_val_loss": best_site_loss,
-        "train_loss_epoch": site_train_loss_epoch,
-        "val_loss_epoch": site_val_loss_epoch,
-        "train_acc_epoch": site_train_acc_epoch,
-        "val_acc_epoch": site_val_acc_epoch,
-        "current_lr_epoch": site_current_lr_epoch
-    }
+                train_site_correct += (predicted_sites == site_true).sum().item()
+            avg_train_site_loss = train_site_loss / train_items
+            avg_train_site_acc = (train_site_correct / train_items) * 100
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                site_predictor.eval()
+                val_site_loss = 0.0
+                val_site_correct = 0
+                val_items = 0
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        site_true = labels[:, 2].long().to(device, non_blocking=True)
+                        with torch.amp.autocast(device_type="cuda"):
+                            site_pred = site_predictor(tract_data)
+                            site_loss = site_criterion(site_pred, site_true)
+                        val_items += batch_size
+                        val_site_loss += site_loss.item() * batch_size
+                        _, predicted_sites = torch.max(site_pred.data, 1)
+                        val_site_correct += (predicted_sites == site_true).sum().item()
+                avg_val_site_loss = val_site_loss / val_items
+                avg_val_site_acc = (val_site_correct / val_items) * 100
+            else:
+                avg_val_site_loss = avg_val_site_acc = float("nan")
+            site_train_loss_epoch.append(avg_train_site_loss)
+            site_val_loss_epoch.append(avg_val_site_loss)
+            site_train_acc_epoch.append(avg_train_site_acc)
+            site_val_acc_epoch.append(avg_val_site_acc)
+            timer.lap("validation")
+            if val_pass is not None:
+                site_scheduler.step(avg_val_site_loss)
+            timer.mark()
+            if val_schedule.selects_best(val_pass) and avg_val_site_loss < best_site_loss:
+                best_site_loss = avg_val_site_loss
+                best_site_state = site_predictor.state_dict()
+                torch.save(best_site_state, os.path.join(save_dir, "best_site_predictor_alternating_improved.pth"))
+            timer.lap("checkpoint")
+            timer.end_epoch()
+            metrics_log.log_last("site_predictor", epoch + 1, {
+                "train_loss": site_train_loss_epoch,
+                "val_loss": site_val_loss_epoch,
+                "train_acc": site_train_acc_epoch,
+                "val_acc": site_val_acc_epoch,
+                "current_lr": site_current_lr_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+        profiler.stop()
+        site_predictor.load_state_dict(best_site_state)
+        results["site_predictor"] = {
+            "best_val_loss": best_site_loss,
+            "train_loss_epoch": site_train_loss_epoch,
+            "val_loss_epoch": site_val_loss_epoch,
+            "train_acc_epoch": site_train_acc_epoch,
+            "val_acc_epoch": site_val_acc_epoch,
+            "current_lr_epoch": site_current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files
+        }
 
-    # STAGE 2: Alternating Adversarial Training with Adaptive Cycles
-
-    print(f"\n{'='*40}\nSTAGE 2: Alternating Adversarial Training (Improved)\n{'='*40}")
-    from models import CombinedAE_Predictors
-    combined_model = CombinedAE_Predictors(vae_model, age_predictor, site_predictor, is_variational=is_variational)
-    combined_model = combined_model.to(device)
-    combined_optimizer = torch.optim.Adam([
-        {'params': vae_model.parameters(), 'lr': lr, 'name': 'vae'},
-        {'params': age_predictor.parameters(), 'lr': lr * 0.5, 'name': 'age'},
-        {'params': site_predictor.parameters(), 'lr': lr * 0.5, 'name': 'site'}
-    ])
-    combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
-        combined_optimizer, "min", patience=8, factor=0.7, verbose=False
-    )
-    # Helper function to adjust learning rates based on current training phase
-    def adjust_learning_rates(optimizer, phase, age_weight, site_weight, base_lr):
-        if "age" in phase:
-            optimizer.param_groups[0]['lr'] = base_lr
-            optimizer.param_groups[1]['lr'] = base_lr * age_weight
-            optimizer.param_groups[2]['lr'] = base_lr * site_weight * 0.2
-        else:
-            optimizer.param_groups[0]['lr'] = base_lr
-            optimizer.param_groups[1]['lr'] = base_lr * age_weight * 0.2
-            optimizer.param_groups[2]['lr'] = base_lr * site_weight
-    phase_performance = {"recon_age": [], "recon_site": []}
-    current_cycle_length = cycle_length
-    cycles_without_improvement = 0
-    train_loss_epoch = []
-    val_loss_epoch = []
-    train_recon_loss_epoch = []
-    val_recon_loss_epoch = []
-    train_kl_loss_epoch = []
-    val_kl_loss_epoch = []
-    train_age_loss_epoch = []
-    val_age_loss_epoch = []
-    train_site_loss_epoch = []
-    val_site_loss_epoch = []
-    train_age_mae_epoch = []
-    val_age_mae_epoch = []
-    train_site_acc_epoch = []
-    val_site_acc_epoch = []
-    train_age_r2_epoch = []
-    val_age_r2_epoch = []
-    current_beta_epoch = []
-    current_grl_alpha_epoch = []
-    current_lr_epoch = []
-    training_phase_epoch = []
-    age_weight_epoch = []
-    site_weight_epoch = []
-    cycle_length_epoch = []
-    best_val_metric_value = float("inf")
-    best_combined_state = None
-    best_epoch = 0
-    for epoch in range(epochs_stage2):
-        cycle_position = epoch % current_cycle_length
-        half_cycle = current_cycle_length // 2
-        transition_epochs = 2
-        if cycle_position < half_cycle - transition_epochs:
-            current_phase = "recon_age"
-            age_weight = w_age
-            site_weight = w_site * 0.1
-            current_grl_alpha = 0.0
-        elif cycle_position < half_cycle:
-            current_phase = "transition_to_site"
-            transition_progress = (cycle_position - (half_cycle - transition_epochs)) / transition_epochs
-            age_weight = w_age * (1.0 - 0.7 * transition_progress)
-            site_weight = w_site * (0.1 + 0.9 * transition_progress)
-            current_grl_alpha = grl_alpha_end * transition_progress * 0.3
-        elif cycle_position < current_cycle_length - transition_epochs:
-            current_phase = "recon_site"
-            age_weight = w_age * 0.3
-            site_weight = w_site
-            phase_progress = (cycle_position - half_cycle) / (half_cycle - transition_epochs)
-            current_grl_alpha = grl_alpha_end * (0.3 + 0.7 * phase_progress)
-        else:
-            current_phase = "transition_to_age"
-            transition_progress = (cycle_position - (current_cycle_length - transition_epochs)) / transition_epochs
-            age_weight = w_age * (0.3 + 0.7 * transition_progress)
-            site_weight = w_site * (1.0 - 0.9 * transition_progress)
-            current_grl_alpha = grl_alpha_end * (1.0 - 0.7 * transition_progress)
-        adjust_learning_rates(combined_optimizer, current_phase, age_weight, site_weight, lr)
-        training_phase_epoch.append(current_phase)
-        current_grl_alpha_epoch.append(current_grl_alpha)
-        current_lr_epoch.append(combined_optimizer.param_groups[0]["lr"])
-        age_weight_epoch.append(age_weight)
-        site_weight_epoch.append(site_weight)
-        cycle_length_epoch.append(current_cycle_length)
-        if is_variational and kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
-            annealing_epoch = epoch - kl_annealing_start_epoch
-            if annealing_epoch < kl_annealing_duration:
-                progress = annealing_epoch / kl_annealing_duration
-                sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
-                kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
+        # STAGE 2: Alternating Adversarial Training with Adaptive Cycles
+
+        log.info(f"\n{'='*40}\nSTAGE 2: Alternating Adversarial Training (Improved)\n{'='*40}")
+        try:
+            from .models import CombinedAE_Predictors
+        except ImportError:
+            from models import CombinedAE_Predictors
+        combined_model = CombinedAE_Predictors(vae_model, age_predictor, site_predictor, is_variational=is_variational)
+        combined_model = combined_model.to(device)
+        combined_optimizer = torch.optim.Adam([
+            {'params': vae_model.parameters(), 'lr': lr, 'name': 'vae'},
+            {'params': age_predictor.parameters(), 'lr': lr * 0.5, 'name': 'age'},
+            {'params': site_predictor.parameters(), 'lr': lr * 0.5, 'name': 'site'}
+        ])
+        combined_scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
+            combined_optimizer, "min", patience=8, factor=0.7, verbose=False
+        )
+        # Helper function to adjust learning rates based on current training phase
+        def adjust_learning_rates(optimizer, phase, age_weight, site_weight, base_lr):
+            if "age" in phase:
+                optimizer.param_groups[0]['lr'] = base_lr
+                optimizer.param_groups[1]['lr'] = base_lr * age_weight
+                optimizer.param_groups[2]['lr'] = base_lr * site_weight * 0.2
             else:
-                kl_annealing_factor = 1.0
-        else:
-            kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
-        if is_variational:
-            current_beta = w_kl * kl_annealing_factor
-        else:
-            current_beta = 0.0
-        current_beta_epoch.append(current_beta)
-        combined_model.train()
-        running_loss = 0.0
-        running_recon_loss = 0.0
-        running_kl_loss = 0.0
-        running_age_loss = 0.0
-        running_site_loss = 0.0
-        running_age_mae_sum = 0.0
-        running_site_correct = 0.0
-        train_items = 0
-        train_age_preds = []
-        train_age_trues = []
-        all_train_site_true = []
-        all_train_site_pred = []
-        for x, labels in train_data:
-            batch_size = x.size(0)
-            tract_data = x.to(device, non_blocking=True)
-            age_true = labels[:, 0].float().unsqueeze(1).to(device)
-            site_true = labels[:, 2].long().to(device, non_blocking=True)
-            combined_optimizer.zero_grad(set_to_none=True)
-            with torch.amp.autocast(device_type="cuda"):
-                x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha)
-                recon_loss = recon_criterion(x_hat, tract_data)
-                if is_variational:
-                    kl_loss = kl_divergence_loss(mean, logvar) / batch_size
-                else:
-                    kl_loss = torch.tensor(0.0, device=device)
-                age_loss = age_criterion(age_pred, age_true)
-                site_loss = site_criterion(site_pred, site_true)
-                if is_variational:
-                    total_loss = (w_recon * recon_loss + 
-                                 current_beta * kl_loss + 
-                                 age_weight * age_loss + 
-                                 site_weight * site_loss)
+                optimizer.param_groups[0]['lr'] = base_lr
+                optimizer.param_groups[1]['lr'] = base_lr * age_weight * 0.2
+                optimizer.param_groups[2]['lr'] = base_lr * site_weight
+        phase_performance = {"recon_age": [], "recon_site": []}
+        current_cycle_length = cycle_length
+        cycles_without_improvement = 0
+        train_loss_epoch = []
+        val_loss_epoch = []
+        train_recon_loss_epoch = []
+        val_recon_loss_epoch = []
+        train_kl_loss_epoch = []
+        val_kl_loss_epoch = []
+        train_age_loss_epoch = []
+        val_age_loss_epoch = []
+        train_site_loss_epoch = []
+        val_site_loss_epoch = []
+        train_age_mae_epoch = []
+        val_age_mae_epoch = []
+        train_site_acc_epoch = []
+        val_site_acc_epoch = []
+        train_age_r2_epoch = []
+        val_age_r2_epoch = []
+        current_beta_epoch = []
+        current_grl_alpha_epoch = []
+        current_lr_epoch = []
+        training_phase_epoch = []
+        age_weight_epoch = []
+        site_weight_epoch = []
+        cycle_length_epoch = []
+        site_cm_epochs = []
+        train_site_cm_epoch = []
+        val_site_cm_epoch = []
+        train_site_cm = None
+        val_site_cm = None
+        best_val_metric_value = float("inf")
+        best_combined_state = None
+        best_epoch = 0
+        val_schedule = ValidationSchedule(val_data, epochs_stage2, validate_every, fast_val_data, full_val_every)
+        profiler = StepProfiler(profile, save_dir, "alternating")
+        timer = PhaseTimer(sync_cuda=profiler.enabled)
+        for epoch in range(epochs_stage2):
+            cycle_position = epoch % current_cycle_length
+            half_cycle = current_cycle_length // 2
+            transition_epochs = 2
+            if cycle_position < half_cycle - transition_epochs:
+                current_phase = "recon_age"
+                age_weight = w_age
+                site_weight = w_site * 0.1
+                current_grl_alpha = 0.0
+            elif cycle_position < half_cycle:
+                current_phase = "transition_to_site"
+                transition_progress = (cycle_position - (half_cycle - transition_epochs)) / transition_epochs
+                age_weight = w_age * (1.0 - 0.7 * transition_progress)
+                site_weight = w_site * (0.1 + 0.9 * transition_progress)
+                current_grl_alpha = grl_alpha_end * transition_progress * 0.3
+            elif cycle_position < current_cycle_length - transition_epochs:
+                current_phase = "recon_site"
+                age_weight = w_age * 0.3
+                site_weight = w_site
+                phase_progress = (cycle_position - half_cycle) / (half_cycle - transition_epochs)
+                current_grl_alpha = grl_alpha_end * (0.3 + 0.7 * phase_progress)
+            else:
+                current_phase = "transition_to_age"
+                transition_progress = (cycle_position - (current_cycle_length - transition_epochs)) / transition_epochs
+                age_weight = w_age * (0.3 + 0.7 * transition_progress)
+                site_weight = w_site * (1.0 - 0.9 * transition_progress)
+                current_grl_alpha = grl_alpha_end * (1.0 - 0.7 * transition_progress)
+            adjust_learning_rates(combined_optimizer, current_phase, age_weight, site_weight, lr)
+            training_phase_epoch.append(current_phase)
+            current_grl_alpha_epoch.append(current_grl_alpha)
+            current_lr_epoch.append(combined_optimizer.param_groups[0]["lr"])
+            age_weight_epoch.append(age_weight)
+            site_weight_epoch.append(site_weight)
+            cycle_length_epoch.append(current_cycle_length)
+            if is_variational and kl_annealing_duration > 0 and epoch >= kl_annealing_start_epoch:
+                annealing_epoch = epoch - kl_annealing_start_epoch
+                if annealing_epoch < kl_annealing_duration:
+                    progress = annealing_epoch / kl_annealing_duration
+                    sigmoid_val = 1 / (1 + np.exp(-10 * (progress - 0.5)))
+                    kl_annealing_factor = kl_annealing_start + (1.0 - kl_annealing_start) * sigmoid_val
                 else:
-                    total_loss = (w_recon * recon_loss + 
-                                 age_weight * age_loss + 
-                                 site_weight * site_loss)
-            total_loss.backward()
-            torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
-            combined_optimizer.step()
-            train_items += batch_size
-            running_loss += total_loss.item() * batch_size
-            running_recon_loss += recon_loss.item() * batch_size
-            running_kl_loss += kl_loss.item() * batch_size
-            running_age_loss += age_loss.item() * batch_size
-            running_site_loss += site_loss.item() * batch_size
-            running_age_mae_sum += age_loss.item() * batch_size
-            train_age_preds.append(age_pred.detach())
-            train_age_trues.append(age_true.detach())
-            _, predicted_sites = torch.max(site_pred.data, 1)
-            running_site_correct += (predicted_sites == site_true).sum().item()
-            all_train_site_true.append(site_true.detach().cpu())
-            all_train_site_pred.append(predicted_sites.detach().cpu())
-        combined_model.eval()
-        running_val_loss = 0.0
-        running_val_recon_loss = 0.0
-        running_val_kl_loss = 0.0
-        running_val_age_loss = 0.0
-        running_val_site_loss = 0.0
-        running_val_age_mae_sum = 0.0
-        running_val_site_correct = 0.0
-        val_items = 0
-        val_age_preds = []
-        val_age_trues = []
-        all_val_site_true = []
-        all_val_site_pred = []
-        with torch.no_grad():
-            for x, labels in val_data:
+                    kl_annealing_factor = 1.0
+            else:
+                kl_annealing_factor = 0.0 if epoch < kl_annealing_start_epoch else 1.0
+            if is_variational:
+                current_beta = w_kl * kl_annealing_factor
+            else:
+                current_beta = 0.0
+            current_beta_epoch.append(current_beta)
+            combined_model.train()
+            running_loss = 0.0
+            running_recon_loss = 0.0
+            running_kl_loss = 0.0
+            running_age_loss = 0.0
+            running_site_loss = 0.0
+            running_age_mae_sum = 0.0
+            running_site_correct = 0.0
+            train_items = 0
+            train_age_preds = []
+            train_age_trues = []
+            if train_site_cm is not None:
+                train_site_cm.reset()
+            all_train_site_true = []
+            all_train_site_pred = []
+            all_train_latents = []
+            for x, labels in timer.iterate(train_data):
                 batch_size = x.size(0)
                 tract_data = x.to(device, non_blocking=True)
                 age_true = labels[:, 0].float().unsqueeze(1).to(device)
                 site_true = labels[:, 2].long().to(device, non_blocking=True)
+                combined_optimizer.zero_grad(set_to_none=True)
                 with torch.amp.autocast(device_type="cuda"):
                     x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha)
                     recon_loss = recon_criterion(x_hat, tract_data)
@@ -3728,160 +4812,269 @@ def train_vae_age_site_alternating_improved(
                         total_loss = (w_recon * recon_loss + 
                                      age_weight * age_loss + 
                                      site_weight * site_loss)
-                val_items += batch_size
-                running_val_loss += total_loss.item() * batch_size
-                running_val_recon_loss += recon_loss.item() * batch_size
-                running_val_kl_loss += kl_loss.item() * batch_size
-                running_val_age_loss += age_loss.item() * batch_size
-                running_val_site_loss += site_loss.item() * batch_size
-                running_val_age_mae_sum += age_loss.item() * batch_size
-                val_age_preds.append(age_pred)
-                val_age_trues.append(age_true)
+                timer.lap("forward")
+                total_loss.backward()
+                timer.lap("backward")
+                torch.nn.utils.clip_grad_norm_(combined_model.parameters(), max_norm=max_grad_norm)
+                timer.lap("clip")
+                combined_optimizer.step()
+                timer.lap("optimizer")
+                profiler.step()
+                train_items += batch_size
+                running_loss += total_loss.item() * batch_size
+                running_recon_loss += recon_loss.item() * batch_size
+                running_kl_loss += kl_loss.item() * batch_size
+                running_age_loss += age_loss.item() * batch_size
+                running_site_loss += site_loss.item() * batch_size
+                running_age_mae_sum += age_loss.item() * batch_size
+                train_age_preds.append(age_pred.detach())
+                train_age_trues.append(age_true.detach())
                 _, predicted_sites = torch.max(site_pred.data, 1)
-                running_val_site_correct += (predicted_sites == site_true).sum().item()
-                all_val_site_true.append(site_true.cpu())
-                all_val_site_pred.append(predicted_sites.cpu())
-        # Save site prediction data for confusion matrix
-        if epoch == 0 or (epoch + 1) % save_predictions_interval == 0 or epoch == epochs_stage2 - 1:
-            train_site_true = torch.cat(all_train_site_true).numpy()
-            train_site_pred = torch.cat(all_train_site_pred).numpy()
-            val_site_true = torch.cat(all_val_site_true).numpy()
-            val_site_pred = torch.cat(all_val_site_pred).numpy()
-            save_site_predictions(train_site_true, train_site_pred, epoch+1, save_dir, prefix='train')
-            save_site_predictions(val_site_true, val_site_pred, epoch+1, save_dir, prefix='val')
-            # --- NEW: Save confusion matrix PNGs for this epoch ---
-            import os
-            import matplotlib.pyplot as plt
-            from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
-            # Train confusion matrix
-            cm_train = confusion_matrix(train_site_true, train_site_pred, normalize='true')
-            labels_train = [f"Site {i}" for i in range(cm_train.shape[0])]
-            disp_train = ConfusionMatrixDisplay(confusion_matrix=cm_train, display_labels=labels_train)
-            fig_train, ax_train = plt.subplots(figsize=(8, 6))
-            disp_train.plot(ax=ax_train, cmap='Blues', values_format='.2f')
-            plt.title(f'Train Confusion Matrix - Epoch {epoch+1}')
-            plot_dir = os.path.join(save_dir, 'confusion_matrices')
-            os.makedirs(plot_dir, exist_ok=True)
-            plt.tight_layout()
-            plt.savefig(os.path.join(plot_dir, f'train_confusion_matrix_epoch_{epoch+1}.png'))
-            plt.close(fig_train)
-            # Val confusion matrix
-            cm_val = confusion_matrix(val_site_true, val_site_pred, normalize='true')
-            labels_val = [f"Site {i}" for i in range(cm_val.shape[0])]
-            disp_val = ConfusionMatrixDisplay(confusion_matrix=cm_val, display_labels=labels_val)
-            fig_val, ax_val = plt.subplots(figsize=(8, 6))
-            disp_val.plot(ax=ax_val, cmap='Blues', values_format='.2f')
-            plt.title(f'Val Confusion Matrix - Epoch {epoch+1}')
-            plt.tight_layout()
-            plt.savefig(os.path.join(plot_dir, f'val_confusion_matrix_epoch_{epoch+1}.png'))
-            plt.close(fig_val)
-        avg_train_loss = running_loss / train_items
-        avg_train_recon_loss = running_recon_loss / train_items
-        avg_train_kl_loss = running_kl_loss / train_items
-        avg_train_age_loss = running_age_loss / train_items
-        avg_train_site_loss = running_site_loss / train_items
-        avg_train_age_mae = running_age_mae_sum / train_items
-        avg_train_site_acc = (running_site_correct / train_items) * 100
-        all_train_age_preds = torch.cat(train_age_preds)
-        all_train_age_trues = torch.cat(train_age_trues)
-        train_age_r2 = calculate_r2_score(all_train_age_trues, all_train_age_preds, verbose=(epoch < 5))
-        avg_val_loss = running_val_loss / val_items
-        avg_val_recon_loss = running_val_recon_loss / val_items
-        avg_val_kl_loss = running_val_kl_loss / val_items
-        avg_val_age_loss = running_val_age_loss / val_items
-        avg_val_site_loss = running_val_site_loss / val_items
-        avg_val_age_mae = running_val_age_mae_sum / val_items
-        avg_val_site_acc = (running_val_site_correct / val_items) * 100
-        all_val_age_preds = torch.cat(val_age_preds)
-        all_val_age_trues = torch.cat(val_age_trues)
-        val_age_r2 = calculate_r2_score(all_val_age_trues, all_val_age_preds, verbose=(epoch < 5))
-        train_loss_epoch.append(avg_train_loss)
-        train_recon_loss_epoch.append(avg_train_recon_loss)
-        train_kl_loss_epoch.append(avg_train_kl_loss)
-        train_age_loss_epoch.append(avg_train_age_loss)
-        train_site_loss_epoch.append(avg_train_site_loss)
-        train_age_mae_epoch.append(avg_train_age_mae)
-        train_site_acc_epoch.append(avg_train_site_acc)
-        train_age_r2_epoch.append(train_age_r2)
-        val_loss_epoch.append(avg_val_loss)
-        val_recon_loss_epoch.append(avg_val_recon_loss)
-        val_kl_loss_epoch.append(avg_val_kl_loss)
-        val_age_loss_epoch.append(avg_val_age_loss)
-        val_site_loss_epoch.append(avg_val_site_loss)
-        val_age_mae_epoch.append(avg_val_age_mae)
-        val_site_acc_epoch.append(avg_val_site_acc)
-        val_age_r2_epoch.append(val_age_r2)
-        current_epoch_val_metrics = {
-            "val_loss": avg_val_loss,
-            "val_age_mae": avg_val_age_mae,
-        }
-        current_val_metric = current_epoch_val_metrics.get(val_metric_to_monitor, avg_val_loss)
-        print(f"\nEpoch {epoch+1}/{epochs_stage2} ({current_phase}) | Cycle: {current_cycle_length} | " +
-              f"Age Weight: {age_weight:.2f} | Site Weight: {site_weight:.2f}")
-        print(f"  Train Loss: {avg_train_loss:.4f} | Val Loss: {avg_val_loss:.4f}")
-        print(f"  Val Age MAE: {avg_val_age_mae:.4f} | Val Age R²: {val_age_r2:.4f} | Val Site Acc: {avg_val_site_acc:.2f}%")
-        print(f"  Recon RMSE: {np.sqrt(avg_val_recon_loss):.4f} | GRL Alpha: {current_grl_alpha:.2f}")
-        combined_scheduler.step(current_val_metric)
-        if current_val_metric < best_val_metric_value:
-            best_val_metric_value = current_val_metric
-            best_combined_state = combined_model.state_dict()
-            best_epoch = epoch
-            model_path = os.path.join(save_dir, "best_alternating_improved_model.pth")
-            torch.save(best_combined_state, model_path)
-        if (epoch + 1) % periodic_save_interval == 0:
-            periodic_path = os.path.join(save_dir, f"alternating_improved_model_epoch_{epoch+1}.pth")
-            # Ensure the save directory exists
-            os.makedirs(save_dir, exist_ok=True)
-            torch.save(combined_model.state_dict(), periodic_path)
-        # Adaptive cycle length
-        if adaptive_cycle_length and (epoch + 1) % current_cycle_length == 0:
-            recent_age_perf = phase_performance["recon_age"][-5:] if len(phase_performance["recon_age"]) >= 5 else phase_performance["recon_age"]
-            recent_site_perf = phase_performance["recon_site"][-5:] if len(phase_performance["recon_site"]) >= 5 else phase_performance["recon_site"]
-            if len(recent_age_perf) >= 3 and len(recent_site_perf) >= 3:
-                age_improvement = (recent_age_perf[0] - recent_age_perf[-1]) / recent_age_perf[0] if recent_age_perf[0] != 0 else 0
-                site_improvement = (recent_site_perf[-1] - recent_site_perf[0]) / recent_site_perf[0] if recent_site_perf[0] != 0 else 0
-                if age_improvement < 0.01 and site_improvement < 0.01:
-                    cycles_without_improvement += 1
-                    if cycles_without_improvement >= 2:
-                        if current_cycle_length > 10:
-                            current_cycle_length = max(10, current_cycle_length - 4)
-                            print(f"  Reducing cycle length to {current_cycle_length} due to stagnation")
+                running_site_correct += (predicted_sites == site_true).sum().item()
+                if train_site_cm is None:
+                    train_site_cm = SiteConfusionAccumulator(site_pred.shape[1], device=site_pred.device)
+                train_site_cm.update(site_true, predicted_sites)
+                if save_per_sample_predictions:
+                    all_train_site_true.append(site_true.detach())
+                    all_train_site_pred.append(predicted_sites.detach())
+                    if save_prediction_latents:
+                        all_train_latents.append(mean.detach())
+            val_pass = val_schedule.pass_for(epoch)
+            timer.mark()
+            if val_pass is not None:
+                combined_model.eval()
+                running_val_loss = 0.0
+                running_val_recon_loss = 0.0
+                running_val_kl_loss = 0.0
+                running_val_age_loss = 0.0
+                running_val_site_loss = 0.0
+                running_val_age_mae_sum = 0.0
+                running_val_site_correct = 0.0
+                val_items = 0
+                val_age_preds = []
+                val_age_trues = []
+                if val_site_cm is not None:
+                    val_site_cm.reset()
+                all_val_site_true = []
+                all_val_site_pred = []
+                all_val_latents = []
+                with torch.inference_mode():
+                    for x, labels in val_schedule.loader(val_pass):
+                        batch_size = x.size(0)
+                        tract_data = x.to(device, non_blocking=True)
+                        age_true = labels[:, 0].float().unsqueeze(1).to(device)
+                        site_true = labels[:, 2].long().to(device, non_blocking=True)
+                        with torch.amp.autocast(device_type="cuda"):
+                            x_hat, mean, logvar, age_pred, site_pred = combined_model(tract_data, grl_alpha=current_grl_alpha)
+                            recon_loss = recon_criterion(x_hat, tract_data)
+                            if is_variational:
+                                kl_loss = kl_divergence_loss(mean, logvar) / batch_size
+                            else:
+                                kl_loss = torch.tensor(0.0, device=device)
+                            age_loss = age_criterion(age_pred, age_true)
+                            site_loss = site_criterion(site_pred, site_true)
+                            if is_variational:
+                                total_loss = (w_recon * recon_loss + 
+                                             current_beta * kl_loss + 
+                                             age_weight * age_loss + 
+                                             site_weight * site_loss)
+                            else:
+                                total_loss = (w_recon * recon_loss + 
+                                             age_weight * age_loss + 
+                                             site_weight * site_loss)
+                        val_items += batch_size
+                        running_val_loss += total_loss.item() * batch_size
+                        running_val_recon_loss += recon_loss.item() * batch_size
+                        running_val_kl_loss += kl_loss.item() * batch_size
+                        running_val_age_loss += age_loss.item() * batch_size
+                        running_val_site_loss += site_loss.item() * batch_size
+                        running_val_age_mae_sum += age_loss.item() * batch_size
+                        val_age_preds.append(age_pred)
+                        val_age_trues.append(age_true)
+                        _, predicted_sites = torch.max(site_pred.data, 1)
+                        running_val_site_correct += (predicted_sites == site_true).sum().item()
+                        if val_site_cm is None:
+                            val_site_cm = SiteConfusionAccumulator(site_pred.shape[1], device=site_pred.device)
+                        val_site_cm.update(site_true, predicted_sites)
+                        if save_per_sample_predictions:
+                            all_val_site_true.append(site_true)
+                            all_val_site_pred.append(predicted_sites)
+                            if save_prediction_latents:
+                                all_val_latents.append(mean)
+                site_cm_epochs.append(epoch + 1)
+                train_site_cm_epoch.append(train_site_cm.compute())
+                val_site_cm_epoch.append(val_site_cm.compute())
+            timer.lap("validation")
+            # Save site prediction data for confusion matrix (only after epochs with a validation pass)
+            if val_pass is not None and (epoch == 0 or (epoch + 1) % save_predictions_interval == 0 or epoch == epochs_stage2 - 1):
+                save_site_confusion_matrices(site_cm_epochs, train_site_cm_epoch, val_site_cm_epoch, save_dir)
+                if save_per_sample_predictions:
+                    save_site_predictions(torch.cat(all_train_site_true), torch.cat(all_train_site_pred), epoch+1, save_dir, prefix='train',
+                                          age_true=torch.cat(train_age_trues), age_pred=torch.cat(train_age_preds),
+                                          latents=torch.cat(all_train_latents) if save_prediction_latents else None, log=log.info)
+                    save_site_predictions(torch.cat(all_val_site_true), torch.cat(all_val_site_pred), epoch+1, save_dir, prefix='val',
+                                          age_true=torch.cat(val_age_trues), age_pred=torch.cat(val_age_preds),
+                                          latents=torch.cat(all_val_latents) if save_prediction_latents else None, log=log.info)
+                plot_dir = os.path.join(save_dir, 'confusion_matrices')
+                os.makedirs(plot_dir, exist_ok=True)
+                plot_site_confusion_matrix(train_site_cm_epoch[-1], f'Train Confusion Matrix - Epoch {epoch+1}',
+                                           os.path.join(plot_dir, f'train_confusion_matrix_epoch_{epoch+1}.png'))
+                plot_site_confusion_matrix(val_site_cm_epoch[-1], f'Val Confusion Matrix - Epoch {epoch+1}',
+                                           os.path.join(plot_dir, f'val_confusion_matrix_epoch_{epoch+1}.png'))
+            timer.lap("checkpoint")
+            avg_train_loss = running_loss / train_items
+            avg_train_recon_loss = running_recon_loss / train_items
+            avg_train_kl_loss = running_kl_loss / train_items
+            avg_train_age_loss = running_age_loss / train_items
+            avg_train_site_loss = running_site_loss / train_items
+            avg_train_age_mae = running_age_mae_sum / train_items
+            avg_train_site_acc = (running_site_correct / train_items) * 100
+            all_train_age_preds = torch.cat(train_age_preds)
+            all_train_age_trues = torch.cat(train_age_trues)
+            train_age_r2 = calculate_r2_score(all_train_age_trues, all_train_age_preds, verbose=(epoch < 5 and log.enabled_for("debug")))
+            if val_pass is not None:
+                avg_val_loss = running_val_loss / val_items
+                avg_val_recon_loss = running_val_recon_loss / val_items
+                avg_val_kl_loss = running_val_kl_loss / val_items
+                avg_val_age_loss = running_val_age_loss / val_items
+                avg_val_site_loss = running_val_site_loss / val_items
+                avg_val_age_mae = running_val_age_mae_sum / val_items
+                avg_val_site_acc = (running_val_site_correct / val_items) * 100
+                all_val_age_preds = torch.cat(val_age_preds)
+                all_val_age_trues = torch.cat(val_age_trues)
+                val_age_r2 = calculate_r2_score(all_val_age_trues, all_val_age_preds, verbose=(epoch < 5 and log.enabled_for("debug")))
+            else:
+                avg_val_loss = avg_val_recon_loss = avg_val_kl_loss = avg_val_age_loss = float("nan")
+                avg_val_site_loss = avg_val_age_mae = avg_val_site_acc = val_age_r2 = float("nan")
+            train_loss_epoch.append(avg_train_loss)
+            train_recon_loss_epoch.append(avg_train_recon_loss)
+            train_kl_loss_epoch.append(avg_train_kl_loss)
+            train_age_loss_epoch.append(avg_train_age_loss)
+            train_site_loss_epoch.append(avg_train_site_loss)
+            train_age_mae_epoch.append(avg_train_age_mae)
+            train_site_acc_epoch.append(avg_train_site_acc)
+            train_age_r2_epoch.append(train_age_r2)
+            val_loss_epoch.append(avg_val_loss)
+            val_recon_loss_epoch.append(avg_val_recon_loss)
+            val_kl_loss_epoch.append(avg_val_kl_loss)
+            val_age_loss_epoch.append(avg_val_age_loss)
+            val_site_loss_epoch.append(avg_val_site_loss)
+            val_age_mae_epoch.append(avg_val_age_mae)
+            val_site_acc_epoch.append(avg_val_site_acc)
+            val_age_r2_epoch.append(val_age_r2)
+            current_epoch_val_metrics = {
+                "val_loss": avg_val_loss,
+                "val_age_mae": avg_val_age_mae,
+            }
+            current_val_metric = current_epoch_val_metrics.get(val_metric_to_monitor, avg_val_loss)
+            log.info(f"Epoch {epoch+1}/{epochs_stage2} ({current_phase}) | Cycle: {current_cycle_length} | " +
+                  f"Age Weight: {age_weight:.2f} | Site Weight: {site_weight:.2f}")
+            log.info(f"  Train Loss: {avg_train_loss:.4f} | Val Loss: {avg_val_loss:.4f}")
+            log.info(f"  Val Age MAE: {avg_val_age_mae:.4f} | Val Age R²: {val_age_r2:.4f} | Val Site Acc: {avg_val_site_acc:.2f}%")
+            log.info(f"  Recon RMSE: {np.sqrt(avg_val_recon_loss):.4f} | GRL Alpha: {current_grl_alpha:.2f}")
+            if val_pass is not None:
+                combined_scheduler.step(current_val_metric)
+            timer.mark()
+            if val_schedule.selects_best(val_pass) and current_val_metric < best_val_metric_value:
+                best_val_metric_value = current_val_metric
+                best_combined_state = combined_model.state_dict()
+                best_epoch = epoch
+                model_path = os.path.join(save_dir, "best_alternating_improved_model.pth")
+                torch.save(best_combined_state, model_path)
+            if (epoch + 1) % periodic_save_interval == 0:
+                periodic_path = os.path.join(save_dir, f"alternating_improved_model_epoch_{epoch+1}.pth")
+                # Ensure the save directory exists
+                os.makedirs(save_dir, exist_ok=True)
+                torch.save(combined_model.state_dict(), periodic_path)
+            timer.lap("checkpoint")
+            # Adaptive cycle length
+            if adaptive_cycle_length and (epoch + 1) % current_cycle_length == 0:
+                recent_age_perf = phase_performance["recon_age"][-5:] if len(phase_performance["recon_age"]) >= 5 else phase_performance["recon_age"]
+                recent_site_perf = phase_performance["recon_site"][-5:] if len(phase_performance["recon_site"]) >= 5 else phase_performance["recon_site"]
+                if len(recent_age_perf) >= 3 and len(recent_site_perf) >= 3:
+                    age_improvement = (recent_age_perf[0] - recent_age_perf[-1]) / recent_age_perf[0] if recent_age_perf[0] != 0 else 0
+                    site_improvement = (recent_site_perf[-1] - recent_site_perf[0]) / recent_site_perf[0] if recent_site_perf[0] != 0 else 0
+                    if age_improvement < 0.01 and site_improvement < 0.01:
+                        cycles_without_improvement += 1
+                        if cycles_without_improvement >= 2:
+                            if current_cycle_length > 10:
+                                current_cycle_length = max(10, current_cycle_length - 4)
+                                log.info(f"  Reducing cycle length to {current_cycle_length} due to stagnation")
+                            cycles_without_improvement = 0
+                    else:
                         cycles_without_improvement = 0
-                else:
-                    cycles_without_improvement = 0
-    if best_combined_state is not None:
-        combined_model.load_state_dict(best_combined_state)
-    combined_results = {
-        "train_loss_epoch": train_loss_epoch,
-        "val_loss_epoch": val_loss_epoch,
-        "train_recon_loss_epoch": train_recon_loss_epoch,
-        "val_recon_loss_epoch": val_recon_loss_epoch,
-        "train_kl_loss_epoch": train_kl_loss_epoch,
-        "val_kl_loss_epoch": val_kl_loss_epoch,
-        "train_age_loss_epoch": train_age_loss_epoch,
-        "val_age_loss_epoch": val_age_loss_epoch,
-        "train_site_loss_epoch": train_site_loss_epoch,
-        "val_site_loss_epoch": val_site_loss_epoch,
-        "train_age_mae_epoch": train_age_mae_epoch,
-        "val_age_mae_epoch": val_age_mae_epoch,
-        "train_site_acc_epoch": train_site_acc_epoch,
-        "val_site_acc_epoch": val_site_acc_epoch,
-        "train_age_r2_epoch": train_age_r2_epoch,
-        "val_age_r2_epoch": val_age_r2_epoch,
-        "current_beta_epoch": current_beta_epoch,
-        "current_grl_alpha_epoch": current_grl_alpha_epoch,
-        "current_lr_epoch": current_lr_epoch,
-        "training_phase_epoch": training_phase_epoch,
-        "age_weight_epoch": age_weight_epoch,
-        "site_weight_epoch": site_weight_epoch,
-        "cycle_length_epoch": cycle_length_epoch,
-        f"best_{val_metric_to_monitor}": best_val_metric_value,
-        "best_epoch": best_epoch,
-        "model_path": os.path.join(save_dir, "best_alternating_improved_model.pth"),
-        "phase_performance": phase_performance
-    }
-    results["alternating"] = combined_results
-    print(f"\n{'='*40}\nIMPROVED Alternating training complete!\n{'='*40}")
-    print(f"Best {val_metric_to_monitor}: {best_val_metric_value:.4f}")
-    print(f"Final cycle length: {current_cycle_length}")
-    return results
\ No newline at end of file
+            timer.end_epoch()
+            metrics_log.log_last("alternating", epoch + 1, {
+                "train_loss": train_loss_epoch,
+                "val_loss": val_loss_epoch,
+                "train_recon_loss": train_recon_loss_epoch,
+                "val_recon_loss": val_recon_loss_epoch,
+                "train_kl_loss": train_kl_loss_epoch,
+                "val_kl_loss": val_kl_loss_epoch,
+                "train_age_loss": train_age_loss_epoch,
+                "val_age_loss": val_age_loss_epoch,
+                "train_site_loss": train_site_loss_epoch,
+                "val_site_loss": val_site_loss_epoch,
+                "train_age_mae": train_age_mae_epoch,
+                "val_age_mae": val_age_mae_epoch,
+                "train_site_acc": train_site_acc_epoch,
+                "val_site_acc": val_site_acc_epoch,
+                "train_age_r2": train_age_r2_epoch,
+                "val_age_r2": val_age_r2_epoch,
+                "current_beta": current_beta_epoch,
+                "current_grl_alpha": current_grl_alpha_epoch,
+                "current_lr": current_lr_epoch,
+                "training_phase": training_phase_epoch,
+                "age_weight": age_weight_epoch,
+                "site_weight": site_weight_epoch,
+                "cycle_length": cycle_length_epoch,
+                "val_pass": val_schedule.history,
+                **timer.histories(suffix="")
+            })
+        profiler.stop()
+        if best_combined_state is not None:
+            combined_model.load_state_dict(best_combined_state)
+        combined_results = {
+            "train_loss_epoch": train_loss_epoch,
+            "val_loss_epoch": val_loss_epoch,
+            "train_recon_loss_epoch": train_recon_loss_epoch,
+            "val_recon_loss_epoch": val_recon_loss_epoch,
+            "train_kl_loss_epoch": train_kl_loss_epoch,
+            "val_kl_loss_epoch": val_kl_loss_epoch,
+            "train_age_loss_epoch": train_age_loss_epoch,
+            "val_age_loss_epoch": val_age_loss_epoch,
+            "train_site_loss_epoch": train_site_loss_epoch,
+            "val_site_loss_epoch": val_site_loss_epoch,
+            "train_age_mae_epoch": train_age_mae_epoch,
+            "val_age_mae_epoch": val_age_mae_epoch,
+            "train_site_acc_epoch": train_site_acc_epoch,
+            "val_site_acc_epoch": val_site_acc_epoch,
+            "train_age_r2_epoch": train_age_r2_epoch,
+            "val_age_r2_epoch": val_age_r2_epoch,
+            "current_beta_epoch": current_beta_epoch,
+            "current_grl_alpha_epoch": current_grl_alpha_epoch,
+            "current_lr_epoch": current_lr_epoch,
+            "val_pass_epoch": val_schedule.history,
+            **timer.histories(),
+            "phase_times_epoch": timer.history,
+            "trace_files": profiler.trace_files,
+            "training_phase_epoch": training_phase_epoch,
+            "age_weight_epoch": age_weight_epoch,
+            "site_weight_epoch": site_weight_epoch,
+            "cycle_length_epoch": cycle_length_epoch,
+            "site_cm_epochs": site_cm_epochs,
+            "train_site_cm_epoch": train_site_cm_epoch,
+            "val_site_cm_epoch": val_site_cm_epoch,
+            f"best_{val_metric_to_monitor}": best_val_metric_value,
+            "best_epoch": best_epoch,
+            "model_path": os.path.join(save_dir, "best_alternating_improved_model.pth"),
+            "phase_performance": phase_performance
+        }
+        results["alternating"] = combined_results
+        log.info(f"\n{'='*40}\nIMPROVED Alternating training complete!\n{'='*40}")
+        log.info(f"Best {val_metric_to_monitor}: {best_val_metric_value:.4f}")
+        log.info(f"Final cycle length: {current_cycle_length}")
+        return results
+    finally:
+        metrics_log.close()
+        log.close()
\ No newline at end of file
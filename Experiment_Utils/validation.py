@@ -0,0 +1,134 @@
+import numpy as np
+from torch.utils.data import DataLoader, Subset
+
+# Validation cadence for the trainers.
+# By default every trainer runs a full validation pass after every epoch.
+# Three options make validation cheaper on long runs:
+#
+#   validate_every=k     validate after every k-th epoch only
+#   fast_val_subset=n    evaluate a fixed, site-stratified subset of the
+#                        validation set (n samples, or a fraction if n < 1)
+#                        with a large batch size instead of the full set
+#   full_val_every=m     still run a full pass after every m-th epoch; with
+#                        a fast subset it defaults to FULL_VAL_EVERY_MULTIPLE
+#                        x validate_every, so best-model selection keeps
+#                        running during the stage and not only at its end
+#
+# Every stage also runs a full pass after its last epoch. The trainers apply
+# these rules to every validated epoch:
+#
+# - Epochs without a validation pass record NaN in the val_* histories, so
+#   they stay aligned with the train_* histories, and do not step the
+#   ReduceLROnPlateau schedulers (patience counts validation passes).
+# - Each validation pass, fast or full, steps the scheduler with its
+#   monitored metric. The fast subset is stratified, so both passes estimate
+#   the same quantity.
+# - Only full passes can select a new best model, so best metrics and saved
+#   best models always refer to the full validation set. Without a fast
+#   subset every pass is full.
+#
+# The pass that ran after each epoch ("full", "fast" or "") is returned as
+# val_pass_epoch next to the other histories.
+
+FAST_VAL_BATCH_SIZE = 1024
+# Default full_val_every for fast subsets, in multiples of validate_every
+FULL_VAL_EVERY_MULTIPLE = 5
+
+
+def make_fast_val_loader(val_data, subset, batch_size=FAST_VAL_BATCH_SIZE, stratify_col=2, seed=0):
+    """
+    Builds a loader over a fixed, stratified subset of a validation loader's dataset.
+
+    Parameters
+    ----------
+    val_data : DataLoader
+        The full validation loader; its dataset must yield ``(x, labels)``.
+    subset : int or float or None
+        Number of samples, or the fraction of the validation set if below 1.
+        ``None`` returns ``None``.
+    batch_size : int
+        Batch size of the subset loader.
+    stratify_col : int or None
+        Label column to stratify on (the site column by default), ``None``
+        for a plain random subset.
+    seed : int
+        Seed of the subset selection; the subset is the same every epoch.
+
+    Returns
+    -------
+    DataLoader or None
+    """
+    if subset is None:
+        return None
+    dataset = val_data.dataset
+    n_total = len(dataset)
+    n_subset = int(round(subset * n_total)) if subset < 1 else int(subset)
+    if n_subset <= 0:
+        raise ValueError("fast_val_subset must select at least one sample")
+    n_subset = min(n_subset, n_total)
+
+    rng = np.random.default_rng(seed)
+    if stratify_col is None or n_subset == n_total:
+        indices = rng.permutation(n_total)[:n_subset]
+    else:
+        strata = np.array([float(dataset[i][1][stratify_col]) for i in range(n_total)])
+        indices = []
+        for value in np.unique(strata):
+            members = rng.permutation(np.flatnonzero(strata == value))
+            # Proportional allocation, at least one sample per stratum
+            indices.extend(members[:max(1, int(round(n_subset * len(members) / n_total)))])
+        indices = rng.permutation(indices)[:n_subset]
+    return DataLoader(Subset(dataset, sorted(int(i) for i in indices)), batch_size=batch_size, shuffle=False)
+
+
+class ValidationSchedule:
+    """Decides which validation pass follows each epoch of one training stage.
+
+    Parameters
+    ----------
+    val_data : DataLoader
+        The full validation loader.
+    epochs : int
+        Number of epochs of the stage; the last one always gets a full pass.
+    validate_every : int, optional
+        Validate after every ``validate_every``-th epoch.
+    fast_val_data : DataLoader, optional
+        Subset loader from ``make_fast_val_loader``; scheduled passes use it
+        instead of ``val_data``.
+    full_val_every : int, optional
+        Run a full pass after every ``full_val_every``-th epoch regardless of
+        ``validate_every``. With ``fast_val_data`` it defaults to
+        ``FULL_VAL_EVERY_MULTIPLE * validate_every``.
+    """
+
+    def __init__(self, val_data, epochs, validate_every=1, fast_val_data=None, full_val_every=None):
+        if validate_every < 1 or (full_val_every is not None and full_val_every < 1):
+            raise ValueError("validate_every and full_val_every must be positive")
+        if fast_val_data is not None and full_val_every is None:
+            full_val_every = FULL_VAL_EVERY_MULTIPLE * validate_every
+        self.val_data = val_data
+        self.epochs = epochs
+        self.validate_every = validate_every
+        self.fast_val_data = fast_val_data
+        self.full_val_every = full_val_every
+        self.history = []
+
+    def pass_for(self, epoch):
+        """Return ``"full"``, ``"fast"`` or ``None`` (no validation) for a 0-based epoch."""
+        n = epoch + 1
+        if n == self.epochs or (self.full_val_every is not None and n % self.full_val_every == 0):
+            val_pass = "full"
+        elif n % self.validate_every == 0:
+            val_pass = "fast" if self.fast_val_data is not None else "full"
+        else:
+            val_pass = None
+        self.history.append(val_pass or "")
+        return val_pass
+
+    def loader(self, val_pass):
+        return self.fast_val_data if val_pass == "fast" else self.val_data
+
+    def selects_best(self, val_pass):
+        """True if this pass may select a new best model (full passes only)."""
+        return val_pass == "full"
+
@@ -0,0 +1,168 @@
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+
+# File-lock-based work queue on a shared filesystem.
+# Any number of workers (e.g. SLURM array tasks, each possibly with several
+# processes) add the same tasks and then claim them one at a time until none
+# are left, so a slow task only holds up the worker running it.
+#
+# The queue is one JSON file next to a lock file. Every change takes an
+# exclusive fcntl lock on the lock file (cluster-wide on GPFS and NFS with
+# lockd), reads the file, changes it and atomically replaces it; locked_json
+# does this for any shared bookkeeping file.
+#
+# A worker heartbeats its running task from a background thread; a running
+# task whose heartbeat is older than stale_after seconds belongs to a crashed
+# worker and is handed out again, up to max_attempts times. Heartbeats use the
+# workers' wall clocks, so stale_after must be well above the clock skew
+# between nodes.
+
+@contextlib.contextmanager
+def locked_json(path, write=True):
+    """
+    Read-modify-write a JSON dict shared between processes and nodes.
+
+    Holds an exclusive fcntl lock on ``<path>.lock`` while the block runs,
+    yields the parsed contents (``{}`` if the file does not exist yet) and,
+    if ``write``, atomically replaces the file with the changed dict.
+    """
+    with open(path + ".lock", "a") as lock:
+        fcntl.lockf(lock, fcntl.LOCK_EX)
+        try:
+            data = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    data = json.load(f)
+            yield data
+            if write:
+                tmp_path = f"{path}.{socket.gethostname()}_{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f, indent=1)
+                os.replace(tmp_path, path)
+        finally:
+            fcntl.lockf(lock, fcntl.LOCK_UN)
+
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """Shared queue of named tasks; see the module comment.
+
+    Parameters
+    ----------
+    queue_dir : str
+        Directory holding the queue, on a filesystem all workers can reach.
+    stale_after : float, optional
+        Seconds without a heartbeat after which a running task is reclaimed.
+    max_attempts : int, optional
+        Claims per task; a task whose last attempt went stale is marked failed.
+    worker_id : str, optional
+        Name of this worker in the queue. Defaults to ``host:pid``.
+    """
+
+    def __init__(self, queue_dir, stale_after=600.0, max_attempts=3, worker_id=None):
+        os.makedirs(queue_dir, exist_ok=True)
+        self.path = os.path.join(queue_dir, "queue.json")
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+
+    def _locked(self, write=True):
+        return locked_json(self.path, write)
+
+    def add(self, names):
+        """Add tasks as pending; tasks already in the queue keep their state.
+
+        Returns
+        -------
+        int
+            Number of tasks added.
+        """
+        with self._locked() as tasks:
+            new = [name for name in names if name not in tasks]
+            for name in new:
+                tasks[name] = {"status": PENDING, "worker": None, "heartbeat": None, "attempts": 0, "error": None}
+        return len(new)
+
+    def claim(self):
+        """Claim the first pending (or stale) task.
+
+        Returns
+        -------
+        str or None
+            Name of the claimed task, or None when no task is left to claim.
+        """
+        now = time.time()
+        with self._locked() as tasks:
+            for name, task in tasks.items():
+                if task["status"] == RUNNING and now - task["heartbeat"] > self.stale_after:
+                    if task["attempts"] >= self.max_attempts:
+                        task["status"] = FAILED
+                        task["error"] = f"No heartbeat from {task['worker']} for {now - task['heartbeat']:.0f} s"
+                        continue
+                elif task["status"] != PENDING:
+                    continue
+                task.update(status=RUNNING, worker=self.worker_id, heartbeat=now, attempts=task["attempts"] + 1)
+                return name
+        return None
+
+    def heartbeat(self, name):
+        """Mark a claimed task as alive.
+
+        Returns
+        -------
+        bool
+            False if the task was reclaimed by another worker in the meantime.
+        """
+        with self._locked() as tasks:
+            task = tasks[name]
+            if task["status"] != RUNNING or task["worker"] != self.worker_id:
+                return False
+            task["heartbeat"] = time.time()
+            return True
+
+    def complete(self, name, error=None):
+        """Mark a task done, or failed with ``error``; failed tasks are not retried."""
+        with self._locked() as tasks:
+            tasks[name].update(status=FAILED if error else DONE, worker=self.worker_id, heartbeat=time.time(),
+                               error=error)
+
+    def counts(self):
+        """Number of tasks in each state."""
+        with self._locked(write=False) as tasks:
+            counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for task in tasks.values():
+                counts[task["status"]] += 1
+        return counts
+
+    @contextlib.contextmanager
+    def heartbeating(self, name, interval=None):
+        """Heartbeat ``name`` from a background thread while the block runs.
+
+        ``interval`` defaults to a tenth of ``stale_after``.
+        """
+        interval = self.stale_after / 10 if interval is None else interval
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                if not self.heartbeat(name):
+                    print(f"WARNING: Task {name} was reclaimed by another worker")
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,127 @@
+import multiprocessing as mp
+import os
+
+import torch
+
+# Running independent experiments (e.g. one per tract) in a pool of worker processes.
+# The parent loads and preprocesses the data once, moves its tensors into
+# shared memory and forks the workers, which inherit the data without copying
+# or reloading it. Every worker is pinned to its own slice of the CPUs and uses
+# that many torch threads, so N workers do not oversubscribe the machine.
+#
+# Workers are forked (not spawned) because experiment scripts keep their state
+# in module globals. CUDA cannot be used in a forked child once the parent has
+# initialized it, so the parent must pick its device with
+# select_fork_safe_device() and leave all CUDA work to the workers.
+
+# Thread-count variables read by OpenMP/BLAS libraries started in a worker
+_THREAD_ENV_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+
+
+def select_fork_safe_device():
+    """
+    Pick CUDA if available, else CPU, without initializing CUDA in this process.
+
+    Uses PyTorch's NVML-based availability check, so workers forked afterwards
+    can still use the GPU. MPS does not support forking and is not used.
+    """
+    os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def share_dataset_memory(obj):
+    """
+    Move the tensors of datasets into shared memory, in place.
+
+    Walks tuples/lists, DataLoaders, ``Subset``/``ConcatDataset`` wrappers and
+    the tensor attributes of datasets (e.g. ``X`` and ``y`` of afqinsight's
+    torch dataset).
+
+    Returns
+    -------
+    int
+        Number of bytes in shared memory.
+    """
+    seen = set()
+    total = 0
+
+    def visit(item):
+        nonlocal total
+        if id(item) in seen:
+            return
+        seen.add(id(item))
+        if isinstance(item, torch.Tensor):
+            item.share_memory_()
+            total += item.element_size() * item.nelement()
+        elif isinstance(item, (tuple, list)):
+            for element in item:
+                visit(element)
+        elif isinstance(item, torch.utils.data.DataLoader):
+            visit(item.dataset)
+        elif isinstance(item, torch.utils.data.Dataset):
+            for value in vars(item).values():
+                if isinstance(value, (torch.Tensor, torch.utils.data.Dataset, list, tuple)):
+                    visit(value)
+
+    visit(obj)
+    return total
+
+
+def worker_cpu_slices(workers, cpus=None):
+    """
+    Split the CPUs this process may run on into one disjoint slice per worker.
+
+    With more workers than CPUs, workers share single CPUs round-robin.
+    """
+    if cpus is None:
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    if workers >= len(cpus):
+        return [[cpus[i % len(cpus)]] for i in range(workers)]
+    per_worker = len(cpus) // workers
+    return [cpus[i * per_worker:(i + 1) * per_worker] for i in range(workers)]
+
+
+def _init_worker(cpu_slices, counter):
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    cpus = cpu_slices[index % len(cpu_slices)]
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    for var in _THREAD_ENV_VARS:
+        os.environ[var] = str(len(cpus))
+    torch.set_num_threads(len(cpus))
+
+
+def run_in_pool(fn, items, workers, cpus=None):
+    """
+    Call ``fn(item)`` for every item in ``workers`` forked processes.
+
+    Parameters
+    ----------
+    fn : callable
+        Module-level function; it and its results must be picklable.
+    items : list
+        Arguments, one call each.
+    workers : int
+        Number of worker processes.
+    cpus : list of int, optional
+        CPUs to spread the workers over. Defaults to all CPUs this process
+        may run on.
+
+    Yields
+    ------
+    tuple
+        ``(item, result)`` in the order the calls finish.
+    """
+    ctx = mp.get_context("fork")
+    cpu_slices = worker_cpu_slices(workers, cpus)
+    counter = ctx.Value("i", 0)
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(cpu_slices, counter)) as pool:
+        for item, result in pool.imap_unordered(_call, [(fn, item) for item in items]):
+            yield item, result
+
+
+def _call(fn_and_item):
+    fn, item = fn_and_item
+    return item, fn(item)
@@ -1,73 +1,28 @@
 #!/usr/bin/env python
 import os
-import json
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import argparse
-import glob
 
-def load_tract_results(input_dir):
-    """Load and combine all tract results from the given directory."""
-    # Load tract names if available
-    tract_names_file = os.path.join(input_dir, "tract_names.json")
-    tract_names = {}
-    if os.path.exists(tract_names_file):
-        with open(tract_names_file, 'r') as f:
-            tract_list = json.load(f)
-            tract_names = {i: name for i, name in enumerate(tract_list)}
-    
-    # Try loading the combined file first if it exists
-    combined_file = os.path.join(input_dir, "combined_tract_ranking.csv")
-    if os.path.exists(combined_file):
-        print(f"Loading existing combined results from {combined_file}")
-        return pd.read_csv(combined_file)
-    
-    # Otherwise, collect all results manually
-    print("No combined file found, collecting tract results individually...")
-    tract_dirs = glob.glob(os.path.join(input_dir, "tract_*"))
-    all_results = []
-    
-    for tract_dir in tract_dirs:
-        if not os.path.isdir(tract_dir):
-            continue
-            
-        tract_idx = int(tract_dir.split('_')[-1])
-        tract_name = tract_names.get(tract_idx, f"tract_{tract_idx}")
-        
-        # Try to load summary file
-        summary_file = os.path.join(tract_dir, "tract_summary.json")
-        training_file = os.path.join(tract_dir, "training_results.json")
-        
-        if os.path.exists(summary_file):
-            with open(summary_file, 'r') as f:
-                summary = json.load(f)
-                all_results.append(summary)
-        elif os.path.exists(training_file):
-            # Fallback to training results file
-            with open(training_file, 'r') as f:
-                try:
-                    results = json.load(f)
-                    summary = {
-                        "tract_idx": tract_idx,
-                        "tract_name": tract_name,
-                        "best_r2": results.get("best_val_r2", 0),
-                        "best_age_mae": results.get("best_val_mae", 0)
-                    }
-                    all_results.append(summary)
-                except json.JSONDecodeError:
-                    print(f"Error parsing JSON from {training_file}")
-    
-    # Create DataFrame
-    df = pd.DataFrame(all_results)
-    
-    # Ensure we have the right columns
-    if 'best_r2' not in df.columns and 'best_val_r2' in df.columns:
-        df['best_r2'] = df['best_val_r2']
-    
-    if 'best_age_mae' not in df.columns and 'best_val_age_mae' in df.columns:
-        df['best_age_mae'] = df['best_val_age_mae']
+from combine_tract_results import RESULTS_FILE, open_results_store
+
+def load_tract_results(input_dir, config_hash=None):
+    """Load the tract results of the given directory from its results table."""
+    if not os.path.exists(os.path.join(input_dir, RESULTS_FILE)):
+        # Runs that predate the results table: use their combined file if they have one
+        combined_file = os.path.join(input_dir, "combined_tract_ranking.csv")
+        if os.path.exists(combined_file):
+            print(f"Loading existing combined results from {combined_file}")
+            return pd.read_csv(combined_file)
+    
+    store = open_results_store(input_dir)
+    df = store.results(config_hash if config_hash is not None else store.latest_config_hash())
+    
+    # Names used by the plots
+    df['best_r2'] = df['best_val_r2']
+    df['best_age_mae'] = df['best_val_mae']
     
     return df
 
@@ -177,6 +132,7 @@ def main():
     parser = argparse.ArgumentParser(description="Visualize tract importance results")
     parser.add_argument('--input-dir', type=str, required=True, help='Directory containing tract evaluation results')
     parser.add_argument('--top-n', type=int, default=20, help='Show top N tracts in visualizations')
+    parser.add_argument('--config-hash', type=str, default=None, help='Settings hash of the runs to plot (default: the most recently finished)')
     parser.add_argument('--all-plots', action='store_true', help='Generate all plot types')
     parser.add_argument('--bar-chart', action='store_true', help='Generate bar chart')
     parser.add_argument('--heatmap', action='store_true', help='Generate heatmap')
@@ -188,7 +144,7 @@ def main():
         args.bar_chart = True
     
     # Load the results
-    results_df = load_tract_results(args.input_dir)
+    results_df = load_tract_results(args.input_dir, args.config_hash)
     
     if results_df.empty:
         print("No results found to plot")
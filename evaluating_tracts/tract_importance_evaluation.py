@@ -11,7 +11,11 @@ import pandas as pd
 import os
 import sys
 import argparse
+import contextlib
+import hashlib
+import itertools
 import json
+import subprocess
 from datetime import datetime
 from tqdm import tqdm
 import time
@@ -50,6 +54,17 @@ The output includes:
 RUNNING THE SCRIPT:
 - Use --use-both-fa-md to include both FA and MD measurements
 - Use --start-tract and --end-tract to specify which tracts to analyze
+- Use --synthetic-scale 1 to run offline on a synthetic HBN-sized dataset
+- Use --workers N to train N tracts at once in worker processes (the dataset is loaded once and shared)
+- Use --queue-dir DIR in every job of a SLURM array to share the tracts of the range through a work queue
+- Rerunning into the same --output-dir skips tracts that finished with the same settings (see manifest.json)
+  and resumes the others from their last finished stage; use --no-resume to retrain everything
+- Use --importance occlusion to train one age predictor on all tracts instead, and rank the tracts by
+  how much its validation MAE/R² get worse when each tract is replaced by its cohort mean
+- Use --importance linear for a screen that takes seconds: cross-validated ridge regression of age and a
+  multinomial site probe on every tract, fitted for all tracts at once, in the same ranking format
+- Use --node-window N to also find the segments of each tract that drive the age prediction, by
+  occluding a window of N nodes at every position along the tract
 """
 
 # Parse command-line arguments
@@ -60,9 +75,38 @@ parser.add_argument('--epochs-stage2', type=int, default=300, help='Number of ep
 parser.add_argument('--batch-size', type=int, default=128, help='Batch size for training')
 parser.add_argument('--learning-rate', type=float, default=0.001, help='Learning rate')
 parser.add_argument('--use-both-fa-md', action='store_true', help='Use both FA and MD data (default: FA only)')
+parser.add_argument('--stack-fa-md', action='store_true', help='Train one model per tract on its FA and MD profiles stacked as two channels, instead of separate FA and MD models (implies --use-both-fa-md; tract indices are then bundles)')
 parser.add_argument('--start-tract', type=int, default=0, help='Start from this tract index')
 parser.add_argument('--end-tract', type=int, default=47, help='End at this tract index')
+parser.add_argument('--tracts', type=str, default=None, help='Comma-separated tract indices to run instead of --start-tract to --end-tract')
+parser.add_argument('--synthetic-scale', type=float, default=None, help='Use a synthetic HBN-like dataset of this many times the HBN size instead of downloading HBN')
+parser.add_argument('--packed', action='store_true', help='Train all tracts of the range at once with packed (grouped-convolution) models')
+parser.add_argument('--pack-size', type=int, default=0, help='Tracts per packed network with --packed (0 packs the whole range)')
+parser.add_argument('--workers', type=int, default=1, help='Train this many tracts (or packs) at once in forked worker processes sharing the loaded dataset')
+parser.add_argument('--queue-dir', type=str, default=None, help='Claim tracts (or packs) from a work queue in this directory, shared by any number of jobs')
+parser.add_argument('--no-resume', action='store_true', help='Retrain tracts that already finished with the same settings, and ignore stage checkpoints')
+parser.add_argument('--queue-stale-after', type=float, default=600, help='Seconds without a heartbeat after which a queued tract of a crashed worker is handed out again')
+parser.add_argument('--importance', choices=['retrain', 'occlusion', 'linear'], default='retrain', help='retrain: one model per tract; occlusion: one all-tract age predictor, scored with each tract occluded; linear: fast screen with ridge and site probes per tract')
+parser.add_argument('--attributions', action='store_true', help='With --importance occlusion, also save integrated-gradients and gradient x input maps over tracts and nodes')
+parser.add_argument('--attribution-steps', type=int, default=32, help='Interpolation steps of integrated gradients')
+parser.add_argument('--pairwise', action='store_true', help='With --importance occlusion, also mask every pair of tracts and save the tract x tract interaction matrix')
+parser.add_argument('--occlusion-chunk-size', type=int, default=64, help='Masked copies of each subject per forward pass with --importance occlusion')
+parser.add_argument('--node-window', type=int, default=0, help='Also occlude a sliding window of this many nodes along each tract (0 disables)')
+parser.add_argument('--node-stride', type=int, default=1, help='Nodes between two positions of the sliding window')
+parser.add_argument('--permutations', type=int, default=1000, help='Permutations for the p-values in the ranking CSVs (0 disables p-values and confidence intervals)')
+parser.add_argument('--bootstrap-resamples', type=int, default=1000, help='Bootstrap resamples for the 95%% confidence intervals in the ranking CSVs')
+parser.add_argument('--occlusion-baseline', choices=['mean', 'zero'], default='mean', help='What replaces an occluded tract: its cohort mean profile (training data) or zeros')
+parser.add_argument('--halving-rungs', type=int, default=0, help='Successive halving over this many rungs: every tract trains with a fraction of the epochs, and only the most predictive ones go on with twice as many, up to the full --epochs-stage1/2 in the last rung (0 disables)')
+parser.add_argument('--halving-keep', type=float, default=0.5, help='Fraction of the tracts of each rung that go on to the next one with --halving-rungs')
 args = parser.parse_args()
+if args.halving_rungs and args.importance != 'retrain':
+    parser.error('--halving-rungs trains one model per tract and needs --importance retrain')
+if args.halving_rungs and args.queue_dir:
+    parser.error('--halving-rungs decides between rungs within one job and cannot share a --queue-dir')
+if args.stack_fa_md and (args.packed or args.importance != 'retrain'):
+    parser.error('--stack-fa-md trains two-channel per-tract models and needs --importance retrain without --packed')
+if args.stack_fa_md:
+    args.use_both_fa_md = True
 
 # Adjust path as needed - update this to your path
 # sys.path.insert(1, os.path.join(os.getcwd(), 'Experiment_Utils'))
@@ -71,8 +115,22 @@ sys.path.insert(1, '/mmfs1/gscratch/nrdg/samchou/AFQ-Insight-Autoencoder-Experim
 try:
     print("DEBUG: Importing utility functions")
     sys.stdout.flush()
-    from utils import select_device, kl_divergence_loss, prep_fa_dataset, train_vae_age_site_staged
-    from models import Conv1DVariationalAutoencoder_fa, AgePredictorCNN, SitePredictorCNN, CombinedVAE_Predictors
+    from utils import (select_device, kl_divergence_loss, prep_fa_dataset, train_vae_age_site_staged,
+                       clear_stage_checkpoints)
+    from models import Conv1DVariationalAutoencoder_fa, AgePredictorCNN, SitePredictorCNN, CombinedVAE_Predictors, CombinedAE_Predictors
+    from models import (PackedConv1DVariationalAutoencoder_fa, PackedAgePredictorCNN, PackedSitePredictorCNN,
+                        load_tract_state_dict)
+    from packed_training import train_vae_age_site_staged_packed
+    from synthetic_data import make_synthetic_afq_dataset
+    from worker_pool import run_in_pool, select_fork_safe_device, share_dataset_memory
+    from work_queue import WorkQueue, locked_json
+    from tract_importance import (fit_age_predictor, occlusion_importance, pairwise_occlusion_importance,
+                                  predict_ages, sliding_window_occlusion, tract_means)
+    from attribution import METHODS as ATTRIBUTION_METHODS, age_path, save_attribution_maps
+    from significance import occlusion_significance, prediction_significance, successive_halving_keep
+    from linear_probes import (fit_site_probe, loader_arrays, ridge_cv, ridge_predict, site_probe_accuracy,
+                               tract_features)
+    from results_store import RESULTS_FILE, ResultsStore, read_tract_dir, tract_row
     print("DEBUG: Successfully imported utility functions")
     sys.stdout.flush()
 except Exception as e:
@@ -86,10 +144,56 @@ os.makedirs(args.output_dir, exist_ok=True)
 print(f"DEBUG: Saving results to {args.output_dir}")
 sys.stdout.flush()
 
+# Set parameters for the experiment (shared by the per-tract and packed runs)
+latent_dim = 64  # Choose the larger latent dim
+dropout = 0.0  # VAE dropout
+age_dropout = 0.1
+site_dropout = 0.2
+w_recon = 1.0
+w_kl = 0.001
+w_age = 15.0  # Higher weight for age prediction
+w_site = 5.0  # Higher weight for site adversarial training
+val_metric_to_monitor = "val_age_mae"  # Stage 2 keeps the combined model with the best value of this
+
+# Settings that change a tract's results; finished tracts are recorded in the manifest under their hash
+run_config = {
+    "epochs_stage1": args.epochs_stage1,
+    "epochs_stage2": args.epochs_stage2,
+    "batch_size": args.batch_size,
+    "learning_rate": args.learning_rate,
+    "use_both_fa_md": args.use_both_fa_md,
+    "synthetic_scale": args.synthetic_scale,
+    "latent_dim": latent_dim,
+    "dropout": dropout,
+    "age_dropout": age_dropout,
+    "site_dropout": site_dropout,
+    "w_recon": w_recon,
+    "w_kl": w_kl,
+    "w_age": w_age,
+    "w_site": w_site,
+    "val_metric_to_monitor": val_metric_to_monitor,
+    "importance": args.importance,
+}
+def settings_hash(config):
+    """Short hash of a run_config, the key of its finished tracts in the manifest."""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+# Only added when set, so the settings of earlier runs keep their hash
+if args.stack_fa_md:
+    run_config["stack_fa_md"] = True
+if args.packed:
+    # Packed and per-tract training can select different best epochs
+    run_config["packed"] = True
+config_hash = settings_hash(run_config)
+manifest_file = os.path.join(args.output_dir, "manifest.json")
+# One row per finished tract, queried for the rankings (and by combine_tract_results.py / plot_tract_importance.py)
+results_file = os.path.join(args.output_dir, RESULTS_FILE)
+print(f"DEBUG: Settings hash {config_hash}")
+
 # Define custom function for specific tract extraction
-def extract_specific_tract_data(dataset, tract_idx, batch_size=32):
+def extract_specific_tract_data(dataset, tract_idx, batch_size=32, n_tracts=1, fa_md_pair=False):
     """
-    Extract data for a specific tract from a PyTorch dataset.
+    Extract data for a specific tract (or n_tracts consecutive tracts) from a PyTorch dataset.
 
     Parameters
     ----------
@@ -99,6 +203,11 @@ def extract_specific_tract_data(dataset, tract_idx, batch_size=32):
         Index of the tract to extract (0-47)
     batch_size : int
         Batch size for data loaders
+    n_tracts : int
+        Number of consecutive tracts to extract, starting at tract_idx (packed mode)
+    fa_md_pair : bool
+        Extract bundle tract_idx of FA+MD data as two channels: its FA profile
+        and the MD profile of the same bundle (--stack-fa-md)
 
     Returns
     -------
@@ -108,17 +217,22 @@ def extract_specific_tract_data(dataset, tract_idx, batch_size=32):
     print(f"DEBUG: Creating dataset for tract {tract_idx}")
     
     class SingleTractDataset(torch.utils.data.Dataset):
-        def __init__(self, original_dataset, tract_idx):
+        def __init__(self, original_dataset, tract_idx, n_tracts=1, fa_md_pair=False):
             self.original_dataset = original_dataset
             self.tract_idx = tract_idx
+            self.n_tracts = n_tracts
+            self.fa_md_pair = fa_md_pair
 
         def __len__(self):
             return len(self.original_dataset)
 
         def __getitem__(self, idx):
             x, y = self.original_dataset[idx]
-            # Extract just the specified tract
-            tract_data = x[self.tract_idx:self.tract_idx+1, :].clone()
+            if self.fa_md_pair:
+                # All FA bundles come first, then the MD bundles in the same order
+                return x[[self.tract_idx, self.tract_idx + x.shape[0] // 2], :].clone(), y
+            # Extract just the specified tract(s)
+            tract_data = x[self.tract_idx:self.tract_idx+self.n_tracts, :].clone()
             return tract_data, y
 
     # Handle different dataset formats
@@ -150,9 +264,9 @@ def extract_specific_tract_data(dataset, tract_idx, batch_size=32):
             raise ValueError(f"Unsupported dataset type: {type(dataset)}. Cannot extract tract data.")
 
     # Create single tract datasets
-    specific_tract_train = SingleTractDataset(train_dataset, tract_idx)
-    specific_tract_test = SingleTractDataset(test_dataset, tract_idx)
-    specific_tract_val = SingleTractDataset(val_dataset, tract_idx)
+    specific_tract_train = SingleTractDataset(train_dataset, tract_idx, n_tracts, fa_md_pair)
+    specific_tract_test = SingleTractDataset(test_dataset, tract_idx, n_tracts, fa_md_pair)
+    specific_tract_val = SingleTractDataset(val_dataset, tract_idx, n_tracts, fa_md_pair)
 
     # Create data loaders
     specific_tract_train_loader = torch.utils.data.DataLoader(
@@ -169,9 +283,40 @@ def extract_specific_tract_data(dataset, tract_idx, batch_size=32):
     return specific_tract_train_loader, specific_tract_test_loader, specific_tract_val_loader
 
 
-def run_tract_experiment(tract_idx, tract_name, base_output_dir):
+# Remaps the label columns of a batch to [age, sex, remapped_site]
+def transform_labels(batch_labels):
+    """Transform labels to correct format for training."""
+    # Extract values
+    ages = batch_labels[:, age_idx].float().unsqueeze(1)
+    sex_values = batch_labels[:, sex_idx].float().unsqueeze(1)
+    site_values = batch_labels[:, site_idx].float()
+    
+    # Remap site values
+    remapped_sites = torch.zeros_like(site_values)
+    for i in range(len(site_values)):
+        original_site = site_values[i].item()
+        remapped_site = site_map.get(original_site, -1.0)
+        remapped_sites[i] = remapped_site
+    
+    # Stack values into a single tensor
+    return torch.cat([ages, sex_values, remapped_sites.unsqueeze(1)], dim=1)
+
+# Wraps a DataLoader so its batches carry remapped labels
+class RemappedDataLoader:
+    def __init__(self, original_loader):
+        self.original_loader = original_loader
+        
+    def __iter__(self):
+        for x, y in self.original_loader:
+            yield x, transform_labels(y)
+            
+    def __len__(self):
+        return len(self.original_loader)
+
+
+def prepare_tract_output_dir(tract_idx, tract_name, base_output_dir, packed_tracts=None):
     """
-    Run a complete experiment for a single tract and save results.
+    Create the output directory of a tract and save its experiment details.
     
     Parameters
     ----------
@@ -181,15 +326,21 @@ def run_tract_experiment(tract_idx, tract_name, base_output_dir):
         Name of the tract (for display/logs) including modality
     base_output_dir : str
         Base directory to save all results
+    packed_tracts : list of int, optional
+        Indices of all tracts trained together with this one in packed mode
         
     Returns
     -------
-    dict
-        Dictionary containing results metrics
+    tuple
+        The tract's output directory, and whether its stage checkpoints come
+        from an earlier run with the same settings and can be resumed
     """
     # Extract modality from the tract name if available
     modality = "unknown"
-    if "dki_fa" in tract_name:
+    if "dki_fa_md" in tract_name:
+        modality = "dki_fa_md"
+        base_name = tract_name.replace("dki_fa_md", "")
+    elif "dki_fa" in tract_name:
         modality = "dki_fa"
         base_name = tract_name.replace("dki_fa", "")
     elif "dki_md" in tract_name:
@@ -202,6 +353,16 @@ def run_tract_experiment(tract_idx, tract_name, base_output_dir):
     output_dir = os.path.join(base_output_dir, f"tract_{tract_idx}_{modality}")
     os.makedirs(output_dir, exist_ok=True)
     
+    # The details of the previous run tell whether its stage checkpoints can be reused
+    details_file = os.path.join(output_dir, "experiment_details.json")
+    resume = False
+    if not args.no_resume and os.path.exists(details_file):
+        with open(details_file) as f:
+            resume = json.load(f).get("config_hash") == config_hash
+    # Stage checkpoints of other settings must not survive into the details file of this run
+    if not resume:
+        clear_stage_checkpoints(output_dir)
+    
     print(f"\n\n{'-'*80}")
     print(f"RUNNING EXPERIMENT ON TRACT {tract_idx}: {tract_name} (modality: {modality})")
     print(f"{'-'*80}\n")
@@ -219,50 +380,280 @@ def run_tract_experiment(tract_idx, tract_name, base_output_dir):
         "learning_rate": args.learning_rate,
         "using_both_fa_md": args.use_both_fa_md,
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "device": str(device)
+        "device": str(device),
+        "config_hash": config_hash
     }
+    if packed_tracts is not None:
+        experiment_details["packed_tracts"] = packed_tracts
     
     # Save experiment details
-    with open(os.path.join(output_dir, "experiment_details.json"), "w") as f:
+    with open(details_file, "w") as f:
         json.dump(experiment_details, f, indent=2)
     
-    # Extract the specific tract data
-    print(f"Extracting data for tract {tract_idx}")
-    sys.stdout.flush()
+    return output_dir, resume
+
+
+def save_tract_results(results, tract_idx, tract_name, output_dir, training_time):
+    """
+    Save the training histories and results of one tract as CSV and JSON files.
     
-    tract_train_loader, tract_test_loader, tract_val_loader = extract_specific_tract_data(
-        dataset_output, tract_idx=tract_idx, batch_size=args.batch_size
-    )
+    Parameters
+    ----------
+    results : dict
+        Results of train_vae_age_site_staged (or one tract's entry of the packed trainer)
+    tract_idx : int
+        Index of the tract
+    tract_name : str
+        Name of the tract including modality
+    output_dir : str
+        The tract's output directory
+    training_time : float
+        Training time in seconds
+        
+    Returns
+    -------
+    dict
+        ``results`` with the tract metadata and best metrics added
+    """
+    # Add additional metadata to results
+    results["tract_idx"] = tract_idx
+    results["tract_name"] = tract_name
+    results["training_time"] = training_time
+    results["training_time_formatted"] = f"{training_time/60:.2f} minutes"
+    
+    # Extract important metrics for the summary
+    best_val_r2 = None
+    best_val_mae = None
+    best_site_acc = None
     
-    # Create a function to transform labels
-    def transform_labels(batch_labels):
-        """Transform labels to correct format for training."""
-        # Extract values
-        ages = batch_labels[:, age_idx].float().unsqueeze(1)
-        sex_values = batch_labels[:, sex_idx].float().unsqueeze(1)
-        site_values = batch_labels[:, site_idx].float()
+    # Extract R² and MAE from age predictor results
+    if 'age_predictor' in results and 'val_r2_epoch' in results['age_predictor']:
+        age_val_r2 = results['age_predictor']['val_r2_epoch']
+        age_best_index = np.argmax(age_val_r2) if len(age_val_r2) > 0 else -1
+        if age_best_index >= 0:
+            best_val_r2 = age_val_r2[age_best_index]
+            
+        if 'val_loss_epoch' in results['age_predictor']:
+            age_val_mae = results['age_predictor']['val_loss_epoch']  # MAE is the loss for age predictor
+            best_val_mae = min(age_val_mae) if len(age_val_mae) > 0 else None
+    
+    # Extract site accuracy from site predictor results
+    if 'site_predictor' in results and 'val_acc_epoch' in results['site_predictor']:
+        site_val_acc = results['site_predictor']['val_acc_epoch']
+        best_site_acc = max(site_val_acc) if len(site_val_acc) > 0 else None
+    
+    # Also check combined model results
+    if 'combined' in results:
+        combined_results = results['combined']
         
-        # Remap site values
-        remapped_sites = torch.zeros_like(site_values)
-        for i in range(len(site_values)):
-            original_site = site_values[i].item()
-            remapped_site = site_map.get(original_site, -1.0)
-            remapped_sites[i] = remapped_site
+        # Check for R² in combined results
+        if 'val_age_r2_epoch' in combined_results:
+            combined_val_r2 = combined_results['val_age_r2_epoch']
+            combined_best_r2 = max(combined_val_r2) if len(combined_val_r2) > 0 else None
+            if combined_best_r2 is not None and (best_val_r2 is None or combined_best_r2 > best_val_r2):
+                best_val_r2 = combined_best_r2
         
-        # Stack values into a single tensor
-        return torch.cat([ages, sex_values, remapped_sites.unsqueeze(1)], dim=1)
+        # Check for MAE in combined results
+        if 'val_age_mae_epoch' in combined_results:
+            combined_val_mae = combined_results['val_age_mae_epoch']
+            combined_best_mae = min(combined_val_mae) if len(combined_val_mae) > 0 else None
+            if combined_best_mae is not None and (best_val_mae is None or combined_best_mae < best_val_mae):
+                best_val_mae = combined_best_mae
+        
+        # Check for site accuracy in combined results
+        if 'val_site_acc_epoch' in combined_results:
+            combined_site_acc = combined_results['val_site_acc_epoch']
+            combined_best_site_acc = max(combined_site_acc) if len(combined_site_acc) > 0 else None
+            if combined_best_site_acc is not None and (best_site_acc is None or combined_best_site_acc > best_site_acc):
+                best_site_acc = combined_best_site_acc
     
-    # Create DataLoaders with transformed labels
-    class RemappedDataLoader:
-        def __init__(self, original_loader):
-            self.original_loader = original_loader
-            
-        def __iter__(self):
-            for x, y in self.original_loader:
-                yield x, transform_labels(y)
+    # Add best metrics to the top level of results
+    results['best_val_r2'] = best_val_r2
+    results['best_val_mae'] = best_val_mae
+    results['best_site_acc'] = best_site_acc
+    
+    # Save training history as CSV files for easier analysis
+    # Save VAE training history
+    if 'vae' in results:
+        vae_history = pd.DataFrame({
+            'epoch': list(range(1, len(results['vae']['train_loss_epoch']) + 1)),
+            'train_loss': results['vae']['train_loss_epoch'],
+            'val_loss': results['vae']['val_loss_epoch'],
+            'train_recon_loss': results['vae']['train_recon_loss_epoch'],
+            'val_recon_loss': results['vae']['val_recon_loss_epoch'],
+            'train_kl_loss': results['vae']['train_kl_loss_epoch'],
+            'val_kl_loss': results['vae']['val_kl_loss_epoch'],
+            'beta': results['vae']['current_beta_epoch']
+        })
+        vae_history.to_csv(os.path.join(output_dir, 'vae_training_history.csv'), index=False)
+    
+    # Save Age Predictor training history
+    if 'age_predictor' in results:
+        age_history = pd.DataFrame({
+            'epoch': list(range(1, len(results['age_predictor']['train_loss_epoch']) + 1)),
+            'train_mae': results['age_predictor']['train_loss_epoch'],
+            'val_mae': results['age_predictor']['val_loss_epoch'],
+            'train_r2': results['age_predictor']['train_r2_epoch'],
+            'val_r2': results['age_predictor']['val_r2_epoch']
+        })
+        age_history.to_csv(os.path.join(output_dir, 'age_predictor_training_history.csv'), index=False)
+    
+    # Save Site Predictor training history
+    if 'site_predictor' in results:
+        site_history = pd.DataFrame({
+            'epoch': list(range(1, len(results['site_predictor']['train_loss_epoch']) + 1)),
+            'train_loss': results['site_predictor']['train_loss_epoch'],
+            'val_loss': results['site_predictor']['val_loss_epoch'],
+            'train_acc': results['site_predictor']['train_acc_epoch'],
+            'val_acc': results['site_predictor']['val_acc_epoch']
+        })
+        site_history.to_csv(os.path.join(output_dir, 'site_predictor_training_history.csv'), index=False)
+        
+    # Save Combined Model training history
+    if 'combined' in results:
+        combined_cols = {
+            'epoch': list(range(1, len(results['combined']['train_loss_epoch']) + 1)),
+            'train_loss': results['combined']['train_loss_epoch'],
+            'val_loss': results['combined']['val_loss_epoch']
+        }
+        
+        # Add other metrics if they exist
+        for metric in ['train_recon_loss_epoch', 'val_recon_loss_epoch', 
+                      'train_kl_loss_epoch', 'val_kl_loss_epoch',
+                      'train_age_loss_epoch', 'val_age_loss_epoch',
+                      'train_site_loss_epoch', 'val_site_loss_epoch',
+                      'train_age_mae_epoch', 'val_age_mae_epoch',
+                      'train_site_acc_epoch', 'val_site_acc_epoch',
+                      'train_age_r2_epoch', 'val_age_r2_epoch',
+                      'current_beta_epoch', 'current_grl_alpha_epoch']:
+            if metric in results['combined']:
+                # Create a friendlier column name by removing _epoch suffix
+                col_name = metric.replace('_epoch', '')
+                combined_cols[col_name] = results['combined'][metric]
+        
+        combined_history = pd.DataFrame(combined_cols)
+        combined_history.to_csv(os.path.join(output_dir, 'combined_model_training_history.csv'), index=False)
+        
+        # Create a dedicated summary file for adversarial training (stage 2) results
+        # Find the best R² and MAE values from the combined model training
+        combined_val_r2 = results['combined'].get('val_age_r2_epoch', [])
+        combined_val_mae = results['combined'].get('val_age_mae_epoch', [])
+        combined_val_site_acc = results['combined'].get('val_site_acc_epoch', [])
+        
+        best_combined_r2 = max(combined_val_r2) if combined_val_r2 else None
+        best_combined_r2_epoch = combined_val_r2.index(best_combined_r2) + 1 if best_combined_r2 is not None else None
+        
+        best_combined_mae = min(combined_val_mae) if combined_val_mae else None
+        best_combined_mae_epoch = combined_val_mae.index(best_combined_mae) + 1 if best_combined_mae is not None else None
+        
+        # Find the best site accuracy, which is interesting for adversarial training
+        # Lower site accuracy can indicate better site-invariant features
+        best_combined_site_acc = max(combined_val_site_acc) if combined_val_site_acc else None
+        worst_combined_site_acc = min(combined_val_site_acc) if combined_val_site_acc else None
+        
+        # Create a summary DataFrame for stage 2 (adversarial training)
+        adversarial_summary = {
+            'tract_idx': tract_idx,
+            'tract_name': tract_name,
+            'best_val_r2': best_combined_r2,
+            'best_val_r2_epoch': best_combined_r2_epoch,
+            'best_val_mae': best_combined_mae,
+            'best_val_mae_epoch': best_combined_mae_epoch,
+            'best_site_acc': best_combined_site_acc,
+            'worst_site_acc': worst_combined_site_acc,
+            'best_epoch': results['combined'].get('best_epoch', None),
+            'best_metric_value': results['combined'].get(f'best_{val_metric_to_monitor}', None),
+            'total_epochs': len(combined_val_r2)
+        }
+        
+        # Save the adversarial training summary
+        pd.DataFrame([adversarial_summary]).to_csv(
+            os.path.join(output_dir, 'adversarial_training_summary.csv'), index=False
+        )
+        print(f"Saved adversarial training (stage 2) summary to {os.path.join(output_dir, 'adversarial_training_summary.csv')}")
+        results['adversarial_summary'] = adversarial_summary
+    
+    # Save detailed results as JSON
+    try:
+        # Convert numpy arrays and other non-serializable types to lists or primitives
+        serializable_results = {}
+        
+        def make_serializable(obj):
+            if isinstance(obj, np.ndarray):
+                return obj.tolist()
+            elif isinstance(obj, (list, tuple)):
+                # Recurse so lists of arrays (e.g. per-epoch confusion matrices) serialize too
+                return [make_serializable(x) for x in obj]
+            elif isinstance(obj, (np.float32, np.float64)):
+                return float(obj)
+            elif isinstance(obj, (np.int32, np.int64)):
+                return int(obj)
+            elif isinstance(obj, dict):
+                return {k: make_serializable(v) for k, v in obj.items()}
+            else:
+                return obj
+        
+        # Process each top-level key
+        for key, value in results.items():
+            if isinstance(value, dict):
+                serializable_results[key] = make_serializable(value)
+            else:
+                serializable_results[key] = make_serializable(value)
                 
-        def __len__(self):
-            return len(self.original_loader)
+        with open(os.path.join(output_dir, "training_results.json"), "w") as f:
+            json.dump(serializable_results, f, indent=2)
+            
+    except Exception as e:
+        print(f"WARNING: Error serializing full results: {str(e)}")
+        # Fall back to saving a simplified version
+        with open(os.path.join(output_dir, "training_results_simple.json"), "w") as f:
+            simple_results = {
+                "tract_idx": tract_idx,
+                "tract_name": tract_name,
+                "best_val_r2": best_val_r2,
+                "best_val_mae": best_val_mae,
+                "best_site_acc": best_site_acc,
+                "training_time": training_time,
+                "training_time_formatted": f"{training_time/60:.2f} minutes"
+            }
+            json.dump(simple_results, f, indent=2)
+    
+    print(f"Training for tract {tract_idx} completed in {training_time/60:.2f} minutes")
+    print(f"Best validation R²: {best_val_r2}")
+    print(f"Best validation MAE: {best_val_mae}")
+    print(f"Best site accuracy: {best_site_acc}%")
+    sys.stdout.flush()
+    
+    return results
+
+
+def run_tract_experiment(tract_idx, tract_name, base_output_dir):
+    """
+    Run a complete experiment for a single tract and save results.
+    
+    Parameters
+    ----------
+    tract_idx : int
+        Index of the tract to analyze
+    tract_name : str
+        Name of the tract (for display/logs) including modality
+    base_output_dir : str
+        Base directory to save all results
+        
+    Returns
+    -------
+    dict
+        Dictionary containing results metrics
+    """
+    output_dir, resume = prepare_tract_output_dir(tract_idx, tract_name, base_output_dir)
+    
+    # Extract the specific tract data
+    print(f"Extracting data for tract {tract_idx}")
+    sys.stdout.flush()
+    
+    tract_train_loader, tract_test_loader, tract_val_loader = extract_specific_tract_data(
+        dataset_output, tract_idx=tract_idx, batch_size=args.batch_size, fa_md_pair=args.stack_fa_md
+    )
     
     # Wrap the data loaders
     train_loader_raw = RemappedDataLoader(tract_train_loader)
@@ -277,16 +668,6 @@ def run_tract_experiment(tract_idx, tract_name, base_output_dir):
     sequence_length = x_batch.shape[2]
     print(f"Input shape: channels={input_channels}, sequence_length={sequence_length}")
     
-    # Set parameters for the experiment
-    latent_dim = 64  # Choose the larger latent dim
-    dropout = 0.0  # VAE dropout
-    age_dropout = 0.1
-    site_dropout = 0.2
-    w_recon = 1.0
-    w_kl = 0.001
-    w_age = 15.0  # Higher weight for age prediction
-    w_site = 5.0  # Higher weight for site adversarial training
-    
     # Get the number of unique sites from the training data
     unique_sites = set()
     for i, (_, labels) in enumerate(train_loader_raw):
@@ -298,7 +679,8 @@ def run_tract_experiment(tract_idx, tract_name, base_output_dir):
     
     # Create models
     try:
-        vae = Conv1DVariationalAutoencoder_fa(latent_dims=latent_dim, dropout=dropout, input_length=sequence_length)
+        vae = Conv1DVariationalAutoencoder_fa(latent_dims=latent_dim, dropout=dropout, input_length=sequence_length,
+                                              input_channels=input_channels)
         
         age_predictor = AgePredictorCNN(input_channels=input_channels, 
                                         sequence_length=sequence_length, 
@@ -337,239 +719,785 @@ def run_tract_experiment(tract_idx, tract_name, base_output_dir):
             w_kl=w_kl,
             w_age=w_age,
             w_site=w_site,
-            save_dir=output_dir
+            save_dir=output_dir,
+            val_metric_to_monitor=val_metric_to_monitor,
+            resume=resume
         )
         
         training_time = time.time() - start_time
         
-        # Add additional metadata to results
-        results["tract_idx"] = tract_idx
-        results["tract_name"] = tract_name
-        results["training_time"] = training_time
-        results["training_time_formatted"] = f"{training_time/60:.2f} minutes"
+        return save_tract_results(results, tract_idx, tract_name, output_dir, training_time)
         
-        # Extract important metrics for the summary
-        best_val_r2 = None
-        best_val_mae = None
-        best_site_acc = None
+    except Exception as e:
+        print(f"ERROR during training: {str(e)}")
+        import traceback
+        print(traceback.format_exc())
+        sys.stdout.flush()
+        return {"error": str(e), "tract_idx": tract_idx, "tract_name": tract_name}
+
+def run_packed_tract_experiments(tract_indices, tract_names_to_run, base_output_dir):
+    """
+    Run the experiments of several consecutive tracts at once with packed models.
+    
+    Every tract gets its own VAE, age predictor and site predictor inside one
+    grouped-convolution network and trains independently of the others (see
+    Experiment_Utils/packed_training.py). The output files of each tract are
+    the same as with run_tract_experiment.
+    
+    Parameters
+    ----------
+    tract_indices : list of int
+        Consecutive indices of the tracts to analyze
+    tract_names_to_run : list of str
+        Name of each tract including modality
+    base_output_dir : str
+        Base directory to save all results
         
-        # Extract R² and MAE from age predictor results
-        if 'age_predictor' in results and 'val_r2_epoch' in results['age_predictor']:
-            age_val_r2 = results['age_predictor']['val_r2_epoch']
-            age_best_index = np.argmax(age_val_r2) if len(age_val_r2) > 0 else -1
-            if age_best_index >= 0:
-                best_val_r2 = age_val_r2[age_best_index]
-                
-            if 'val_loss_epoch' in results['age_predictor']:
-                age_val_mae = results['age_predictor']['val_loss_epoch']  # MAE is the loss for age predictor
-                best_val_mae = min(age_val_mae) if len(age_val_mae) > 0 else None
+    Returns
+    -------
+    list of dict
+        Dictionary containing results metrics of each tract
+    """
+    n_tracts = len(tract_indices)
+    prepared = [prepare_tract_output_dir(tract_idx, tract_name, base_output_dir, packed_tracts=list(tract_indices))
+                for tract_idx, tract_name in zip(tract_indices, tract_names_to_run)]
+    output_dirs = [output_dir for output_dir, _ in prepared]
+    resume = all(tract_resume for _, tract_resume in prepared)
+    
+    print(f"Extracting data for tracts {tract_indices[0]}-{tract_indices[-1]}")
+    sys.stdout.flush()
+    
+    tract_train_loader, tract_test_loader, tract_val_loader = extract_specific_tract_data(
+        dataset_output, tract_idx=tract_indices[0], batch_size=args.batch_size, n_tracts=n_tracts
+    )
+    train_loader_raw = RemappedDataLoader(tract_train_loader)
+    val_loader_raw = RemappedDataLoader(tract_val_loader)
+    
+    x_batch, _ = next(iter(train_loader_raw))
+    sequence_length = x_batch.shape[2]
+    print(f"Input shape: tracts={x_batch.shape[1]}, sequence_length={sequence_length}")
+    
+    # Get the number of unique sites from the training data
+    unique_sites = set()
+    for _, labels in train_loader_raw:
+        unique_sites.update(labels[:, 2].tolist())
+    num_sites = len(unique_sites)
+    print(f"Detected {num_sites} unique site IDs in the data: {sorted(unique_sites)}")
+    
+    print(f"Starting packed staged training for {n_tracts} tracts")
+    sys.stdout.flush()
+    
+    start_time = time.time()
+    
+    try:
+        vae = PackedConv1DVariationalAutoencoder_fa(num_tracts=n_tracts, latent_dims=latent_dim, dropout=dropout,
+                                                    input_length=sequence_length)
+        age_predictor = PackedAgePredictorCNN(num_tracts=n_tracts, sequence_length=sequence_length, dropout=age_dropout)
+        site_predictor = PackedSitePredictorCNN(num_tracts=n_tracts, num_sites=num_sites,
+                                                sequence_length=sequence_length, dropout=site_dropout)
         
-        # Extract site accuracy from site predictor results
-        if 'site_predictor' in results and 'val_acc_epoch' in results['site_predictor']:
-            site_val_acc = results['site_predictor']['val_acc_epoch']
-            best_site_acc = max(site_val_acc) if len(site_val_acc) > 0 else None
+        packed_results = train_vae_age_site_staged_packed(
+            vae_model=vae,
+            age_predictor=age_predictor,
+            site_predictor=site_predictor,
+            train_data=train_loader_raw,
+            val_data=val_loader_raw,
+            epochs_stage1=args.epochs_stage1,
+            epochs_stage2=args.epochs_stage2,
+            lr=args.learning_rate,
+            device=device,
+            max_grad_norm=1.0,
+            w_recon=w_recon,
+            w_kl=w_kl,
+            w_age=w_age,
+            w_site=w_site,
+            save_dirs=output_dirs,
+            val_metric_to_monitor=val_metric_to_monitor,
+            resume=resume
+        )
         
-        # Also check combined model results
-        if 'combined' in results:
-            combined_results = results['combined']
-            
-            # Check for R² in combined results
-            if 'val_age_r2_epoch' in combined_results:
-                combined_val_r2 = combined_results['val_age_r2_epoch']
-                combined_best_r2 = max(combined_val_r2) if len(combined_val_r2) > 0 else None
-                if combined_best_r2 is not None and (best_val_r2 is None or combined_best_r2 > best_val_r2):
-                    best_val_r2 = combined_best_r2
-            
-            # Check for MAE in combined results
-            if 'val_age_mae_epoch' in combined_results:
-                combined_val_mae = combined_results['val_age_mae_epoch']
-                combined_best_mae = min(combined_val_mae) if len(combined_val_mae) > 0 else None
-                if combined_best_mae is not None and (best_val_mae is None or combined_best_mae < best_val_mae):
-                    best_val_mae = combined_best_mae
-            
-            # Check for site accuracy in combined results
-            if 'val_site_acc_epoch' in combined_results:
-                combined_site_acc = combined_results['val_site_acc_epoch']
-                combined_best_site_acc = max(combined_site_acc) if len(combined_site_acc) > 0 else None
-                if combined_best_site_acc is not None and (best_site_acc is None or combined_best_site_acc > best_site_acc):
-                    best_site_acc = combined_best_site_acc
+        training_time = time.time() - start_time
         
-        # Add best metrics to the top level of results
-        results['best_val_r2'] = best_val_r2
-        results['best_val_mae'] = best_val_mae
-        results['best_site_acc'] = best_site_acc
+    except Exception as e:
+        print(f"ERROR during packed training: {str(e)}")
+        import traceback
+        print(traceback.format_exc())
+        sys.stdout.flush()
+        return [{"error": str(e), "tract_idx": tract_idx, "tract_name": tract_name}
+                for tract_idx, tract_name in zip(tract_indices, tract_names_to_run)]
+    
+    # The tracts share the wall time; each is charged an equal part of it
+    all_tract_results = []
+    for tract_idx, tract_name, output_dir, results in zip(tract_indices, tract_names_to_run, output_dirs, packed_results):
+        results["packed_training_time"] = training_time
+        all_tract_results.append(save_tract_results(results, tract_idx, tract_name, output_dir, training_time / n_tracts))
+    return all_tract_results
+
+
+def run_tract_group(tract_group):
+    """
+    Run the experiment(s) of one group of tracts: a single tract, or a pack of
+    tracts with --packed.
+    
+    Returns
+    -------
+    list of dict
+        Dictionary containing results metrics of each tract
+    """
+    finished = {} if args.no_resume else finished_tracts()
+    todo = [tract_idx for tract_idx in tract_group if tract_idx not in finished]
+    for tract_idx in tract_group:
+        tract_name = tract_name_and_modality(tract_idx)[0]
+        if tract_idx in finished:
+            print(f"\nSkipping tract {tract_idx}: {tract_name} (already finished with settings {config_hash})")
+        else:
+            print(f"\nProcessing tract {tract_idx}/{args.end_tract}: {tract_name}")
+    
+    group_results = []
+    if args.packed:
+        # Packs hold consecutive tracts; finished tracts split a pack into several
+        for _, run in itertools.groupby(enumerate(todo), key=lambda item: item[1] - item[0]):
+            run = [tract_idx for _, tract_idx in run]
+            group_results += run_packed_tract_experiments(run, [tract_name_and_modality(t)[0] for t in run], args.output_dir)
+    elif todo:
+        group_results = [run_tract_experiment(todo[0], tract_name_and_modality(todo[0])[0], args.output_dir)]
+    
+    for tract_idx, result in zip(todo, group_results):
+        tract_name, modality = tract_name_and_modality(tract_idx)
+        # Make sure modality is in the result
+        if "modality" not in result:
+            result["modality"] = modality
+        append_summary_row(summary_file, tract_idx, tract_name, modality, result)
+        if "error" not in result:
+            analyze_trained_tract(tract_idx, tract_name, modality)
+            record_finished_tract(tract_idx, tract_name, modality, result)
+    return group_results
+
+
+def analyze_trained_tract(tract_idx, tract_name, modality):
+    """
+    Cache the validation predictions of a finished tract, and run its sliding-window occlusion.
+    
+    Loads the tract's best_combined_model.pth (written by the serial and the
+    packed trainer alike) and saves the ages and predicted ages of the
+    validation data, through the deterministic age path, as
+    val_predictions.npz; the significance tests of the rankings permute
+    them. With --node-window, the model is also scored with a window of
+    nodes replaced at every position. Results go to the tract's output
+    directory.
+    """
+    output_dir = os.path.join(args.output_dir, f"tract_{tract_idx}_{modality}")
+    try:
+        train_loader, _, val_loader = extract_specific_tract_data(dataset_output, tract_idx=tract_idx,
+                                                                   batch_size=args.batch_size,
+                                                                   fa_md_pair=args.stack_fa_md)
+        train_loader_raw = RemappedDataLoader(train_loader)
+        val_loader_raw = RemappedDataLoader(val_loader)
+        _, input_channels, sequence_length = next(iter(train_loader_raw))[0].shape
+        state = torch.load(os.path.join(output_dir, "best_combined_model.pth"), map_location="cpu")
+        num_sites = state["site_predictor.fc_out.weight"].shape[0]
+        model = CombinedAE_Predictors(
+            Conv1DVariationalAutoencoder_fa(latent_dims=latent_dim, dropout=dropout, input_length=sequence_length,
+                                            input_channels=input_channels),
+            AgePredictorCNN(input_channels=input_channels, sequence_length=sequence_length, dropout=age_dropout),
+            SitePredictorCNN(num_sites=num_sites, input_channels=input_channels, sequence_length=sequence_length,
+                             dropout=site_dropout))
+        # Packed runs save only the layers of the length branch the VAE uses
+        load_tract_state_dict(model, state)
+        model.to(device).eval()
         
-        # Save training history as CSV files for easier analysis
-        # Save VAE training history
-        if 'vae' in results:
-            vae_history = pd.DataFrame({
-                'epoch': list(range(1, len(results['vae']['train_loss_epoch']) + 1)),
-                'train_loss': results['vae']['train_loss_epoch'],
-                'val_loss': results['vae']['val_loss_epoch'],
-                'train_recon_loss': results['vae']['train_recon_loss_epoch'],
-                'val_recon_loss': results['vae']['val_recon_loss_epoch'],
-                'train_kl_loss': results['vae']['train_kl_loss_epoch'],
-                'val_kl_loss': results['vae']['val_kl_loss_epoch'],
-                'beta': results['vae']['current_beta_epoch']
-            })
-            vae_history.to_csv(os.path.join(output_dir, 'vae_training_history.csv'), index=False)
+        ages, predictions = predict_ages(age_path(model), val_loader_raw, device=device)
+        np.savez(os.path.join(output_dir, "val_predictions.npz"), ages=ages.numpy(), predictions=predictions.numpy())
         
-        # Save Age Predictor training history
-        if 'age_predictor' in results:
-            age_history = pd.DataFrame({
-                'epoch': list(range(1, len(results['age_predictor']['train_loss_epoch']) + 1)),
-                'train_mae': results['age_predictor']['train_loss_epoch'],
-                'val_mae': results['age_predictor']['val_loss_epoch'],
-                'train_r2': results['age_predictor']['train_r2_epoch'],
-                'val_r2': results['age_predictor']['val_r2_epoch']
+        if args.node_window:
+            baseline = tract_means(train_loader_raw) if args.occlusion_baseline == 'mean' else 0.0
+            node_scores = sliding_window_occlusion(age_path(model), val_loader_raw, baseline, window=args.node_window,
+                                                   stride=args.node_stride, device=device)
+            # A two-channel model gets one row of scores per metric
+            names = ([tract_name.replace("dki_fa_md", metric) for metric in ("dki_fa", "dki_md")]
+                     if input_channels == 2 else [tract_name])
+            write_node_occlusion(node_scores, [tract_idx] * len(names), names, output_dir)
+    except Exception as e:
+        print(f"ERROR analyzing the trained model of tract {tract_idx}: {str(e)}")
+        import traceback
+        print(traceback.format_exc())
+        sys.stdout.flush()
+
+
+def tract_prediction_significance(tract_indices, base_output_dir=None):
+    """
+    P-values and confidence intervals of the R² and MAE of finished tracts.
+    
+    Uses the validation predictions cached by analyze_trained_tract in
+    base_output_dir (default: --output-dir); the p-value permutes the ages.
+    Tracts without cached predictions (finished by an older version of this
+    script) are left out.
+    
+    Returns
+    -------
+    pd.DataFrame
+        One row per tract, keyed by tract_idx
+    """
+    rows = []
+    for tract_idx in tract_indices:
+        _, modality = tract_name_and_modality(tract_idx)
+        predictions_file = os.path.join(base_output_dir or args.output_dir, f"tract_{tract_idx}_{modality}",
+                                        "val_predictions.npz")
+        if not os.path.exists(predictions_file):
+            continue
+        cached = np.load(predictions_file)
+        significance = prediction_significance(cached['predictions'][None], cached['ages'],
+                                               num_permutations=args.permutations,
+                                               num_resamples=args.bootstrap_resamples)
+        row = {key: values[0] for key, values in significance.items()}
+        # R² and MAE of the saved model the tests are about (best_val_r2 is the best over epochs)
+        row['model_val_r2'] = row.pop('r2')
+        row['model_val_mae'] = row.pop('mae')
+        rows.append({'tract_idx': tract_idx, **row})
+    return pd.DataFrame(rows, columns=['tract_idx', 'model_val_r2', 'model_val_mae', 'r2_p_value', 'r2_ci_low',
+                                       'r2_ci_high', 'mae_ci_low', 'mae_ci_high'])
+
+
+def write_node_occlusion(node_scores, tract_indices, names, out_dir):
+    """
+    Save sliding-window occlusion scores: one row per tract and window in
+    node_occlusion.csv, and the per-node R² drop as a tract x node matrix
+    (with a heatmap when there are several tracts).
+    """
+    rows = []
+    for t, (tract_idx, tract_name) in enumerate(zip(tract_indices, names)):
+        for p, start in enumerate(node_scores['starts']):
+            rows.append({
+                'tract_idx': tract_idx,
+                'tract_name': tract_name,
+                'window_start': start,
+                'window_end': start + args.node_window - 1,
+                'r2_drop': node_scores['r2_drop'][t, p],
+                'mae_increase': node_scores['mae_increase'][t, p],
             })
-            age_history.to_csv(os.path.join(output_dir, 'age_predictor_training_history.csv'), index=False)
+    pd.DataFrame(rows).to_csv(os.path.join(out_dir, "node_occlusion.csv"), index=False)
+    node_r2_drop = pd.DataFrame(node_scores['node_r2_drop'], index=names)
+    node_r2_drop.to_csv(os.path.join(out_dir, "node_occlusion_r2_drop.csv"))
+    
+    if len(names) > 1:
+        fig, ax = plt.subplots(figsize=(14, 12))
+        image = ax.imshow(node_r2_drop.values, aspect='auto', cmap='viridis')
+        ax.set_yticks(range(len(names)))
+        ax.set_yticklabels(names, fontsize=6)
+        ax.set_xlabel('Node')
+        ax.set_title(f'R² drop when occluding {args.node_window} nodes around each node')
+        fig.colorbar(image, ax=ax, label='R² drop')
+        plt.tight_layout()
+        plt.savefig(os.path.join(out_dir, "node_occlusion_r2_drop.png"))
+        plt.close(fig)
+
+
+def finished_tracts(base_output_dir=None, settings=None):
+    """
+    Summaries of the tracts that finished with the current settings (or the
+    settings of hash ``settings``), by tract index, from the manifest of
+    --output-dir (or base_output_dir). Tracts whose tract_summary.json was
+    removed count as unfinished.
+    """
+    path = os.path.join(base_output_dir, "manifest.json") if base_output_dir else manifest_file
+    with locked_json(path, write=False) as manifest:
+        tracts = manifest.get(settings or config_hash, {}).get("tracts", {})
+    return {int(tract_idx): summary for tract_idx, summary in tracts.items()
+            if os.path.exists(os.path.join(summary["output_dir"], "tract_summary.json"))}
+
+
+def record_finished_tract(tract_idx, tract_name, modality, result):
+    """Write a finished tract's tract_summary.json, and add it to the manifest and the results table."""
+    def to_float(value):
+        return None if value is None else float(value)
+    
+    output_dir = os.path.join(args.output_dir, f"tract_{tract_idx}_{modality}")
+    summary = {
+        "tract_idx": tract_idx,
+        "tract_name": tract_name,
+        "modality": modality,
+        "base_tract_name": tract_name.replace(modality, "") if modality != "unknown" else tract_name,
+        "best_val_r2": to_float(result.get("best_val_r2")),
+        "best_val_mae": to_float(result.get("best_val_mae")),
+        "best_site_acc": to_float(result.get("best_site_acc")),
+        "training_time": to_float(result.get("training_time", 0)),
+        # Names read by combine_tract_results.py and plot_tract_importance.py
+        "best_r2": to_float(result.get("best_val_r2")),
+        "best_age_mae": to_float(result.get("best_val_mae")),
+        "config_hash": config_hash,
+        "output_dir": output_dir,
+        "finished": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    with open(os.path.join(output_dir, "tract_summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    with locked_json(manifest_file) as manifest:
+        entry = manifest.setdefault(config_hash, {"config": run_config, "tracts": {}})
+        entry["tracts"][str(tract_idx)] = summary
+    ResultsStore(results_file).record(tract_row(summary, result.get("adversarial_summary")))
+
+
+def run_tract_group_in_worker(tract_group):
+    """run_tract_group for a worker process; seeding by tract keeps results independent of scheduling."""
+    torch.manual_seed(tract_group[0])
+    print(f"DEBUG: Worker {os.getpid()} starting tracts {tract_group} with {torch.get_num_threads()} threads")
+    sys.stdout.flush()
+    return run_tract_group(tract_group)
+
+
+def claimed_tract_groups():
+    """
+    Claim tract groups from the work queue in --queue-dir and run them until
+    none are left, heartbeating while each one trains.
+    
+    Yields
+    ------
+    tuple
+        ``(tract_group, group_results)`` of each finished group
+    """
+    queue = WorkQueue(args.queue_dir, stale_after=args.queue_stale_after)
+    while True:
+        task = queue.claim()
+        if task is None:
+            return
+        tract_group = [int(tract_idx) for tract_idx in task.split(",")]
+        print(f"DEBUG: {queue.worker_id} claimed tracts {tract_group}")
+        sys.stdout.flush()
+        # Seeding by tract keeps results independent of which worker claims the group
+        torch.manual_seed(tract_group[0])
+        with queue.heartbeating(task):
+            group_results = run_tract_group(tract_group)
+        errors = [str(result["error"]) for result in group_results if "error" in result]
+        queue.complete(task, error="; ".join(errors) if errors else None)
+        yield tract_group, group_results
+
+
+def drain_work_queue(worker_index):
+    """claimed_tract_groups for a worker process; returns all groups it ran."""
+    return list(claimed_tract_groups())
+
+
+def selected_tracts():
+    """Tract indices of this run: --tracts, or --start-tract to --end-tract."""
+    if args.tracts:
+        return [int(tract_idx) for tract_idx in args.tracts.split(",")]
+    if args.stack_fa_md:
+        # Indices are bundles, half as many as FA and MD tracts; the default --end-tract covers all of them
+        return list(range(args.start_tract, min(args.end_tract, len(tract_names) - 1) + 1))
+    return list(range(args.start_tract, args.end_tract + 1))
+
+
+def tract_name_and_modality(tract_idx):
+    """Return the name (including modality) and the modality of a tract index."""
+    if tract_idx < len(tract_names):
+        tract_name = tract_names[tract_idx]
         
-        # Save Site Predictor training history
-        if 'site_predictor' in results:
-            site_history = pd.DataFrame({
-                'epoch': list(range(1, len(results['site_predictor']['train_loss_epoch']) + 1)),
-                'train_loss': results['site_predictor']['train_loss_epoch'],
-                'val_loss': results['site_predictor']['val_loss_epoch'],
-                'train_acc': results['site_predictor']['train_acc_epoch'],
-                'val_acc': results['site_predictor']['val_acc_epoch']
+        # Determine modality from tract name
+        if "dki_fa_md" in tract_name:
+            modality = "dki_fa_md"
+        elif "dki_fa" in tract_name:
+            modality = "dki_fa"
+        elif "dki_md" in tract_name:
+            modality = "dki_md"
+        else:
+            modality = "unknown"
+    else:
+        # Create default name if index is out of range
+        if args.stack_fa_md:
+            modality = "dki_fa_md"
+            tract_name = f"dki_fa_mdtract_{tract_idx}"
+        elif args.use_both_fa_md:
+            # Determine if this is an FA or MD tract based on index
+            if tract_idx % 2 == 0:
+                modality = "dki_fa"
+                tract_name = f"dki_fatract_{tract_idx//2}"
+            else:
+                modality = "dki_md"
+                tract_name = f"dki_mdtract_{tract_idx//2}"
+        else:
+            modality = "dki_fa"
+            tract_name = f"dki_fatract_{tract_idx}"
+    
+    return tract_name, modality
+
+
+def write_importance_rankings(importance_df, base_output_dir, r2_column='r2_drop', mae_column='mae_increase',
+                              mae_ascending=False):
+    """
+    Write the tract rankings of an all-tract importance engine.
+    
+    Uses the file names of the per-tract rankings (tract_ranking_by_r2.csv,
+    tract_ranking_by_mae.csv and their fa_/md_ variants), with the most
+    important tract first: highest ``r2_column``, and highest (or lowest,
+    with ``mae_ascending``) ``mae_column``.
+    """
+    rankings = {"r2": (r2_column, False), "mae": (mae_column, mae_ascending)}
+    for prefix, modality in [("", None), ("fa_", "dki_fa"), ("md_", "dki_md")]:
+        subset = importance_df if modality is None else importance_df[importance_df['modality'] == modality]
+        if subset.empty:
+            continue
+        for metric, (column, ascending) in rankings.items():
+            ranking = subset.sort_values(column, ascending=ascending).reset_index(drop=True)
+            ranking.to_csv(os.path.join(base_output_dir, f"{prefix}tract_ranking_by_{metric}.csv"), index=False)
+    
+    print(f"\nTop 5 tracts by {r2_column}:")
+    for i, row in importance_df.sort_values(r2_column, ascending=False).head(5).iterrows():
+        print(f"{row['tract_name']} (idx: {row['tract_idx']}): {r2_column}={row[r2_column]:.4f}, " +
+              f"{mae_column}={row[mae_column]:.4f} years")
+
+
+def run_linear_screen(base_output_dir):
+    """
+    Screen every tract with closed-form linear probes before any deep training.
+    
+    Fits a ridge regression of age (penalty cross-validated per tract) and a
+    multinomial logistic site probe on the nodes of each tract, for all
+    tracts at once (see Experiment_Utils/linear_probes.py), and writes the
+    validation scores in the format of the per-tract rankings.
+    """
+    _, train_loader, _, val_loader = dataset_output
+    start_time = time.time()
+    x_train, labels_train = loader_arrays(RemappedDataLoader(train_loader))
+    x_val, labels_val = loader_arrays(RemappedDataLoader(val_loader))
+    features_train, mean, std = tract_features(x_train)
+    features_val, _, _ = tract_features(x_val, mean, std)
+    num_tracts = features_train.shape[0]
+    print(f"Fitting linear probes on {num_tracts} tracts of {features_train.shape[2]} nodes")
+    sys.stdout.flush()
+    
+    ridge = ridge_cv(features_train, labels_train[:, 0])
+    predictions = ridge_predict(features_val, ridge).numpy()
+    ages = labels_val[:, 0].double().numpy()
+    sites_train, sites_val = labels_train[:, 2], labels_val[:, 2]
+    num_sites = int(max(sites_train.max(), sites_val.max())) + 1
+    site_accuracy = site_probe_accuracy(features_val, sites_val, fit_site_probe(features_train, sites_train, num_sites))
+    training_time = time.time() - start_time
+    
+    rows = []
+    for tract_idx in range(num_tracts):
+        tract_name, modality = tract_name_and_modality(tract_idx)
+        errors = predictions[tract_idx] - ages
+        rows.append({
+            'tract_idx': tract_idx,
+            'tract_name': tract_name,
+            'modality': modality,
+            'base_tract_name': tract_name.replace(modality, '') if modality != 'unknown' else tract_name,
+            'best_val_r2': 1 - (errors ** 2).sum() / ((ages - ages.mean()) ** 2).sum(),
+            'best_val_mae': np.abs(errors).mean(),
+            'best_site_acc': site_accuracy[tract_idx].item() * 100,
+            'training_time_minutes': training_time / 60 / num_tracts,
+            'ridge_alpha': ridge['alpha'][tract_idx].item(),
+        })
+    screen_df = pd.DataFrame(rows)
+    if args.permutations:
+        significance = prediction_significance(predictions, ages, num_permutations=args.permutations,
+                                               num_resamples=args.bootstrap_resamples)
+        for key in ['r2_p_value', 'r2_ci_low', 'r2_ci_high', 'mae_ci_low', 'mae_ci_high']:
+            screen_df[key] = significance[key]
+    
+    screen_df.to_csv(os.path.join(base_output_dir, "linear_screen.csv"), index=False)
+    write_importance_rankings(screen_df, base_output_dir, r2_column='best_val_r2', mae_column='best_val_mae',
+                              mae_ascending=True)
+
+
+def run_occlusion_importance(base_output_dir):
+    """
+    Rank tracts with one age predictor trained on all tracts at once.
+    
+    Every tract of the validation data is replaced by its cohort mean profile
+    (or zeros), one tract at a time, and the tract's importance is the drop in
+    validation R² and the increase in MAE that causes (see
+    Experiment_Utils/tract_importance.py). The per-tract VAE and site models
+    are not trained.
+    """
+    _, train_loader, _, val_loader = dataset_output
+    train_loader_raw = RemappedDataLoader(train_loader)
+    val_loader_raw = RemappedDataLoader(val_loader)
+    x_batch, _ = next(iter(train_loader_raw))
+    num_tracts, sequence_length = x_batch.shape[1], x_batch.shape[2]
+    print(f"Training one age predictor on {num_tracts} tracts of {sequence_length} nodes")
+    sys.stdout.flush()
+    
+    model_dir = os.path.join(base_output_dir, "all_tracts_occlusion")
+    os.makedirs(model_dir, exist_ok=True)
+    details_file = os.path.join(model_dir, "experiment_details.json")
+    resume = False
+    if not args.no_resume and os.path.exists(details_file):
+        with open(details_file) as f:
+            resume = json.load(f).get("config_hash") == config_hash
+    if not resume:
+        clear_stage_checkpoints(model_dir)
+    with open(details_file, "w") as f:
+        json.dump({**run_config, "config_hash": config_hash, "num_tracts": num_tracts,
+                   "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "device": str(device)}, f, indent=2)
+    
+    # As long as the age predictor of a per-tract run trains in stage 1
+    model = AgePredictorCNN(input_channels=num_tracts, sequence_length=sequence_length, dropout=age_dropout)
+    start_time = time.time()
+    history = fit_age_predictor(model, train_loader_raw, val_loader_raw, epochs=args.epochs_stage1 * 2,
+                                lr=args.learning_rate, device=device, save_dir=model_dir, resume=resume)
+    training_time = time.time() - start_time
+    
+    baseline = tract_means(train_loader_raw) if args.occlusion_baseline == 'mean' else 0.0
+    model.eval()
+    scores = occlusion_importance(model, val_loader_raw, baseline, device=device, chunk_size=args.occlusion_chunk_size)
+    print(f"All tracts: validation MAE={scores['intact_mae']:.4f} years, R²={scores['intact_r2']:.4f}")
+    
+    rows = []
+    for tract_idx in range(num_tracts):
+        tract_name, modality = tract_name_and_modality(tract_idx)
+        rows.append({
+            'tract_idx': tract_idx,
+            'tract_name': tract_name,
+            'modality': modality,
+            'base_tract_name': tract_name.replace(modality, '') if modality != 'unknown' else tract_name,
+            'r2_drop': scores['r2_drop'][tract_idx],
+            'mae_increase': scores['mae_increase'][tract_idx],
+            'occluded_r2': scores['occluded_r2'][tract_idx],
+            'occluded_mae': scores['occluded_mae'][tract_idx],
+            'intact_r2': scores['intact_r2'],
+            'intact_mae': scores['intact_mae'],
+        })
+    importance_df = pd.DataFrame(rows)
+    if args.permutations:
+        # Swaps of intact and occluded predictions within subjects, from the cached predictions
+        significance = occlusion_significance(scores['intact_predictions'], scores['occluded_predictions'],
+                                              scores['ages'], num_permutations=args.permutations,
+                                              num_resamples=args.bootstrap_resamples)
+        for key, values in significance.items():
+            importance_df[key] = values
+    
+    if args.attributions:
+        # Per-subject [tracts, nodes] maps of the validation data, from the same baseline as the occlusion
+        attribution_dir = os.path.join(base_output_dir, "attributions")
+        for method in ATTRIBUTION_METHODS:
+            print(f"Computing {method} maps")
+            sys.stdout.flush()
+            save_attribution_maps(model, val_loader_raw, attribution_dir, method=method, baseline=baseline,
+                                  steps=args.attribution_steps, device=device, num_subjects=len(val_loader.dataset))
+            mean_abs = np.load(os.path.join(attribution_dir, f"{method}_cohort_mean_abs.npy"))
+            importance_df[f"{method}_abs"] = mean_abs.sum(axis=1)
+    
+    importance_df.to_csv(os.path.join(base_output_dir, "occlusion_importance.csv"), index=False)
+    with open(os.path.join(model_dir, "training_history.json"), "w") as f:
+        json.dump({**history, "training_time": training_time}, f, indent=2)
+    write_importance_rankings(importance_df, base_output_dir)
+    
+    if args.node_window:
+        print(f"Occluding windows of {args.node_window} nodes along every tract")
+        sys.stdout.flush()
+        node_scores = sliding_window_occlusion(model, val_loader_raw, baseline, window=args.node_window,
+                                               stride=args.node_stride, device=device,
+                                               chunk_size=args.occlusion_chunk_size)
+        write_node_occlusion(node_scores, importance_df['tract_idx'].tolist(), importance_df['tract_name'].tolist(),
+                             base_output_dir)
+    
+    if args.pairwise:
+        print(f"Masking all {num_tracts * (num_tracts - 1) // 2} tract pairs")
+        sys.stdout.flush()
+        pair_scores = pairwise_occlusion_importance(model, val_loader_raw, baseline, device=device,
+                                                    chunk_size=args.occlusion_chunk_size)
+        write_pairwise_importance(pair_scores, importance_df['tract_name'].tolist(), base_output_dir)
+
+
+def write_pairwise_importance(pair_scores, names, base_output_dir):
+    """
+    Save the tract x tract matrices of pairwise occlusion, a ranking of the pairs and an interaction heatmap.
+    """
+    for key in ['pair_r2_drop', 'pair_mae_increase', 'r2_interaction', 'mae_interaction']:
+        pd.DataFrame(pair_scores[key], index=names, columns=names).to_csv(
+            os.path.join(base_output_dir, f"pairwise_{key.replace('pair_', '')}.csv"))
+    
+    first, second = np.triu_indices(len(names), 1)
+    pairs_df = pd.DataFrame({
+        'tract_a_idx': first,
+        'tract_b_idx': second,
+        'tract_a': [names[i] for i in first],
+        'tract_b': [names[j] for j in second],
+        'pair_r2_drop': pair_scores['pair_r2_drop'][first, second],
+        'pair_mae_increase': pair_scores['pair_mae_increase'][first, second],
+        'r2_interaction': pair_scores['r2_interaction'][first, second],
+        'mae_interaction': pair_scores['mae_interaction'][first, second],
+    }).sort_values('r2_interaction', ascending=False).reset_index(drop=True)
+    pairs_df.to_csv(os.path.join(base_output_dir, "pairwise_importance.csv"), index=False)
+    
+    # Diverging colors centered on zero: red pairs carry more together than alone (redundant tracts)
+    interaction = pair_scores['r2_interaction']
+    limit = np.abs(interaction).max() or 1.0
+    fig, ax = plt.subplots(figsize=(14, 12))
+    image = ax.imshow(interaction, cmap='RdBu_r', vmin=-limit, vmax=limit)
+    ax.set_xticks(range(len(names)))
+    ax.set_yticks(range(len(names)))
+    ax.set_xticklabels(names, rotation=90, fontsize=6)
+    ax.set_yticklabels(names, fontsize=6)
+    ax.set_title('Pairwise tract interaction: R² drop of the pair minus the drops of each tract')
+    fig.colorbar(image, ax=ax, label='R² interaction')
+    plt.tight_layout()
+    plt.savefig(os.path.join(base_output_dir, "pairwise_r2_interaction.png"))
+    plt.close(fig)
+    
+    print("\nTop 5 interacting tract pairs (R² drop beyond the single tracts):")
+    for i, row in pairs_df.head(5).iterrows():
+        print(f"{i+1}. {row['tract_a']} + {row['tract_b']}: interaction={row['r2_interaction']:.4f}, " +
+              f"pair R² drop={row['pair_r2_drop']:.4f}")
+
+
+def run_successive_halving(base_output_dir):
+    """
+    Rank the tracts with successive halving instead of training every tract
+    for the full number of epochs.
+    
+    Rung r of R trains its tracts for 2^(r - R + 1) times --epochs-stage1 and
+    --epochs-stage2, so the last rung gets the full budget. Each rung is a
+    run of this script on its tracts (--tracts), with the same settings
+    otherwise, in halving_rung_<r>/ (the last one in base_output_dir itself,
+    which therefore holds the usual rankings of the tracts that made it).
+    Between rungs, successive_halving_keep promotes the top --halving-keep
+    of the tracts by validation R² of the saved model, and any other tract
+    whose bootstrap upper bound reaches the last of those.
+    
+    Every decision goes to halving_decisions.csv as the rungs finish, and
+    halving_ranking.csv ranks all tracts by the last rung they reached, then
+    by R² there. Rungs resume like any run: finished tracts are skipped.
+    """
+    tract_range = selected_tracts()
+    rungs = args.halving_rungs
+    decisions_file = os.path.join(base_output_dir, "halving_decisions.csv")
+    rows = []
+    tract_epochs = 0
+    for rung in range(rungs):
+        scale = 2.0 ** (rung - rungs + 1)
+        epochs_stage1 = max(1, round(args.epochs_stage1 * scale))
+        epochs_stage2 = max(1, round(args.epochs_stage2 * scale))
+        final = rung == rungs - 1
+        rung_dir = base_output_dir if final else os.path.join(base_output_dir, f"halving_rung_{rung}")
+        print(f"\n{'='*80}\nSUCCESSIVE HALVING RUNG {rung + 1}/{rungs}: {len(tract_range)} tracts, "
+              f"{epochs_stage1}+{epochs_stage2} epochs, in {rung_dir}\n{'='*80}")
+        sys.stdout.flush()
+        # Later options override earlier ones, so the rung keeps every other setting of this run
+        subprocess.run([sys.executable, sys.argv[0], *sys.argv[1:], '--halving-rungs', '0',
+                        '--tracts', ','.join(map(str, tract_range)), '--output-dir', rung_dir,
+                        '--epochs-stage1', str(epochs_stage1), '--epochs-stage2', str(epochs_stage2)], check=True)
+        tract_epochs += len(tract_range) * (epochs_stage1 + epochs_stage2)
+        
+        rung_config = {**run_config, "epochs_stage1": epochs_stage1, "epochs_stage2": epochs_stage2}
+        finished = finished_tracts(rung_dir, settings_hash(rung_config))
+        significance_df = tract_prediction_significance([t for t in tract_range if t in finished], rung_dir)
+        significance = significance_df.set_index('tract_idx')
+        rung_rows = []
+        for tract_idx in tract_range:
+            summary = finished.get(tract_idx, {})
+            cached = tract_idx in significance.index
+            rung_rows.append({
+                'rung': rung,
+                'epochs_stage1': epochs_stage1,
+                'epochs_stage2': epochs_stage2,
+                'tract_idx': tract_idx,
+                'tract_name': tract_name_and_modality(tract_idx)[0],
+                # R² of the saved model, which the interval is about; the best over epochs without cached predictions
+                'val_r2': significance.at[tract_idx, 'model_val_r2'] if cached else summary.get('best_val_r2', np.nan),
+                'r2_ci_low': significance.at[tract_idx, 'r2_ci_low'] if cached else np.nan,
+                'r2_ci_high': significance.at[tract_idx, 'r2_ci_high'] if cached else np.nan,
+                'best_val_r2': summary.get('best_val_r2', np.nan),
+                'best_val_mae': summary.get('best_val_mae', np.nan),
             })
-            site_history.to_csv(os.path.join(output_dir, 'site_predictor_training_history.csv'), index=False)
-            
-        # Save Combined Model training history
-        if 'combined' in results:
-            combined_cols = {
-                'epoch': list(range(1, len(results['combined']['train_loss_epoch']) + 1)),
-                'train_loss': results['combined']['train_loss_epoch'],
-                'val_loss': results['combined']['val_loss_epoch']
-            }
-            
-            # Add other metrics if they exist
-            for metric in ['train_recon_loss_epoch', 'val_recon_loss_epoch', 
-                          'train_kl_loss_epoch', 'val_kl_loss_epoch',
-                          'train_age_loss_epoch', 'val_age_loss_epoch',
-                          'train_site_loss_epoch', 'val_site_loss_epoch',
-                          'train_age_mae_epoch', 'val_age_mae_epoch',
-                          'train_site_acc_epoch', 'val_site_acc_epoch',
-                          'train_age_r2_epoch', 'val_age_r2_epoch',
-                          'current_beta_epoch', 'current_grl_alpha_epoch']:
-                if metric in results['combined']:
-                    # Create a friendlier column name by removing _epoch suffix
-                    col_name = metric.replace('_epoch', '')
-                    combined_cols[col_name] = results['combined'][metric]
-            
-            combined_history = pd.DataFrame(combined_cols)
-            combined_history.to_csv(os.path.join(output_dir, 'combined_model_training_history.csv'), index=False)
-            
-            # Create a dedicated summary file for adversarial training (stage 2) results
-            # Find the best R² and MAE values from the combined model training
-            combined_val_r2 = results['combined'].get('val_age_r2_epoch', [])
-            combined_val_mae = results['combined'].get('val_age_mae_epoch', [])
-            combined_val_site_acc = results['combined'].get('val_site_acc_epoch', [])
-            
-            best_combined_r2 = max(combined_val_r2) if combined_val_r2 else None
-            best_combined_r2_epoch = combined_val_r2.index(best_combined_r2) + 1 if best_combined_r2 is not None else None
+        rung_df = pd.DataFrame(rung_rows).astype({'val_r2': float, 'r2_ci_high': float})
+        if final:
+            keep, cutoff = np.ones(len(rung_df), dtype=bool), np.nan
+        else:
+            keep, cutoff = successive_halving_keep(rung_df['val_r2'].values, rung_df['r2_ci_high'].values,
+                                                   keep_fraction=args.halving_keep)
+        rung_df['cutoff_r2'] = cutoff
+        rung_df['decision'] = np.where(rung_df['val_r2'].isna(), 'failed',
+                                       np.where(keep, 'final' if final else 'promoted', 'dropped'))
+        rows.append(rung_df)
+        pd.concat(rows).to_csv(decisions_file, index=False)
+        
+        for _, row in rung_df.iterrows():
+            print(f"Rung {rung}: tract {row['tract_idx']} ({row['tract_name']}) R²={row['val_r2']:.4f} "
+                  f"[{row['r2_ci_low']:.4f}, {row['r2_ci_high']:.4f}] -> {row['decision']}")
+        tract_range = rung_df.loc[rung_df['decision'].isin(['promoted', 'final']), 'tract_idx'].tolist()
+        if not tract_range:
+            print("No tract was promoted; stopping early")
+            break
+    
+    decisions = pd.concat(rows)
+    ranking = (decisions.sort_values(['rung', 'val_r2'], ascending=[False, False], na_position='last')
+               .drop_duplicates('tract_idx').rename(columns={'rung': 'last_rung'}).reset_index(drop=True))
+    ranking.to_csv(os.path.join(base_output_dir, "halving_ranking.csv"), index=False)
+    full_epochs = len(selected_tracts()) * (args.epochs_stage1 + args.epochs_stage2)
+    print(f"\nSuccessive halving used {tract_epochs} tract-epochs, {100 * tract_epochs / full_epochs:.1f}% of "
+          f"training every tract for the full {args.epochs_stage1}+{args.epochs_stage2} epochs")
+    print(f"Decisions saved to {decisions_file}")
+
+
+def append_summary_row(summary_file, tract_idx, tract_name, modality, result):
+    """Append the line of one tract to summary_results.csv."""
+    # Update summary file
+    with open(summary_file, 'a') as f:
+        if "error" in result:
+            f.write(f"{tract_idx},{tract_name},{modality},0,0,0,0,0,0,0,0,error\n")
+        else:
+            # Extract metrics for stage 1 (independent training)
+            # These would come from the individual predictors
+            stage1_r2 = 0
+            stage1_mae = 0
+            stage1_site_acc = 0
             
-            best_combined_mae = min(combined_val_mae) if combined_val_mae else None
-            best_combined_mae_epoch = combined_val_mae.index(best_combined_mae) + 1 if best_combined_mae is not None else None
+            # Check for age predictor metrics first
+            if 'age_predictor' in result and 'val_r2_epoch' in result['age_predictor']:
+                stage1_r2 = max(result['age_predictor']['val_r2_epoch']) if result['age_predictor']['val_r2_epoch'] else 0
+                stage1_mae = min(result['age_predictor']['val_loss_epoch']) if result['age_predictor']['val_loss_epoch'] else 0
             
-            # Find the best site accuracy, which is interesting for adversarial training
-            # Lower site accuracy can indicate better site-invariant features
-            best_combined_site_acc = max(combined_val_site_acc) if combined_val_site_acc else None
-            worst_combined_site_acc = min(combined_val_site_acc) if combined_val_site_acc else None
+            # Check for site predictor metrics
+            if 'site_predictor' in result and 'val_acc_epoch' in result['site_predictor']:
+                stage1_site_acc = max(result['site_predictor']['val_acc_epoch']) if result['site_predictor']['val_acc_epoch'] else 0
             
-            # Create a summary DataFrame for stage 2 (adversarial training)
-            adversarial_summary = {
-                'tract_idx': tract_idx,
-                'tract_name': tract_name,
-                'best_val_r2': best_combined_r2,
-                'best_val_r2_epoch': best_combined_r2_epoch,
-                'best_val_mae': best_combined_mae,
-                'best_val_mae_epoch': best_combined_mae_epoch,
-                'best_site_acc': best_combined_site_acc,
-                'worst_site_acc': worst_combined_site_acc,
-                'best_epoch': results['combined'].get('best_epoch', None),
-                'best_metric_value': results['combined'].get(f'best_{val_metric_to_monitor}', None),
-                'total_epochs': len(combined_val_r2)
-            }
+            # Extract metrics for stage 2 (adversarial training)
+            # These would come from the combined model
+            stage2_r2 = 0
+            stage2_mae = 0
+            stage2_site_acc = 0
+            stage2_worst_site_acc = 0
             
-            # Save the adversarial training summary
-            pd.DataFrame([adversarial_summary]).to_csv(
-                os.path.join(output_dir, 'adversarial_training_summary.csv'), index=False
-            )
-            print(f"Saved adversarial training (stage 2) summary to {os.path.join(output_dir, 'adversarial_training_summary.csv')}")
-        
-        # Save detailed results as JSON
-        try:
-            # Convert numpy arrays and other non-serializable types to lists or primitives
-            serializable_results = {}
+            if 'combined' in result:
+                if 'val_age_r2_epoch' in result['combined']:
+                    stage2_r2 = max(result['combined']['val_age_r2_epoch']) if result['combined']['val_age_r2_epoch'] else 0
+                
+                if 'val_age_mae_epoch' in result['combined']:
+                    stage2_mae = min(result['combined']['val_age_mae_epoch']) if result['combined']['val_age_mae_epoch'] else 0
+                
+                if 'val_site_acc_epoch' in result['combined']:
+                    site_acc_values = result['combined']['val_site_acc_epoch']
+                    if site_acc_values:
+                        stage2_site_acc = max(site_acc_values)
+                        stage2_worst_site_acc = min(site_acc_values)
             
-            def make_serializable(obj):
-                if isinstance(obj, (np.ndarray, list, tuple)):
-                    return [float(x) if isinstance(x, (np.float32, np.float64)) else 
-                            int(x) if isinstance(x, (np.int32, np.int64)) else x 
-                            for x in obj]
-                elif isinstance(obj, (np.float32, np.float64)):
-                    return float(obj)
-                elif isinstance(obj, (np.int32, np.int64)):
-                    return int(obj)
-                elif isinstance(obj, dict):
-                    return {k: make_serializable(v) for k, v in obj.items()}
-                else:
-                    return obj
+            training_time_mins = result.get('training_time', 0) / 60
             
-            # Process each top-level key
-            for key, value in results.items():
-                if isinstance(value, dict):
-                    serializable_results[key] = make_serializable(value)
-                else:
-                    serializable_results[key] = make_serializable(value)
-                    
-            with open(os.path.join(output_dir, "training_results.json"), "w") as f:
-                json.dump(serializable_results, f, indent=2)
-                
-        except Exception as e:
-            print(f"WARNING: Error serializing full results: {str(e)}")
-            # Fall back to saving a simplified version
-            with open(os.path.join(output_dir, "training_results_simple.json"), "w") as f:
-                simple_results = {
-                    "tract_idx": tract_idx,
-                    "tract_name": tract_name,
-                    "best_val_r2": best_val_r2,
-                    "best_val_mae": best_val_mae,
-                    "best_site_acc": best_site_acc,
-                    "training_time": training_time,
-                    "training_time_formatted": f"{training_time/60:.2f} minutes"
-                }
-                json.dump(simple_results, f, indent=2)
-        
-        print(f"Training for tract {tract_idx} completed in {training_time/60:.2f} minutes")
-        print(f"Best validation R²: {best_val_r2}")
-        print(f"Best validation MAE: {best_val_mae}")
-        print(f"Best site accuracy: {best_site_acc}%")
-        sys.stdout.flush()
-        
-        return results
-        
-    except Exception as e:
-        print(f"ERROR during training: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        sys.stdout.flush()
-        return {"error": str(e), "tract_idx": tract_idx, "tract_name": tract_name}
+            f.write(f"{tract_idx},{tract_name},{modality}," +
+                    f"{stage1_r2},{stage1_mae},{stage1_site_acc}," +
+                    f"{stage2_r2},{stage2_mae},{stage2_site_acc},{stage2_worst_site_acc}," +
+                    f"{training_time_mins:.2f},completed\n")
 
 
 # Main script execution
 try:
     print("DEBUG: Selecting device")
     sys.stdout.flush()
-    device = select_device()
+    if args.workers > 1:
+        # The workers are forked, so CUDA must stay uninitialized in this process
+        device = select_fork_safe_device()
+    else:
+        device = select_device()
     print(f"DEBUG: Selected device: {device}")
     sys.stdout.flush()
 
     print("DEBUG: Loading dataset")
     sys.stdout.flush()
-    dataset = AFQDataset.from_study('hbn')
+    if args.synthetic_scale is not None:
+        dataset = make_synthetic_afq_dataset(scale=args.synthetic_scale)
+    else:
+        dataset = AFQDataset.from_study('hbn')
     print(f"DEBUG: Loaded dataset with shape: {dataset.X.shape}")
     print(f"DEBUG: Target columns: {dataset.target_cols}")
     sys.stdout.flush()
@@ -652,7 +1580,17 @@ try:
         # Save the data types
         with open(os.path.join(args.output_dir, "tract_data_types.json"), "w") as f:
             json.dump(tract_data_types, f, indent=2)
-    
+
+    if args.stack_fa_md:
+        # One two-channel model per bundle, named after both metrics (e.g. dki_fa_mdARC_L)
+        tract_names = ["dki_fa_md" + name[len("dki_fa"):] for name in tract_names if name.startswith("dki_fa")]
+        tract_data_types = {name: "dki_fa_md" for name in tract_names}
+        print(f"DEBUG: Stacking FA and MD of {len(tract_names)} bundles as channels")
+        with open(os.path.join(args.output_dir, "tract_names.json"), "w") as f:
+            json.dump(tract_names, f, indent=2)
+        with open(os.path.join(args.output_dir, "tract_data_types.json"), "w") as f:
+            json.dump(tract_data_types, f, indent=2)
+
     print("DEBUG: Getting age and site indices")
     sys.stdout.flush()
     age_idx = dataset.target_cols.index('age')
@@ -676,121 +1614,89 @@ try:
         # Create an FA-only dataset
         dataset_output = prep_fa_dataset(dataset, target_labels=["dki_fa"], batch_size=args.batch_size)
     
+    if args.halving_rungs:
+        run_successive_halving(args.output_dir)
+        print("\nExperiment completed!")
+        sys.exit(0)
+    
+    if args.importance != 'retrain':
+        # One all-tract model (or closed-form probes) scores every tract; the per-tract training below is skipped
+        if args.importance == 'occlusion':
+            run_occlusion_importance(args.output_dir)
+        else:
+            run_linear_screen(args.output_dir)
+        print("\nExperiment completed!")
+        sys.exit(0)
+    
     # Run experiments for each tract in the specified range
     all_results = []
-    print(f"Starting experiments for tracts {args.start_tract} to {args.end_tract}")
+    tract_range = selected_tracts()
+    print(f"Starting experiments for tracts {', '.join(map(str, tract_range))}")
     
     # Create summary file to track progress
     summary_file = os.path.join(args.output_dir, "summary_results.csv")
-    with open(summary_file, 'w') as f:
+    # Jobs sharing a work queue, and resumed runs, append to the same file; only the first one writes the header
+    with contextlib.suppress(FileExistsError), open(summary_file, 'w' if args.no_resume and not args.queue_dir else 'x') as f:
         f.write("tract_idx,tract_name,modality,stage1_best_r2,stage1_best_mae,stage1_best_site_acc," +
                 "stage2_best_r2,stage2_best_mae,stage2_best_site_acc,stage2_worst_site_acc," +
                 "training_time_minutes,status\n")
     
-    for tract_idx in range(args.start_tract, args.end_tract + 1):
-        if tract_idx < len(tract_names):
-            tract_name = tract_names[tract_idx]
-            
-            # Determine modality from tract name
-            if "dki_fa" in tract_name:
-                modality = "dki_fa"
-            elif "dki_md" in tract_name:
-                modality = "dki_md"
-            else:
-                modality = "unknown"
-            
-            print(f"\nProcessing tract {tract_idx}/{args.end_tract}: {tract_name}")
+    if args.packed:
+        pack_size = args.pack_size if args.pack_size > 0 else len(tract_range)
+        tract_groups = [tract_range[i:i + pack_size] for i in range(0, len(tract_range), pack_size)]
+    else:
+        tract_groups = [[tract_idx] for tract_idx in tract_range]
+    
+    if args.queue_dir:
+        # Every job adds the same groups; tasks already queued keep their state
+        queue = WorkQueue(args.queue_dir, stale_after=args.queue_stale_after)
+        added = queue.add([",".join(str(tract_idx) for tract_idx in tract_group) for tract_group in tract_groups])
+        print(f"DEBUG: Added {added} tract groups to the work queue in {args.queue_dir}: {queue.counts()}")
+        sys.stdout.flush()
+    
+    if args.workers > 1:
+        # Load once, share with the workers: they inherit the tensors without copying them
+        shared_bytes = share_dataset_memory(dataset_output)
+        print(f"DEBUG: Moved {shared_bytes / 1024**2:.1f} MB of data to shared memory for {args.workers} workers")
+        sys.stdout.flush()
+        if args.queue_dir:
+            finished_groups = (finished for _, worker_groups in run_in_pool(drain_work_queue, list(range(args.workers)), args.workers)
+                               for finished in worker_groups)
         else:
-            # Create default name if index is out of range
-            if args.use_both_fa_md:
-                # Determine if this is an FA or MD tract based on index
-                if tract_idx % 2 == 0:
-                    modality = "dki_fa"
-                    tract_name = f"dki_fatract_{tract_idx//2}"
-                else:
-                    modality = "dki_md"
-                    tract_name = f"dki_mdtract_{tract_idx//2}"
-            else:
-                modality = "dki_fa"
-                tract_name = f"dki_fatract_{tract_idx}"
-            
-            print(f"\nProcessing tract {tract_idx}/{args.end_tract}: {tract_name}")
-        
-        # Run the experiment
-        result = run_tract_experiment(tract_idx, tract_name, args.output_dir)
-        
-        # Make sure modality is in the result
-        if "modality" not in result:
-            result["modality"] = modality
-        
-        all_results.append(result)
-        
-        # Update summary file
-        with open(summary_file, 'a') as f:
-            if "error" in result:
-                f.write(f"{tract_idx},{tract_name},{modality},0,0,0,0,0,0,0,0,error\n")
-            else:
-                # Extract metrics for stage 1 (independent training)
-                # These would come from the individual predictors
-                stage1_r2 = 0
-                stage1_mae = 0
-                stage1_site_acc = 0
-                
-                # Check for age predictor metrics first
-                if 'age_predictor' in result and 'val_r2_epoch' in result['age_predictor']:
-                    stage1_r2 = max(result['age_predictor']['val_r2_epoch']) if result['age_predictor']['val_r2_epoch'] else 0
-                    stage1_mae = min(result['age_predictor']['val_loss_epoch']) if result['age_predictor']['val_loss_epoch'] else 0
-                
-                # Check for site predictor metrics
-                if 'site_predictor' in result and 'val_acc_epoch' in result['site_predictor']:
-                    stage1_site_acc = max(result['site_predictor']['val_acc_epoch']) if result['site_predictor']['val_acc_epoch'] else 0
-                
-                # Extract metrics for stage 2 (adversarial training)
-                # These would come from the combined model
-                stage2_r2 = 0
-                stage2_mae = 0
-                stage2_site_acc = 0
-                stage2_worst_site_acc = 0
-                
-                if 'combined' in result:
-                    if 'val_age_r2_epoch' in result['combined']:
-                        stage2_r2 = max(result['combined']['val_age_r2_epoch']) if result['combined']['val_age_r2_epoch'] else 0
-                    
-                    if 'val_age_mae_epoch' in result['combined']:
-                        stage2_mae = min(result['combined']['val_age_mae_epoch']) if result['combined']['val_age_mae_epoch'] else 0
-                    
-                    if 'val_site_acc_epoch' in result['combined']:
-                        site_acc_values = result['combined']['val_site_acc_epoch']
-                        if site_acc_values:
-                            stage2_site_acc = max(site_acc_values)
-                            stage2_worst_site_acc = min(site_acc_values)
-                
-                training_time_mins = result.get('training_time', 0) / 60
-                
-                f.write(f"{tract_idx},{tract_name},{modality}," +
-                        f"{stage1_r2},{stage1_mae},{stage1_site_acc}," +
-                        f"{stage2_r2},{stage2_mae},{stage2_site_acc},{stage2_worst_site_acc}," +
-                        f"{training_time_mins:.2f},completed\n")
+            finished_groups = run_in_pool(run_tract_group_in_worker, tract_groups, args.workers)
+    elif args.queue_dir:
+        finished_groups = claimed_tract_groups()
+    else:
+        finished_groups = ((tract_group, run_tract_group(tract_group)) for tract_group in tract_groups)
     
-    # Create a final summary with tract ranking
-    print("\nAnalyzing results...")
-    valid_results = [r for r in all_results if "error" not in r]
+    # Results arrive in completion order with --workers or --queue-dir
+    for tract_group, group_results in finished_groups:
+        all_results.extend(group_results)
+    print(f"\nTrained {len(all_results)} tracts in this run ({sum('error' in r for r in all_results)} failed)")
     
-    if valid_results:
+    # Create a final summary with tract ranking, from every tract that has finished with these settings
+    # (including earlier runs and other jobs)
+    finished = finished_tracts()
+    print(f"\nAnalyzing results of {len(finished)} finished tracts...")
+    store = ResultsStore(results_file)
+    # Tracts that finished before the results table existed are added from their directories
+    stored = set(store.query("SELECT tract_idx FROM tract_results WHERE config_hash = ?", (config_hash,))['tract_idx'])
+    store.record_many([read_tract_dir(finished[tract_idx]['output_dir'], config_hash=config_hash)
+                       for tract_idx in sorted(set(finished) - stored)])
+    
+    def finished_rows(df):
+        return df[df['tract_idx'].isin(finished)].reset_index(drop=True)
+    
+    if finished:
         # Create a comprehensive DataFrame with all metrics
-        metrics_df = pd.DataFrame([
-            {
-                'tract_idx': r['tract_idx'],
-                'tract_name': r['tract_name'],
-                'modality': r.get('modality', 'unknown'),
-                'base_tract_name': r.get('base_tract_name', r['tract_name']),
-                'best_val_r2': r.get('best_val_r2', 0),
-                'best_val_mae': r.get('best_val_mae', 0),
-                'best_site_acc': r.get('best_site_acc', 0),
-                'training_time_minutes': r.get('training_time', 0) / 60
-            } 
-            for r in valid_results
-        ])
+        metrics_df = finished_rows(store.results(config_hash))
+        metrics_df['training_time_minutes'] = metrics_df['training_time'].fillna(0) / 60
+        metrics_df = metrics_df[['tract_idx', 'tract_name', 'modality', 'base_tract_name', 'best_val_r2',
+                                 'best_val_mae', 'best_site_acc', 'training_time_minutes']]
+        
+        if args.permutations:
+            significance_df = tract_prediction_significance(metrics_df['tract_idx'].tolist())
+            metrics_df = metrics_df.merge(significance_df, on='tract_idx', how='left')
         
         # Save complete metrics table
         metrics_df.to_csv(os.path.join(args.output_dir, "all_tract_metrics.csv"), index=False)
@@ -835,26 +1741,13 @@ try:
                 print(f"{i+1}. {row['base_tract_name']} (idx: {row['tract_idx']}): " + 
                       f"R²={row['best_val_r2']:.4f}, MAE={row['best_val_mae']:.4f} years")
         
-        # Create a consolidated summary of adversarial training results
-        adversarial_summaries = []
-        for tract_idx in range(args.start_tract, args.end_tract + 1):
-            # Look for files with modality in the directory name
-            for modality in ['dki_fa', 'dki_md', 'unknown']:
-                adversarial_file = os.path.join(args.output_dir, f"tract_{tract_idx}_{modality}", "adversarial_training_summary.csv")
-                if os.path.exists(adversarial_file):
-                    try:
-                        adv_data = pd.read_csv(adversarial_file)
-                        if not adv_data.empty:
-                            # Add modality information
-                            adv_row = adv_data.iloc[0].to_dict()
-                            adv_row['modality'] = modality
-                            adversarial_summaries.append(adv_row)
-                    except Exception as e:
-                        print(f"Error reading adversarial summary for tract {tract_idx} ({modality}): {e}")
-                    break  # Found file for this tract, no need to check other modalities
+        # Consolidated summary of adversarial training results
+        adv_df = finished_rows(store.adversarial_results(config_hash))
         
-        if adversarial_summaries:
-            adv_df = pd.DataFrame(adversarial_summaries)
+        if not adv_df.empty:
+            if args.permutations:
+                # The cached predictions come from the stage 2 (adversarial) model
+                adv_df = adv_df.merge(significance_df, on='tract_idx', how='left')
             # Save the consolidated adversarial training summary
             adv_df.to_csv(os.path.join(args.output_dir, "all_tracts_adversarial_summary.csv"), index=False)
             
@@ -905,7 +1798,7 @@ try:
                             label='Normalized MAE (higher means lower error)')
             
             # Color bars by modality
-            colors = {'dki_fa': 'skyblue', 'dki_md': 'salmon', 'unknown': 'gray'}
+            colors = {'dki_fa': 'skyblue', 'dki_md': 'salmon', 'dki_fa_md': 'mediumpurple', 'unknown': 'gray'}
             for i, (_, row) in enumerate(top20_adv_r2.iterrows()):
                 if 'modality' in row:
                     modality = row['modality']
@@ -923,6 +1816,8 @@ try:
                 legend_elements.append(Patch(facecolor=colors['dki_fa'], label='FA'))
             if 'dki_md' in top20_adv_r2['modality'].values:
                 legend_elements.append(Patch(facecolor=colors['dki_md'], label='MD'))
+            if 'dki_fa_md' in top20_adv_r2['modality'].values:
+                legend_elements.append(Patch(facecolor=colors['dki_fa_md'], label='FA+MD'))
             if 'unknown' in top20_adv_r2['modality'].values:
                 legend_elements.append(Patch(facecolor=colors['unknown'], label='Unknown'))
             
@@ -939,49 +1834,20 @@ try:
             for i, row in adv_r2_ranking.head(5).iterrows():
                 modality = row['modality'] if 'modality' in row else 'unknown'
                 # Clean up modality display
-                display_modality = 'FA' if modality == 'dki_fa' else 'MD' if modality == 'dki_md' else modality
+                display_modality = {'dki_fa': 'FA', 'dki_md': 'MD', 'dki_fa_md': 'FA+MD'}.get(modality, modality)
                 print(f"{i+1}. {display_modality} {row['tract_name']} (idx: {row['tract_idx']}): " + 
                       f"R²={row['best_val_r2']:.4f}, MAE={row['best_val_mae']:.4f} years")
                       
         # Compare FA and MD performance if both are present
         if not fa_metrics.empty and not md_metrics.empty:
-            # Try to match tracts by their base name
-            fa_base_tracts = set([name.replace('dki_fa', '') for name in fa_metrics['tract_name']])
-            md_base_tracts = set([name.replace('dki_md', '') for name in md_metrics['tract_name']])
+            # Match the FA and MD tracts of the same bundle by their base name
+            comparison_df = store.fa_md_comparison(config_hash)
+            comparison_df = comparison_df[comparison_df['fa_tract_idx'].isin(finished) &
+                                          comparison_df['md_tract_idx'].isin(finished)].reset_index(drop=True)
             
-            # Find common tracts
-            common_base_tracts = fa_base_tracts.intersection(md_base_tracts)
-            
-            if common_base_tracts:
-                # Create comparison data
-                comparison_data = []
-                for base_tract in common_base_tracts:
-                    fa_name = 'dki_fa' + base_tract
-                    md_name = 'dki_md' + base_tract
-                    
-                    fa_row = fa_metrics[fa_metrics['tract_name'] == fa_name].iloc[0]
-                    md_row = md_metrics[md_metrics['tract_name'] == md_name].iloc[0]
-                    
-                    # Calculate differences
-                    r2_diff = fa_row['best_val_r2'] - md_row['best_val_r2']
-                    mae_diff = fa_row['best_val_mae'] - md_row['best_val_mae']
-                    
-                    comparison_data.append({
-                        'base_tract': base_tract,
-                        'fa_tract_idx': fa_row['tract_idx'],
-                        'md_tract_idx': md_row['tract_idx'],
-                        'fa_r2': fa_row['best_val_r2'],
-                        'md_r2': md_row['best_val_r2'],
-                        'r2_diff': r2_diff,  # Positive means FA is better
-                        'fa_mae': fa_row['best_val_mae'],
-                        'md_mae': md_row['best_val_mae'],
-                        'mae_diff': mae_diff,  # Negative means FA is better (lower MAE)
-                        'better_r2': 'FA' if r2_diff > 0 else 'MD',
-                        'better_mae': 'FA' if mae_diff < 0 else 'MD'
-                    })
-                
-                # Create comparison DataFrame and save
-                comparison_df = pd.DataFrame(comparison_data)
+            if not comparison_df.empty:
+                comparison_df['better_r2'] = np.where(comparison_df['r2_diff'] > 0, 'FA', 'MD')
+                comparison_df['better_mae'] = np.where(comparison_df['mae_diff'] < 0, 'FA', 'MD')
                 comparison_df.to_csv(os.path.join(args.output_dir, "fa_md_comparison.csv"), index=False)
                 
                 # Print comparison summary
@@ -990,7 +1856,7 @@ try:
                 fa_better_mae = sum(comparison_df['mae_diff'] < 0)
                 md_better_mae = sum(comparison_df['mae_diff'] > 0)
                 
-                print(f"\nComparison of FA vs MD tracts ({len(common_base_tracts)} matched tracts):")
+                print(f"\nComparison of FA vs MD tracts ({len(comparison_df)} matched tracts):")
                 print(f"  Better R² with FA: {fa_better_r2} tracts")
                 print(f"  Better R² with MD: {md_better_r2} tracts")
                 print(f"  Better MAE with FA: {fa_better_mae} tracts")
@@ -1024,7 +1890,7 @@ try:
                 md_bars = ax.bar(x + width/2, top_diff['md_r2'], width, label='MD R²', color='salmon')
                 
                 # Add markers for better modality
-                for i, row in enumerate(top_diff.iterrows()[1]):
+                for i, (_, row) in enumerate(top_diff.iterrows()):
                     better = row['better_r2']
                     if better == 'FA':
                         ax.annotate('FA', xy=(i - width/2, row['fa_r2']), xytext=(0, 5), 
@@ -1057,7 +1923,7 @@ try:
                 md_bars = ax.bar(x + width/2, top_mae_diff['md_mae'], width, label='MD MAE', color='salmon')
                 
                 # Add markers for better modality (lower MAE is better)
-                for i, row in enumerate(top_mae_diff.iterrows()[1]):
+                for i, (_, row) in enumerate(top_mae_diff.iterrows()):
                     better = row['better_mae']
                     if better == 'FA':
                         ax.annotate('FA', xy=(i - width/2, row['fa_mae']), xytext=(0, -15), 
@@ -1082,7 +1948,7 @@ try:
         for i, row in r2_ranking.head(5).iterrows():
             # Clean up display
             modality = row['modality']
-            display_modality = 'FA' if modality == 'dki_fa' else 'MD' if modality == 'dki_md' else modality
+            display_modality = {'dki_fa': 'FA', 'dki_md': 'MD', 'dki_fa_md': 'FA+MD'}.get(modality, modality)
             base_name = row['base_tract_name'] if 'base_tract_name' in row else row['tract_name'].replace('dki_fa', '').replace('dki_md', '')
             
             print(f"{i+1}. {display_modality} {base_name} (idx: {row['tract_idx']}): " + 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for asynchronous validation of weight snapshots in a side process.
+"""
+
+import math
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+def _loader(n=32, batch_size=8):
+    torch.manual_seed(0)
+    return DataLoader(TensorDataset(torch.randn(n, 1, 100), torch.zeros(n, 3)), batch_size=batch_size)
+
+def test_async_validation_config():
+    """Test the async_validation= argument normalization."""
+    from Experiment_Utils.async_validation import async_validation_config
+
+    assert async_validation_config(None) is None
+    assert async_validation_config(False) is None
+    assert async_validation_config(True)["max_lag"] == 2
+    assert async_validation_config({"max_lag": 3})["max_lag"] == 3
+    with pytest.raises(ValueError):
+        async_validation_config({"lag": 3})
+    with pytest.raises(ValueError):
+        async_validation_config({"max_lag": 0})
+    print("✓ Async validation options are validated")
+
+def test_validator_evaluates_each_snapshot():
+    """Test that every result belongs to the weights submitted for its epoch, with max_lag=1."""
+    from Experiment_Utils.async_validation import AsyncValidator, async_validation_config
+    from Experiment_Utils.models import Conv1DAutoencoder_fa
+    from Experiment_Utils.utils import _evaluate_ae
+
+    loader = _loader()
+    model = Conv1DAutoencoder_fa(latent_dims=4).eval()
+    validator = AsyncValidator(model, _evaluate_ae, {"full": loader}, async_validation_config({"max_lag": 1}))
+    expected = []
+    results = []
+    try:
+        for epoch in range(3):
+            # Change the weights after every submission, as training would
+            with torch.no_grad():
+                for param in model.parameters():
+                    param.add_(0.05 * torch.randn_like(param))
+            expected.append(_evaluate_ae(model, loader, "cpu")["rmse"])
+            validator.submit(epoch, "full", model)
+            results.extend(validator.poll())
+        results.extend(validator.drain())
+    finally:
+        validator.close()
+
+    assert [result.epoch for result in results] == [0, 1, 2]
+    assert [result.metrics["rmse"] for result in results] == pytest.approx(expected)
+    assert validator.pending == set()
+    print("✓ Async validator evaluates each snapshot")
+
+def test_trainer_with_async_validation(tmp_path, monkeypatch):
+    """Test that late results fill the histories, the metrics CSV and best-model selection."""
+    from Experiment_Utils.metrics_log import read_metrics
+    from Experiment_Utils.models import Conv1DAutoencoder_fa
+    from Experiment_Utils.utils import train_autoencoder
+
+    monkeypatch.chdir(tmp_path)
+    loader = _loader()
+    results = train_autoencoder(Conv1DAutoencoder_fa(latent_dims=4), loader, loader, epochs=3, device="cpu",
+                                metrics_file="metrics.csv", async_validation={"max_lag": 2})
+    val_rmse = results["val_rmse_per_epoch"]
+    assert len(val_rmse) == 3 and not any(math.isnan(value) for value in val_rmse)
+    assert results["best_val_rmse"] == pytest.approx(min(val_rmse))
+
+    metrics = read_metrics(str(tmp_path / "metrics.csv"))
+    assert metrics["epoch"].tolist() == [1, 2, 3]
+    assert metrics["val_rmse"].tolist() == pytest.approx(val_rmse)
+    print("✓ Trainer applies asynchronous validation results")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_async_validation_config()
+    test_validator_evaluates_each_snapshot()
+    with tempfile.TemporaryDirectory() as d:
+        monkeypatch = pytest.MonkeyPatch()
+        test_trainer_with_async_validation(pathlib.Path(d), monkeypatch)
+        monkeypatch.undo()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Tests for the CPU benchmark suite.
+"""
+
+import json
+
+def test_model_benchmark_records_timings_and_errors():
+    """Test that runnable model cases are timed and shape mismatches are recorded."""
+    from Experiment_Utils.benchmarks import benchmark_models
+
+    records = benchmark_models([4], [50], warmup=0, repeats=1,
+                               names={"AgePredictorCNN", "Conv1DVariationalAutoencoder"})
+    by_model = {r["model"]: r for r in records}
+    assert by_model["AgePredictorCNN"]["median_s"] > 0
+    assert by_model["AgePredictorCNN"]["samples_per_sec"] > 0
+    # The multi-tract VAE only accepts 100-node inputs
+    assert "error" in by_model["Conv1DVariationalAutoencoder"]
+    print("✓ Model benchmark records timings and errors")
+
+def test_trainer_benchmark_reports_stage_phases():
+    """Test one epoch of a trainer on synthetic tensors."""
+    from Experiment_Utils.benchmarks import benchmark_trainers
+
+    (record,) = benchmark_trainers(n_samples=16, batch_size=8, names={"train_variational_autoencoder"})
+    assert record["seconds"] > 0
+    assert record["stages"]["vae"]["phase_times"]["forward"] > 0
+    print("✓ Trainer benchmark reports per-stage phase times")
+
+def test_benchmark_cli_writes_comparable_json(tmp_path):
+    """Test the JSON output and the comparison against an earlier run."""
+    from Experiment_Utils.benchmarks import main
+
+    old, new = tmp_path / "old.json", tmp_path / "new.json"
+    args = ["--quick", "--sections", "models", "--batch-sizes", "2", "--repeats", "1"]
+    main(args + ["--out", str(old)])
+    main(args + ["--out", str(new), "--compare", str(old)])
+
+    results = json.loads(new.read_text())
+    assert results["environment"]["torch"]
+    assert len(results["models"]) > 0
+    cases = results["comparison"]["cases"]
+    assert "model/AgePredictorCNN/L50/B2" in cases
+    assert cases["model/AgePredictorCNN/L50/B2"]["ratio"] > 0
+    print("✓ Benchmark CLI writes comparable JSON")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_model_benchmark_records_timings_and_errors()
+    test_trainer_benchmark_reports_stage_phases()
+    with tempfile.TemporaryDirectory() as d:
+        test_benchmark_cli_writes_comparable_json(pathlib.Path(d))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tests for the cross-validation folds over one preprocessed tensor set.
+"""
+
+import torch
+
+def _data(n=90, num_tracts=4, nodes=6):
+    g = torch.Generator().manual_seed(0)
+    x = torch.randn(n, num_tracts, nodes, generator=g)
+    age = 10 + 2 * x[:, 0, :2].sum(1)
+    return {"x": x, "age": age, "sex": (torch.arange(n) % 2).float(),
+            "site": torch.tensor([0.0, 1.0, 3.0, 4.0])[torch.arange(n) % 4],
+            "split": (torch.arange(n) // 4 % 3).to(torch.int8)}
+
+def _least_squares(fold, train_loader, val_loader):
+    # Deterministic "trainer": least squares of age on the nodes of every sample
+    x, labels = (torch.cat(tensors) for tensors in zip(*train_loader))
+    x = x.flatten(1).double()
+    design = torch.cat([x, torch.ones(len(x), 1, dtype=x.dtype)], 1)
+    weights = torch.linalg.lstsq(design, labels[:, :1].double()).solution
+
+    def predict(batch):
+        batch = batch.flatten(1).double()
+        return torch.cat([batch, torch.ones(len(batch), 1, dtype=batch.dtype)], 1) @ weights
+
+    return {"predict": predict, "train_samples": len(x)}
+
+def test_leave_one_site_out_folds():
+    """Test the fold masks, the per-fold site vocabulary and the remapped site labels."""
+    from Experiment_Utils.cross_validation import TRAIN, VAL, fold_loaders, leave_one_site_out_folds
+
+    data = _data()
+    folds = leave_one_site_out_folds(data["site"], data["split"])
+    assert [fold["held_out_site"] for fold in folds] == [0.0, 1.0, 3.0, 4.0]
+    fold = folds[2]
+    assert torch.equal(fold["test"], data["site"] == 3.0)
+    assert torch.equal(fold["train"], (data["site"] != 3.0) & (data["split"] == TRAIN))
+    assert torch.equal(fold["val"], (data["site"] != 3.0) & (data["split"] == VAL))
+    assert fold["site_vocab"].tolist() == [0.0, 1.0, 4.0]
+
+    train_loader, _, test_loader = fold_loaders(data, fold, batch_size=7)
+    x, labels = (torch.cat(tensors) for tensors in zip(*train_loader))
+    assert x.shape == (4 * int(fold["train"].sum()), 1, 6)
+    assert sorted(labels[:, 2].unique().tolist()) == [0.0, 1.0, 2.0]
+    # Site 4 is renumbered to 2 in this fold
+    for sample, label in zip(x, labels):
+        subject = (data["x"][:, :, :] == sample[0]).all(-1).any(-1).nonzero()[0, 0]
+        assert label[0] == data["age"][subject]
+        assert label[2] == {0.0: 0.0, 1.0: 1.0, 4.0: 2.0}[data["site"][subject].item()]
+    assert (torch.cat([labels for _, labels in test_loader])[:, 2] == -1).all()
+
+    _, _, subject_loader = fold_loaders(data, fold, layout="subjects")
+    assert torch.equal(torch.cat([x for x, _ in subject_loader]), data["x"][fold["test"]])
+    print("✓ Leave-one-site-out folds are masks over the shared tensors")
+
+def test_run_folds_in_workers():
+    """Test that the folds give the same per-site results serially and in worker processes."""
+    from Experiment_Utils.cross_validation import leave_one_site_out_folds, run_folds
+
+    data = _data(n=240)
+    folds = leave_one_site_out_folds(data["site"], data["split"])
+    serial = run_folds(data, folds, _least_squares, layout="subjects", num_permutations=50, num_resamples=50)
+    parallel = run_folds(data, folds, _least_squares, workers=2, layout="subjects", num_permutations=50,
+                         num_resamples=50)
+    assert serial["held_out_site"].tolist() == [0.0, 1.0, 3.0, 4.0]
+    assert serial["n_test"].tolist() == [60, 60, 60, 60] and (serial["num_sites"] == 3).all()
+    assert (serial["train_samples"] == serial["n_train"]).all()
+    # Age is linear in the inputs, so every held-out site is predicted well
+    assert (serial["r2"] > 0.99).all() and (serial["subject_mae"] < 0.1).all()
+    assert ((serial["r2_ci_low"] <= serial["subject_r2"]) & (serial["subject_r2"] <= serial["r2_ci_high"])).all()
+    assert torch.allclose(torch.tensor(serial["mae"].values), torch.tensor(parallel["mae"].values))
+    print("✓ Folds run in worker processes")
+
+def test_stratified_folds_are_cached(tmp_path, monkeypatch):
+    """Test that the folds balance every site x age bin, and are computed once per data and settings."""
+    import numpy as np
+    from Experiment_Utils import cross_validation
+
+    rng = np.random.default_rng(0)
+    sites = np.repeat([0.0, 1.0, 3.0, 4.0], [100, 80, 40, 20])
+    ages = rng.uniform(5, 21, len(sites))
+    fold_of = cross_validation.stratified_fold_assignments(sites, ages, k=5, age_bins=4)
+    age_bin = np.searchsorted(np.quantile(ages, [0.25, 0.5, 0.75]), ages, side="right")
+    for site in np.unique(sites):
+        for b in range(4):
+            counts = np.bincount(fold_of[(sites == site) & (age_bin == b)], minlength=5)
+            assert counts.max() - counts.min() <= 1
+    assert np.bincount(fold_of).tolist() == [48] * 5
+
+    path = str(tmp_path / "cv_folds.npz")
+    cached = cross_validation.cached_fold_assignments(path, sites, ages, k=5)
+    assert np.array_equal(cached, fold_of)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("folds recomputed")
+
+    with monkeypatch.context() as m:
+        m.setattr(cross_validation, "stratified_fold_assignments", fail)
+        assert np.array_equal(cross_validation.cached_fold_assignments(path, sites, ages, k=5), fold_of)
+    # Other settings replace the cache
+    reseeded = cross_validation.cached_fold_assignments(path, sites, ages, k=5, seed=1)
+    assert not np.array_equal(reseeded, fold_of)
+    assert np.array_equal(np.load(path)["fold_of"], reseeded)
+    print("✓ Stratified folds are cached")
+
+def test_kfold_tidy_results():
+    """Test the k-fold masks, and the tidy per-fold table with confidence intervals over folds."""
+    import numpy as np
+    from scipy import stats
+    from Experiment_Utils.cross_validation import (aggregate_fold_results, kfold_folds, run_folds,
+                                                   stratified_fold_assignments, tidy_fold_results)
+
+    data = _data(n=240)
+    folds = kfold_folds(stratified_fold_assignments(data["site"].numpy(), data["age"].numpy(), k=4), data["site"])
+    assert torch.equal(sum(fold["test"].long() for fold in folds), torch.ones(240, dtype=torch.long))
+    for fold in folds:
+        assert torch.equal(fold["train"].long() + fold["val"].long() + fold["test"].long(), torch.ones(240, dtype=torch.long))
+        assert fold["site_vocab"].tolist() == [0.0, 1.0, 3.0, 4.0]
+
+    results = run_folds(data, folds, _least_squares, workers=2, layout="flattened", num_permutations=20,
+                        num_resamples=20)
+    tidy = tidy_fold_results(results)
+    assert set(tidy.columns) == {"fold", "n_train", "n_val", "n_test", "num_sites", "metric", "value"}
+    assert len(tidy) == 4 * tidy["metric"].nunique() and "subject_mae" in set(tidy["metric"])
+
+    summary = aggregate_fold_results(tidy).set_index("metric")
+    maes = results["mae"].to_numpy()
+    half_width = stats.t.ppf(0.975, 3) * maes.std(ddof=1) / 2
+    assert summary.loc["mae", "n_folds"] == 4
+    assert np.isclose(summary.loc["mae", "mean"], maes.mean())
+    assert np.isclose(summary.loc["mae", "ci_high"] - summary.loc["mae", "mean"], half_width)
+    print("✓ k-fold results are tidy, with confidence intervals over folds")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    import pytest
+    test_leave_one_site_out_folds()
+    test_run_folds_in_workers()
+    with tempfile.TemporaryDirectory() as d, pytest.MonkeyPatch.context() as monkeypatch:
+        test_stratified_folds_are_cached(pathlib.Path(d), monkeypatch)
+    test_kfold_tidy_results()
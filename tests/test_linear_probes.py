@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Tests for the batched linear probes of every tract.
+"""
+
+import torch
+
+def _data(n=120, num_tracts=3, nodes=8):
+    g = torch.Generator().manual_seed(0)
+    x = torch.randn(n, num_tracts, nodes, generator=g)
+    ages = 10 + 2 * x[:, 1, :3].sum(1) + 0.5 * torch.randn(n, generator=g)
+    sites = torch.bucketize(x[:, 2, 0].contiguous(), torch.tensor([-0.5, 0.5]))
+    return x, ages, sites
+
+def _ridge(x, y, alpha):
+    x_mean, y_mean = x.mean(0), y.mean()
+    xc = x - x_mean
+    w = torch.linalg.solve(xc.T @ xc + alpha * torch.eye(x.shape[1], dtype=x.dtype), xc.T @ (y - y_mean))
+    return w, y_mean - x_mean @ w
+
+def test_ridge_cv_matches_per_tract_solves():
+    """Test the batched cross-validated ridge against solving each tract, fold and penalty on its own."""
+    from Experiment_Utils.linear_probes import ridge_cv, ridge_predict, tract_features
+
+    x, ages, _ = _data()
+    features, _, _ = tract_features(x)
+    alphas = [0.1, 10.0, 1000.0]
+    fit = ridge_cv(features, ages, alphas=alphas, folds=4, seed=1)
+    fold_of = torch.randperm(len(ages), generator=torch.Generator().manual_seed(1)) % 4
+    y = ages.double()
+    for t in range(3):
+        for a, alpha in enumerate(alphas):
+            squared_error = 0.0
+            for f in range(4):
+                train, test = fold_of != f, fold_of == f
+                w, b = _ridge(features[t][train], y[train], alpha)
+                squared_error += ((features[t][test] @ w + b - y[test]) ** 2).sum()
+            assert torch.isclose(fit["cv_mse"][t, a], squared_error / len(y))
+        w, b = _ridge(features[t], y, fit["alpha"][t].item())
+        assert torch.allclose(fit["weights"][t], w) and torch.isclose(fit["intercept"][t], b)
+    # Only tract 1 carries age
+    errors = ((ridge_predict(features, fit) - y) ** 2).mean(1)
+    assert errors.argmin() == 1 and fit["alpha"][1] < fit["alpha"][0]
+    print("✓ Batched ridge matches per-tract solves")
+
+def test_site_probe():
+    """Test that the multinomial site probe finds the tract that carries the site."""
+    from Experiment_Utils.linear_probes import fit_site_probe, site_probe_accuracy, tract_features
+
+    x, _, sites = _data()
+    features, _, _ = tract_features(x)
+    accuracy = site_probe_accuracy(features, sites, fit_site_probe(features, sites, num_sites=3))
+    assert accuracy.argmax() == 2 and accuracy[2] > 0.9
+    print("✓ Site probe finds the site tract")
+
+if __name__ == "__main__":
+    test_ridge_cv_matches_per_tract_solves()
+    test_site_probe()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-epoch metrics log.
+"""
+
+import pytest
+import torch
+
+def test_metrics_writer_buffers_and_reads_back(tmp_path):
+    """Test that rows are buffered, flushed and read back with a fixed schema."""
+    from Experiment_Utils.metrics_log import MetricsWriter, read_metrics, COLUMNS
+
+    path = str(tmp_path / "metrics.csv")
+    writer = MetricsWriter(path, flush_every=3, flush_interval=1e9)
+    writer.log("vae", 1, train_loss=torch.tensor(1.5), val_loss=2.0, current_lr=1e-3)
+    writer.log("vae", 2, train_loss=1.25, val_loss=1.75, current_lr=1e-3)
+    # Nothing but the header is on disk until the buffer fills
+    assert len(read_metrics(path)) == 0
+
+    writer.log_last("combined", 1, {"train_loss": [0.5], "training_phase": ["recon_age"]})
+    df = read_metrics(path)
+    assert list(df.columns) == COLUMNS
+    assert df["stage"].tolist() == ["vae", "vae", "combined"]
+    assert df.loc[0, "train_loss"] == pytest.approx(1.5)
+    assert df.loc[2, "training_phase"] == "recon_age"
+    assert read_metrics(path, stage="vae")["epoch"].tolist() == [1, 2]
+    print("✓ Metrics writer buffers rows and reads them back")
+
+def test_metrics_writer_rejects_unknown_columns(tmp_path):
+    """Test that metrics outside the shared schema are rejected."""
+    from Experiment_Utils.metrics_log import MetricsWriter
+
+    writer = MetricsWriter(str(tmp_path / "metrics.csv"))
+    with pytest.raises(ValueError):
+        writer.log("vae", 1, not_a_metric=1.0)
+    print("✓ Unknown metric columns are rejected")
+
+def test_disabled_metrics_writer_is_noop(tmp_path):
+    """Test that a writer without a path never touches the disk."""
+    from Experiment_Utils.metrics_log import MetricsWriter
+
+    writer = MetricsWriter(None)
+    writer.log("vae", 1, train_loss=1.0)
+    writer.close()
+    assert not writer.enabled
+    assert list(tmp_path.iterdir()) == []
+    print("✓ Disabled metrics writer is a no-op")
+
+def test_trainer_flushes_metrics_on_error(tmp_path, monkeypatch):
+    """Test that rows buffered before a trainer fails are still written."""
+    from Experiment_Utils.metrics_log import read_metrics
+    from Experiment_Utils.models import Conv1DAutoencoder_fa
+    from Experiment_Utils.utils import train_autoencoder
+
+    x = torch.randn(16, 1, 100)
+    loader = torch.utils.data.DataLoader(torch.utils.data.TensorDataset(x, torch.zeros(16, 3)), batch_size=8)
+
+    class FailingLoader:
+        # Serves one epoch, then fails like an interrupted run
+        def __init__(self):
+            self.epochs = 0
+
+        def __len__(self):
+            return len(loader)
+
+        def __iter__(self):
+            self.epochs += 1
+            if self.epochs > 1:
+                raise RuntimeError("data went away")
+            return iter(loader)
+
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(RuntimeError, match="data went away"):
+        train_autoencoder(Conv1DAutoencoder_fa(latent_dims=4), FailingLoader(), loader, epochs=3, device="cpu",
+                          metrics_file="metrics.csv")
+    assert read_metrics(str(tmp_path / "metrics.csv"))["epoch"].tolist() == [1]
+    print("✓ Trainers flush the metrics log when they fail")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    for test in (test_metrics_writer_buffers_and_reads_back,
+                 test_metrics_writer_rejects_unknown_columns,
+                 test_disabled_metrics_writer_is_noop):
+        with tempfile.TemporaryDirectory() as d:
+            test(pathlib.Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        monkeypatch = pytest.MonkeyPatch()
+        test_trainer_flushes_metrics_on_error(pathlib.Path(d), monkeypatch)
+        monkeypatch.undo()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Tests for the appendable per-epoch prediction store.
+"""
+
+import numpy as np
+import torch
+
+def test_store_append_and_lookup(tmp_path):
+    """Test appending several epochs and reading them back by (split, epoch)."""
+    from Experiment_Utils.prediction_store import PredictionStore
+
+    store = PredictionStore(str(tmp_path / "store"), latent_dim=3)
+    for epoch in (1, 50, 100):
+        n = 10 + epoch % 7
+        store.append(epoch, "train",
+                     site_true=torch.full((n,), epoch % 4),
+                     site_pred=torch.zeros(n, dtype=torch.long),
+                     age_true=torch.arange(n, dtype=torch.float32),
+                     age_pred=torch.arange(n, dtype=torch.float32) + epoch,
+                     latents=torch.ones(n, 3) * epoch)
+    store.append(100, "val", site_true=np.array([0, 1]), site_pred=np.array([1, 1]))
+
+    assert store.epochs("train") == [1, 50, 100]
+    preds = store.get(50, "train")
+    assert preds["site_true"].tolist() == [2] * 11
+    assert np.allclose(preds["age_pred"], np.arange(11) + 50)
+    assert preds["latents"].shape == (11, 3) and np.all(preds["latents"] == 50)
+
+    val = store.get(100, "val")
+    assert val["site_pred"].tolist() == [1, 1]
+    assert np.all(np.isnan(val["age_true"]))
+    print("✓ Prediction store appends and looks up epochs")
+
+def test_store_readable_while_writing(tmp_path):
+    """Test that a reader opened before later appends picks them up on refresh."""
+    from Experiment_Utils.prediction_store import PredictionStore
+
+    path = str(tmp_path / "store")
+    writer = PredictionStore(path)
+    writer.append(1, "val", site_true=[0, 1, 2], site_pred=[0, 1, 1])
+
+    reader = PredictionStore(path, mode="r")
+    assert reader.keys() == [("val", 1)]
+
+    writer.append(2, "val", site_true=[3], site_pred=[3])
+    assert reader.get(2, "val")["site_true"].tolist() == [3]
+    print("✓ Prediction store is readable during training")
+
+def test_store_drops_uncommitted_rows(tmp_path):
+    """Test that rows written without an index record are discarded on reopen."""
+    from Experiment_Utils.prediction_store import PredictionStore
+
+    path = tmp_path / "store"
+    store = PredictionStore(str(path))
+    store.append(1, "train", site_true=[0, 1], site_pred=[0, 1])
+    # Simulate a crash after writing column data but before the index record
+    with open(path / "site_true.bin", "ab") as f:
+        np.array([3, 3, 3], dtype=np.int16).tofile(f)
+
+    store = PredictionStore(str(path))
+    store.append(2, "train", site_true=[2], site_pred=[2])
+    assert store.get(2, "train")["site_true"].tolist() == [2]
+    print("✓ Prediction store recovers from interrupted appends")
+
+def test_store_replaces_rewritten_epochs(tmp_path):
+    """Test that saving an epoch twice (e.g. after a resume) keeps the newest predictions."""
+    from Experiment_Utils.prediction_store import PredictionStore, open_prediction_store
+    from Experiment_Utils.utils import save_site_predictions
+
+    save_dir = str(tmp_path)
+    save_site_predictions(torch.tensor([0, 1]), torch.tensor([1, 1]), 1, save_dir, prefix="val")
+    save_site_predictions(torch.tensor([2, 2, 2]), torch.tensor([0, 2, 2]), 1, save_dir, prefix="val")
+    save_site_predictions(torch.tensor([3]), torch.tensor([3]), 2, save_dir, prefix="val")
+
+    store = open_prediction_store(save_dir, mode="r")
+    assert store.keys() == [("val", 1), ("val", 2)]
+    assert store.get(1, "val")["site_true"].tolist() == [2, 2, 2]
+
+    # Reopening for appends keeps the rows of the replaced record in place
+    writer = open_prediction_store(save_dir)
+    writer.append(3, "val", site_true=[1], site_pred=[1])
+    assert PredictionStore(writer.path, mode="r").get(2, "val")["site_true"].tolist() == [3]
+    print("✓ Prediction store replaces rewritten epochs")
+
+def test_store_records_latent_width_on_first_use(tmp_path):
+    """Test that latents appended to a store created without a width are kept."""
+    from Experiment_Utils.prediction_store import PredictionStore
+
+    path = str(tmp_path / "store")
+    store = PredictionStore(path)
+    store.append(1, "val", site_true=[0, 1], site_pred=[0, 1])
+    store.append(2, "val", site_true=[1], site_pred=[1], latents=torch.ones(1, 4))
+
+    reader = PredictionStore(path, mode="r")
+    assert reader.meta["latent_dim"] == 4
+    assert np.all(np.isnan(reader.get(1, "val")["latents"]))
+    assert reader.get(2, "val")["latents"].tolist() == [[1.0] * 4]
+    print("✓ Prediction store records the latent width on first use")
+
+def test_store_rejected_append_leaves_no_rows(tmp_path):
+    """Test that an append with latents of the wrong width writes nothing, so later epochs stay aligned."""
+    import pytest
+    from Experiment_Utils.prediction_store import PredictionStore
+
+    path = str(tmp_path / "store")
+    store = PredictionStore(path, latent_dim=2)
+    store.append(1, "val", site_true=[0], site_pred=[0], latents=torch.zeros(1, 2))
+    with pytest.raises(ValueError, match="width 2"):
+        store.append(2, "val", site_true=[5, 5, 5], site_pred=[5, 5, 5], latents=torch.zeros(3, 4))
+    store.append(3, "val", site_true=[1, 2], site_pred=[2, 1], latents=torch.ones(2, 2))
+
+    reader = PredictionStore(path, mode="r")
+    assert reader.keys() == [("val", 1), ("val", 3)]
+    assert reader.get(3, "val")["site_true"].tolist() == [1, 2]
+    assert reader.get(3, "val")["latents"].tolist() == [[1.0, 1.0]] * 2
+    print("✓ Prediction store rejects an append without leaving rows behind")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    for test in (test_store_append_and_lookup, test_store_readable_while_writing, test_store_drops_uncommitted_rows,
+                 test_store_replaces_rewritten_epochs, test_store_records_latent_width_on_first_use,
+                 test_store_rejected_append_leaves_no_rows):
+        with tempfile.TemporaryDirectory() as d:
+            test(pathlib.Path(d))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-phase epoch timers, throughput counters and the torch.profiler window.
+"""
+
+import os
+import time
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+def test_phase_timer_charges_phases():
+    """Test that laps, marks and loader waits land in the right phases."""
+    from Experiment_Utils.profiling import PhaseTimer, PHASES
+
+    timer = PhaseTimer()
+    for _ in timer.iterate(range(3)):
+        time.sleep(0.002)
+        timer.lap("forward")
+        timer.lap("backward")
+    timer.mark()
+    time.sleep(0.005)
+    timer.lap("validation")
+    totals = timer.end_epoch()
+
+    assert totals["forward"] >= 0.006
+    assert totals["validation"] >= 0.005
+    assert totals["checkpoint"] == 0.0
+    assert totals["total"] >= sum(totals[name] for name in PHASES if name != "other")
+    assert all(len(timer.history[name]) == 1 for name in PHASES)
+    print("✓ Phase timer charges laps to phases")
+
+def test_phase_timer_throughput_counters():
+    """Test samples/sec, step times and loader wait from a slow loader."""
+    from Experiment_Utils.profiling import PhaseTimer, THROUGHPUT_METRICS
+
+    class SlowLoader:
+        def __iter__(self):
+            for _ in range(4):
+                time.sleep(0.004)
+                yield torch.zeros(8, 1, 50), torch.zeros(8, 3)
+
+    timer = PhaseTimer()
+    for x, labels in timer.iterate(SlowLoader()):
+        time.sleep(0.001)
+    timer.end_epoch()
+
+    stats = timer.histories()
+    assert set(stats) == {name + "_epoch" for name in THROUGHPUT_METRICS}
+    assert stats["data_wait_time_epoch"][0] > stats["compute_time_epoch"][0]
+    assert stats["step_time_mean_epoch"][0] >= 0.001
+    assert stats["step_time_p95_epoch"][0] >= stats["step_time_mean_epoch"][0] * 0.5
+    loop_time = stats["data_wait_time_epoch"][0] + stats["compute_time_epoch"][0]
+    assert stats["samples_per_sec_epoch"][0] == pytest.approx(32 / loop_time)
+    print("✓ Throughput counters separate loader wait from compute")
+
+def test_profile_config_validates_options():
+    """Test the profile= argument normalization."""
+    from Experiment_Utils.profiling import profile_config
+
+    assert profile_config(None) is None
+    assert profile_config(True)["active"] == 5
+    assert profile_config({"active": 2})["active"] == 2
+    with pytest.raises(ValueError):
+        profile_config({"steps": 3})
+    print("✓ Profile options are validated")
+
+def test_trainer_exports_trace_and_phase_times(tmp_path):
+    """Test that a profiled training run writes a Chrome trace and per-epoch phase times."""
+    from Experiment_Utils.models import Conv1DVariationalAutoencoder_fa
+    from Experiment_Utils.utils import train_variational_autoencoder
+
+    torch.manual_seed(0)
+    x = torch.randn(32, 1, 100)
+    loader = DataLoader(TensorDataset(x, torch.zeros(32, 3)), batch_size=4)
+    model = Conv1DVariationalAutoencoder_fa(latent_dims=4, input_length=100)
+
+    results = train_variational_autoencoder(model, loader, loader, epochs=2, device="cpu",
+                                            save_dir=str(tmp_path), metrics_file=None,
+                                            profile={"wait": 1, "warmup": 1, "active": 2})
+    phase_times = results["phase_times_per_epoch"]
+    assert len(phase_times["forward"]) == 2
+    assert phase_times["total"][1] > 0
+    assert len(results["samples_per_sec_per_epoch"]) == 2
+    assert results["samples_per_sec_per_epoch"][0] > 0
+    assert len(results["trace_files"]) == 1
+    assert os.path.getsize(results["trace_files"][0]) > 0
+    print("✓ Profiled trainer exports a trace and phase times")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_phase_timer_charges_phases()
+    test_phase_timer_throughput_counters()
+    test_profile_config_validates_options()
+    with tempfile.TemporaryDirectory() as d:
+        test_trainer_exports_trace_and_phase_times(pathlib.Path(d))
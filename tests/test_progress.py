@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for leveled progress reporting and the opt-in model shape hook.
+"""
+
+import io
+import torch
+
+def test_reporter_levels_and_buffering():
+    """Test that debug lines are dropped and info lines wait for a flush."""
+    from Experiment_Utils.progress import ProgressReporter
+
+    out = io.StringIO()
+    log = ProgressReporter(level="info", stream=out, flush_interval=1e9)
+    log.debug("hidden")
+    log.info("Epoch", 1, "done")
+    assert out.getvalue() == ""
+
+    log.flush()
+    assert out.getvalue() == "Epoch 1 done\n"
+
+    # Warnings are written immediately, together with anything buffered
+    log.info("Epoch 2 done")
+    log.warning("diverged")
+    assert out.getvalue().splitlines()[-2:] == ["Epoch 2 done", "diverged"]
+    log.close()
+    print("✓ Progress reporter filters levels and buffers output")
+
+def test_reporter_rate_limits_progress():
+    """Test that progress lines with the same key are rate limited."""
+    from Experiment_Utils.progress import ProgressReporter
+
+    out = io.StringIO()
+    log = ProgressReporter(level="info", stream=out, min_interval=1e9, flush_interval=0)
+    for i in range(100):
+        log.progress(f"Batch {i}")
+    log.progress("Other", key="other")
+    log.close()
+    assert out.getvalue().splitlines() == ["Batch 0", "Other"]
+    print("✓ Progress lines are rate limited")
+
+def test_shape_debug_hook_is_opt_in(capsys):
+    """Test that predictor forwards are silent unless the shape hook is attached."""
+    from Experiment_Utils.models import AgePredictorCNN, attach_shape_debug_hook
+
+    model = AgePredictorCNN(input_channels=1, sequence_length=50)
+    x = torch.randn(2, 1, 50)
+    model(x)
+    assert capsys.readouterr().out == ""
+
+    messages = []
+    handles = attach_shape_debug_hook(model, log=messages.append)
+    model(x)
+    assert any("flattened x shape" in m for m in messages)
+    assert any("output shape: (2, 1)" in m for m in messages)
+
+    for handle in handles:
+        handle.remove()
+    messages.clear()
+    model(x)
+    assert messages == []
+    print("✓ Shape debug hook is opt-in")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for the consolidated table of tract results.
+"""
+
+import json
+import os
+import threading
+
+import pandas as pd
+
+def _row(tract_idx, modality, r2, mae, config_hash="abc"):
+    return {"config_hash": config_hash, "tract_idx": tract_idx, "tract_name": f"{modality}CST_{tract_idx % 2}",
+            "modality": modality, "base_tract_name": f"CST_{tract_idx % 2}", "best_val_r2": r2, "best_val_mae": mae,
+            "finished": f"2024-01-01 00:00:0{tract_idx}"}
+
+def test_record_ranking_and_comparison(tmp_path):
+    """Test that rows are replaced per settings and tract, and that rankings and the FA/MD comparison are queries."""
+    from Experiment_Utils.results_store import ResultsStore
+
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    store.record_many([_row(0, "dki_fa", 0.2, 3.0), _row(1, "dki_fa", 0.5, 2.0),
+                       _row(2, "dki_md", 0.4, 2.5), _row(3, "dki_md", 0.1, 3.5)])
+    store.record(_row(0, "dki_fa", 0.6, 1.5))  # rerun of tract 0
+    store.record(_row(0, "dki_fa", 0.9, 1.0, config_hash="other"))
+    assert len(store.results("abc")) == 4 and len(store.results()) == 5
+    assert store.latest_config_hash() == "abc"
+
+    assert store.ranking("best_val_r2", config_hash="abc")["tract_idx"].tolist() == [0, 1, 2, 3]
+    assert store.ranking("best_val_mae", ascending=True, modality="dki_md", config_hash="abc")["tract_idx"].tolist() == [2, 3]
+
+    comparison = store.fa_md_comparison("abc").set_index("base_tract")
+    assert comparison.loc["CST_0", "fa_tract_idx"] == 0 and comparison.loc["CST_0", "md_tract_idx"] == 2
+    assert abs(comparison.loc["CST_0", "r2_diff"] - 0.2) < 1e-9
+    assert abs(comparison.loc["CST_1", "mae_diff"] + 1.5) < 1e-9
+    print("✓ Rankings and FA/MD comparison come from the results table")
+
+def test_index_tract_dirs(tmp_path):
+    """Test that tract directories of earlier runs, named with their modality, are indexed."""
+    from Experiment_Utils.results_store import ResultsStore
+
+    (tmp_path / "tract_names.json").write_text(json.dumps(["dki_faCST_L", "dki_faCST_R", "dki_mdCST_L"]))
+    fa_dir = tmp_path / "tract_0_dki_fa"
+    fa_dir.mkdir()
+    (fa_dir / "tract_summary.json").write_text(json.dumps({"tract_idx": 0, "tract_name": "dki_faCST_L",
+                                                           "modality": "dki_fa", "best_r2": 0.3, "best_age_mae": 2.0}))
+    pd.DataFrame([{"tract_idx": 0, "tract_name": "dki_faCST_L", "best_val_r2": 0.35, "best_val_mae": 1.9,
+                   "best_site_acc": 40.0, "total_epochs": 3}]).to_csv(fa_dir / "adversarial_training_summary.csv", index=False)
+    md_dir = tmp_path / "tract_2_dki_md"
+    md_dir.mkdir()
+    (md_dir / "training_results.json").write_text(json.dumps({"best_val_r2": 0.1, "best_val_mae": 2.5}))
+    (tmp_path / "tract_1_dki_fa").mkdir()  # unfinished
+
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    assert store.index_tract_dirs(str(tmp_path)) == 2
+    df = store.results().set_index("tract_idx")
+    assert df.loc[0, "best_val_r2"] == 0.3 and df.loc[2, "tract_name"] == "dki_mdCST_L"
+    assert df.loc[2, "modality"] == "dki_md" and df.loc[2, "base_tract_name"] == "CST_L"
+    adversarial = store.adversarial_results()
+    assert adversarial["tract_idx"].tolist() == [0] and adversarial["total_epochs"].tolist() == [3]
+    assert store.fa_md_comparison()["base_tract"].tolist() == ["CST_L"]
+    print("✓ Earlier tract directories are indexed")
+
+def test_concurrent_writers(tmp_path):
+    """Test that writers with their own connections all land their rows."""
+    from Experiment_Utils.results_store import ResultsStore
+
+    path = str(tmp_path / "results.sqlite")
+    ResultsStore(path)
+
+    def write(worker):
+        store = ResultsStore(path)
+        for i in range(10):
+            store.record(_row(worker * 10 + i, "dki_fa", 0.1, 1.0))
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ResultsStore(path).results()["tract_idx"]) == list(range(40))
+    print("✓ Concurrent writers")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    for test in (test_record_ranking_and_comparison, test_index_tract_dirs, test_concurrent_writers):
+        with tempfile.TemporaryDirectory() as d:
+            test(pathlib.Path(d))
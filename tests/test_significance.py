@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for the vectorized permutation tests and bootstrap intervals of tract rankings.
+"""
+
+import numpy as np
+
+def _r2(predictions, ages):
+    return 1 - ((predictions - ages) ** 2).sum() / ((ages - ages.mean()) ** 2).sum()
+
+def test_prediction_significance():
+    """Test permutation p-values and bootstrap intervals against computing them one resample at a time."""
+    from Experiment_Utils.significance import bootstrap_weights, permutation_indices, prediction_significance
+
+    rng = np.random.default_rng(0)
+    ages = rng.uniform(5, 20, 80)
+    predictions = np.stack([ages + rng.normal(0, 2, 80), rng.uniform(5, 20, 80)])
+    result = prediction_significance(predictions, ages, num_permutations=200, num_resamples=300, seed=3)
+
+    null = np.array([[_r2(p, ages[perm]) for p in predictions] for perm in permutation_indices(80, 200, 3)])
+    assert np.allclose(result["r2_p_value"], (1 + (null >= result["r2"]).sum(0)) / 201)
+    assert result["r2_p_value"][0] < 0.01 < result["r2_p_value"][1]
+
+    boot = []
+    for weights in bootstrap_weights(80, 300, 4):
+        sample = np.repeat(np.arange(80), weights.astype(int))
+        boot.append([_r2(p[sample], ages[sample]) for p in predictions])
+    assert np.allclose(result["r2_ci_low"], np.percentile(boot, 2.5, axis=0))
+    assert np.allclose(result["r2_ci_high"], np.percentile(boot, 97.5, axis=0))
+    assert (result["r2_ci_low"] < result["r2"]).all() and (result["r2"] < result["r2_ci_high"]).all()
+    assert (result["mae_ci_low"] < result["mae"]).all() and (result["mae"] < result["mae_ci_high"]).all()
+    print("✓ Prediction p-values and intervals match the resample-by-resample computation")
+
+def test_occlusion_significance():
+    """Test that only the occlusion that changes the errors is significant."""
+    from Experiment_Utils.significance import occlusion_significance
+
+    rng = np.random.default_rng(1)
+    ages = rng.uniform(5, 20, 100)
+    intact = ages + rng.normal(0, 1, 100)
+    occluded = np.stack([intact + rng.normal(0, 0.01, 100), intact + rng.normal(0, 3, 100)])
+    result = occlusion_significance(intact, occluded, ages, num_permutations=500, num_resamples=500)
+    assert result["r2_drop_p_value"][1] < 0.01 and result["mae_increase_p_value"][1] < 0.01
+    assert result["r2_drop_p_value"][0] > 0.01
+    assert result["r2_drop_ci_low"][0] < 0 < result["r2_drop_ci_high"][0]
+    assert result["r2_drop_ci_low"][1] > 0 and result["mae_increase_ci_low"][1] > 0
+    print("✓ Only the informative occlusion is significant")
+
+def test_successive_halving_keep():
+    """Test that a rung keeps the top tracts and those not clearly worse, and drops failed ones."""
+    from Experiment_Utils.significance import successive_halving_keep
+
+    scores = np.array([0.1, 0.5, np.nan, 0.3, 0.05, 0.4])
+    keep, cutoff = successive_halving_keep(scores, keep_fraction=0.5)
+    assert cutoff == 0.3 and keep.tolist() == [False, True, False, True, False, True]
+    # Tract 0's interval reaches the cutoff, tract 4's does not
+    ci_high = np.array([0.35, 0.6, np.nan, 0.4, 0.2, 0.5])
+    keep, _ = successive_halving_keep(scores, ci_high, keep_fraction=0.5)
+    assert keep.tolist() == [True, True, False, True, False, True]
+    assert successive_halving_keep(scores, keep_fraction=0.0)[0].sum() == 1
+    print("✓ Successive halving keeps the top tracts and those not clearly worse")
+
+if __name__ == "__main__":
+    test_prediction_significance()
+    test_occlusion_significance()
+    test_successive_halving_keep()
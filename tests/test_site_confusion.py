@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming site confusion matrix helpers.
+"""
+
+import numpy as np
+import torch
+from sklearn.metrics import confusion_matrix
+
+def test_accumulator_matches_sklearn():
+    """Test that batched bincount updates reproduce sklearn's confusion matrix."""
+    from Experiment_Utils.utils import SiteConfusionAccumulator
+
+    torch.manual_seed(0)
+    true_sites = torch.randint(0, 4, (200,))
+    pred_sites = torch.randint(0, 4, (200,))
+
+    acc = SiteConfusionAccumulator(num_sites=4)
+    for start in range(0, 200, 32):
+        acc.update(true_sites[start:start + 32], pred_sites[start:start + 32])
+
+    expected = confusion_matrix(true_sites.numpy(), pred_sites.numpy(), labels=[0, 1, 2, 3])
+    assert np.array_equal(acc.compute(), expected)
+
+    acc.reset()
+    assert acc.compute().sum() == 0
+    print("✓ Streaming confusion matrix matches sklearn")
+
+def test_accumulator_skips_unmapped_sites():
+    """Test that labels the site remap could not place (-1) are ignored."""
+    from Experiment_Utils.utils import SiteConfusionAccumulator
+
+    acc = SiteConfusionAccumulator(num_sites=2)
+    acc.update(torch.tensor([0, 1, -1]), torch.tensor([0, 0, 1]))
+    assert acc.compute().tolist() == [[1, 0], [1, 0]]
+    print("✓ Unmapped site labels are skipped")
+
+def test_confusion_matrices_round_trip(tmp_path):
+    """Test saving and loading per-epoch confusion matrices."""
+    from Experiment_Utils.utils import save_site_confusion_matrices, load_site_confusion_matrices
+
+    train = [np.eye(3, dtype=np.int64) * 5, np.ones((3, 3), dtype=np.int64)]
+    val = [np.eye(3, dtype=np.int64), np.eye(3, dtype=np.int64) * 2]
+    save_site_confusion_matrices([1, 50], train, val, str(tmp_path))
+
+    matrices = load_site_confusion_matrices(str(tmp_path))
+    assert sorted(matrices) == [('train', 1), ('train', 50), ('val', 1), ('val', 50)]
+    assert np.array_equal(matrices[('train', 50)], train[1])
+    assert np.array_equal(matrices[('val', 1)], val[0])
+    print("✓ Confusion matrices round-trip through disk")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_accumulator_matches_sklearn()
+    test_accumulator_skips_unmapped_sites()
+    with tempfile.TemporaryDirectory() as d:
+        test_confusion_matrices_round_trip(pathlib.Path(d))
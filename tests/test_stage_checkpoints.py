@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests for resuming the staged trainer from its stage checkpoints.
+"""
+
+import os
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+def _loader(n=32, num_tracts=1):
+    g = torch.Generator().manual_seed(0)
+    x = torch.randn(n, num_tracts, 100, generator=g)
+    labels = torch.stack([torch.rand(n, generator=g) * 15 + 5, torch.zeros(n), (torch.arange(n) % 4).float()], 1)
+    return DataLoader(TensorDataset(x, labels), batch_size=16)
+
+class _CountingLoader:
+    # Counts the passes over the data and fails at pass ``fail_at`` like an interrupted run
+    def __init__(self, loader, fail_at=None):
+        self.loader = loader
+        self.fail_at = fail_at
+        self.passes = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.passes += 1
+        if self.passes == self.fail_at:
+            raise RuntimeError("job killed")
+        return iter(self.loader)
+
+def test_staged_trainer_resumes_combined_stage(tmp_path):
+    """Test that a run killed during stage 2 continues from its last checkpoint and ends like an uninterrupted run."""
+    from Experiment_Utils.models import AgePredictorCNN, Conv1DVariationalAutoencoder_fa, SitePredictorCNN
+    from Experiment_Utils.metrics_log import read_metrics
+    from Experiment_Utils.utils import load_stage_checkpoint, train_vae_age_site_staged
+
+    def run(train_data, save_dir, resume=False, seed=0):
+        torch.manual_seed(seed)
+        models = (Conv1DVariationalAutoencoder_fa(latent_dims=4, input_length=100), AgePredictorCNN(1, 100),
+                  SitePredictorCNN(4, 1, 100))
+        return train_vae_age_site_staged(*models, train_data, _loader(), epochs_stage1=1, epochs_stage2=6,
+                                         device="cpu", w_kl=0.001, save_dir=save_dir, periodic_save_interval=2,
+                                         log_level="warning", resume=resume)
+
+    counting = _CountingLoader(_loader())
+    baseline = run(counting, str(tmp_path / "baseline"))["combined"]
+
+    # Killed at the start of the last combined epoch, after the checkpoint of epoch 4 (in phase 2)
+    save_dir = str(tmp_path / "resumed")
+    with pytest.raises(RuntimeError, match="job killed"):
+        run(_CountingLoader(_loader(), fail_at=counting.passes), save_dir)
+    assert load_stage_checkpoint(save_dir, "combined")["training_state"]["epoch"] == 4
+
+    resumed_data = _CountingLoader(_loader())
+    resumed = run(resumed_data, save_dir, resume=True, seed=1)["combined"]
+    # One look at the first batch, then the two remaining combined epochs
+    assert resumed_data.passes == 3
+    assert resumed["val_pass_epoch"] == baseline["val_pass_epoch"]
+    for key in ("train_loss_epoch", "val_loss_epoch", "val_age_mae_epoch", "current_lr_epoch"):
+        assert resumed[key][:4] == baseline[key][:4], key
+        # Continued epochs match up to float rounding of the CPU kernels
+        assert resumed[key] == pytest.approx(baseline[key], rel=1e-4), key
+    assert len(resumed["phase_times_epoch"]["total"]) == 6
+    # Epoch 5 was logged before the kill and again after the resume, but appears once
+    assert read_metrics(os.path.join(save_dir, "metrics.csv"), stage="combined")["epoch"].tolist() == [1, 2, 3, 4, 5, 6]
+    assert load_stage_checkpoint(save_dir, "combined")["training_state"]["epoch"] == 6
+    print("✓ Staged trainer resumes the combined stage from its checkpoint")
+
+def test_packed_trainer_resumes_combined_stage(tmp_path):
+    """Test that a packed run killed during stage 2 continues every tract from its last checkpoint."""
+    from Experiment_Utils.models import (PackedAgePredictorCNN, PackedConv1DVariationalAutoencoder_fa,
+                                         PackedSitePredictorCNN)
+    from Experiment_Utils.metrics_log import read_metrics
+    from Experiment_Utils.packed_training import train_vae_age_site_staged_packed
+    from Experiment_Utils.utils import load_stage_checkpoint
+
+    def run(train_data, save_dirs, resume=False, seed=0):
+        torch.manual_seed(seed)
+        models = (PackedConv1DVariationalAutoencoder_fa(2, 8, 0.0, 100), PackedAgePredictorCNN(2, 1, 100, 0.1),
+                  PackedSitePredictorCNN(2, 4, 1, 100, 0.2))
+        return train_vae_age_site_staged_packed(*models, train_data, _loader(num_tracts=2), epochs_stage1=1,
+                                                epochs_stage2=6, device="cpu", w_kl=0.001, save_dirs=save_dirs,
+                                                periodic_save_interval=2, log_level="warning", resume=resume)
+
+    counting = _CountingLoader(_loader(num_tracts=2))
+    baseline = run(counting, [str(tmp_path / "baseline" / f"tract_{t}") for t in range(2)])
+
+    save_dirs = [str(tmp_path / "resumed" / f"tract_{t}") for t in range(2)]
+    with pytest.raises(RuntimeError, match="job killed"):
+        run(_CountingLoader(_loader(num_tracts=2), fail_at=counting.passes), save_dirs)
+    assert load_stage_checkpoint(save_dirs[1], "combined_packed")["training_state"]["epoch"] == 4
+
+    resumed_data = _CountingLoader(_loader(num_tracts=2))
+    resumed = run(resumed_data, save_dirs, resume=True, seed=1)
+    assert resumed_data.passes == 3
+    for t in range(2):
+        combined, expected = resumed[t]["combined"], baseline[t]["combined"]
+        assert combined["val_pass_epoch"] == expected["val_pass_epoch"]
+        assert combined["site_cm_epochs"] == expected["site_cm_epochs"]
+        assert all((a == b).all() for a, b in zip(combined["val_site_cm_epoch"][:4], expected["val_site_cm_epoch"][:4]))
+        for key in ("train_loss_epoch", "val_loss_epoch", "val_age_mae_epoch", "current_lr_epoch"):
+            assert combined[key][:4] == expected[key][:4], key
+            assert combined[key] == pytest.approx(expected[key], rel=1e-4), key
+        assert combined["best_epoch"] == expected["best_epoch"]
+        assert read_metrics(os.path.join(save_dirs[t], "metrics.csv"), stage="combined")["epoch"].tolist() == [1, 2, 3, 4, 5, 6]
+    print("✓ Packed trainer resumes the combined stage from its checkpoints")
+
+def test_clear_stage_checkpoints(tmp_path):
+    """Test that clearing a run directory removes its stage checkpoints and nothing else."""
+    from Experiment_Utils.utils import clear_stage_checkpoints, load_stage_checkpoint, save_stage_checkpoint
+
+    save_stage_checkpoint(str(tmp_path), "age_predictor", {}, {})
+    save_stage_checkpoint(str(tmp_path), "combined_packed", {}, {}, {"epoch": 2})
+    (tmp_path / "best_combined_model.pth").write_bytes(b"")
+    clear_stage_checkpoints(str(tmp_path))
+    assert load_stage_checkpoint(str(tmp_path), "age_predictor") is None
+    assert load_stage_checkpoint(str(tmp_path), "combined_packed") is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["best_combined_model.pth"]
+    clear_stage_checkpoints(str(tmp_path / "missing"))
+    print("✓ Stage checkpoints are cleared")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    for test in (test_staged_trainer_resumes_combined_stage, test_packed_trainer_resumes_combined_stage,
+                 test_clear_stage_checkpoints):
+        with tempfile.TemporaryDirectory() as d:
+            test(pathlib.Path(d))
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for tract importance from a single all-tract model.
+"""
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+def _loader(n=40, num_tracts=6, length=10):
+    g = torch.Generator().manual_seed(0)
+    x = torch.randn(n, num_tracts, length, generator=g)
+    # Age depends on tract 2 only
+    ages = 10 + 2 * x[:, 2].mean(1) + 0.1 * torch.randn(n, generator=g)
+    labels = torch.stack([ages, torch.zeros(n), torch.zeros(n)], 1)
+    return DataLoader(TensorDataset(x, labels), batch_size=16)
+
+def test_occlusion_matches_per_tract_loop():
+    """Test that batched occlusion scores equal occluding one tract at a time."""
+    from Experiment_Utils.models import AgePredictorCNN
+    from Experiment_Utils.tract_importance import age_scores, occlusion_importance, predict_ages, tract_means
+
+    torch.manual_seed(0)
+    loader = _loader()
+    model = AgePredictorCNN(input_channels=6, sequence_length=10).eval()
+    baseline = tract_means(loader)
+    scores = occlusion_importance(model, loader, baseline, chunk_size=4)
+
+    ages, intact = predict_ages(model, loader)
+    assert np.isclose(scores["intact_mae"], age_scores(intact, ages)[0].item())
+    for t in range(6):
+        def occlude(x, t=t):
+            x = x.clone()
+            x[:, t] = baseline[t]
+            return model(x)
+        mae, r2 = age_scores(predict_ages(occlude, loader)[1], ages)
+        assert np.isclose(scores["occluded_mae"][t], mae.item(), atol=1e-5)
+        assert np.isclose(scores["occluded_r2"][t], r2.item(), atol=1e-5)
+    print("✓ Batched occlusion matches the per-tract loop")
+
+def test_occlusion_finds_predictive_tract():
+    """Test that the tract the age depends on is the only important one."""
+    from Experiment_Utils.tract_importance import occlusion_importance, tract_means
+
+    loader = _loader()
+    # Linear model on the tract means that uses tract 2 only
+    predict = lambda x: 10 + 2 * x[:, 2].mean(1)
+    scores = occlusion_importance(predict, loader, tract_means(loader))
+    assert np.argmax(scores["r2_drop"]) == 2
+    assert np.allclose(np.delete(scores["r2_drop"], 2), 0, atol=1e-6)
+    assert scores["mae_increase"][2] > 0
+    print("✓ Occlusion finds the predictive tract")
+
+def test_pairwise_occlusion():
+    """Test pairwise scores against masking each pair by hand, and their relation to single-tract occlusion."""
+    from Experiment_Utils.models import AgePredictorCNN
+    from Experiment_Utils.tract_importance import (age_scores, occlusion_importance, pairwise_occlusion_importance,
+                                                   predict_ages, tract_means)
+
+    torch.manual_seed(0)
+    loader = _loader()
+    model = AgePredictorCNN(input_channels=6, sequence_length=10).eval()
+    baseline = tract_means(loader)
+    pairs = pairwise_occlusion_importance(model, loader, baseline, chunk_size=7)
+    singles = occlusion_importance(model, loader, baseline)
+    assert np.allclose(np.diag(pairs["pair_r2_drop"]), singles["r2_drop"], atol=1e-5)
+    assert np.allclose(pairs["r2_interaction"], pairs["r2_interaction"].T)
+
+    ages, _ = predict_ages(model, loader)
+    for i, j in [(0, 1), (2, 5), (3, 4)]:
+        def occlude(x, i=i, j=j):
+            x = x.clone()
+            x[:, [i, j]] = baseline[[i, j]]
+            return model(x)
+        _, r2 = age_scores(predict_ages(occlude, loader)[1], ages)
+        assert np.isclose(pairs["pair_r2_drop"][i, j], pairs["intact_r2"] - r2.item(), atol=1e-5)
+        expected = pairs["pair_r2_drop"][i, j] - singles["r2_drop"][i] - singles["r2_drop"][j]
+        assert np.isclose(pairs["r2_interaction"][j, i], expected, atol=1e-5)
+    print("✓ Pairwise occlusion matches masking pairs by hand")
+
+def test_sliding_window_occlusion():
+    """Test that windows find the segment a model uses, and match masking one window by hand."""
+    from Experiment_Utils.tract_importance import age_scores, predict_ages, sliding_window_occlusion, tract_means
+
+    # Age depends on nodes 10-14 of tract 1 only, and so does the model
+    predict = lambda x: 10 + 2 * x[:, 1, 10:15].mean(1)
+    x = torch.randn(40, 3, 30, generator=torch.Generator().manual_seed(0))
+    labels = torch.stack([predict(x) + 0.1 * torch.randn(40), torch.zeros(40), torch.zeros(40)], 1)
+    loader = DataLoader(TensorDataset(x, labels), batch_size=16)
+    baseline = tract_means(loader)
+    scores = sliding_window_occlusion(predict, loader, baseline, window=4, stride=2, chunk_size=5)
+    assert scores["r2_drop"].shape == (3, 14)
+    assert np.allclose(scores["r2_drop"][[0, 2]], 0, atol=1e-6)
+    used = scores["node_r2_drop"][1] > 1e-6
+    assert used[10:15].all() and not used[:7].any() and not used[18:].any()
+
+    ages, _ = predict_ages(predict, loader)
+    def occlude(x):
+        x = x.clone()
+        x[:, 1, 12:16] = baseline[1, 12:16]
+        return predict(x)
+    _, r2 = age_scores(predict_ages(occlude, loader)[1], ages)
+    assert np.isclose(scores["r2_drop"][1, 6], scores["intact_r2"] - r2.item(), atol=1e-6)
+    print("✓ Sliding windows find the used segment")
+
+if __name__ == "__main__":
+    test_occlusion_matches_per_tract_loop()
+    test_occlusion_finds_predictive_tract()
+    test_pairwise_occlusion()
+    test_sliding_window_occlusion()
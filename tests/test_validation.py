@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for the validation cadence and the fixed fast-validation subset.
+"""
+
+import math
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+def _site_loader(n=80, batch_size=8):
+    torch.manual_seed(0)
+    x = torch.randn(n, 1, 100)
+    sites = torch.tensor([0, 0, 0, 1, 1, 2, 3, 3] * (n // 8)).float()
+    labels = torch.stack([torch.rand(n) * 15 + 5, torch.zeros(n), sites], 1)
+    return DataLoader(TensorDataset(x, labels), batch_size=batch_size)
+
+def test_schedule_passes():
+    """Test which pass follows each epoch."""
+    from Experiment_Utils.validation import ValidationSchedule
+
+    loader = _site_loader()
+    schedule = ValidationSchedule(loader, epochs=7, validate_every=2)
+    assert [schedule.pass_for(epoch) for epoch in range(7)] == [None, "full", None, "full", None, "full", "full"]
+    assert schedule.history == ["", "full", "", "full", "", "full", "full"]
+
+    fast = ValidationSchedule(loader, epochs=6, validate_every=1, fast_val_data=loader, full_val_every=3)
+    passes = [fast.pass_for(epoch) for epoch in range(6)]
+    assert passes == ["fast", "fast", "full", "fast", "fast", "full"]
+    assert [fast.selects_best(p) for p in passes] == [False, False, True, False, False, True]
+
+    # A fast subset without full_val_every still gets periodic full passes
+    default = ValidationSchedule(loader, epochs=12, validate_every=2, fast_val_data=loader)
+    assert [default.pass_for(epoch) for epoch in range(12)] == [None, "fast", None, "fast", None, "fast",
+                                                                None, "fast", None, "full", None, "full"]
+
+    with pytest.raises(ValueError):
+        ValidationSchedule(loader, epochs=3, validate_every=0)
+    print("✓ Validation schedule picks fast, full and skipped passes")
+
+def test_fast_val_loader_is_fixed_and_stratified():
+    """Test that the fast subset keeps every site and is the same each time."""
+    from Experiment_Utils.validation import make_fast_val_loader
+
+    loader = _site_loader()
+    assert make_fast_val_loader(loader, None) is None
+
+    fast = make_fast_val_loader(loader, 0.5)
+    again = make_fast_val_loader(loader, 40)
+    assert len(fast.dataset) == 40
+    assert fast.dataset.indices == again.dataset.indices
+    sites = torch.cat([labels[:, 2] for _, labels in fast])
+    assert set(sites.tolist()) == {0.0, 1.0, 2.0, 3.0}
+    # Proportions follow the full set (3/8 of the samples are site 0)
+    assert (sites == 0).sum().item() == 15
+    print("✓ Fast validation subset is fixed and stratified by site")
+
+def test_trainer_skips_validation_and_selects_best_on_full_passes(tmp_path):
+    """Test NaN entries for skipped epochs and best-model selection on full passes only."""
+    from Experiment_Utils.models import Conv1DVariationalAutoencoder_fa
+    from Experiment_Utils.utils import train_variational_autoencoder
+
+    loader = _site_loader(n=32, batch_size=8)
+    model = Conv1DVariationalAutoencoder_fa(latent_dims=4, input_length=100)
+
+    results = train_variational_autoencoder(model, loader, loader, epochs=5, device="cpu",
+                                            save_dir=str(tmp_path), metrics_file="metrics.csv",
+                                            validate_every=2, fast_val_subset=16)
+    assert results["val_pass_per_epoch"] == ["", "fast", "", "fast", "full"]
+    val_rmse = results["val_rmse_per_epoch"]
+    assert len(val_rmse) == len(results["train_rmse_per_epoch"]) == 5
+    assert math.isnan(val_rmse[0]) and math.isnan(val_rmse[2])
+    # The last epoch is the only full pass, so it is the best one
+    assert results["best_epoch"] == 5
+    assert results["best_val_rmse"] == pytest.approx(val_rmse[4])
+    print("✓ Trainer records skipped epochs and selects best on full passes")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    test_schedule_passes()
+    test_fast_val_loader_is_fixed_and_stratified()
+    with tempfile.TemporaryDirectory() as d:
+        test_trainer_skips_validation_and_selects_best_on_full_passes(pathlib.Path(d))
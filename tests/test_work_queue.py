@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for the file-lock-based work queue.
+"""
+
+import multiprocessing as mp
+import time
+
+def _claim_all(queue_dir, worker_id):
+    from Experiment_Utils.work_queue import WorkQueue
+
+    queue = WorkQueue(queue_dir, worker_id=worker_id)
+    claimed = []
+    while True:
+        task = queue.claim()
+        if task is None:
+            return claimed
+        claimed.append(task)
+        queue.complete(task)
+
+def test_concurrent_claims(tmp_path):
+    """Test that workers in separate processes claim every task exactly once."""
+    from Experiment_Utils.work_queue import WorkQueue
+
+    queue_dir = str(tmp_path / "queue")
+    tasks = [str(i) for i in range(40)]
+    assert WorkQueue(queue_dir).add(tasks) == 40
+    assert WorkQueue(queue_dir).add(tasks) == 0
+
+    with mp.get_context("fork").Pool(4) as pool:
+        claimed = pool.starmap(_claim_all, [(queue_dir, f"worker{i}") for i in range(4)])
+    assert sorted(task for worker_tasks in claimed for task in worker_tasks) == sorted(tasks)
+    assert WorkQueue(queue_dir).counts() == {"pending": 0, "running": 0, "done": 40, "failed": 0}
+    print("✓ Concurrent workers claim each task once")
+
+def test_reclaim_stale_tasks(tmp_path):
+    """Test that a task without heartbeats is reclaimed, and failed after max_attempts."""
+    from Experiment_Utils.work_queue import WorkQueue
+
+    crashed = WorkQueue(str(tmp_path), stale_after=0.2, max_attempts=2, worker_id="crashed")
+    other = WorkQueue(str(tmp_path), stale_after=0.2, max_attempts=2, worker_id="other")
+    crashed.add(["a"])
+    assert crashed.claim() == "a"
+    assert other.claim() is None  # Still fresh
+
+    time.sleep(0.3)
+    assert other.claim() == "a"
+    assert not crashed.heartbeat("a")  # The crashed worker lost the task
+    assert other.heartbeat("a")
+
+    time.sleep(0.3)
+    assert crashed.claim() is None  # Second attempt went stale as well
+    assert other.counts()["failed"] == 1
+
+    other.add(["b"])
+    assert other.claim() == "b"
+    with other.heartbeating("b", interval=0.05):
+        time.sleep(0.4)
+    assert crashed.claim() is None  # Heartbeats kept it alive
+    other.complete("b", error="boom")
+    assert other.counts() == {"pending": 0, "running": 0, "done": 0, "failed": 2}
+    print("✓ Stale tasks are reclaimed")
+
+def _increment(path):
+    from Experiment_Utils.work_queue import locked_json
+
+    for _ in range(25):
+        with locked_json(path) as data:
+            data["count"] = data.get("count", 0) + 1
+
+def test_locked_json(tmp_path):
+    """Test that concurrent read-modify-writes of a shared JSON file are not lost."""
+    from Experiment_Utils.work_queue import locked_json
+
+    path = str(tmp_path / "shared.json")
+    with mp.get_context("fork").Pool(4) as pool:
+        pool.map(_increment, [path] * 4)
+    with locked_json(path, write=False) as data:
+        assert data == {"count": 100}
+    print("✓ Locked JSON updates are not lost")
+
+if __name__ == "__main__":
+    import tempfile, pathlib
+    with tempfile.TemporaryDirectory() as d:
+        test_concurrent_claims(pathlib.Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_reclaim_stale_tasks(pathlib.Path(d))
+    with tempfile.TemporaryDirectory() as d:
+        test_locked_json(pathlib.Path(d))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for running experiments in a pool of forked worker processes.
+"""
+
+import os
+
+import torch
+from torch.utils.data import DataLoader, Subset, TensorDataset
+
+def test_worker_cpu_slices():
+    """Test that workers get disjoint CPU slices, or share CPUs when there are more workers than CPUs."""
+    from Experiment_Utils.worker_pool import worker_cpu_slices
+
+    assert worker_cpu_slices(2, [0, 1, 2, 3, 4]) == [[0, 1], [2, 3]]
+    assert worker_cpu_slices(3, [4, 5]) == [[4], [5], [4]]
+    print("✓ CPU slices are split per worker")
+
+def test_share_dataset_memory():
+    """Test that the tensors behind loaders and dataset wrappers move to shared memory once."""
+    from Experiment_Utils.worker_pool import share_dataset_memory
+
+    x, y = torch.randn(10, 2, 5), torch.zeros(10, 3)
+    base = TensorDataset(x, y)
+    loaders = (base, DataLoader(Subset(base, range(8))), DataLoader(Subset(base, range(8, 10))))
+    assert share_dataset_memory(loaders) == x.nbytes + y.nbytes
+    assert x.is_shared() and y.is_shared()
+    print("✓ Dataset tensors are moved to shared memory")
+
+def _worker_info(value):
+    return value * 2, torch.get_num_threads(), sorted(os.sched_getaffinity(0))
+
+def test_run_in_pool():
+    """Test that every item runs once in a worker pinned to its CPU slice."""
+    from Experiment_Utils.worker_pool import run_in_pool
+
+    cpus = sorted(os.sched_getaffinity(0))[:1]
+    results = dict(run_in_pool(_worker_info, [1, 2, 3], workers=2, cpus=cpus))
+    assert {item: result[0] for item, result in results.items()} == {1: 2, 2: 4, 3: 6}
+    for _, num_threads, affinity in results.values():
+        assert num_threads == 1 and affinity == cpus
+    print("✓ Pool runs every item in pinned workers")
+
+if __name__ == "__main__":
+    test_worker_cpu_slices()
+    test_share_dataset_memory()
+    test_run_in_pool()